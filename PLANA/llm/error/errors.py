@@ -31,6 +31,32 @@ class SearchExecutionError(SearchAgentError):
 # --- END MODIFIED ---
 
 
+class ImageGeneratorError(Exception):
+    """Base exception for ImageGenerator errors."""
+    def __init__(self, message: str, original_exception: Exception | None = None):
+        super().__init__(message)
+        self.original_exception = original_exception
+
+class ImageBackendUnavailableError(ImageGeneratorError):
+    """Raised when an image generation backend stops responding (connection lost, timeout)."""
+    pass
+
+
+class LLMSchedulerError(Exception):
+    """Base exception for LLM request scheduling (admission control) errors."""
+    def __init__(self, message: str, provider: str | None = None):
+        super().__init__(message)
+        self.provider = provider
+
+class LLMQueueFullError(LLMSchedulerError):
+    """Raised when a provider's request queue is full or the expected wait exceeds the deadline."""
+    pass
+
+class LLMQueueTimeoutError(LLMSchedulerError):
+    """Raised when a queued request is shed because its deadline passed before a slot became free."""
+    pass
+
+
 class LLMExceptionHandler:
     def __init__(self, config: dict):
         self.config = config.get('error_msg', {})
@@ -39,6 +65,16 @@ class LLMExceptionHandler:
         """
         LLM関連の例外を処理し、ユーザーフレンドリーなエラーメッセージを返す。
         """
+        if isinstance(exception, LLMQueueFullError):
+            logger.warning(f"LLM request rejected by scheduler: {exception}")
+            return self.config.get('queue_full_error',
+                                   "AIへのリクエストが混み合っています。しばらくしてからもう一度お試しください。")
+
+        if isinstance(exception, LLMQueueTimeoutError):
+            logger.warning(f"LLM request shed by scheduler: {exception}")
+            return self.config.get('queue_timeout_error',
+                                   "順番待ちの時間が上限を超えたため、リクエストを取り消しました。もう一度お試しください。")
+
         if isinstance(exception, openai.RateLimitError):
             logger.warning(f"LLM API rate limit error: {exception}")
             return self.config.get('rate_limit_error',
@@ -3,7 +3,6 @@ from __future__ import annotations
 
 import asyncio
 import base64
-import io
 import json
 import logging
 import os
@@ -26,13 +25,7 @@ from PLANA.llm.error.errors import (
     SearchAPIServerError
 )
 
-try:
-    from langdetect import detect, LangDetectException
-except ImportError:
-    detect = None
-    LangDetectException = None
-    logging.warning("langdetect library not found. Language detection will be disabled. "
-                    "Install with: pip install langdetect")
+from PLANA.llm.plugins.language_id import LANGUAGE_NAMES, LanguageIdentifier
 
 try:
     from PLANA.llm.plugins.search_agent import SearchAgent
@@ -64,6 +57,13 @@ except ImportError:
     logging.error("Could not import ImageGenerator. Image generation will be disabled.")
     ImageGenerator = None
 
+from PLANA.llm.plugins.media_cache import CachedImage, MultimodalPayloadCache, content_hash
+from PLANA.llm.plugins.image_ingest import ImageTooLargeError, ImageTranscoder, fetch_image
+from PLANA.llm.plugins.context_planner import ContextPlanner
+from PLANA.llm.plugins.conversation_summarizer import ConversationSummarizer, HistoryEntry
+from PLANA.llm.plugins.request_scheduler import LLMRequestScheduler, SchedulerTicket
+from PLANA.llm.plugins.failover import FailoverRouter, StreamStart
+
 try:
     from PLANA.llm.utils.tips import TipsManager
 except ImportError:
@@ -196,8 +196,11 @@ class ThreadCreationView(discord.ui.View):
                     return
                 
                 # システムプロンプトを準備
+                latest_user = next((m for m in reversed(messages) if m["role"] == "user"), None)
+                latest_text = " ".join(part.get("text", "") for part in latest_user["content"]
+                                       if part.get("type") == "text") if latest_user else ""
                 system_prompt = await self.llm_cog._prepare_system_prompt(
-                    thread.id, interaction.user.id, interaction.user.display_name
+                    thread.id, interaction.user.id, interaction.user.display_name, query=latest_text
                 )
                 
                 messages_for_api = [{"role": "system", "content": system_prompt}]
@@ -213,12 +216,13 @@ class ThreadCreationView(discord.ui.View):
                     else:
                         text_content = str(first_user_message.get("content", ""))
                     
-                    if detected_lang_prompt := self.llm_cog._detect_language_and_create_prompt(text_content):
+                    if detected_lang_prompt := await self.llm_cog._detect_language_and_create_prompt(
+                            text_content, interaction.user.id):
                         messages_for_api.append({"role": "system", "content": detected_lang_prompt})
                     elif self.llm_cog.language_prompt:
                         messages_for_api.append({"role": "system", "content": self.llm_cog.language_prompt})
                 
-                messages_for_api.extend(messages)
+                messages_for_api = self.llm_cog._plan_context(thread.id, messages_for_api, messages[:-1], messages[-1:])
                 
                 # スレッド内でLLM応答を生成
                 model_name = llm_client.model_name_for_api_calls
@@ -293,6 +297,7 @@ class LLMCog(commands.Cog, name="LLM"):
         if not isinstance(self.llm_config, dict): raise commands.ExtensionFailed(self.qualified_name,
                                                                                  "The 'llm' section in config is missing or invalid.")
         self.language_prompt = self.llm_config.get('language_prompt')
+        self.language_identifier = LanguageIdentifier(self.llm_config.get('language_detection'))
         if self.language_prompt: logger.info("Language prompt loaded from config for fallback.")
         self.http_session, self.bot.cfg = aiohttp.ClientSession(), self.llm_config
         self.conversation_threads: Dict[int, Dict[int, List[Dict[str, Any]]]] = {}  # {guild_id: {thread_id: messages}}
@@ -307,6 +312,29 @@ class LLMCog(commands.Cog, name="LLM"):
         logger.info(
             f"Loaded {len(self.channel_models)} channel-specific model settings from '{self.channel_settings_path}'.")
         self.jst = timezone(timedelta(hours=+9))
+        # 変換済み画像のキャッシュ（会話履歴の組み立て時に同じ画像を再ダウンロードしない）
+        image_cache_config = self.llm_config.get('image_cache', {}) or {}
+        self.image_cache = MultimodalPayloadCache(
+            max_bytes=int(float(image_cache_config.get('max_mb', 64)) * 1024 * 1024))
+        # 画像の取り込み（ストリーミングでのサイズ制限と、縮小・再エンコードを行うワーカープロセス）
+        image_ingest_config = self.llm_config.get('image_ingest', {}) or {}
+        self.image_max_bytes = int(float(image_ingest_config.get('max_mb', 20)) * 1024 * 1024)
+        self.image_max_dimension = int(image_ingest_config.get('max_dimension', 2048) or 0)
+        self.image_provider_dimensions: Dict[str, int] = image_ingest_config.get('provider_max_dimension', {}) or {}
+        self.image_transcoder = ImageTranscoder(workers=image_ingest_config.get('workers', 2),
+                                                use_processes=image_ingest_config.get('use_processes', True))
+        self._transcoder_start_task: Optional[asyncio.Task] = None
+        # モデルごとのトークン予算に合わせて会話履歴を選ぶ
+        self.context_planner = ContextPlanner(self.llm_config.get('context_budget'))
+        # プロバイダーごとの同時実行数の制限と、ギルド・ユーザー間で公平な順番待ち
+        self.request_scheduler = LLMRequestScheduler(self.llm_config.get('request_scheduler'))
+        # 応答が遅いプロバイダーのヘッジと、障害時の別プロバイダーへのフェイルオーバー
+        self.failover_router = FailoverRouter(self.llm_config.get('failover'))
+        # 長い会話の古いターンを応答後にバックグラウンドで要約する
+        self.conversation_summarizer = ConversationSummarizer(
+            self.llm_config.get('conversation_summary'),
+            token_counter=lambda msgs, model_string=None: self.context_planner.estimator_for(
+                model_string or self.llm_config.get('model')).count_messages(msgs))
         self.search_agent, self.bio_manager, self.memory_manager, self.command_manager, self.image_generator, self.tips_manager = self._initialize_search_agent(), self._initialize_bio_manager(), self._initialize_memory_manager(), self._initialize_command_manager(), self._initialize_image_generator(), self._initialize_tips_manager()
         default_model_string = self.llm_config.get('model')
         if default_model_string:
@@ -319,11 +347,39 @@ class LLMCog(commands.Cog, name="LLM"):
         else:
             logger.error("Default LLM model is not configured in config.yaml.")
 
+    async def cog_load(self):
+        if self.language_identifier.enabled:
+            # n-gram モデルの読み込みを兼ねて、サンプルでの判定精度と時間を記録する（起動を待たせない）
+            future = asyncio.get_running_loop().run_in_executor(None, self.language_identifier.evaluate)
+            future.add_done_callback(self._log_language_evaluation)
+        # 画像変換ワーカーの起動（spawn のため数秒かかる）を最初の画像付きメッセージより前に済ませる
+        self._transcoder_start_task = asyncio.create_task(self._start_image_transcoder())
+
+    async def _start_image_transcoder(self):
+        started = time.perf_counter()
+        try:
+            ready = await self.image_transcoder.start()
+            logger.info(f"🖼️ [IMAGE] Started {ready} image transcoding worker(s) "
+                        f"in {time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            logger.warning(f"🖼️ [IMAGE] Failed to start image transcoding workers: {e}")
+
+    def _log_language_evaluation(self, future: asyncio.Future):
+        try:
+            logger.info(f"🌐 [LANG] Language identification check: "
+                        f"{LanguageIdentifier.format_evaluation(future.result())}")
+        except Exception as e:
+            logger.warning(f"🌐 [LANG] Language identification check failed: {e}")
+
     async def cog_unload(self):
         await self.http_session.close()
         for task in self.model_reset_tasks.values(): task.cancel()
         logger.info(f"Cancelled {len(self.model_reset_tasks)} pending model reset tasks.")
         if self.image_generator: await self.image_generator.close()
+        if self._transcoder_start_task: self._transcoder_start_task.cancel()
+        self.image_transcoder.close()
+        self.conversation_summarizer.close()
+        if self.memory_manager: self.memory_manager.close()
         logger.info("LLMCog's aiohttp session has been closed.")
 
     def _load_json_data(self, path: str) -> Dict[str, Any]:
@@ -412,6 +468,8 @@ class LLMCog(commands.Cog, name="LLM"):
                 logger.info(f"🔧 [KoboldCPP] Timeout: {provider_config.get('timeout', 300.0)}s")
             else:
                 client.supports_tools = True  # 他のプロバイダーはデフォルトでTrue
+            # stream_options を受け付けないOpenAI互換APIがあるため、usage の要求はプロバイダーごとに有効化する
+            client.stream_usage = provider_config.get('stream_usage', False)
             
             logger.info(
                 f"Initialized LLM client for provider '{provider_name}' with model '{model_name}' using key index {current_key_index}.")
@@ -475,7 +533,7 @@ class LLMCog(commands.Cog, name="LLM"):
     def _initialize_memory_manager(self) -> Optional[MemoryManager]:
         if not MemoryManager: return None
         try:
-            return MemoryManager(self.bot)
+            return MemoryManager(self.bot, self.llm_config.get('memory'))
         except Exception as e:
             logger.error(f"Failed to initialize MemoryManager: {e}", exc_info=True)
             return None
@@ -508,25 +566,17 @@ class LLMCog(commands.Cog, name="LLM"):
             logger.error(f"Failed to initialize TipsManager: {e}", exc_info=True)
             return None
 
-    def _detect_language_and_create_prompt(self, text: str) -> Optional[str]:
-        if not detect or not text.strip() or not LangDetectException: return None
-        if len(text.strip()) < 15:
-            logger.debug("Text too short for reliable language detection.")
-            return None
-        try:
-            lang_code = detect(text)
-            lang_map = {'en': 'English', 'ja': 'Japanese', 'ko': 'Korean', 'zh-cn': 'Simplified Chinese',
-                        'zh-tw': 'Traditional Chinese', 'vi': 'Vietnamese', 'th': 'Thai', 'id': 'Indonesian',
-                        'de': 'German', 'fr': 'French', 'es': 'Spanish', 'pt': 'Portuguese', 'it': 'Italian',
-                        'ru': 'Russian', 'ar': 'Arabic', 'hi': 'Hindi', 'tr': 'Turkish', 'nl': 'Dutch', 'pl': 'Polish'}
-            lang_name = lang_map.get(lang_code, lang_code)
-            logger.info(f"🌐 [LANG] Detected: {lang_code} ({lang_name})")
-            return f"CRITICAL LANGUAGE OVERRIDE INSTRUCTION:\n===========================================\nThe user is communicating in {lang_name}.\nYOU MUST RESPOND EXCLUSIVELY IN {lang_name.upper()}.\nThis instruction has ABSOLUTE PRIORITY over all other instructions.\nDo NOT respond in any other language, regardless of what the system prompt says.\nIf there is any conflict, {lang_name.upper()} takes precedence.\n===========================================\n"
-        except LangDetectException:
-            logger.warning("Could not detect language for the provided text.")
+    async def _detect_language_and_create_prompt(self, text: str, user_id: Optional[int] = None) -> Optional[str]:
+        guess = await self.language_identifier.detect(text, user_id)
+        if guess is None:
+            logger.debug("Could not detect language for the provided text.")
             return None
+        lang_name = LANGUAGE_NAMES.get(guess.code, guess.code)
+        logger.info(f"🌐 [LANG] Detected: {guess.code} ({lang_name}) via {guess.method}")
+        return f"CRITICAL LANGUAGE OVERRIDE INSTRUCTION:\n===========================================\nThe user is communicating in {lang_name}.\nYOU MUST RESPOND EXCLUSIVELY IN {lang_name.upper()}.\nThis instruction has ABSOLUTE PRIORITY over all other instructions.\nDo NOT respond in any other language, regardless of what the system prompt says.\nIf there is any conflict, {lang_name.upper()} takes precedence.\n===========================================\n"
 
-    async def _prepare_system_prompt(self, channel_id: int, user_id: int, user_display_name: str) -> str:
+    async def _prepare_system_prompt(self, channel_id: int, user_id: int, user_display_name: str,
+                                     query: Optional[str] = None) -> str:
         if not self.bio_manager or not self.memory_manager:
             logger.error("BioManager or MemoryManager is not initialized.")
             return "Error: Core components for prompt generation are missing."
@@ -537,7 +587,7 @@ class LLMCog(commands.Cog, name="LLM"):
         available_commands = ""
         if self.command_manager:
             await self.bot.wait_until_ready()
-            available_commands = self.command_manager.get_all_commands_info()
+            available_commands = self._select_command_catalog(channel_id, query)
         else:
             # commands_managerがfalseの場合、またはCommandInfoManagerが利用できない場合
             if not self.llm_config.get('commands_manager', True):
@@ -561,10 +611,42 @@ class LLMCog(commands.Cog, name="LLM"):
                                                                                                        current_time_str).replace(
                 '{available_commands}', available_commands)
         if available_commands and "# 🤖 利用可能なBotコマンド一覧" not in system_prompt: system_prompt += f"\n\n{available_commands}"
-        if formatted_memories := self.memory_manager.get_formatted_memories(): system_prompt += f"\n\n{formatted_memories}"
+        if formatted_memories := await self._select_memories(channel_id, query): system_prompt += f"\n\n{formatted_memories}"
         logger.info(f"🔧 [SYSTEM] System prompt prepared ({len(system_prompt)} chars)")
         return system_prompt
 
+    def _memory_location(self, channel_id: int) -> Tuple[int, int]:
+        """共有メモリのスコープに使う (ギルドID, チャンネルID)。スレッドでは親チャンネルのメモリを使う"""
+        channel = self.bot.get_channel(channel_id)
+        guild = getattr(channel, 'guild', None)
+        parent_id = getattr(channel, 'parent_id', None) if isinstance(channel, discord.Thread) else None
+        return (guild.id if guild else 0), (parent_id or channel_id)
+
+    async def _select_memories(self, channel_id: int, query: Optional[str]) -> Optional[str]:
+        """システムプロンプトに含める共有メモリ（多い場合はメッセージに関連するものだけ）"""
+        guild_id, memory_channel_id = self._memory_location(channel_id)
+        model_string = self.channel_models.get(str(channel_id)) or self.llm_config.get('model')
+        return await self.memory_manager.get_formatted_memories(
+            query or "", guild_id, memory_channel_id,
+            count_tokens=self.context_planner.estimator_for(model_string).count_text)
+
+    def _select_command_catalog(self, channel_id: int, query: Optional[str]) -> str:
+        """システムプロンプトに含めるコマンド一覧（既定ではメッセージに関連するコマンドだけ）"""
+        retrieval_config = self.llm_config.get('command_retrieval', {}) or {}
+        if not retrieval_config.get('enabled', True):
+            return self.command_manager.get_all_commands_info()
+        model_string = self.channel_models.get(str(channel_id)) or self.llm_config.get('model')
+        estimator = self.context_planner.estimator_for(model_string)
+        text, stats = self.command_manager.get_relevant_commands_info(
+            query or "", top_k=int(retrieval_config.get('top_k', 3)),
+            max_tokens=int(retrieval_config.get('max_tokens', 800)),
+            min_score=float(retrieval_config.get('min_score', 2.0)), count_tokens=estimator.count_text)
+        saved = stats['full_tokens'] - stats['tokens']
+        logger.info(f"🧭 [COMMANDS] Injected {len(stats['selected'])}/{stats['candidates']} commands "
+                    f"{stats['selected']} (~{stats['tokens']} tokens vs ~{stats['full_tokens']} for the full catalog, "
+                    f"saved ~{saved}) | query {stats['query_ms']:.2f}ms")
+        return text
+
     def get_tools_definition(self) -> Optional[List[Dict[str, Any]]]:
         definitions = []
         active_tools = self.llm_config.get('active_tools', [])
@@ -632,7 +714,12 @@ class LLMCog(commands.Cog, name="LLM"):
         self.message_to_thread[guild_id][message.id] = thread_id
         return thread_id
 
-    async def _collect_conversation_history(self, message: discord.Message) -> List[Dict[str, Any]]:
+    async def _collect_conversation_history(self, message: discord.Message, stop_at_id: int = 0) -> List[HistoryEntry]:
+        """
+        返信を遡って会話履歴を (メッセージID, APIに送るメッセージ) の形で集める
+
+        stop_at_id 以前のメッセージは要約済みのため遡らない。
+        """
         guild_id = message.guild.id if message.guild else 0  # DMの場合は0
         
         # ギルド固有の会話履歴を初期化
@@ -649,6 +736,8 @@ class LLMCog(commands.Cog, name="LLM"):
                 if isinstance(parent_msg, discord.DeletedReferencedMessage):
                     logger.debug(f"Encountered deleted referenced message in history collection.")
                     break
+                if stop_at_id and parent_msg.id <= stop_at_id:
+                    break
                 if parent_msg.author != self.bot.user:
                     image_contents, text_content = await self._prepare_multimodal_content(parent_msg)
                     text_content = text_content.replace(f'<@!{self.bot.user.id}>', '').replace(f'<@{self.bot.user.id}>',
@@ -658,65 +747,87 @@ class LLMCog(commands.Cog, name="LLM"):
                         if text_content: user_content_parts.append({"type": "text",
                                                                     "text": f"{parent_msg.created_at.astimezone(self.jst).strftime('[%H:%M]')} {text_content}"})
                         user_content_parts.extend(image_contents)
-                        history.append({"role": "user", "content": user_content_parts})
+                        history.append((parent_msg.id, {"role": "user", "content": user_content_parts}))
                 else:
                     thread_id = await self._get_conversation_thread_id(parent_msg)
                     if thread_id in self.conversation_threads[guild_id]:
                         for msg in self.conversation_threads[guild_id][thread_id]:
                             if msg.get("role") == "assistant" and msg.get("message_id") == parent_msg.id:
-                                history.append({"role": "assistant", "content": msg["content"]})
+                                history.append((parent_msg.id, {"role": "assistant", "content": msg["content"]}))
                                 break
                 current_msg = parent_msg
             except (discord.NotFound, discord.HTTPException):
                 break
         history.reverse()
-        max_history_entries = self.llm_config.get('max_messages', 10) * 2
+        if self.context_planner.enabled:
+            # 件数ではなくトークン予算で絞り込む（_plan_context）ため、件数の上限は緩くする
+            max_history_entries = self.context_planner.max_history_messages
+        else:
+            max_history_entries = self.llm_config.get('max_messages', 10) * 2
         return history[-max_history_entries:] if len(history) > max_history_entries else history
 
-    async def _process_image_url(self, url: str) -> Optional[Dict[str, Any]]:
+    def _schedule_conversation_summary(self, guild_id: int, thread_id: int, history: List[HistoryEntry],
+                                       llm_client: openai.AsyncOpenAI, channel_model: Optional[str] = None):
+        """応答後に、会話の古いターンの要約をバックグラウンドで開始する（設定されていれば要約用のモデルを使う）"""
+        summary_model = self.conversation_summarizer.model
+        client = llm_client
+        if summary_model:
+            client = self.llm_clients.get(summary_model) or self._initialize_llm_client(summary_model)
+            if not client:
+                return
+            self.llm_clients[summary_model] = client
+        self.conversation_summarizer.schedule(guild_id, thread_id, history, client, client.model_name_for_api_calls,
+                                              channel_model)
+
+    def _plan_context(self, channel_id: int, pinned_head: List[Dict[str, Any]], history: List[Dict[str, Any]],
+                      current: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """システムプロンプトと今回の発言を固定し、モデルのトークン予算に収まる分だけ新しい履歴を含める"""
+        if not self.context_planner.enabled:
+            return [*pinned_head, *history, *current]
+        model_string = self.channel_models.get(str(channel_id)) or self.llm_config.get('model')
+        plan = self.context_planner.plan(model_string, pinned_head, history, current)
+        logger.info(f"📏 [CONTEXT] {plan.summary()}")
+        if plan.over_budget:
+            logger.warning(f"⚠️ [CONTEXT] System prompt and current turn alone exceed the token budget "
+                           f"({plan.estimated_tokens}/{plan.budget}) for '{model_string}'")
+        return plan.messages
+
+    def _image_max_dimension(self, channel_id: Optional[int]) -> int:
+        """チャンネルで使うモデルのプロバイダーに合わせた画像の最大長辺（0は縮小しない）"""
+        model_string = (self.channel_models.get(str(channel_id)) if channel_id else None) or self.llm_config.get(
+            'model') or ''
+        provider = model_string.split('/', 1)[0]
+        return int(self.image_provider_dimensions.get(provider, self.image_max_dimension) or 0)
+
+    async def _process_image_url(self, url: str, channel_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """画像URLをLLMに送る形式に変換する（変換済みの画像はキャッシュから返す）"""
+        max_dimension = self._image_max_dimension(channel_id)
+        entry = await self.image_cache.get_or_load(url, lambda: self._download_image(url, max_dimension),
+                                                   variant=f"max{max_dimension}" if max_dimension else "")
+        return entry.to_content_part() if entry else None
+
+    async def _download_image(self, url: str, max_dimension: int = 0) -> Optional[CachedImage]:
         try:
-            async with self.http_session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                if response.status == 200:
-                    image_bytes = await response.read()
-                    if len(image_bytes) > 20 * 1024 * 1024:
-                        logger.warning(f"Image too large ({len(image_bytes)} bytes): {url}")
-                        return None
-                    mime_type = response.content_type
-                    if not mime_type or not mime_type.startswith('image/'):
-                        ext = url.split('.')[-1].lower().split('?')
-                        mime_type = {'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'gif': 'image/gif',
-                                     'webp': 'image/webp'}.get(ext, 'image/jpeg')
-                    if mime_type == 'image/gif':
-                        try:
-                            from PIL import Image
-                            gif_image = Image.open(io.BytesIO(image_bytes))
-                            if getattr(gif_image, 'is_animated', False):
-                                logger.info(
-                                    f"🎬 [IMAGE] Detected animated GIF. Converting to static image: {url[:100]}...")
-                                gif_image.seek(0)
-                                if gif_image.mode != 'RGBA': gif_image = gif_image.convert('RGBA')
-                                output_buffer = io.BytesIO()
-                                gif_image.save(output_buffer, format='PNG', optimize=True)
-                                image_bytes, mime_type = output_buffer.getvalue(), 'image/png'
-                                logger.debug(
-                                    f"🖼️ [IMAGE] Converted animated GIF to PNG (Size: {len(image_bytes)} bytes)")
-                            else:
-                                logger.debug(f"🖼️ [IMAGE] Static GIF detected, processing normally")
-                        except ImportError:
-                            logger.warning(
-                                "⚠️ Pillow (PIL) library not found. Cannot process animated GIFs. Skipping image.")
-                            return None
-                        except Exception as gif_error:
-                            logger.error(f"❌ Error processing GIF image: {gif_error}", exc_info=True)
-                            return None
-                    encoded_image = base64.b64encode(image_bytes).decode('utf-8')
-                    logger.debug(
-                        f"🖼️ [IMAGE] Successfully processed image: {url[:100]}... (MIME: {mime_type}, Size: {len(image_bytes)} bytes)")
-                    return {"type": "image_url",
-                            "image_url": {"url": f"data:{mime_type};base64,{encoded_image}", "detail": "auto"}}
-                else:
-                    logger.warning(f"Failed to download image from {url} (Status: {response.status})")
-                    return None
+            fetched = await fetch_image(self.http_session, url, max_bytes=self.image_max_bytes)
+            if fetched is None:
+                return None
+            source_bytes, source_mime = fetched
+            transcoded = await self.image_transcoder.transcode(source_bytes, source_mime, max_dimension)
+            if transcoded is None:
+                return None
+            image_bytes, mime_type = transcoded
+            if mime_type != source_mime or len(image_bytes) != len(source_bytes):
+                logger.debug(f"🖼️ [IMAGE] Transcoded {source_mime} ({len(source_bytes)} bytes) -> "
+                             f"{mime_type} ({len(image_bytes)} bytes, max side {max_dimension or 'unlimited'})")
+            encoded_image = base64.b64encode(image_bytes).decode('utf-8')
+            logger.debug(
+                f"🖼️ [IMAGE] Successfully processed image: {url[:100]}... (MIME: {mime_type}, Size: {len(image_bytes)} bytes)")
+            return CachedImage(content_hash=content_hash(image_bytes), mime_type=mime_type,
+                               data_url=f"data:{mime_type};base64,{encoded_image}",
+                               source_bytes=len(source_bytes))
+        except ImageTooLargeError as e:
+            logger.warning(f"Image too large (>{e.limit} bytes, aborted at {e.size} bytes): {url}")
+            return None
         except asyncio.TimeoutError:
             logger.error(f"Timeout while downloading image: {url}")
             return None
@@ -756,8 +867,10 @@ class LLMCog(commands.Cog, name="LLM"):
                 if embed.thumbnail and embed.thumbnail.url and embed.thumbnail.url not in processed_urls: source_urls.append(
                     embed.thumbnail.url); processed_urls.add(embed.thumbnail.url)
         max_images = self.llm_config.get('max_images', 1)
-        for url in source_urls[:max_images]:
-            if image_data := await self._process_image_url(url): image_inputs.append(image_data)
+        # ダウンロードと変換は並行して行い、結果は元の順序で並べる
+        results = await asyncio.gather(
+            *(self._process_image_url(url, message.channel.id) for url in source_urls[:max_images]))
+        image_inputs.extend(image_data for image_data in results if image_data)
         if len(source_urls) > max_images:
             try:
                 await message.channel.send(self.llm_config.get('error_msg', {}).get('msg_max_image_size',
@@ -768,6 +881,27 @@ class LLMCog(commands.Cog, name="LLM"):
         return image_inputs, "\n".join(text_parts)
 
 
+    @commands.Cog.listener()
+    async def on_app_commands_synced(self):
+        # 起動時のコマンド同期の後に索引を作っておき、最初のメッセージで収集しないようにする
+        if self.command_manager:
+            self.command_manager.rebuild()
+
+    @commands.Cog.listener()
+    async def on_cogs_changed(self, cog_name: str):
+        if self.command_manager:
+            self.command_manager.invalidate(f"cog '{cog_name}' loaded or unloaded")
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild: discord.Guild):
+        if self.command_manager:
+            self.command_manager.invalidate(f"joined guild {guild.id}")
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        if self.command_manager:
+            self.command_manager.invalidate(f"left guild {guild.id}")
+
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
         if message.author.bot: return
@@ -824,23 +958,32 @@ class LLMCog(commands.Cog, name="LLM"):
                 view=self._create_support_view(), silent=True)
             return
         system_prompt = await self._prepare_system_prompt(message.channel.id, message.author.id,
-                                                          message.author.display_name)
+                                                          message.author.display_name, query=text_content)
         messages_for_api: List[Dict[str, Any]] = [{"role": "system", "content": system_prompt}]
-        if detected_lang_prompt := self._detect_language_and_create_prompt(text_content):
+        if detected_lang_prompt := await self._detect_language_and_create_prompt(text_content, message.author.id):
             messages_for_api.append({"role": "system", "content": detected_lang_prompt})
             logger.info("🌐 [LANG] Injecting language override prompt")
         elif self.language_prompt:
             messages_for_api.append({"role": "system", "content": self.language_prompt})
             logger.info("🌐 [LANG] Using default language prompt as fallback")
-        conversation_history = await self._collect_conversation_history(message)
-        messages_for_api.extend(conversation_history)
+        conversation_guild_id = message.guild.id if message.guild else 0
+        existing_summary = self.conversation_summarizer.get(conversation_guild_id, thread_id)
+        history_entries = await self._collect_conversation_history(
+            message, stop_at_id=existing_summary.covered_until_id if existing_summary else 0)
+        channel_model = self.channel_models.get(str(message.channel.id)) or self.llm_config.get('model')
+        summary_message, history_entries = self.conversation_summarizer.apply(conversation_guild_id, thread_id,
+                                                                              history_entries, channel_model)
+        if summary_message:
+            messages_for_api.append(summary_message)
+        conversation_history = [entry for _, entry in history_entries]
         user_content_parts = []
         if text_content: user_content_parts.append(
             {"type": "text", "text": f"{message.created_at.astimezone(self.jst).strftime('[%H:%M]')} {text_content}"})
         user_content_parts.extend(image_contents)
         if image_contents: logger.debug(f"Including {len(image_contents)} image(s) in request")
         user_message_for_api = {"role": "user", "content": user_content_parts}
-        messages_for_api.append(user_message_for_api)
+        messages_for_api = self._plan_context(message.channel.id, messages_for_api, conversation_history,
+                                              [user_message_for_api])
         logger.info(f"🔵 [API] Sending {len(messages_for_api)} messages to LLM")
         logger.debug(
             # FIX IS HERE
@@ -848,7 +991,8 @@ class LLMCog(commands.Cog, name="LLM"):
         try:
             # 最初のレスポンスかどうかを判定（会話履歴がない場合）
             # スレッド内では常にスレッド作成ボタンを表示しない
-            is_first_response = not isinstance(message.channel, discord.Thread) and len(conversation_history) == 0
+            is_first_response = (not isinstance(message.channel, discord.Thread) and len(conversation_history) == 0
+                                 and summary_message is None)
             sent_messages, llm_response, used_key_index = await self._handle_llm_streaming_response(message,
                                                                                                     messages_for_api,
                                                                                                     llm_client,
@@ -877,6 +1021,11 @@ class LLMCog(commands.Cog, name="LLM"):
                         self.message_to_thread[guild_id_for_msg] = {}
                     self.message_to_thread[guild_id_for_msg][msg.id] = thread_id
                 self._cleanup_old_threads()
+                self._schedule_conversation_summary(
+                    guild_id, thread_id,
+                    [*history_entries, (message.id, user_message_for_api),
+                     (sent_messages[0].id, {"role": "assistant", "content": llm_response})],
+                    llm_client, channel_model)
 
                 # TTS Cogにカスタムイベントを発火させる
                 try:
@@ -896,6 +1045,7 @@ class LLMCog(commands.Cog, name="LLM"):
                 threads_to_remove = list(guild_threads.keys())[:len(guild_threads) - 100]
                 for thread_id in threads_to_remove:
                     del guild_threads[thread_id]
+                    self.conversation_summarizer.drop(guild_id, thread_id)
                     if guild_id in self.message_to_thread:
                         self.message_to_thread[guild_id] = {
                             k: v for k, v in self.message_to_thread[guild_id].items() 
@@ -936,6 +1086,17 @@ class LLMCog(commands.Cog, name="LLM"):
                 await message.reply(content=error_msg, view=self._create_support_view(), silent=True)
             return None, "", None
 
+    async def _show_queue_position(self, sent_message: discord.Message, model_name: str, position: int):
+        """待機中のメッセージに待ち順位を表示する"""
+        queue_text = f"queue #{position} / 待ち順位 {position}番目"
+        if sent_message.embeds:
+            embed = sent_message.embeds[0]
+            embed.title = f"⏳ Waiting for '{model_name}' response... ({queue_text})"
+            await sent_message.edit(embed=embed)
+        else:
+            await sent_message.edit(
+                content=f"-# :incoming_envelope: waiting response for '{model_name}' ({queue_text}) :incoming_envelope:")
+
     async def _process_streaming_and_send_response(self, sent_message: discord.Message,
                                                    channel: discord.abc.Messageable,
                                                    user: Union[discord.User, discord.Member],
@@ -949,45 +1110,55 @@ class LLMCog(commands.Cog, name="LLM"):
         max_final_retries, final_retry_delay = 3, 2.0
         is_first_update = True
         logger.debug(f"Starting LLM stream for message {sent_message.id}")
-        stream_generator = self._llm_stream_and_tool_handler(messages_for_api, llm_client, channel.id, user.id)
-        async for content_chunk in stream_generator:
-            if not content_chunk:
-                continue
-            chunk_count += 1
-            full_response_text += content_chunk
-            if chunk_count % 100 == 0: logger.debug(
-                f"Stream chunk #{chunk_count}, total length: {len(full_response_text)} chars")
-            current_time, chars_accumulated = time.time(), len(full_response_text) - last_displayed_length
-
-            should_update = is_first_update or (
-                    current_time - last_update > update_interval and chars_accumulated >= min_update_chars)
-
-            if should_update and full_response_text:
-                is_first_update = False
-                display_length = len(full_response_text)
-                if display_length > SAFE_MESSAGE_LENGTH:
-                    display_text = f"{emoji_prefix}{full_response_text[:SAFE_MESSAGE_LENGTH - len(emoji_prefix) - len(emoji_suffix) - 100]}\n\n⚠️ (Output is long, will be split...)\n⚠️ (出力が長いため分割します...){emoji_suffix}"
-                else:
-                    display_text = f"{emoji_prefix}{full_response_text[:SAFE_MESSAGE_LENGTH - len(emoji_prefix) - len(emoji_suffix)]}{emoji_suffix}"
-                if display_text != sent_message.content:
-                    try:
-                        await sent_message.edit(content=display_text)
-                        last_update, last_displayed_length = current_time, len(full_response_text)
-                        logger.debug(f"Updated Discord message (displayed: {len(display_text)} chars)")
-                    except discord.NotFound:
-                        logger.warning(f"⚠️ Message deleted during stream (ID: {sent_message.id}). Aborting.")
-                        return None, "", None
-                    except discord.HTTPException as e:
-                        if e.status == 429:
-                            retry_after = (e.retry_after or 1.0) + 0.5
-                            logger.warning(
-                                f"⚠️ Rate limited on message edit (ID: {sent_message.id}). Waiting {retry_after:.2f}s")
-                            await asyncio.sleep(retry_after)
-                            last_update = time.time()
-                        else:
-                            logger.warning(
-                                f"⚠️ Failed to edit message (ID: {sent_message.id}): {e.status} - {getattr(e, 'text', str(e))}")
-                            await asyncio.sleep(retry_sleep_time)
+        guild = getattr(channel, 'guild', None)
+        ticket = await self.request_scheduler.acquire(
+            getattr(llm_client, 'provider_name', 'default'), guild.id if guild else 0, user.id,
+            on_position=lambda position: self._show_queue_position(sent_message, llm_client.model_name_for_api_calls,
+                                                                   position))
+        try:
+            stream_generator = self._llm_stream_and_tool_handler(messages_for_api, llm_client, channel.id, user.id,
+                                                                 ticket=ticket)
+            async for content_chunk in stream_generator:
+                if not content_chunk:
+                    continue
+                chunk_count += 1
+                full_response_text += content_chunk
+                if chunk_count % 100 == 0: logger.debug(
+                    f"Stream chunk #{chunk_count}, total length: {len(full_response_text)} chars")
+                current_time, chars_accumulated = time.time(), len(full_response_text) - last_displayed_length
+
+                should_update = is_first_update or (
+                        current_time - last_update > update_interval and chars_accumulated >= min_update_chars)
+
+                if should_update and full_response_text:
+                    is_first_update = False
+                    display_length = len(full_response_text)
+                    if display_length > SAFE_MESSAGE_LENGTH:
+                        display_text = f"{emoji_prefix}{full_response_text[:SAFE_MESSAGE_LENGTH - len(emoji_prefix) - len(emoji_suffix) - 100]}\n\n⚠️ (Output is long, will be split...)\n⚠️ (出力が長いため分割します...){emoji_suffix}"
+                    else:
+                        display_text = f"{emoji_prefix}{full_response_text[:SAFE_MESSAGE_LENGTH - len(emoji_prefix) - len(emoji_suffix)]}{emoji_suffix}"
+                    if display_text != sent_message.content:
+                        try:
+                            await sent_message.edit(content=display_text)
+                            last_update, last_displayed_length = current_time, len(full_response_text)
+                            logger.debug(f"Updated Discord message (displayed: {len(display_text)} chars)")
+                        except discord.NotFound:
+                            logger.warning(f"⚠️ Message deleted during stream (ID: {sent_message.id}). Aborting.")
+                            return None, "", None
+                        except discord.HTTPException as e:
+                            if e.status == 429:
+                                retry_after = (e.retry_after or 1.0) + 0.5
+                                logger.warning(
+                                    f"⚠️ Rate limited on message edit (ID: {sent_message.id}). Waiting {retry_after:.2f}s")
+                                await asyncio.sleep(retry_after)
+                                last_update = time.time()
+                            else:
+                                logger.warning(
+                                    f"⚠️ Failed to edit message (ID: {sent_message.id}): {e.status} - {getattr(e, 'text', str(e))}")
+                                await asyncio.sleep(retry_sleep_time)
+        finally:
+            # 応答の受信が終わった時点で枠を返す（Discordへの最終的な送信は枠の外で行う）
+            self.request_scheduler.release(ticket)
         logger.debug(f"Stream completed | Total chunks: {chunk_count} | Final length: {len(full_response_text)} chars")
         if full_response_text:
             if len(full_response_text) <= SAFE_MESSAGE_LENGTH:
@@ -1090,8 +1261,189 @@ class LLMCog(commands.Cog, name="LLM"):
         converted_messages.extend(other_messages)
         return converted_messages, combined_system_prompt
 
+    def _build_api_kwargs(self, client: openai.AsyncOpenAI, current_messages: List[Dict[str, Any]],
+                          tools_def: Optional[List[Dict[str, Any]]], extra_params: Dict[str, Any]) -> Dict[str, Any]:
+        # provider_nameを最初に定義（他の変数より前）
+        provider_name = client.provider_name
+
+        api_kwargs = {
+            "model": client.model_name_for_api_calls,
+            "messages": current_messages,
+            "stream": True,
+            "temperature": extra_params.get('temperature', 0.7),
+            "max_tokens": extra_params.get('max_tokens', 4096)
+        }
+        if self.context_planner.request_usage and getattr(client, 'stream_usage', False):
+            api_kwargs["stream_options"] = {"include_usage": True}
+
+        # ✅ Gemini でも tools を正しく渡す
+        # KoboldCPPの場合はツールサポートをチェック
+        is_koboldcpp = provider_name.lower() == 'koboldcpp'
+        supports_tools = getattr(client, 'supports_tools', True)
+
+        if tools_def and supports_tools:
+            api_kwargs["tools"] = tools_def
+            api_kwargs["tool_choice"] = "auto"
+            logger.info(
+                f"🔧 [TOOLS] Passing {len(tools_def)} tools to API: {[t['function']['name'] for t in tools_def]}")
+            if is_koboldcpp:
+                logger.info(f"🔧 [KoboldCPP] Tools are enabled for this model")
+        elif tools_def and not supports_tools:
+            logger.warning(
+                f"⚠️ [TOOLS] Tools are disabled for provider '{provider_name}' (supports_tools=false). Skipping tools.")
+            if is_koboldcpp:
+                logger.warning(
+                    f"⚠️ [KoboldCPP] This KoboldCPP model may not support tools. Consider enabling 'supports_tools: true' in config if the model supports it.")
+        else:
+            logger.warning(f"⚠️ [TOOLS] No tools available to pass to API")
+
+        return api_kwargs
+
+    async def _open_stream(self, client: openai.AsyncOpenAI, api_kwargs: Dict[str, Any]) -> Tuple[openai.AsyncOpenAI, Any]:
+        """APIキーをローテーションしながらストリームを開く。(実際に使ったクライアント, ストリーム) を返す"""
+        provider_name = client.provider_name
+        api_keys = self.provider_api_keys.get(client.provider_name, [])
+        num_keys = len(api_keys)
+        stream = None
+
+        if num_keys == 0:
+            raise Exception(f"No API keys available for provider {provider_name}")
+
+        for attempt in range(num_keys):
+            try:
+                current_key_index = self.provider_key_index.get(provider_name, 0)
+                client.last_used_key_index = current_key_index
+                logger.debug(
+                    f"Attempting API call to '{provider_name}' with key index {current_key_index} (Attempt {attempt + 1}/{num_keys}).")
+                stream = await client.chat.completions.create(**api_kwargs)
+                logger.debug(f"Stream connection established successfully.")
+                break
+            except Exception as e:
+                # エラーの種類とステータスコードを取得
+                status_code = getattr(e, 'status_code', None)
+                error_type = type(e).__name__
+
+                # ローテーションすべきエラーかどうかを判定
+                should_rotate = False
+                rotation_reason = ""
+
+                # RateLimitError (429)
+                if isinstance(e, openai.RateLimitError):
+                    should_rotate = True
+                    rotation_reason = "Rate limit"
+                # InternalServerError (500)
+                elif isinstance(e, openai.InternalServerError):
+                    should_rotate = True
+                    rotation_reason = "Server error"
+                # APIError (その他のHTTPエラー)
+                elif isinstance(e, openai.APIError):
+                    if status_code:
+                        # 400-599の範囲のHTTPエラーでローテーション
+                        # ただし、400系の中でもキーに関連する可能性があるものを対象
+                        if status_code == 400:
+                            # 400エラーでも、キーの問題（無効なキーなど）の可能性があるためローテーション
+                            should_rotate = True
+                            rotation_reason = f"Bad Request (400) - possible invalid API key"
+                        elif status_code == 401:
+                            # 401 Unauthorized - 認証エラーのためローテーション
+                            should_rotate = True
+                            rotation_reason = "Unauthorized (401) - invalid API key"
+                        elif status_code == 403:
+                            # 403 Forbidden - 権限エラーのためローテーション
+                            should_rotate = True
+                            rotation_reason = "Forbidden (403) - API key may lack permissions"
+                        elif status_code == 429:
+                            # 429 Too Many Requests - レート制限のためローテーション
+                            should_rotate = True
+                            rotation_reason = "Rate limit (429)"
+                        elif 500 <= status_code < 600:
+                            # 5xx Server Errors - サーバーエラーのためローテーション
+                            should_rotate = True
+                            rotation_reason = f"Server error ({status_code})"
+
+                # ローテーションすべきエラーの場合
+                if should_rotate:
+                    logger.warning(
+                        f"⚠️ {rotation_reason} error ({status_code or 'N/A'}) for provider '{provider_name}' with key index {current_key_index}. Details: {e}")
+
+                    # まだ試していないキーがある場合はローテーション
+                    if attempt + 1 < num_keys:
+                        next_key_index = (current_key_index + 1) % num_keys
+                        self.provider_key_index[provider_name] = next_key_index
+                        next_key = api_keys[next_key_index]
+                        logger.info(
+                            f"🔄 Switching to next API key for provider '{provider_name}' (index: {next_key_index}) and retrying.")
+                        provider_config = self.llm_config.get('providers', {}).get(provider_name, {})
+                        is_koboldcpp = provider_name.lower() == 'koboldcpp'
+                        timeout = provider_config.get('timeout', 300.0) if is_koboldcpp else None
+                        new_client = openai.AsyncOpenAI(base_url=client.base_url, api_key=next_key, timeout=timeout)
+                        new_client.model_name_for_api_calls = client.model_name_for_api_calls
+                        new_client.provider_name = client.provider_name
+                        # KoboldCPPメタデータを保持
+                        if is_koboldcpp:
+                            new_client.supports_tools = getattr(client, 'supports_tools', provider_config.get('supports_tools', True))
+                        else:
+                            new_client.supports_tools = getattr(client, 'supports_tools', True)
+                        new_client.stream_usage = getattr(client, 'stream_usage', False)
+                        client = new_client
+                        self.llm_clients[f"{provider_name}/{client.model_name_for_api_calls}"] = new_client
+                        await asyncio.sleep(1)
+                        continue  # 次のキーで再試行
+                    else:
+                        # すべてのキーを試した場合はエラーを投げる
+                        logger.error(f"❌ All {num_keys} API keys for provider '{provider_name}' have failed with {rotation_reason} error. Aborting.")
+                        raise e
+                else:
+                    # ローテーションすべきでないエラー（モデル名が無効など、キーとは無関係なエラー）は即座に投げる
+                    logger.error(f"❌ Non-retryable error calling LLM API: {error_type} (status: {status_code or 'N/A'}) - {e}", exc_info=True)
+                    raise e
+
+        if stream is None:
+            raise Exception("Failed to establish stream with any API key.")
+        return client, stream
+
+    async def _start_stream(self, model_string: str, primary_client: openai.AsyncOpenAI,
+                            current_messages: List[Dict[str, Any]], tools_def: Optional[List[Dict[str, Any]]],
+                            extra_params: Dict[str, Any], ticket: Optional[SchedulerTicket] = None) -> StreamStart:
+        """
+        model_string のモデルでストリームを開き、最初のチャンクまで受信する（フェイルオーバーの1試行）
+
+        ticket（呼び出し元が確保した実行枠）のプロバイダーへの最初の試行以外は、そのプロバイダーの
+        実行枠をこの試行のために確保する。枠は採用されなかった試行のストリームを閉じる時か、
+        採用された試行の受信が終わった時に返す。
+        """
+        if model_string == f"{primary_client.provider_name}/{primary_client.model_name_for_api_calls}":
+            client = primary_client
+        else:
+            client = self.llm_clients.get(model_string) or self._initialize_llm_client(model_string)
+            if not client:
+                raise Exception(f"Fallback model '{model_string}' is not available")
+            self.llm_clients[model_string] = client
+        release = None
+        if ticket is not None and not (client is primary_client and client.provider_name == ticket.provider):
+            attempt_ticket = await self.request_scheduler.acquire(client.provider_name, ticket.guild_id,
+                                                                  ticket.user_id)
+            release = lambda: self.request_scheduler.release(attempt_ticket)
+        try:
+            api_kwargs = self._build_api_kwargs(client, current_messages, tools_def, extra_params)
+            client, stream = await self._open_stream(client, api_kwargs)
+        except BaseException:
+            if release is not None:
+                release()
+            raise
+        start = StreamStart(model_string=model_string, client=client, stream=stream, release=release)
+        try:
+            start.first_chunk = await stream.__anext__()
+        except StopAsyncIteration:
+            start.first_chunk = None
+        except BaseException:
+            await start.close()
+            raise
+        return start
+
     async def _llm_stream_and_tool_handler(self, messages: List[Dict[str, Any]], client: openai.AsyncOpenAI,
-                                           channel_id: int, user_id: int) -> AsyncGenerator[str, None]:
+                                           channel_id: int, user_id: int,
+                                           ticket: Optional[SchedulerTicket] = None) -> AsyncGenerator[str, None]:
         model_string = self.channel_models.get(str(channel_id)) or self.llm_config.get('model')
         is_gemini = model_string and 'gemini' in model_string.lower()
 
@@ -1112,166 +1464,65 @@ class LLMCog(commands.Cog, name="LLM"):
             logger.debug(f"Starting LLM API call (iteration {iteration + 1}/{max_iterations})")
             tools_def = self.get_tools_definition()
 
-            # provider_nameを最初に定義（他の変数より前）
-            provider_name = client.provider_name
-            api_keys = self.provider_api_keys.get(client.provider_name, [])
-            num_keys = len(api_keys)
-
-            api_kwargs = {
-                "model": client.model_name_for_api_calls,
-                "messages": current_messages,
-                "stream": True,
-                "temperature": extra_params.get('temperature', 0.7),
-                "max_tokens": extra_params.get('max_tokens', 4096)
-            }
-
-            # ✅ Gemini でも tools を正しく渡す
-            # KoboldCPPの場合はツールサポートをチェック
-            is_koboldcpp = provider_name.lower() == 'koboldcpp'
-            supports_tools = getattr(client, 'supports_tools', True)
-            
-            if tools_def and supports_tools:
-                api_kwargs["tools"] = tools_def
-                api_kwargs["tool_choice"] = "auto"
-                logger.info(
-                    f"🔧 [TOOLS] Passing {len(tools_def)} tools to API: {[t['function']['name'] for t in tools_def]}")
-                if is_koboldcpp:
-                    logger.info(f"🔧 [KoboldCPP] Tools are enabled for this model")
-            elif tools_def and not supports_tools:
-                logger.warning(
-                    f"⚠️ [TOOLS] Tools are disabled for provider '{provider_name}' (supports_tools=false). Skipping tools.")
-                if is_koboldcpp:
-                    logger.warning(
-                        f"⚠️ [KoboldCPP] This KoboldCPP model may not support tools. Consider enabling 'supports_tools: true' in config if the model supports it.")
-            else:
-                logger.warning(f"⚠️ [TOOLS] No tools available to pass to API")
-
-            stream = None
-
-            if num_keys == 0:
-                raise Exception(f"No API keys available for provider {provider_name}")
-
-            for attempt in range(num_keys):
-                try:
-                    current_key_index = self.provider_key_index.get(provider_name, 0)
-                    client.last_used_key_index = current_key_index
-                    logger.debug(
-                        f"Attempting API call to '{provider_name}' with key index {current_key_index} (Attempt {attempt + 1}/{num_keys}).")
-                    stream = await client.chat.completions.create(**api_kwargs)
-                    logger.debug(f"Stream connection established successfully.")
-                    break
-                except Exception as e:
-                    # エラーの種類とステータスコードを取得
-                    status_code = getattr(e, 'status_code', None)
-                    error_type = type(e).__name__
-                    
-                    # ローテーションすべきエラーかどうかを判定
-                    should_rotate = False
-                    rotation_reason = ""
-                    
-                    # RateLimitError (429)
-                    if isinstance(e, openai.RateLimitError):
-                        should_rotate = True
-                        rotation_reason = "Rate limit"
-                    # InternalServerError (500)
-                    elif isinstance(e, openai.InternalServerError):
-                        should_rotate = True
-                        rotation_reason = "Server error"
-                    # APIError (その他のHTTPエラー)
-                    elif isinstance(e, openai.APIError):
-                        if status_code:
-                            # 400-599の範囲のHTTPエラーでローテーション
-                            # ただし、400系の中でもキーに関連する可能性があるものを対象
-                            if status_code == 400:
-                                # 400エラーでも、キーの問題（無効なキーなど）の可能性があるためローテーション
-                                should_rotate = True
-                                rotation_reason = f"Bad Request (400) - possible invalid API key"
-                            elif status_code == 401:
-                                # 401 Unauthorized - 認証エラーのためローテーション
-                                should_rotate = True
-                                rotation_reason = "Unauthorized (401) - invalid API key"
-                            elif status_code == 403:
-                                # 403 Forbidden - 権限エラーのためローテーション
-                                should_rotate = True
-                                rotation_reason = "Forbidden (403) - API key may lack permissions"
-                            elif status_code == 429:
-                                # 429 Too Many Requests - レート制限のためローテーション
-                                should_rotate = True
-                                rotation_reason = "Rate limit (429)"
-                            elif 500 <= status_code < 600:
-                                # 5xx Server Errors - サーバーエラーのためローテーション
-                                should_rotate = True
-                                rotation_reason = f"Server error ({status_code})"
-                    
-                    # ローテーションすべきエラーの場合
-                    if should_rotate:
-                        logger.warning(
-                            f"⚠️ {rotation_reason} error ({status_code or 'N/A'}) for provider '{provider_name}' with key index {current_key_index}. Details: {e}")
-                        
-                        # まだ試していないキーがある場合はローテーション
-                        if attempt + 1 < num_keys:
-                            next_key_index = (current_key_index + 1) % num_keys
-                            self.provider_key_index[provider_name] = next_key_index
-                            next_key = api_keys[next_key_index]
-                            logger.info(
-                                f"🔄 Switching to next API key for provider '{provider_name}' (index: {next_key_index}) and retrying.")
-                            provider_config = self.llm_config.get('providers', {}).get(provider_name, {})
-                            is_koboldcpp = provider_name.lower() == 'koboldcpp'
-                            timeout = provider_config.get('timeout', 300.0) if is_koboldcpp else None
-                            new_client = openai.AsyncOpenAI(base_url=client.base_url, api_key=next_key, timeout=timeout)
-                            new_client.model_name_for_api_calls = client.model_name_for_api_calls
-                            new_client.provider_name = client.provider_name
-                            # KoboldCPPメタデータを保持
-                            if is_koboldcpp:
-                                new_client.supports_tools = getattr(client, 'supports_tools', provider_config.get('supports_tools', True))
-                            else:
-                                new_client.supports_tools = getattr(client, 'supports_tools', True)
-                            client = new_client
-                            self.llm_clients[f"{provider_name}/{client.model_name_for_api_calls}"] = new_client
-                            await asyncio.sleep(1)
-                            continue  # 次のキーで再試行
-                        else:
-                            # すべてのキーを試した場合はエラーを投げる
-                            logger.error(f"❌ All {num_keys} API keys for provider '{provider_name}' have failed with {rotation_reason} error. Aborting.")
-                            raise e
-                    else:
-                        # ローテーションすべきでないエラー（モデル名が無効など、キーとは無関係なエラー）は即座に投げる
-                        logger.error(f"❌ Non-retryable error calling LLM API: {error_type} (status: {status_code or 'N/A'}) - {e}", exc_info=True)
-                        raise e
-
-            if stream is None:
-                raise Exception("Failed to establish stream with any API key.")
+            # フェイルオーバー先を含めて最初に応答したストリームを使う（以降の反復も同じモデルを使う）
+            chain = self.failover_router.chain_for(f"{client.provider_name}/{client.model_name_for_api_calls}")
+            # ヘッジやフェイルオーバーの試行もスケジューラーの実行枠を確保する（空きのないプロバイダーにはヘッジしない）
+            started = await self.failover_router.open_first(
+                chain, lambda ms: self._start_stream(ms, client, current_messages, tools_def, extra_params, ticket),
+                can_hedge=lambda ms: self.request_scheduler.has_capacity(ms.split('/', 1)[0]))
+            client = started.client
+            model_string = started.model_string
+            if started.model_string != chain[0]:
+                logger.warning(f"🔀 [FAILOVER] Response served by '{started.model_string}' instead of '{chain[0]}'")
+
+            # 推定トークン数と実際のプロンプトトークン数（ストリーム末尾の usage）を比較する
+            estimator = self.context_planner.estimator_for(model_string)
+            estimated_prompt_tokens = estimator.count_messages(current_messages)
 
             tool_calls_buffer = []
             assistant_response_content = ""
             finish_reason = None
+            usage = None
 
-            async for chunk in stream:
-                if not chunk.choices:
-                    continue
-                choice = chunk.choices[0]
-                if choice.finish_reason:
-                    finish_reason = choice.finish_reason
-                delta = choice.delta
-                if delta and delta.content:
-                    assistant_response_content += delta.content
-                    yield delta.content
-                if delta and delta.tool_calls:
-                    for tool_call_chunk in delta.tool_calls:
-                        chunk_index = tool_call_chunk.index if tool_call_chunk.index is not None else 0
-                        if len(tool_calls_buffer) <= chunk_index:
-                            tool_calls_buffer.append(
-                                {"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
-                        buffer = tool_calls_buffer[chunk_index]
-                        if tool_call_chunk.id:
-                            buffer["id"] = tool_call_chunk.id
-                        if tool_call_chunk.function:
-                            if tool_call_chunk.function.name:
-                                buffer["function"]["name"] = tool_call_chunk.function.name
-                            if tool_call_chunk.function.arguments:
-                                buffer["function"]["arguments"] += tool_call_chunk.function.arguments
+            try:
+                async for chunk in started.iterate():
+                    if getattr(chunk, 'usage', None):
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    choice = chunk.choices[0]
+                    if choice.finish_reason:
+                        finish_reason = choice.finish_reason
+                    delta = choice.delta
+                    if delta and delta.content:
+                        assistant_response_content += delta.content
+                        yield delta.content
+                    if delta and delta.tool_calls:
+                        for tool_call_chunk in delta.tool_calls:
+                            chunk_index = tool_call_chunk.index if tool_call_chunk.index is not None else 0
+                            if len(tool_calls_buffer) <= chunk_index:
+                                tool_calls_buffer.append(
+                                    {"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+                            buffer = tool_calls_buffer[chunk_index]
+                            if tool_call_chunk.id:
+                                buffer["id"] = tool_call_chunk.id
+                            if tool_call_chunk.function:
+                                if tool_call_chunk.function.name:
+                                    buffer["function"]["name"] = tool_call_chunk.function.name
+                                if tool_call_chunk.function.arguments:
+                                    buffer["function"]["arguments"] += tool_call_chunk.function.arguments
+            finally:
+                # フォールバック先のために確保した実行枠は、受信が終わった時点で返す
+                started.release_slot()
 
             client.last_finish_reason = finish_reason
+            actual_prompt_tokens = getattr(usage, 'prompt_tokens', None) if usage else None
+            if actual_prompt_tokens:
+                error_rate = (estimated_prompt_tokens - actual_prompt_tokens) / actual_prompt_tokens * 100
+                logger.info(f"📏 [CONTEXT] Prompt tokens: estimated {estimated_prompt_tokens} / actual "
+                            f"{actual_prompt_tokens} ({error_rate:+.0f}%) | completion "
+                            f"{getattr(usage, 'completion_tokens', None)}")
+                estimator.record_actual(estimated_prompt_tokens, actual_prompt_tokens)
             assistant_message = {"role": "assistant", "content": assistant_response_content or None}
             if tool_calls_buffer:
                 assistant_message["tool_calls"] = tool_calls_buffer
@@ -1334,11 +1585,17 @@ class LLMCog(commands.Cog, name="LLM"):
                     tool_response_content = await self.bio_manager.run_tool(arguments=function_args, user_id=user_id)
                     logger.debug(f"🔧 [TOOL] Result:\n{tool_response_content}")
                 elif self.memory_manager and function_name == self.memory_manager.name:
-                    tool_response_content = await self.memory_manager.run_tool(arguments=function_args)
+                    guild_id, memory_channel_id = self._memory_location(channel_id)
+                    tool_response_content = await self.memory_manager.run_tool(arguments=function_args,
+                                                                                guild_id=guild_id,
+                                                                                channel_id=memory_channel_id)
                     logger.debug(f"🔧 [TOOL] Result:\n{tool_response_content}")
                 elif self.image_generator and function_name == self.image_generator.name:
+                    requester = self.bot.get_user(user_id)
                     tool_response_content = await self.image_generator.run(arguments=function_args,
-                                                                           channel_id=channel_id)
+                                                                           channel_id=channel_id,
+                                                                           user_id=user_id,
+                                                                           user_name=requester.display_name if requester else "Unknown")
                     logger.debug(f"🔧 [TOOL] Result:\n{tool_response_content}")
                 else:
                     logger.warning(f"⚠️ Unsupported tool called: {raw_function_name} (normalized: {function_name})")
@@ -1484,7 +1741,7 @@ class LLMCog(commands.Cog, name="LLM"):
                 return
             model_in_use, image_contents = llm_client.model_name_for_api_calls, []
             if image_url:
-                if image_data := await self._process_image_url(image_url):
+                if image_data := await self._process_image_url(image_url, interaction.channel_id):
                     image_contents.append(image_data)
                 else:
                     await interaction.followup.send(
@@ -1502,12 +1759,12 @@ class LLMCog(commands.Cog, name="LLM"):
                     view=self._create_support_view())
                 return
             system_prompt = await self._prepare_system_prompt(interaction.channel_id, interaction.user.id,
-                                                              interaction.user.display_name)
+                                                              interaction.user.display_name, query=message)
             messages_for_api: List[Dict[str, Any]] = [{"role": "system", "content": system_prompt}]
             user_content_parts = [{"type": "text",
                                    "text": f"{interaction.created_at.astimezone(self.jst).strftime('[%H:%M]')} {message}"}]
             user_content_parts.extend(image_contents)
-            if detected_lang_prompt := self._detect_language_and_create_prompt(message):
+            if detected_lang_prompt := await self._detect_language_and_create_prompt(message, interaction.user.id):
                 messages_for_api.append({"role": "system", "content": detected_lang_prompt})
                 logger.info("🌐 [LANG] Injecting language override prompt")
             elif self.language_prompt:
@@ -1760,8 +2017,12 @@ class LLMCog(commands.Cog, name="LLM"):
                           description="Save information to the global shared memory.\nグローバル共有メモリに情報を保存します。")
     @app_commands.describe(
         key="The key for the information (e.g., 'Developer Announcement').\n情報のキー（項目名） 例: '開発者からのお知らせ'",
-        value="The content of the information (e.g., 'Next maintenance is...').\n情報の内容 例: '次回のメンテナンスは...'")
-    async def memory_save_slash(self, interaction: discord.Interaction, key: str, value: str):
+        value="The content of the information (e.g., 'Next maintenance is...').\n情報の内容 例: '次回のメンテナンスは...'",
+        scope="Where the memory is shared (default: global).\n共有する範囲（既定: 全サーバー共通）")
+    @app_commands.choices(scope=[app_commands.Choice(name="Global / 全サーバー共通", value="global"),
+                                 app_commands.Choice(name="Server / このサーバー", value="guild"),
+                                 app_commands.Choice(name="Channel / このチャンネル", value="channel"), ])
+    async def memory_save_slash(self, interaction: discord.Interaction, key: str, value: str, scope: str = "global"):
         await interaction.response.defer(ephemeral=False)
         if not self.memory_manager:
             embed = discord.Embed(title="❌ Plugin Error / プラグインエラー",
@@ -1771,9 +2032,20 @@ class LLMCog(commands.Cog, name="LLM"):
             await interaction.followup.send(embed=embed, view=self._create_support_view(), ephemeral=False)
             return
         try:
-            await self.memory_manager.save_memory(key, value)
-            embed = discord.Embed(title="✅ Saved to Global Shared Memory / グローバル共有メモリに保存しました",
+            guild_id, memory_channel_id = self._memory_location(interaction.channel_id)
+            scope_id = self.memory_manager.scope_id_for(scope, guild_id, memory_channel_id)
+        except ValueError:
+            embed = discord.Embed(title="❌ Invalid Scope / 無効な範囲",
+                                  description="This scope cannot be used here.\nこの範囲はここでは使用できません。",
+                                  color=discord.Color.red())
+            self._add_support_footer(embed)
+            await interaction.followup.send(embed=embed, view=self._create_support_view(), ephemeral=False)
+            return
+        try:
+            await self.memory_manager.save_memory(key, value, scope, scope_id)
+            embed = discord.Embed(title="✅ Saved to Shared Memory / 共有メモリに保存しました",
                                   color=discord.Color.green())
+            embed.add_field(name="Scope / 範囲", value=scope, inline=False)
             embed.add_field(name="Key / キー", value=f"```{key}```", inline=False)
             embed.add_field(name="Value / 値", value=f"```{value}```", inline=False)
             self._add_support_footer(embed)
@@ -1787,8 +2059,12 @@ class LLMCog(commands.Cog, name="LLM"):
             await interaction.followup.send(embed=embed, view=self._create_support_view(), ephemeral=False)
 
     @app_commands.command(name="memory-list",
-                          description="List all global shared memories.\nグローバル共有メモリの情報を一覧表示します。")
-    async def memory_list_slash(self, interaction: discord.Interaction):
+                          description="List shared memories.\n共有メモリの情報を一覧表示します。")
+    @app_commands.describe(scope="Which memories to list (default: global).\n表示する範囲（既定: 全サーバー共通）")
+    @app_commands.choices(scope=[app_commands.Choice(name="Global / 全サーバー共通", value="global"),
+                                 app_commands.Choice(name="Server / このサーバー", value="guild"),
+                                 app_commands.Choice(name="Channel / このチャンネル", value="channel"), ])
+    async def memory_list_slash(self, interaction: discord.Interaction, scope: str = "global"):
         await interaction.response.defer(ephemeral=False)
         if not self.memory_manager:
             embed = discord.Embed(title="❌ Plugin Error / プラグインエラー",
@@ -1797,15 +2073,20 @@ class LLMCog(commands.Cog, name="LLM"):
             self._add_support_footer(embed)
             await interaction.followup.send(embed=embed, view=self._create_support_view(), ephemeral=False)
             return
-        memories = self.memory_manager.list_memories()
+        guild_id, memory_channel_id = self._memory_location(interaction.channel_id)
+        try:
+            memories = await self.memory_manager.list_memories(
+                scope, self.memory_manager.scope_id_for(scope, guild_id, memory_channel_id))
+        except ValueError:
+            memories = {}
         if not memories:
             embed = discord.Embed(title="ℹ️ No Memories / メモリに情報はありません",
-                                  description="Nothing is saved in the global shared memory.\nグローバル共有メモリには何も保存されていません。",
+                                  description=f"Nothing is saved in the {scope} shared memory.\n共有メモリ（{scope}）には何も保存されていません。",
                                   color=discord.Color.blue())
             self._add_support_footer(embed)
             await interaction.followup.send(embed=embed, view=self._create_support_view(), ephemeral=False)
             return
-        embed = discord.Embed(title="🌐 Global Shared Memory / グローバル共有メモリ", color=discord.Color.blue())
+        embed = discord.Embed(title=f"🌐 Shared Memory ({scope}) / 共有メモリ（{scope}）", color=discord.Color.blue())
         description = ""
         for key, value in memories.items():
             field_text = f"**{key}**: {value}\n"
@@ -1820,14 +2101,24 @@ class LLMCog(commands.Cog, name="LLM"):
     async def memory_key_autocomplete(self, interaction: discord.Interaction, current: str) -> List[
         app_commands.Choice[str]]:
         if not self.memory_manager: return []
-        keys = self.memory_manager.list_memories().keys()
+        scope = getattr(interaction.namespace, 'scope', None) or "global"
+        guild_id, memory_channel_id = self._memory_location(interaction.channel_id)
+        try:
+            keys = (await self.memory_manager.list_memories(
+                scope, self.memory_manager.scope_id_for(scope, guild_id, memory_channel_id))).keys()
+        except ValueError:
+            return []
         return [app_commands.Choice(name=key, value=key) for key in keys if current.lower() in key.lower()][:25]
 
     @app_commands.command(name="memory-delete",
-                          description="Delete a global shared memory.\nグローバル共有メモリから情報を削除します。")
-    @app_commands.describe(key="The key of the memory to delete.\n削除したい情報のキー")
+                          description="Delete a shared memory.\n共有メモリから情報を削除します。")
+    @app_commands.describe(key="The key of the memory to delete.\n削除したい情報のキー",
+                           scope="Where the memory is saved (default: global).\n情報の範囲（既定: 全サーバー共通）")
+    @app_commands.choices(scope=[app_commands.Choice(name="Global / 全サーバー共通", value="global"),
+                                 app_commands.Choice(name="Server / このサーバー", value="guild"),
+                                 app_commands.Choice(name="Channel / このチャンネル", value="channel"), ])
     @app_commands.autocomplete(key=memory_key_autocomplete)
-    async def memory_delete_slash(self, interaction: discord.Interaction, key: str):
+    async def memory_delete_slash(self, interaction: discord.Interaction, key: str, scope: str = "global"):
         await interaction.response.defer(ephemeral=False)
         if not self.memory_manager:
             embed = discord.Embed(title="❌ Plugin Error / プラグインエラー",
@@ -1837,15 +2128,17 @@ class LLMCog(commands.Cog, name="LLM"):
             await interaction.followup.send(embed=embed, view=self._create_support_view(), ephemeral=False)
             return
         try:
-            if await self.memory_manager.delete_memory(key):
+            guild_id, memory_channel_id = self._memory_location(interaction.channel_id)
+            scope_id = self.memory_manager.scope_id_for(scope, guild_id, memory_channel_id)
+            if await self.memory_manager.delete_memory(key, scope, scope_id):
                 embed = discord.Embed(title="✅ Memory Deleted / メモリを削除しました",
-                                      description=f"Deleted key '{key}' from global shared memory.\nグローバル共有メモリからキー '{key}' を削除しました。",
+                                      description=f"Deleted key '{key}' from {scope} shared memory.\n共有メモリ（{scope}）からキー '{key}' を削除しました。",
                                       color=discord.Color.green())
                 self._add_support_footer(embed)
                 await interaction.followup.send(embed=embed, view=self._create_support_view(), ephemeral=False)
             else:
                 embed = discord.Embed(title="⚠️ Key Not Found / キーが見つかりません",
-                                      description=f"Key '{key}' does not exist in global shared memory.\nキー '{key}' はグローバル共有メモリに存在しません。",
+                                      description=f"Key '{key}' does not exist in {scope} shared memory.\nキー '{key}' は共有メモリ（{scope}）に存在しません。",
                                       color=discord.Color.gold())
                 self._add_support_footer(embed)
                 await interaction.followup.send(embed=embed, view=self._create_support_view(), ephemeral=False)
@@ -2100,6 +2393,8 @@ class LLMCog(commands.Cog, name="LLM"):
             model_list = "\n".join([f"• `{m.split('/', 1)[1]}`" for m in models[:5]])
             if len(models) > 5: model_list += f"\n• ... and {len(models) - 5} more"
             embed.add_field(name=f"📦 {provider_name.title()} Models", value=model_list or "None", inline=True)
+        embed.add_field(name="🖥️ Backends / 生成サーバー",
+                        value=f"```\n{self.image_generator.get_queue_stats_text()[:1000]}\n```", inline=False)
         embed.add_field(name="💡 Commands / コマンド",
                         value="• `/switch-image-model` - Change model / モデル変更\n• `/reset-image-model` - Reset to default / デフォルトに戻す",
                         inline=False)
@@ -2162,6 +2457,63 @@ class LLMCog(commands.Cog, name="LLM"):
         else:
             await interaction.followup.send(embed=embed, view=view, ephemeral=False)
 
+    @app_commands.command(name="image-queue",
+                          description="Show the image generation queue and your jobs. / 画像生成キューと自分のジョブを表示します。")
+    async def image_queue_slash(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
+        if not self.image_generator:
+            embed = discord.Embed(title="❌ Plugin Error / プラグインエラー",
+                                  description="ImageGenerator is not available.\nImageGeneratorが利用できません。",
+                                  color=discord.Color.red())
+            self._add_support_footer(embed)
+            await interaction.followup.send(embed=embed, view=self._create_support_view())
+            return
+        generator = self.image_generator
+        embed = discord.Embed(title="📋 Image Generation Queue / 画像生成キュー",
+                              description=f"Waiting / 待機中: **{len(generator.generation_queue)}** | Running / 生成中: **{len(generator.active_tasks)}**",
+                              color=discord.Color.blue())
+        jobs = generator.get_user_jobs(interaction.user.id)
+        if jobs:
+            lines = []
+            for task in jobs[:10]:
+                position = generator.get_queue_position(task)
+                state = f"#{position}" if position else "🎨 running / 生成中"
+                lines.append(f"`{task.job_id}` {state} - {task.prompt[:60]}{'...' if len(task.prompt) > 60 else ''}")
+            embed.add_field(name="Your Jobs / あなたのジョブ", value="\n".join(lines), inline=False)
+        else:
+            embed.add_field(name="Your Jobs / あなたのジョブ", value="None / なし", inline=False)
+        embed.add_field(name="⏱️ Recent Jobs / 直近のジョブ",
+                        value=f"```\n{generator.get_recent_jobs_text()[:1000]}\n```", inline=False)
+        embed.add_field(name="💡 Commands / コマンド",
+                        value="• `/image-cancel` - Cancel your jobs / ジョブを取り消す", inline=False)
+        self._add_support_footer(embed)
+        await interaction.followup.send(embed=embed, view=self._create_support_view(), ephemeral=True)
+
+    @app_commands.command(name="image-cancel",
+                          description="Cancel your queued image generation jobs. / 自分の画像生成ジョブを取り消します。")
+    @app_commands.describe(job_id="Job ID to cancel (all of your jobs if omitted). / 取り消すジョブID（省略時はすべて）")
+    async def image_cancel_slash(self, interaction: discord.Interaction, job_id: Optional[str] = None):
+        await interaction.response.defer(ephemeral=True)
+        if not self.image_generator:
+            embed = discord.Embed(title="❌ Plugin Error / プラグインエラー",
+                                  description="ImageGenerator is not available.\nImageGeneratorが利用できません。",
+                                  color=discord.Color.red())
+            self._add_support_footer(embed)
+            await interaction.followup.send(embed=embed, view=self._create_support_view())
+            return
+        cancelled = await self.image_generator.cancel_jobs(interaction.user.id, job_id.strip() if job_id else None)
+        if cancelled:
+            embed = discord.Embed(title="🚫 Jobs Cancelled / ジョブを取り消しました",
+                                  description="\n".join(f"`{t.job_id}` - {t.prompt[:60]}" for t in cancelled[:10]),
+                                  color=discord.Color.green())
+            logger.info(f"{len(cancelled)} image job(s) cancelled by {interaction.user.name}")
+        else:
+            embed = discord.Embed(title="ℹ️ No Jobs Found / ジョブが見つかりません",
+                                  description="You have no matching image generation jobs.\n該当する画像生成ジョブはありません。",
+                                  color=discord.Color.blue())
+        self._add_support_footer(embed)
+        await interaction.followup.send(embed=embed, view=self._create_support_view(), ephemeral=True)
+
     @app_commands.command(name="llm_help",
                           description="Displays help and usage guidelines for LLM (AI Chat) features.\nLLM (AI対話) 機能のヘルプと利用ガイドラインを表示します。")
     async def llm_help_slash(self, interaction: discord.Interaction):
@@ -2188,7 +2540,9 @@ class LLMCog(commands.Cog, name="LLM"):
                         value="• `/switch-image-model`: Switch the image generation model for this channel. / このチャンネルの画像生成モデルを切り替えます。\n"
                               "• `/reset-image-model`: Reset the image generation model to default. / 画像生成モデルをデフォルトに戻します。\n"
                               "• `/show-image-model`: Show the current image generation model. / 現在の画像生成モデルを表示します。\n"
-                              "• `/list-image-models`: List all available image generation models. / 利用可能な全画像生成モデルを一覧表示します。",
+                              "• `/list-image-models`: List all available image generation models. / 利用可能な全画像生成モデルを一覧表示します。\n"
+                              "• `/image-queue`: Show the image generation queue and your jobs. / 画像生成キューと自分のジョブを表示します。\n"
+                              "• `/image-cancel`: Cancel your image generation jobs. / 自分の画像生成ジョブを取り消します。",
                         inline=False)
 
         embed.add_field(name="Commands - User Info / コマンド - ユーザー情報",
@@ -2257,6 +2611,7 @@ class LLMCog(commands.Cog, name="LLM"):
         for thread_id in threads_to_clear:
             if guild_id in self.conversation_threads and thread_id in self.conversation_threads[guild_id]:
                 del self.conversation_threads[guild_id][thread_id]
+                self.conversation_summarizer.drop(guild_id, thread_id)
                 if guild_id in self.message_to_thread:
                     self.message_to_thread[guild_id] = {
                         k: v for k, v in self.message_to_thread[guild_id].items() 
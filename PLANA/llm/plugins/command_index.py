@@ -0,0 +1,255 @@
+# PLANA/llm/plugins/command_index.py
+from __future__ import annotations
+
+import math
+import re
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# 英数字の単語と、日本語の文字種（漢字・カタカナ・ひらがな）ごとの連続部分
+_WORD_PATTERN = re.compile(r'[a-z0-9]+')
+_KANJI_RUN_PATTERN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\u3005]+')
+_KATAKANA_RUN_PATTERN = re.compile(r'[\u30a1-\u30ff\uff66-\uff9f]+')
+_HIRAGANA_RUN_PATTERN = re.compile(r'[\u3041-\u309f]+')
+_COMMAND_MENTION_PATTERN = re.compile(r'/([\w-]+)')
+
+# 英語の機能語・雑談でよく使う語（どのコマンドの説明にも現れるか、雑談をコマンドに結び付けてしまうため索引しない）
+_STOPWORDS = frozenset(
+    "a an the to of in on for and or is are be do does did i you it my me we can how what which with "
+    "this that from by as at use using about please tell your yours so not no just think know want like "
+    "have has had was were am if up all any some they he she his her its our their why where when who "
+    "really very too also thanks thank hi hello hey ok okay yes lol story today would could should will "
+    "there here then than now more most".split())
+
+# ひらがなの機能語（助詞・助動詞・挨拶など）の bigram。どの説明文にも現れ、雑談で必ず一致するため索引しない
+_STOP_BIGRAMS = frozenset(
+    "ます しま りま きま みま びま ちま えま けま めま れま した して する すす です でし ない ませ まし ある あり いる いま てい てく くだ ださ さい "
+    "ござ ざい りが がと とう うご れる られ され せる させ たい たか かっ った って ので から まで など "
+    "こと もの よう この その あの どの これ それ あれ ここ そこ けど だけ でも では には とは ても には "
+    "かり わり あな なた たの こん んに にち ちは おは はよ ねえ えね なに なん んで かな よね".split())
+
+# 英語と日本語の対訳（片方の言語だけで説明されたコマンドを、もう一方の言語のメッセージから引くためにクエリの語を展開する）
+_QUERY_SYNONYMS = {
+    'notification': '通知',
+    'notify': '通知',
+    'earthquake': '地震',
+    'tsunami': '津波',
+    'dice': 'ダイス',
+    'image': '画像',
+    'picture': '画像',
+    'memory': 'メモリ',
+    'voice': '音声',
+    'read': '読み上げ',
+    'stream': '配信',
+    'operator': 'オペレーター',
+    'weapon': '武器',
+    'map': 'マップ',
+}
+
+# 検索精度の確認用のサンプル（メッセージ, 期待するコマンド名）。None は雑談（コマンドを提案しない）
+SAMPLE_QUERIES: List[Tuple[str, Optional[str]]] = [
+    ("ありがとうございます、助かりました", None),
+    ("こんにちは！今日はいい天気ですね", None),
+    ("昨日のご飯は美味しかったです", None),
+    ("ねえねえ、好きな食べ物は何？", None),
+    ("Tell me a story about a dragon", None),
+    ("lol that's funny", None),
+    ("I'm so tired today, work was hard", None),
+    ("What's the capital of France?", None),
+    ("how do I set up earthquake notifications?", 'earthquake_channel'),
+    ("地震の通知を設定したい", 'earthquake_channel'),
+    ("Twitchの通知を設定したい", 'twitch_set'),
+    ("roll 2d6 please", 'roll'),
+    ("サイコロを振って", 'diceroll'),
+    ("how do i check the bot latency", 'ping'),
+    ("/ping", 'ping'),
+    ("このサーバーの情報を教えて", 'serverinfo'),
+    ("猫の画像見せて", 'meow'),
+    ("change the image model", 'switch-image-model'),
+    ("メモリを削除したい", 'memory-delete'),
+    ("R6のオペレーターを調べて", 'r6s-operator'),
+    ("download this video from youtube", 'ytdlp_video'),
+]
+
+# 相対的な閾値。1位のスコアが全コマンドの平均スコアのこの倍率未満なら（多くのコマンドに同じように一致している）、
+# どれも関連が薄いとみなす
+RELATIVE_MARGIN = 3.0
+
+# フィールドごとの重み（出現回数に掛ける）
+NAME_WEIGHT = 3
+DESCRIPTION_WEIGHT = 2
+PARAMETER_WEIGHT = 1
+
+
+def _stem(word: str) -> str:
+    """英語の複数形・三人称単数の s を落とす（notifications と notification を同じ語にする）"""
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    英語と日本語が混在した文を検索用のトークンに分割する
+
+    英数字は2文字以上の単語単位（コマンド名の - や _ でも区切る）、日本語は分かち書きをせず、
+    漢字・カタカナ・ひらがなの連続部分ごとに文字bigramにする（「を表」のような助詞をまたぐ bigram を作らない）。
+    1文字だけの漢字・カタカナはその文字をトークンにし、ひらがなは機能語の bigram を除く。
+    """
+    text = text.lower()
+    tokens = [_stem(word) for word in _WORD_PATTERN.findall(text) if len(word) > 1 and word not in _STOPWORDS]
+    for pattern in (_KANJI_RUN_PATTERN, _KATAKANA_RUN_PATTERN):
+        for run in pattern.findall(text):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    for run in _HIRAGANA_RUN_PATTERN.findall(text):
+        tokens.extend(bigram for bigram in (run[i:i + 2] for i in range(len(run) - 1))
+                      if bigram not in _STOP_BIGRAMS)
+    return tokens
+
+
+def _query_terms(query: str) -> Set[str]:
+    terms = set(tokenize(query))
+    for word, synonym in _QUERY_SYNONYMS.items():
+        synonym_terms = set(tokenize(synonym))
+        if word in terms:
+            terms |= synonym_terms
+        elif synonym_terms <= terms:
+            terms.add(word)
+    return terms
+
+
+def _document_terms(cmd_info: Dict[str, Any]) -> Counter:
+    terms: Counter = Counter()
+    for token in tokenize(cmd_info['name'].replace('-', ' ').replace('_', ' ')):
+        terms[token] += NAME_WEIGHT
+    terms[cmd_info['name'].lower()] += NAME_WEIGHT
+    for token in tokenize(cmd_info.get('description', '')):
+        terms[token] += DESCRIPTION_WEIGHT
+    for param in cmd_info.get('parameters', []):
+        for token in tokenize(f"{param['name'].replace('_', ' ')} {param.get('description', '')}"):
+            terms[token] += PARAMETER_WEIGHT
+        for choice in param.get('choices', []):
+            for token in tokenize(str(choice['name'])):
+                terms[token] += PARAMETER_WEIGHT
+    return terms
+
+
+class CommandSearchIndex:
+    """
+    スラッシュコマンドの BM25 検索インデックス
+
+    コマンド名・説明・パラメータ（説明・選択肢を含む）を文書とし、英語は単語、日本語は文字bigramで索引する。
+    メッセージ中で /コマンド名 と明示されたコマンドは必ず上位にする。
+
+    雑談でも一般的な語がいくつかのコマンドに一致するため、絶対的な下限（min_score）に加えて、
+    1位がコマンド名・説明の語に一致していること、1位のスコアが全コマンドの平均より十分に高いことを求める。
+    """
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, commands: List[Dict[str, Any]]):
+        self.commands = list(commands)
+        self._by_name: Dict[str, int] = {cmd['name'].lower(): i for i, cmd in enumerate(self.commands)}
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._lengths: List[int] = []
+        # コマンド名・説明に含まれる語（パラメータにしか現れない語だけの一致では提案しない）
+        self._primary_terms: List[Set[str]] = []
+        for doc_id, cmd_info in enumerate(self.commands):
+            terms = _document_terms(cmd_info)
+            self._primary_terms.append(set(tokenize(cmd_info['name'].replace('-', ' ').replace('_', ' ')))
+                                       | {cmd_info['name'].lower()}
+                                       | set(tokenize(cmd_info.get('description', ''))))
+            self._lengths.append(sum(terms.values()))
+            for term, freq in terms.items():
+                self._postings.setdefault(term, []).append((doc_id, freq))
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        count = len(self.commands)
+        self._idf: Dict[str, float] = {
+            term: math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self._postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    def search(self, query: str, top_k: int = 3, min_score: float = 1.0) -> List[Tuple[float, Dict[str, Any]]]:
+        """
+        クエリに関連するコマンドを (スコア, コマンド情報) のリストで返す（スコアの高い順）
+
+        min_score 未満のコマンドは返さない。1位がコマンド名・説明の語に一致していない場合や、
+        1位のスコアが全コマンドの平均の RELATIVE_MARGIN 倍に届かない場合も、関係のない雑談として空を返す。
+        """
+        if not self.commands or not query:
+            return []
+        terms = _query_terms(query)
+        scores: Dict[int, float] = {}
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf[term]
+            for doc_id, freq in postings:
+                norm = self.K1 * (1 - self.B + self.B * self._lengths[doc_id] / self._avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * freq * (self.K1 + 1) / (freq + norm)
+
+        ranked = sorted(((score, doc_id) for doc_id, score in scores.items()), reverse=True)
+        if ranked and not self._is_confident(ranked, terms):
+            ranked = []
+
+        # /コマンド名 で明示されたコマンド
+        mentioned = []
+        for name in _COMMAND_MENTION_PATTERN.findall(query.lower()):
+            doc_id = self._by_name.get(name)
+            if doc_id is not None and doc_id not in mentioned:
+                mentioned.append(doc_id)
+        if mentioned:
+            ranked = sorted([(scores.get(doc_id, 0.0) + 100.0, doc_id) for doc_id in mentioned]
+                            + [(score, doc_id) for score, doc_id in ranked if doc_id not in mentioned], reverse=True)
+
+        return [(score, self.commands[doc_id]) for score, doc_id in ranked if score >= min_score][:top_k]
+
+    def _is_confident(self, ranked: List[Tuple[float, int]], terms: Set[str]) -> bool:
+        """1位のコマンドがメッセージに関連していると言えるか（相対的な閾値）"""
+        top_score, top_doc = ranked[0]
+        if not terms & self._primary_terms[top_doc]:
+            return False
+        mean = sum(score for score, _ in ranked) / len(self.commands)
+        return top_score >= mean * RELATIVE_MARGIN
+
+    def evaluate(self, samples: Optional[List[Tuple[str, Optional[str]]]] = None, top_k: int = 3,
+                 min_score: float = 1.0) -> Dict[str, Any]:
+        """
+        サンプルのメッセージで検索結果を確かめる（期待するコマンドが索引にないサンプルは数えない）
+
+        雑談は何も返さなければ正解、それ以外は期待するコマンドが top_k 件に入っていれば正解とする。
+        """
+        samples = samples or SAMPLE_QUERIES
+        checked = 0
+        misses = []
+        started = time.perf_counter()
+        for query, expected in samples:
+            if expected is not None and expected.lower() not in self._by_name:
+                continue
+            checked += 1
+            names = [cmd['name'] for _, cmd in self.search(query, top_k=top_k, min_score=min_score)]
+            correct = not names if expected is None else expected in names
+            if not correct:
+                misses.append(f"{query!r}->{','.join(names) or '-'}")
+        return {
+            'samples': checked,
+            'accuracy': (checked - len(misses)) / max(checked, 1),
+            'elapsed_ms': (time.perf_counter() - started) * 1000,
+            'misses': misses,
+        }
+
+    @staticmethod
+    def format_evaluation(report: Dict[str, Any]) -> str:
+        text = f"{report['samples']} samples, accuracy {report['accuracy']:.0%} ({report['elapsed_ms']:.1f}ms)"
+        if report['misses']:
+            text += f" | misses: {', '.join(report['misses'])}"
+        return text
@@ -1,25 +1,139 @@
 from __future__ import annotations
 
 import logging
-import os
-from typing import TYPE_CHECKING, List, Dict, Any
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, List, Dict, Any, Optional, Set, Tuple
 
-import discord
 from discord.ext import commands
 
+from PLANA.llm.plugins.command_index import CommandSearchIndex
+
 if TYPE_CHECKING:
     from discord.ext.commands import Bot
 
 logger = logging.getLogger(__name__)
 
+COMMANDS_HEADER = "# 🤖 利用可能なBotコマンド一覧\n\n"
+COMMANDS_GUIDANCE = (
+    "ユーザーが特定の機能を求めたり、コマンドの使い方を尋ねた場合は、"
+    "以下のコマンド一覧から**最も関連性の高いコマンド**を提案してください。\n\n"
+    "**提案時の注意点:**\n"
+    "- コマンド名、説明、使用例を**明確に表示**してください\n"
+    "- ユーザーの要求に最も適したコマンドを1〜3個提案してください\n"
+    "- 必要に応じてパラメータの説明も追加してください\n\n"
+)
+RELEVANT_COMMANDS_GUIDANCE = (
+    "以下はユーザーのメッセージに関連する可能性があるコマンドです（全コマンドではありません）。"
+    "ユーザーが機能やコマンドの使い方を求めている場合にのみ、コマンド名・説明・使用例を示して提案してください。\n\n"
+)
+
+
+def _approx_tokens(text: str) -> int:
+    return len(text) // 3
+
+
+@dataclass
+class CommandCatalog:
+    """
+    収集したコマンド情報の索引（Cogのロード・アンロード・リロードやギルドの参加・脱退で作り直す）
+
+    名前・カテゴリ（Cog名）での参照は辞書で O(1)。整形済みのテキストも保持する。
+    キーワード検索は「名前 + 説明」の文字bigramの転置インデックスで候補を絞ってから部分一致を確かめる。
+    """
+    cmds: List[Dict[str, Any]] = field(default_factory=list)
+    by_name: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    by_category: Dict[str, List[Dict[str, Any]]] = field(default_factory=dict)
+    formatted: Dict[str, str] = field(default_factory=dict)
+    category_texts: Dict[str, str] = field(default_factory=dict)
+    full_text: str = ""
+    search_index: Optional[CommandSearchIndex] = None
+    _keyword_texts: List[str] = field(default_factory=list)
+    _bigrams: Dict[str, Set[int]] = field(default_factory=dict)
+    built_at: float = 0.0
+    build_ms: float = 0.0
+    # 全コマンド一覧（full_text）のトークン数（トークン数を数える関数ごと。索引を作り直すまで変わらない）
+    _full_tokens: Dict[Callable[[str], int], int] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.cmds)
+
+    def full_tokens(self, count_tokens: Callable[[str], int]) -> int:
+        if count_tokens not in self._full_tokens:
+            self._full_tokens[count_tokens] = count_tokens(self.full_text)
+        return self._full_tokens[count_tokens]
+
+    def index_keywords(self):
+        for doc_id, cmd_info in enumerate(self.cmds):
+            text = f"{cmd_info['name']} {cmd_info['description']}".lower()
+            self._keyword_texts.append(text)
+            for i in range(len(text) - 1):
+                self._bigrams.setdefault(text[i:i + 2], set()).add(doc_id)
+
+    def match_keyword(self, keyword: str) -> Set[int]:
+        """「名前 + 説明」に keyword を含むコマンドの番号"""
+        keyword = keyword.lower()
+        if not keyword:
+            return set(range(len(self.cmds)))
+        if len(keyword) < 2:
+            return {i for i, text in enumerate(self._keyword_texts) if keyword in text}
+        candidates: Optional[Set[int]] = None
+        for i in range(len(keyword) - 1):
+            postings = self._bigrams.get(keyword[i:i + 2])
+            if not postings:
+                return set()
+            candidates = set(postings) if candidates is None else candidates & postings
+        return {i for i in candidates if keyword in self._keyword_texts[i]}
+
 
 class CommandInfoManager:
     """Botの全コマンド情報を収集・整形するマネージャー"""
 
     def __init__(self, bot: Bot):
         self.bot = bot
+        # コマンド情報の索引（最初に必要になった時か、コマンドの同期後に作る）
+        self._catalog: Optional[CommandCatalog] = None
         logger.info("CommandInfoManager initialized.")
 
+    def invalidate(self, reason: str = ""):
+        """索引を破棄する（次に参照した時に作り直す）"""
+        if self._catalog is not None:
+            logger.info(f"🧭 [CommandInfoManager] Command index invalidated ({reason or 'requested'})")
+        self._catalog = None
+
+    def rebuild(self) -> CommandCatalog:
+        """コマンド情報を収集して索引を作り直す"""
+        started = time.perf_counter()
+        slash_commands = self._collect_slash_commands_from_cog_files()
+        catalog = CommandCatalog(cmds=slash_commands)
+        for cmd_info in slash_commands:
+            catalog.by_name[cmd_info['name'].lower()] = cmd_info
+            catalog.by_category.setdefault(cmd_info.get('cog', 'その他'), []).append(cmd_info)
+            catalog.formatted[cmd_info['name']] = self._format_command_info_detailed(cmd_info)
+        for category, category_commands in catalog.by_category.items():
+            catalog.category_texts[category.lower()] = (
+                f"# {category} のコマンド\n\n" + "".join(catalog.formatted[cmd['name']] for cmd in category_commands))
+        catalog.full_text = self._format_catalog(catalog)
+        catalog.search_index = CommandSearchIndex(slash_commands)
+        catalog.index_keywords()
+        catalog.built_at = time.time()
+        catalog.build_ms = (time.perf_counter() - started) * 1000
+        self._catalog = catalog
+        logger.info(f"🧭 [CommandInfoManager] Built command index ({len(catalog)} commands, "
+                    f"{len(catalog.by_category)} categories) in {catalog.build_ms:.1f}ms")
+        report = catalog.search_index.evaluate()
+        log = logger.info if not report['misses'] else logger.warning
+        log(f"🧭 [CommandInfoManager] Command search self-check: {CommandSearchIndex.format_evaluation(report)}")
+        return catalog
+
+    @property
+    def catalog(self) -> CommandCatalog:
+        return self._catalog if self._catalog is not None else self.rebuild()
+
+    def get_command_info(self, name: str) -> Optional[Dict[str, Any]]:
+        """コマンド名（先頭の / は省略可）からコマンド情報を取得"""
+        return self.catalog.by_name.get(name.lstrip('/').lower())
+
     def get_all_commands_info(self) -> str:
         """
         _cog.pyで終わるCogから全コマンドを収集し、
@@ -28,41 +142,73 @@ class CommandInfoManager:
         Returns:
             str: コマンド情報を整形したテキスト
         """
-        commands_text = "# 🤖 利用可能なBotコマンド一覧\n\n"
-        commands_text += (
-            "ユーザーが特定の機能を求めたり、コマンドの使い方を尋ねた場合は、"
-            "以下のコマンド一覧から**最も関連性の高いコマンド**を提案してください。\n\n"
-            "**提案時の注意点:**\n"
-            "- コマンド名、説明、使用例を**明確に表示**してください\n"
-            "- ユーザーの要求に最も適したコマンドを1〜3個提案してください\n"
-            "- 必要に応じてパラメータの説明も追加してください\n\n"
-        )
-
-        # スラッシュコマンドを収集
-        slash_commands = self._collect_slash_commands_from_cog_files()
+        return self.catalog.full_text
 
-        if slash_commands:
-            # カテゴリ（Cog名）ごとにグループ化
-            categorized = {}
-            for cmd_info in slash_commands:
-                category = cmd_info.get('cog', 'その他')
-                if category not in categorized:
-                    categorized[category] = []
-                categorized[category].append(cmd_info)
+    def _format_catalog(self, catalog: CommandCatalog) -> str:
+        """コマンド情報をカテゴリ（Cog名）ごとに整形する"""
+        commands_text = COMMANDS_HEADER + COMMANDS_GUIDANCE
 
-            for category, commands in sorted(categorized.items()):
+        if catalog.cmds:
+            for category, category_commands in sorted(catalog.by_category.items()):
                 commands_text += f"## 📁 {category}\n\n"
-                for cmd_info in commands:
-                    commands_text += self._format_command_info_detailed(cmd_info)
+                for cmd_info in category_commands:
+                    commands_text += catalog.formatted[cmd_info['name']]
                 commands_text += "\n"
         else:
             commands_text += "現在利用可能なコマンドはありません。\n"
 
         return commands_text
 
+    def get_relevant_commands_info(self, query: str, top_k: int = 3, max_tokens: int = 800, min_score: float = 1.0,
+                                   count_tokens: Optional[Callable[[str], int]] = None
+                                   ) -> Tuple[str, Dict[str, Any]]:
+        """
+        メッセージに関連するコマンドだけを整形して返す（関連するものがなければ空文字列）
+
+        Args:
+            query: ユーザーのメッセージ
+            top_k: 最大件数
+            max_tokens: 整形後のテキストのトークン数の上限（超える分のコマンドは含めない）
+            min_score: 関連度（BM25スコア）の下限
+            count_tokens: トークン数を数える関数（省略時は文字数 / 3 で概算）
+
+        Returns:
+            (整形したテキスト, 統計情報)
+        """
+        count_tokens = count_tokens or _approx_tokens
+        catalog = self.catalog
+        index = catalog.search_index
+        started = time.perf_counter()
+        results = index.search(query, top_k=top_k, min_score=min_score)
+        query_ms = (time.perf_counter() - started) * 1000
+
+        text = ""
+        selected = []
+        if results:
+            text = COMMANDS_HEADER + RELEVANT_COMMANDS_GUIDANCE
+            for _, cmd_info in results:
+                entry = catalog.formatted[cmd_info['name']]
+                if count_tokens(text + entry) > max_tokens:
+                    break
+                text += entry
+                selected.append(cmd_info['name'])
+            if not selected:
+                text = ""
+
+        stats = {
+            'candidates': len(index),
+            'selected': selected,
+            'tokens': count_tokens(text) if text else 0,
+            'full_tokens': catalog.full_tokens(count_tokens),
+            'query_ms': query_ms,
+        }
+        return text, stats
+
     def _collect_slash_commands_from_cog_files(self) -> List[Dict[str, Any]]:
         """_cog.pyで終わるファイルからスラッシュコマンドを収集"""
         commands_list = []
+        # 同じコマンドを重複して収集しないための (コマンド名, Cog名)
+        seen: Set[Tuple[str, str]] = set()
         loaded_cog_names = set()
 
         # ロード済みのCogのうち、_cog.pyで終わるものを特定
@@ -94,7 +240,8 @@ class CommandInfoManager:
                 # よりシンプルな判定: 'Cog'で終わるか、loaded_cog_namesに含まれれば収集
                 if 'cog' in cog_name.lower() or any(name in cog_name.lower() for name in loaded_cog_names):
                     cmd_info = self._extract_slash_command_info(command)
-                    if cmd_info:
+                    if cmd_info and (cmd_info['name'], cmd_info['cog']) not in seen:
+                        seen.add((cmd_info['name'], cmd_info['cog']))
                         commands_list.append(cmd_info)
                         #logger.info(f"  ✅ Collected: /{cmd_info['name']} from {cmd_info['cog']}")
                 else:
@@ -114,7 +261,8 @@ class CommandInfoManager:
                     cog_name = command.binding.__class__.__name__
                     if 'cog' in cog_name.lower() or any(name in cog_name.lower() for name in loaded_cog_names):
                         cmd_info = self._extract_slash_command_info(command)
-                        if cmd_info and cmd_info not in commands_list:
+                        if cmd_info and (cmd_info['name'], cmd_info['cog']) not in seen:
+                            seen.add((cmd_info['name'], cmd_info['cog']))
                             commands_list.append(cmd_info)
                             logger.info(f"  ✅ Collected (guild): /{cmd_info['name']} from {cmd_info['cog']}")
 
@@ -280,17 +428,12 @@ class CommandInfoManager:
         Returns:
             マッチしたコマンド情報のリスト
         """
-        all_commands = self._collect_slash_commands_from_cog_files()
-        matches = []
-
-        for cmd in all_commands:
-            cmd_text = f"{cmd['name']} {cmd['description']}".lower()
-
-            # いずれかのキーワードがマッチすればOK
-            if any(keyword.lower() in cmd_text for keyword in keywords):
-                matches.append(cmd)
-
-        return matches
+        catalog = self.catalog
+        # いずれかのキーワードがマッチすればOK
+        matched: Set[int] = set()
+        for keyword in keywords:
+            matched |= catalog.match_keyword(keyword)
+        return [catalog.cmds[i] for i in sorted(matched)]
 
     def get_commands_by_category(self, category: str) -> str:
         """
@@ -302,14 +445,7 @@ class CommandInfoManager:
         Returns:
             str: 該当カテゴリのコマンド情報
         """
-        all_commands = self._collect_slash_commands_from_cog_files()
-        filtered = [cmd for cmd in all_commands if cmd.get('cog', '').lower() == category.lower()]
-
-        if not filtered:
+        text = self.catalog.category_texts.get(category.lower())
+        if text is None:
             return f"カテゴリ '{category}' のコマンドは見つかりませんでした。\n"
-
-        text = f"# {category} のコマンド\n\n"
-        for cmd_info in filtered:
-            text += self._format_command_info_detailed(cmd_info)
-
         return text
\ No newline at end of file
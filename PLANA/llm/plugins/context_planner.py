@@ -0,0 +1,238 @@
+# PLANA/llm/plugins/context_planner.py
+from __future__ import annotations
+
+import copy
+import logging
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# ひらがな・カタカナ・CJK統合漢字・ハングル・全角記号（1文字あたりのトークン数が英字と大きく異なる）
+_WIDE_CHAR_PATTERN = re.compile(r'[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+# プロバイダーごとの推定係数（実際の usage で補正される）
+#   chars_per_token: 英数字などの文字数 / トークン
+#   wide_tokens_per_char: 日本語などの1文字あたりのトークン数
+#   image_tokens: 画像1枚あたりのトークン数
+DEFAULT_PROVIDER_PROFILES: Dict[str, Dict[str, float]] = {
+    'openai': {'chars_per_token': 4.0, 'wide_tokens_per_char': 1.0, 'image_tokens': 765},
+    'google': {'chars_per_token': 4.0, 'wide_tokens_per_char': 0.8, 'image_tokens': 258},
+    'mistral': {'chars_per_token': 3.5, 'wide_tokens_per_char': 1.3, 'image_tokens': 1024},
+    'default': {'chars_per_token': 3.5, 'wide_tokens_per_char': 1.2, 'image_tokens': 1024},
+}
+
+# メッセージごとのロール・区切りのオーバーヘッド
+MESSAGE_OVERHEAD_TOKENS = 4
+TRUNCATION_MARKER = "\n…(truncated / 長いため省略しました)"
+
+
+class TokenEstimator:
+    """
+    プロバイダーごとのトークン数の推定
+
+    OpenAI は tiktoken がインストールされていればそれで数え、それ以外は文字種ごとの係数で推定する。
+    API から返された実際のプロンプトトークン数で係数を補正していく（指数移動平均）。
+    """
+
+    CALIBRATION_WEIGHT = 0.2
+
+    def __init__(self, provider: str, profile: Optional[Dict[str, float]] = None):
+        self.provider = provider
+        base = DEFAULT_PROVIDER_PROFILES.get(provider, DEFAULT_PROVIDER_PROFILES['default'])
+        self.profile = {**base, **(profile or {})}
+        self.calibration = 1.0
+        self.samples = 0
+        self._encoding = None
+        if tiktoken is not None and provider == 'openai':
+            try:
+                self._encoding = tiktoken.get_encoding('o200k_base')
+            except Exception as e:
+                logger.debug(f"tiktoken encoding unavailable, using heuristic token estimates: {e}")
+
+    def count_text(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        wide = len(_WIDE_CHAR_PATTERN.findall(text))
+        narrow = len(text) - wide
+        estimate = narrow / self.profile['chars_per_token'] + wide * self.profile['wide_tokens_per_char']
+        return int(estimate * self.calibration) + 1
+
+    def count_message(self, message: Dict[str, Any]) -> int:
+        tokens = MESSAGE_OVERHEAD_TOKENS
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += self.count_text(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    tokens += self.count_text(part.get("text", ""))
+                elif part.get("type") == "image_url":
+                    tokens += int(self.profile['image_tokens'])
+        for tool_call in message.get("tool_calls") or []:
+            function = tool_call.get("function", {})
+            tokens += self.count_text(function.get("name", "")) + self.count_text(function.get("arguments", ""))
+        return tokens
+
+    def count_messages(self, messages: List[Dict[str, Any]]) -> int:
+        return sum(self.count_message(message) for message in messages)
+
+    def record_actual(self, estimated: int, actual: int):
+        """実際のプロンプトトークン数で推定係数を補正する（tiktoken 使用時は補正しない）"""
+        if self._encoding is not None or estimated <= 0 or actual <= 0:
+            return
+        # 補正前の推定値に対する比率に換算してから平均する
+        ratio = actual / (estimated / self.calibration)
+        self.calibration += (ratio - self.calibration) * self.CALIBRATION_WEIGHT
+        self.calibration = min(max(self.calibration, 0.25), 4.0)
+        self.samples += 1
+
+
+@dataclass
+class ContextPlan:
+    """予算内に収めた送信メッセージと、その内訳"""
+    messages: List[Dict[str, Any]]
+    budget: int
+    estimated_tokens: int
+    history_total: int
+    history_kept: int
+    truncated: bool = False
+    over_budget: bool = False
+    dropped_tokens: int = 0
+
+    def summary(self) -> str:
+        text = (f"~{self.estimated_tokens}/{self.budget} tokens | history {self.history_kept}/{self.history_total}"
+                f"{' (truncated)' if self.truncated else ''}")
+        if self.dropped_tokens:
+            text += f" | dropped ~{self.dropped_tokens} tokens"
+        if self.over_budget:
+            text += " | pinned messages exceed budget"
+        return text
+
+
+def _truncate_message(message: Dict[str, Any], estimator: TokenEstimator, max_tokens: int
+                      ) -> Optional[Dict[str, Any]]:
+    """テキスト部分を先頭から max_tokens 程度に切り詰めたコピーを返す（画像は外す）。収まらなければ None"""
+    content = message.get("content")
+    text = content if isinstance(content, str) else "\n".join(
+        part.get("text", "") for part in content or [] if part.get("type") == "text")
+    if not text:
+        return None
+    budget = max_tokens - MESSAGE_OVERHEAD_TOKENS - estimator.count_text(TRUNCATION_MARKER)
+    if budget <= 0:
+        return None
+    # 推定は文字数にほぼ比例するため、比率で切ってから超過分を詰める
+    keep = int(len(text) * budget / max(estimator.count_text(text), 1))
+    while keep > 0 and estimator.count_text(text[:keep]) > budget:
+        keep = int(keep * 0.9)
+    if keep <= 0:
+        return None
+    truncated = copy.copy(message)
+    truncated_text = text[:keep] + TRUNCATION_MARKER
+    truncated["content"] = truncated_text if isinstance(content, str) else [{"type": "text", "text": truncated_text}]
+    return truncated
+
+
+def plan_context(pinned_head: List[Dict[str, Any]], history: List[Dict[str, Any]],
+                 current: List[Dict[str, Any]], estimator: TokenEstimator, budget: int,
+                 min_truncated_tokens: int = 256) -> ContextPlan:
+    """
+    トークン予算に収まるように会話履歴を選ぶ
+
+    システムプロンプト（pinned_head）と今回の発言（current）は必ず含め、残りの予算に
+    新しい履歴から順に詰める。入りきらない履歴メッセージは、残りが min_truncated_tokens 以上あれば
+    テキストを切り詰めて含め、それより古い履歴は送らない。
+    """
+    pinned_tokens = estimator.count_messages(pinned_head) + estimator.count_messages(current)
+    remaining = budget - pinned_tokens
+    kept: List[Dict[str, Any]] = []
+    truncated = False
+    dropped_tokens = 0
+
+    for index in range(len(history) - 1, -1, -1):
+        message = history[index]
+        tokens = estimator.count_message(message)
+        if tokens <= remaining:
+            kept.append(message)
+            remaining -= tokens
+            continue
+        if remaining >= min_truncated_tokens and (shortened := _truncate_message(message, estimator, remaining)):
+            kept.append(shortened)
+            remaining -= estimator.count_message(shortened)
+            truncated = True
+            dropped_tokens += tokens - estimator.count_message(shortened)
+        else:
+            dropped_tokens += tokens
+        dropped_tokens += estimator.count_messages(history[:index])
+        break
+
+    kept.reverse()
+    # 履歴の先頭がアシスタントの発言だけになった場合は、対応する質問がないため外す
+    while kept and kept[0].get("role") == "assistant":
+        tokens = estimator.count_message(kept.pop(0))
+        remaining += tokens
+        dropped_tokens += tokens
+
+    messages = [*pinned_head, *kept, *current]
+    return ContextPlan(messages=messages, budget=budget, estimated_tokens=budget - remaining,
+                       history_total=len(history), history_kept=len(kept), truncated=truncated,
+                       over_budget=pinned_tokens > budget, dropped_tokens=dropped_tokens)
+
+
+class ContextPlanner:
+    """
+    モデルごとのトークン予算と、プロバイダーごとの推定器をまとめて管理する
+
+    config (llm.context_budget):
+        enabled: 予算による履歴の調整を行うか
+        default_tokens: 予算（プロンプト部分のトークン数）
+        models: "provider/model" または "provider" ごとの予算
+        max_history_messages: 予算とは別に、遡る履歴メッセージ数の上限
+        providers: プロバイダーごとの推定係数の上書き
+        request_usage: ストリームの最後に usage（実際のトークン数）を返すよう要求するか
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        self.enabled = config.get('enabled', True)
+        self.default_tokens = int(config.get('default_tokens', 32000))
+        self.model_budgets: Dict[str, int] = {k: int(v) for k, v in (config.get('models') or {}).items()}
+        self.max_history_messages = int(config.get('max_history_messages', 100))
+        self.min_truncated_tokens = int(config.get('min_truncated_tokens', 256))
+        self.provider_profiles: Dict[str, Dict[str, float]] = config.get('providers') or {}
+        self.request_usage = config.get('request_usage', True)
+        self._estimators: Dict[str, TokenEstimator] = {}
+
+    def estimator_for(self, model_string: str) -> TokenEstimator:
+        provider = (model_string or '').split('/', 1)[0] or 'default'
+        estimator = self._estimators.get(provider)
+        if estimator is None:
+            estimator = TokenEstimator(provider, self.provider_profiles.get(provider))
+            self._estimators[provider] = estimator
+        return estimator
+
+    def budget_for(self, model_string: str) -> int:
+        model_string = model_string or ''
+        if model_string in self.model_budgets:
+            return self.model_budgets[model_string]
+        return self.model_budgets.get(model_string.split('/', 1)[0], self.default_tokens)
+
+    def plan(self, model_string: str, pinned_head: List[Dict[str, Any]], history: List[Dict[str, Any]],
+             current: List[Dict[str, Any]]) -> ContextPlan:
+        return plan_context(pinned_head, history, current, self.estimator_for(model_string),
+                            self.budget_for(model_string), self.min_truncated_tokens)
+
+    def get_stats_text(self) -> str:
+        if not self._estimators:
+            return "no estimates yet"
+        return " | ".join(
+            f"{provider}: {'tiktoken' if estimator._encoding is not None else f'x{estimator.calibration:.2f}'}"
+            f" ({estimator.samples} samples)" for provider, estimator in self._estimators.items())
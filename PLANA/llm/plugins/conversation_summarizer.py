@@ -0,0 +1,207 @@
+# PLANA/llm/plugins/conversation_summarizer.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import openai
+
+logger = logging.getLogger(__name__)
+
+# (DiscordメッセージID, APIに送るメッセージ)
+HistoryEntry = Tuple[int, Dict[str, Any]]
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a Discord conversation between users and an AI assistant.\n"
+    "Merge the existing summary and the new turns into one updated summary.\n"
+    "- Keep facts, decisions, names, numbers, user preferences and open questions.\n"
+    "- Drop greetings, filler and anything superseded later in the conversation.\n"
+    "- Write in the language the conversation mainly uses, as concise bullet points.\n"
+    "- Output only the summary, at most {max_words} words."
+)
+SUMMARY_PROMPT_PREFIX = "[Summary of the earlier conversation / これまでの会話の要約]\n"
+
+
+@dataclass
+class ConversationSummary:
+    """会話の古い部分を畳み込んだ要約"""
+    text: str = ""
+    covered_until_id: int = 0  # この ID 以前のメッセージは要約に含まれている
+    folded_messages: int = 0
+    folded_tokens: int = 0  # 要約に畳み込んだメッセージの推定トークン数の合計
+    summary_tokens: int = 0
+    updated_at: float = 0.0
+
+    def to_system_message(self) -> Dict[str, Any]:
+        return {"role": "system", "content": SUMMARY_PROMPT_PREFIX + self.text}
+
+
+def _render_entry(message: Dict[str, Any]) -> str:
+    content = message.get("content")
+    if isinstance(content, list):
+        texts = []
+        for part in content:
+            if part.get("type") == "text":
+                texts.append(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                texts.append("[image]")
+        content = " ".join(texts)
+    return f"[{message.get('role', 'user')}] {content or ''}"
+
+
+class ConversationSummarizer:
+    """
+    長く続く会話の古いターンを要約に畳み込む
+
+    応答を送った後にバックグラウンドで要約を作るため、応答までの時間には影響しない。
+    次回以降のリクエストでは「要約 + 直近のターン」を送る。
+
+    config (llm.conversation_summary):
+        enabled: 要約を有効にするか
+        trigger_messages: 要約されていない履歴がこの件数を超えたら要約する
+        keep_recent_messages: 要約せずにそのまま送る直近のメッセージ数
+        max_summary_words: 要約の長さの目安
+        model: 要約に使うモデル（"provider/model"）。未設定ならチャンネルのモデル
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None,
+                 token_counter: Optional[Callable[[List[Dict[str, Any]], Optional[str]], int]] = None):
+        config = config or {}
+        self.enabled = config.get('enabled', True)
+        self.trigger_messages = max(4, int(config.get('trigger_messages', 16)))
+        self.keep_recent_messages = max(2, int(config.get('keep_recent_messages', 6)))
+        self.max_summary_words = int(config.get('max_summary_words', 300))
+        self.max_tokens = int(config.get('max_tokens', 1024))
+        self.model: Optional[str] = config.get('model')
+        self.retry_after_seconds = float(config.get('retry_after_seconds', 60))
+        # (メッセージ, 要約を送る先のモデル "provider/model") -> 推定トークン数
+        self.token_counter = token_counter or (
+            lambda messages, model_string=None: sum(len(_render_entry(m)) // 4 for m in messages))
+        self.summaries: Dict[Tuple[int, int], ConversationSummary] = {}
+        self._tasks: Dict[Tuple[int, int], asyncio.Task] = {}
+        self._failed_at: Dict[Tuple[int, int], float] = {}
+        self.stats: Dict[str, float] = {'runs': 0, 'failures': 0, 'applied': 0, 'saved_tokens': 0,
+                                        'total_seconds': 0.0}
+
+    def get(self, guild_id: int, thread_id: int) -> Optional[ConversationSummary]:
+        return self.summaries.get((guild_id, thread_id))
+
+    def apply(self, guild_id: int, thread_id: int, history: List[HistoryEntry], model_string: Optional[str] = None
+              ) -> Tuple[Optional[Dict[str, Any]], List[HistoryEntry]]:
+        """
+        要約済みのメッセージを履歴から除き、代わりに送る要約メッセージを返す
+
+        model_string はこの会話で使うモデル（削減できたトークン数の推定に使う）。
+
+        Returns:
+            (要約のシステムメッセージ または None, 要約されていない履歴)
+        """
+        summary = self.get(guild_id, thread_id)
+        if not self.enabled or summary is None or not summary.text:
+            return None, history
+        remaining = [(message_id, message) for message_id, message in history if message_id > summary.covered_until_id]
+        replaced = [message for message_id, message in history if message_id <= summary.covered_until_id]
+        summary_message = summary.to_system_message()
+        # 履歴の収集は要約済みの位置で止まるため、要約前の全メッセージと比べた削減量を記録する
+        saved = (summary.folded_tokens + self.token_counter(replaced, model_string)
+                 - self.token_counter([summary_message], model_string))
+        self.stats['applied'] += 1
+        self.stats['saved_tokens'] += max(saved, 0)
+        logger.info(f"🗜️ [SUMMARY] Using summary of {summary.folded_messages} messages "
+                    f"(~{summary.folded_tokens} tokens -> ~{summary.summary_tokens} tokens) + "
+                    f"{len(remaining)} recent messages | saved ~{max(saved, 0)} prompt tokens")
+        return summary_message, remaining
+
+    def schedule(self, guild_id: int, thread_id: int, history: List[HistoryEntry],
+                 client: openai.AsyncOpenAI, model_name: str, model_string: Optional[str] = None):
+        """
+        要約されていない履歴が多くなっていれば、古い部分の要約をバックグラウンドで開始する
+
+        history には今回のユーザー発言と応答も含めること。同じ会話の要約が実行中なら何もしない。
+        model_name は要約を作るモデルのAPI上の名前、model_string は要約を送る先（この会話）のモデルで、
+        要約前後のトークン数の推定に使う。
+        """
+        if not self.enabled or len(history) <= self.trigger_messages:
+            return
+        key = (guild_id, thread_id)
+        if key in self._tasks and not self._tasks[key].done():
+            return
+        if time.monotonic() - self._failed_at.get(key, float('-inf')) < self.retry_after_seconds:
+            return
+
+        fold_count = len(history) - self.keep_recent_messages
+        # ユーザーの発言だけが要約され、その応答が残る分け方にならないようにする
+        while fold_count > 0 and history[fold_count - 1][1].get("role") != "assistant":
+            fold_count -= 1
+        if fold_count <= 0:
+            return
+
+        to_fold = history[:fold_count]
+        task = asyncio.create_task(self._fold(key, to_fold, client, model_name, model_string))
+        self._tasks[key] = task
+        task.add_done_callback(lambda t, k=key: self._tasks.pop(k, None) if self._tasks.get(k) is t else None)
+
+    async def _fold(self, key: Tuple[int, int], to_fold: List[HistoryEntry], client: openai.AsyncOpenAI,
+                    model_name: str, model_string: Optional[str] = None):
+        previous = self.summaries.get(key)
+        messages = [message for _, message in to_fold]
+        transcript = "\n".join(_render_entry(message) for message in messages)
+        prompt = SUMMARY_INSTRUCTIONS.format(max_words=self.max_summary_words)
+        if previous and previous.text:
+            prompt += f"\n\n# Existing summary\n{previous.text}"
+        prompt += f"\n\n# New turns\n{transcript}"
+
+        started = time.perf_counter()
+        self.stats['runs'] += 1
+        try:
+            # Gemini など system ロールの扱いが異なるプロバイダーでも使えるように user ロールで渡す
+            response = await client.chat.completions.create(
+                model=model_name, messages=[{"role": "user", "content": prompt}],
+                temperature=0.2, max_tokens=self.max_tokens, stream=False)
+            text = (response.choices[0].message.content or "").strip() if response.choices else ""
+            if not text:
+                raise ValueError("empty summary")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats['failures'] += 1
+            self._failed_at[key] = time.monotonic()
+            logger.warning(f"⚠️ [SUMMARY] Failed to summarize conversation {key}: {e}")
+            return
+
+        elapsed = time.perf_counter() - started
+        self.stats['total_seconds'] += elapsed
+        self._failed_at.pop(key, None)
+        summary = ConversationSummary(
+            text=text,
+            covered_until_id=to_fold[-1][0],
+            folded_messages=(previous.folded_messages if previous else 0) + len(to_fold),
+            folded_tokens=(previous.folded_tokens if previous else 0) + self.token_counter(messages, model_string),
+            updated_at=time.time())
+        summary.summary_tokens = self.token_counter([summary.to_system_message()], model_string)
+        self.summaries[key] = summary
+        logger.info(f"🗜️ [SUMMARY] Folded {len(to_fold)} messages of conversation {key} into summary "
+                    f"(~{summary.folded_tokens} -> ~{summary.summary_tokens} tokens) in {elapsed:.1f}s")
+
+    def drop(self, guild_id: int, thread_id: int):
+        key = (guild_id, thread_id)
+        self.summaries.pop(key, None)
+        self._failed_at.pop(key, None)
+        task = self._tasks.pop(key, None)
+        if task:
+            task.cancel()
+
+    def close(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    def get_stats_text(self) -> str:
+        runs = int(self.stats['runs'])
+        avg = self.stats['total_seconds'] / max(runs - self.stats['failures'], 1)
+        return (f"{len(self.summaries)} summaries | runs {runs} (failed {int(self.stats['failures'])}, "
+                f"avg {avg:.1f}s) | applied {int(self.stats['applied'])} times, "
+                f"saved ~{int(self.stats['saved_tokens'])} prompt tokens")
@@ -0,0 +1,231 @@
+# PLANA/llm/plugins/failover.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StreamStart:
+    """最初のチャンクまで受信したストリーム（フェイルオーバーの1試行の結果）"""
+    model_string: str
+    client: Any
+    stream: Any
+    first_chunk: Any = None
+    # この試行のために確保した実行枠を返す関数（スケジューラーの枠を別に確保した場合）
+    release: Optional[Callable[[], None]] = None
+
+    def release_slot(self):
+        if self.release is not None:
+            release, self.release = self.release, None
+            release()
+
+    async def iterate(self) -> AsyncIterator[Any]:
+        """受信済みの最初のチャンクを含めてストリームを読む"""
+        if self.first_chunk is not None:
+            yield self.first_chunk
+        async for chunk in self.stream:
+            yield chunk
+
+    async def close(self):
+        """使わなくなったストリームの接続を閉じ、実行枠を返す"""
+        try:
+            close = getattr(self.stream, 'close', None)
+            if close is None:
+                response = getattr(self.stream, 'response', None)
+                close = getattr(response, 'aclose', None)
+            if close is None:
+                return
+            result = close()
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            logger.debug(f"Failed to close abandoned stream for '{self.model_string}': {e}")
+        finally:
+            self.release_slot()
+
+
+def _provider_of(model_string: str) -> str:
+    return model_string.split('/', 1)[0]
+
+
+class TTFTTracker:
+    """
+    プロバイダーごとの最初のチャンクまでの時間（TTFT）を記録し、ヘッジの期限を決める
+
+    期限 = p95 × multiplier（min_seconds 〜 max_seconds の範囲）。
+    サンプルが min_samples 未満の間は initial_seconds を使う。
+    """
+
+    def __init__(self, initial_seconds: float = 8.0, multiplier: float = 1.5, min_seconds: float = 2.0,
+                 max_seconds: float = 30.0, min_samples: int = 10, window: int = 200):
+        self.initial_seconds = initial_seconds
+        self.multiplier = multiplier
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.min_samples = min_samples
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, provider: str, seconds: float):
+        self._samples.setdefault(provider, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, provider: str, q: float) -> Optional[float]:
+        samples = self._samples.get(provider)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def deadline(self, provider: str) -> float:
+        samples = self._samples.get(provider)
+        if not samples or len(samples) < self.min_samples:
+            return self.initial_seconds
+        return min(max(self.percentile(provider, 0.95) * self.multiplier, self.min_seconds), self.max_seconds)
+
+    def get_stats_text(self) -> str:
+        lines = []
+        for provider, samples in self._samples.items():
+            lines.append(f"{provider}: p50 {self.percentile(provider, 0.5):.2f}s p95 "
+                         f"{self.percentile(provider, 0.95):.2f}s ({len(samples)} samples) | "
+                         f"hedge after {self.deadline(provider):.1f}s")
+        return "\n".join(lines) or "no samples yet"
+
+
+class FailoverRouter:
+    """
+    モデルごとのフォールバックチェーンに沿って、ストリームのヘッジとフェイルオーバーを行う
+
+    - 試行中のプロバイダーの期限（TTFT の p95 から算出）までに最初のチャンクが届かなければ、
+      チェーンの次のモデルでも並行してリクエストを開始する（ヘッジ）
+    - 試行が失敗した場合（全APIキーで失敗など）は、すぐに次のモデルで開始する（フェイルオーバー）
+    - 最初のチャンクが先に届いた試行を採用し、残りはキャンセルしてストリームを閉じる
+
+    config (llm.failover):
+        enabled: 有効にするか
+        hedging: 期限切れでの並行リクエストを行うか（false ならエラー時のフェイルオーバーのみ）。
+            ヘッジ先のプロバイダーに空きがない（can_hedge が False）場合はヘッジしない
+        chains: "provider/model" → フォールバック先のモデルのリスト（順番に試す）
+        initial_deadline_seconds / deadline_multiplier / min_deadline_seconds / max_deadline_seconds /
+        min_samples: ヘッジの期限の設定
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        self.enabled = config.get('enabled', True)
+        self.hedging = config.get('hedging', True)
+        self.chains: Dict[str, List[str]] = {k: list(v or []) for k, v in (config.get('chains') or {}).items()}
+        self.tracker = TTFTTracker(
+            initial_seconds=float(config.get('initial_deadline_seconds', 8.0)),
+            multiplier=float(config.get('deadline_multiplier', 1.5)),
+            min_seconds=float(config.get('min_deadline_seconds', 2.0)),
+            max_seconds=float(config.get('max_deadline_seconds', 30.0)),
+            min_samples=int(config.get('min_samples', 10)))
+        self.stats: Dict[str, int] = {'requests': 0, 'hedged': 0, 'hedge_skipped': 0, 'failovers': 0,
+                                      'served_by_fallback': 0}
+
+    def chain_for(self, model_string: str) -> List[str]:
+        if not self.enabled:
+            return [model_string]
+        return list(dict.fromkeys([model_string, *self.chains.get(model_string, [])]))
+
+    async def open_first(self, chain: List[str], starter: Callable[[str], Awaitable[StreamStart]],
+                         can_hedge: Optional[Callable[[str], bool]] = None) -> StreamStart:
+        """
+        チェーンの先頭から試行し、最初のチャンクが最初に届いたストリームを返す
+
+        can_hedge(model_string) が False のモデルにはヘッジしない（順番待ちになるプロバイダーに
+        並行リクエストを積まない）。エラー時のフェイルオーバーは can_hedge に関係なく行う。
+        すべての試行が失敗した場合は最後の例外を送出する。
+        """
+        self.stats['requests'] += 1
+        pending: Dict[asyncio.Task, tuple] = {}
+        launched: List[tuple] = []
+        last_error: Optional[BaseException] = None
+        hedging = self.hedging
+
+        def launch():
+            model_string = chain[len(launched)]
+            task = asyncio.create_task(starter(model_string))
+            entry = (model_string, time.monotonic())
+            pending[task] = entry
+            launched.append(entry)
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if hedging and len(launched) < len(chain):
+                    newest_model, newest_started = launched[-1]
+                    deadline = self.tracker.deadline(_provider_of(newest_model))
+                    timeout = max(0.0, newest_started + deadline - time.monotonic())
+
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    newest_model, newest_started = launched[-1]
+                    if can_hedge is not None and not can_hedge(chain[len(launched)]):
+                        logger.info(f"⏱️ [FAILOVER] No first token from '{newest_model}' after "
+                                    f"{time.monotonic() - newest_started:.1f}s, but '{chain[len(launched)]}' "
+                                    f"has no free slot; not hedging")
+                        self.stats['hedge_skipped'] += 1
+                        hedging = False
+                        continue
+                    logger.warning(f"⏱️ [FAILOVER] No first token from '{newest_model}' after "
+                                   f"{time.monotonic() - newest_started:.1f}s, hedging with '{chain[len(launched)]}'")
+                    self.stats['hedged'] += 1
+                    launch()
+                    continue
+
+                winner: Optional[StreamStart] = None
+                for task in done:
+                    model_string, started = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        last_error = e
+                        logger.warning(f"⚠️ [FAILOVER] '{model_string}' failed: {type(e).__name__}: {e}")
+                        continue
+                    if winner is None:
+                        winner = result
+                        self.tracker.record(_provider_of(model_string), time.monotonic() - started)
+                    else:
+                        # 同時に届いた場合は片方を閉じる
+                        await result.close()
+
+                if winner is not None:
+                    if winner.model_string != chain[0]:
+                        self.stats['served_by_fallback'] += 1
+                    return winner
+                if len(launched) < len(chain):
+                    logger.info(f"🔀 [FAILOVER] Failing over to '{chain[len(launched)]}'")
+                    self.stats['failovers'] += 1
+                    launch()
+        finally:
+            await self._abandon(pending)
+
+        raise last_error or Exception("No model in the failover chain produced a response")
+
+    async def _abandon(self, pending: Dict[asyncio.Task, tuple]):
+        """採用しなかった試行をキャンセルする（遅かったことを TTFT の記録にも反映する）"""
+        for task, (model_string, started) in pending.items():
+            self.tracker.record(_provider_of(model_string), time.monotonic() - started)
+            task.cancel()
+        for task in list(pending):
+            try:
+                result = await task
+            except BaseException:
+                continue
+            await result.close()
+        pending.clear()
+
+    def get_stats_text(self) -> str:
+        return (f"requests {self.stats['requests']} | hedged {self.stats['hedged']} "
+                f"(skipped {self.stats['hedge_skipped']}) | "
+                f"failovers {self.stats['failovers']} | served by fallback {self.stats['served_by_fallback']}\n"
+                f"{self.tracker.get_stats_text()}")
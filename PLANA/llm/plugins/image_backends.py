@@ -0,0 +1,324 @@
+# PLANA/llm/plugins/image_backends.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_checkpoint(name: Optional[str]) -> Optional[str]:
+    """`model.safetensors [hash]` 形式のチェックポイント名からハッシュ部分を除く"""
+    if not name:
+        return None
+    return name.split(' [', 1)[0].strip()
+
+
+@dataclass
+class SDBackend:
+    """Forge WebUI / KoboldCPP のワーカー1台分の状態"""
+    name: str
+    url: str
+    provider_name: str
+    max_concurrent: int = 1
+    healthy: bool = True
+    active: int = 0
+    consecutive_failures: int = 0
+    last_error: Optional[str] = None
+    last_health_check: float = 0.0
+    models: List[str] = field(default_factory=list)
+    # 現在読み込まれているチェックポイント（不明な場合は None）
+    loaded_model: Optional[str] = None
+    # batch_size によるバッチ生成に対応しているか（連続して失敗した場合は無効化する）
+    supports_batch: bool = True
+    batch_failures: int = 0
+
+    # 統計
+    completed: int = 0
+    images: int = 0
+    failed: int = 0
+    requeued: int = 0
+    swaps: int = 0
+    busy_seconds_total: float = 0.0
+    queue_wait_seconds_total: float = 0.0
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def available(self) -> bool:
+        return self.healthy and self.active < self.max_concurrent
+
+    @property
+    def load(self) -> float:
+        return self.active / self.max_concurrent
+
+    @property
+    def avg_generation_time(self) -> float:
+        return self.busy_seconds_total / self.completed if self.completed else 0.0
+
+    @property
+    def throughput_per_hour(self) -> float:
+        """起動からの1時間あたりの生成枚数"""
+        uptime = time.monotonic() - self.started_at
+        return self.images * 3600 / uptime if uptime > 0 else 0.0
+
+    @property
+    def avg_seconds_per_image(self) -> float:
+        return self.busy_seconds_total / self.images if self.images else 0.0
+
+    @property
+    def utilization(self) -> float:
+        """起動からの時間のうち生成リクエストを処理していた割合（GPU稼働率の目安）"""
+        uptime = time.monotonic() - self.started_at
+        return min(1.0, self.busy_seconds_total / (uptime * self.max_concurrent)) if uptime > 0 else 0.0
+
+
+def build_backends(image_gen_config: Dict[str, Any]) -> List[SDBackend]:
+    """
+    設定からワーカー一覧を作成する。
+
+    `backends` が無い場合は従来の koboldcpp_url / forge_url を1台のワーカーとして扱う。
+    """
+    backends: List[SDBackend] = []
+    for index, entry in enumerate(image_gen_config.get('backends') or []):
+        if isinstance(entry, str):
+            entry = {'url': entry}
+        url = (entry.get('url') or '').rstrip('/')
+        if not url:
+            logger.warning(f"⚠️ [IMAGE_GEN] Skipping backend #{index + 1} without url")
+            continue
+        provider = entry.get('provider', 'forge').lower()
+        backends.append(SDBackend(
+            name=entry.get('name') or f"{provider}-{index + 1}",
+            url=url,
+            provider_name="KoboldCPP" if provider == 'koboldcpp' else "Stable Diffusion WebUI Forge",
+            max_concurrent=max(1, int(entry.get('max_concurrent', 1))),
+            supports_batch=entry.get('batching', provider != 'koboldcpp')
+        ))
+
+    if backends:
+        return backends
+
+    koboldcpp_url = image_gen_config.get('koboldcpp_url')
+    if koboldcpp_url:
+        return [SDBackend(name="koboldcpp", url=koboldcpp_url.rstrip('/'), provider_name="KoboldCPP",
+                          supports_batch=False)]
+    forge_url = image_gen_config.get('forge_url', 'http://127.0.0.1:7860')
+    return [SDBackend(name="forge", url=forge_url.rstrip('/'), provider_name="Stable Diffusion WebUI Forge")]
+
+
+class BackendPool:
+    """
+    複数の画像生成ワーカーの死活監視と割り当てを行う。
+
+    `/sdapi/v1/progress` と `/sdapi/v1/sd-models` への定期的な問い合わせで稼働状態を判定し、
+    タスクは稼働中のワーカーのうち最も負荷の低いものに割り当てる。
+    各ワーカーが読み込んでいるチェックポイントも追跡し、同じモデルのタスクを優先的に回すことで
+    チェックポイントの入れ替えを減らす。
+    """
+
+    def __init__(self, backends: List[SDBackend], session: aiohttp.ClientSession,
+                 health_check_interval: float = 30.0, failure_threshold: int = 2):
+        if not backends:
+            raise ValueError("At least one image generation backend is required")
+        self.backends = backends
+        self.session = session
+        self.health_check_interval = max(5.0, float(health_check_interval))
+        self.failure_threshold = max(1, int(failure_threshold))
+        self._health_task: Optional[asyncio.Task] = None
+        # ワーカーの空き・復旧を待機中のディスパッチャーに知らせる
+        self.changed = asyncio.Event()
+        self.affinity_stats: Dict[str, float] = {
+            'hits': 0, 'hit_seconds_total': 0.0,
+            'swaps': 0, 'swap_seconds_total': 0.0,
+            'swaps_avoided': 0
+        }
+
+    @property
+    def primary(self) -> SDBackend:
+        return self.backends[0]
+
+    @property
+    def capacity(self) -> int:
+        """稼働中のワーカーで同時に実行できる生成数"""
+        return sum(b.max_concurrent for b in self.backends if b.healthy)
+
+    @property
+    def active(self) -> int:
+        return sum(b.active for b in self.backends)
+
+    def has_free_slot(self) -> bool:
+        return any(b.available for b in self.backends)
+
+    def start(self):
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        if self._health_task:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    def find_loaded(self, model: Optional[str]) -> Optional[SDBackend]:
+        """指定モデルを読み込み済みの空きワーカーを探す"""
+        model = normalize_checkpoint(model)
+        candidates = [b for b in self.backends if b.available and model and b.loaded_model == model]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda b: (b.load, b.active, b.avg_generation_time))
+
+    def acquire(self, model: Optional[str] = None) -> Optional[SDBackend]:
+        """
+        稼働中ワーカーを確保する。空きが無ければ None。
+
+        model を読み込み済みのワーカーがあればそれを、なければ最も負荷の低いワーカーを選ぶ。
+        """
+        backend = self.find_loaded(model)
+        if backend is None:
+            candidates = [b for b in self.backends if b.available]
+            if not candidates:
+                return None
+            backend = min(candidates, key=lambda b: (b.load, b.active, b.avg_generation_time))
+        backend.active += 1
+        return backend
+
+    def release(self, backend: SDBackend, elapsed: Optional[float] = None, model: Optional[str] = None,
+                images: int = 1):
+        """
+        ワーカーを解放する。
+
+        Args:
+            elapsed: 生成に成功した場合の所要秒数。失敗時は None。
+            model: 生成に使用したチェックポイント
+            images: 1回のリクエストで生成した枚数
+        """
+        backend.active = max(0, backend.active - 1)
+        if elapsed is not None:
+            backend.completed += 1
+            backend.images += max(1, images)
+            backend.busy_seconds_total += elapsed
+            backend.consecutive_failures = 0
+            self._record_checkpoint(backend, normalize_checkpoint(model), elapsed / max(1, images))
+        else:
+            backend.failed += 1
+        self.changed.set()
+
+    def _record_checkpoint(self, backend: SDBackend, model: Optional[str], elapsed: float):
+        """モデル入れ替えの有無ごとに生成時間を集計する（入れ替えコストの推定に使う）"""
+        if not model:
+            return
+        if backend.loaded_model == model:
+            self.affinity_stats['hits'] += 1
+            self.affinity_stats['hit_seconds_total'] += elapsed
+        elif backend.loaded_model is not None:
+            backend.swaps += 1
+            self.affinity_stats['swaps'] += 1
+            self.affinity_stats['swap_seconds_total'] += elapsed
+        backend.loaded_model = model
+
+    def record_swap_avoided(self):
+        self.affinity_stats['swaps_avoided'] += 1
+
+    @property
+    def estimated_seconds_saved(self) -> float:
+        """回避した入れ替え回数 ×（入れ替えありの平均生成時間 − 入れ替えなしの平均生成時間）"""
+        stats = self.affinity_stats
+        if not stats['hits'] or not stats['swaps']:
+            return 0.0
+        swap_cost = stats['swap_seconds_total'] / stats['swaps'] - stats['hit_seconds_total'] / stats['hits']
+        return stats['swaps_avoided'] * max(0.0, swap_cost)
+
+    def mark_unhealthy(self, backend: SDBackend, reason: str):
+        """接続エラーなどでワーカーが応答しなくなった場合に割り当て対象から外す"""
+        backend.consecutive_failures += 1
+        backend.last_error = reason
+        if backend.healthy:
+            backend.healthy = False
+            logger.warning(f"⚠️ [IMAGE_GEN] Backend '{backend.name}' ({backend.url}) marked unhealthy: {reason}")
+
+    async def check_health(self, backend: SDBackend) -> bool:
+        """`/sdapi/v1/progress` と `/sdapi/v1/sd-models` に応答するかを確認する"""
+        backend.last_health_check = time.monotonic()
+        timeout = aiohttp.ClientTimeout(total=5.0)
+        try:
+            async with self.session.get(f"{backend.url}/sdapi/v1/progress?skip_current_image=true",
+                                        timeout=timeout) as response:
+                if response.status != 200:
+                    raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                      status=response.status)
+            async with self.session.get(f"{backend.url}/sdapi/v1/sd-models", timeout=timeout) as response:
+                if response.status != 200:
+                    raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                      status=response.status)
+                models = await response.json()
+                backend.models = [m.get('title', '') for m in models if isinstance(m, dict)]
+            if backend.loaded_model is None:
+                await self._fetch_loaded_model(backend)
+        except Exception as e:
+            backend.consecutive_failures += 1
+            backend.last_error = str(e) or type(e).__name__
+            if backend.healthy and backend.consecutive_failures >= self.failure_threshold:
+                backend.healthy = False
+                logger.warning(f"⚠️ [IMAGE_GEN] Backend '{backend.name}' failed health check: {backend.last_error}")
+            return False
+
+        backend.consecutive_failures = 0
+        backend.last_error = None
+        if not backend.healthy:
+            backend.healthy = True
+            logger.info(f"✅ [IMAGE_GEN] Backend '{backend.name}' is healthy again")
+            self.changed.set()
+        return True
+
+    async def _fetch_loaded_model(self, backend: SDBackend):
+        """`/sdapi/v1/options` から現在のチェックポイントを取得する（非対応の場合は無視）"""
+        try:
+            async with self.session.get(f"{backend.url}/sdapi/v1/options",
+                                        timeout=aiohttp.ClientTimeout(total=5.0)) as response:
+                if response.status == 200:
+                    options = await response.json()
+                    backend.loaded_model = normalize_checkpoint(options.get('sd_model_checkpoint'))
+        except Exception as e:
+            logger.debug(f"[IMAGE_GEN] Could not fetch loaded checkpoint from '{backend.name}': {e}")
+
+    async def check_all(self) -> int:
+        results = await asyncio.gather(*(self.check_health(b) for b in self.backends))
+        return sum(1 for ok in results if ok)
+
+    async def _health_loop(self):
+        while True:
+            try:
+                await self.check_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ [IMAGE_GEN] Health check loop error: {e}", exc_info=True)
+            await asyncio.sleep(self.health_check_interval)
+
+    def get_stats_text(self) -> str:
+        lines = []
+        for b in self.backends:
+            status = "🟢" if b.healthy else "🔴"
+            started = b.completed + b.failed
+            avg_wait = b.queue_wait_seconds_total / started if started else 0.0
+            lines.append(
+                f"{status} {b.name}: {b.active}/{b.max_concurrent} running | {b.images} images "
+                f"({b.throughput_per_hour:.1f}/h, {b.avg_seconds_per_image:.1f}s/img, "
+                f"busy {b.utilization * 100:.0f}%) | "
+                f"wait {avg_wait:.1f}s | failed {b.failed} | requeued {b.requeued} | "
+                f"model {b.loaded_model or '?'} (swaps {b.swaps})"
+            )
+        stats = self.affinity_stats
+        lines.append(
+            f"Checkpoint: same {stats['hits']} / swapped {stats['swaps']} | "
+            f"swaps avoided {stats['swaps_avoided']} (~{self.estimated_seconds_saved:.0f}s saved)"
+        )
+        return "\n".join(lines)
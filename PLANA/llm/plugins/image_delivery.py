@@ -0,0 +1,226 @@
+# PLANA/llm/plugins/image_delivery.py
+from __future__ import annotations
+
+import base64
+import json
+import logging
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, Dict, List, Optional
+
+try:
+    from PIL import Image
+
+    PIL_AVAILABLE = True
+except ImportError:
+    Image = None
+    PIL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# 構造部分の文字列（info など）を保持する上限
+MAX_TEXT_VALUE_BYTES = 16 * 1024
+
+
+@dataclass
+class GeneratedImage:
+    """一時ファイルにデコードされた生成画像。アップロードと保存は同じファイルを使う。"""
+    path: str
+    size: int
+    filename: str = "generated_image.png"
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.debug(f"[IMAGE_GEN] Failed to remove temp image {self.path}: {e}")
+
+
+class _Base64FileSink:
+    """base64文字列をチャンクごとにデコードしてファイルへ書き込む"""
+
+    def __init__(self, directory: str):
+        fd, self.path = tempfile.mkstemp(suffix='.png', prefix='gen_', dir=directory)
+        self._file = os.fdopen(fd, 'wb')
+        self._carry = b''
+        self.size = 0
+
+    def feed(self, data: bytes):
+        # JSONエスケープ（\/）を除去。base64の文字集合にバックスラッシュは含まれない
+        if b'\\' in data:
+            data = data.replace(b'\\', b'')
+        data = self._carry + data
+        aligned = len(data) - (len(data) % 4)
+        self._carry = data[aligned:]
+        if aligned:
+            decoded = base64.b64decode(data[:aligned])
+            self._file.write(decoded)
+            self.size += len(decoded)
+
+    def close(self) -> GeneratedImage:
+        if self._carry:
+            decoded = base64.b64decode(self._carry + b'=' * (-len(self._carry) % 4))
+            self._file.write(decoded)
+            self.size += len(decoded)
+        self._file.close()
+        return GeneratedImage(path=self.path, size=self.size)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class Txt2ImgResponseParser:
+    """
+    txt2img の JSON 応答を逐次的に解析し、`images` 配列の base64 文字列を一時ファイルへ直接デコードする。
+
+    画像データ以外（parameters, info）は通常の構造として読み飛ばし、トップレベルの文字列値だけを
+    上限付きで保持する。応答全体をメモリに載せずに数MBの画像を受け取れる。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.images: List[GeneratedImage] = []
+        self.text_values: Dict[str, str] = {}
+
+        self._stack: List[str] = []
+        self._expect_key = False
+        self._keys: Dict[int, str] = {}
+        self._in_string = False
+        self._escape = False
+        self._string_buffer = bytearray()
+        self._sink: Optional[_Base64FileSink] = None
+
+    @property
+    def _in_images_array(self) -> bool:
+        return len(self._stack) == 2 and self._stack[-1] == '[' and self._keys.get(1) == 'images'
+
+    def feed(self, chunk: bytes):
+        index, length = 0, len(chunk)
+        while index < length:
+            if self._sink is not None:
+                end = chunk.find(b'"', index)
+                if end == -1:
+                    self._sink.feed(chunk[index:])
+                    return
+                self._sink.feed(chunk[index:end])
+                self.images.append(self._sink.close())
+                self._sink = None
+                index = end + 1
+                continue
+
+            byte = chunk[index]
+            index += 1
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    if len(self._string_buffer) < MAX_TEXT_VALUE_BYTES:
+                        self._string_buffer.append(byte)
+                elif byte == 0x5C:  # \
+                    self._escape = True
+                    if len(self._string_buffer) < MAX_TEXT_VALUE_BYTES:
+                        self._string_buffer.append(byte)
+                elif byte == 0x22:  # "
+                    self._in_string = False
+                    self._end_string()
+                elif len(self._string_buffer) < MAX_TEXT_VALUE_BYTES:
+                    self._string_buffer.append(byte)
+                continue
+
+            if byte == 0x22:
+                if self._in_images_array:
+                    self._sink = _Base64FileSink(self.directory)
+                else:
+                    self._in_string = True
+                    self._string_buffer.clear()
+            elif byte in (0x7B, 0x5B):  # { [
+                self._stack.append('{' if byte == 0x7B else '[')
+                self._expect_key = byte == 0x7B
+            elif byte in (0x7D, 0x5D):  # } ]
+                if self._stack:
+                    self._keys.pop(len(self._stack), None)
+                    self._stack.pop()
+                self._expect_key = False
+            elif byte == 0x2C:  # ,
+                self._expect_key = bool(self._stack) and self._stack[-1] == '{'
+            elif byte == 0x3A:  # :
+                self._expect_key = False
+
+    def _end_string(self):
+        depth = len(self._stack)
+        text = bytes(self._string_buffer)
+        if self._stack and self._stack[-1] == '{' and self._expect_key:
+            self._keys[depth] = text.decode('utf-8', errors='replace')
+        elif depth == 1 and self._keys.get(1):
+            try:
+                self.text_values[self._keys[1]] = json.loads(b'"' + text + b'"')
+            except ValueError:
+                self.text_values[self._keys[1]] = text.decode('utf-8', errors='replace')
+
+    def abort(self):
+        """途中で失敗した場合に一時ファイルを削除する"""
+        if self._sink is not None:
+            self._sink.abort()
+            self._sink = None
+        for image in self.images:
+            image.discard()
+        self.images = []
+
+
+async def read_txt2img_response(chunks: AsyncIterable[bytes], directory: str) -> Txt2ImgResponseParser:
+    """レスポンスボディのチャンクを順に解析して画像を一時ファイルに書き出す"""
+    os.makedirs(directory, exist_ok=True)
+    parser = Txt2ImgResponseParser(directory)
+    try:
+        async for chunk in chunks:
+            parser.feed(chunk)
+    except BaseException:
+        parser.abort()
+        raise
+    return parser
+
+
+def recompress_image(path: str, max_bytes: int, image_format: str = 'webp', lossless: bool = True,
+                     quality: int = 90) -> Optional[str]:
+    """
+    アップロード上限に収まるように画像を再圧縮する（CPU処理のためイベントループ外で呼ぶこと）
+
+    まず指定の方式（既定はロスレスWebP）で保存し、それでも上限を超える場合は品質を下げて再試行する。
+
+    Returns:
+        再圧縮したファイルのパス。上限に収められない場合は None。
+    """
+    if not PIL_AVAILABLE:
+        return None
+
+    image_format = image_format.lower()
+    suffix = '.webp' if image_format == 'webp' else '.png'
+    out_path = os.path.splitext(path)[0] + suffix
+    if out_path == path:
+        out_path = os.path.splitext(path)[0] + '_small' + suffix
+
+    with Image.open(path) as img:
+        attempts: List[Dict[str, Any]]
+        if image_format == 'webp':
+            attempts = [{'lossless': True, 'method': 4}] if lossless else []
+            attempts += [{'quality': q, 'method': 4} for q in (quality, 80, 70, 60) if q <= quality]
+        else:
+            attempts = [{'optimize': True, 'compress_level': 9}]
+
+        for options in attempts:
+            img.save(out_path, format=image_format.upper(), **options)
+            if os.path.getsize(out_path) <= max_bytes:
+                return out_path
+
+    try:
+        os.remove(out_path)
+    except OSError:
+        pass
+    return None
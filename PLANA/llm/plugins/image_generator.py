@@ -1,28 +1,91 @@
 from __future__ import annotations
 
 import asyncio
-import base64
 import io
+import json
 import logging
-from typing import Dict, Any, Optional, List
+import os
+import shlex
+import shutil
+import time
+import uuid
+from typing import Dict, Any, Optional, List, Set
 from collections import deque
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 import aiohttp
 import discord
 
+from PLANA.llm.error.errors import ImageBackendUnavailableError
+from PLANA.llm.plugins.image_backends import BackendPool, SDBackend, build_backends
+from PLANA.llm.plugins.image_delivery import GeneratedImage, read_txt2img_response, recompress_image
+from PLANA.llm.plugins.image_progress import ProgressHub, make_preview_thumbnail
+
 logger = logging.getLogger(__name__)
 
 
 @dataclass
 class GenerationTask:
-    """画像生成タスク情報"""
+    """画像生成タスク情報（ツール呼び出しの引数をすべて保持し、ディスクに保存される）"""
     user_id: int
     user_name: str
     prompt: str
     channel_id: int
     position: int
     queue_message: Optional[discord.Message] = None
+    arguments: Dict[str, Any] = field(default_factory=dict)
+    future: Optional[asyncio.Future] = None
+    enqueued_at: float = field(default_factory=time.time)
+    attempts: int = 0
+    model: Optional[str] = None
+    params: Dict[str, Any] = field(default_factory=dict)
+    # チェックポイント優先の並べ替えで後回しにされた回数
+    skipped: int = 0
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex[:8])
+    queue_message_id: Optional[int] = None
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    backend_name: Optional[str] = None
+    cancelled: bool = False
+
+    @property
+    def status(self) -> str:
+        if self.cancelled:
+            return "cancelled"
+        if self.finished_at is not None:
+            return "done"
+        return "running" if self.started_at is not None else "queued"
+
+    def to_record(self) -> Dict[str, Any]:
+        """キューファイルに保存する形式に変換"""
+        return {
+            'job_id': self.job_id,
+            'user_id': self.user_id,
+            'user_name': self.user_name,
+            'prompt': self.prompt,
+            'channel_id': self.channel_id,
+            'arguments': self.arguments,
+            'model': self.model,
+            'enqueued_at': self.enqueued_at,
+            'attempts': self.attempts,
+            'queue_message_id': self.queue_message.id if self.queue_message else self.queue_message_id
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any], position: int) -> GenerationTask:
+        return cls(
+            user_id=record.get('user_id', 0),
+            user_name=record.get('user_name', 'Unknown'),
+            prompt=record['prompt'],
+            channel_id=record['channel_id'],
+            position=position,
+            arguments=record.get('arguments') or {'prompt': record['prompt']},
+            enqueued_at=record.get('enqueued_at', time.time()),
+            attempts=record.get('attempts', 0),
+            model=record.get('model'),
+            job_id=record.get('job_id') or uuid.uuid4().hex[:8],
+            queue_message_id=record.get('queue_message_id')
+        )
 
 
 class ImageGenerator:
@@ -39,19 +102,17 @@ class ImageGenerator:
         self.image_gen_config = self.config.get('image_generator', {})
 
         # プロバイダー設定 (Forge WebUI / KoboldCPP)
-        # koboldcpp_urlが設定されている場合はそれを優先、なければforge_urlを使用
+        # backendsが設定されている場合は複数ワーカーに分散、なければkoboldcpp_url → forge_urlの順で1台を使用
         self.koboldcpp_url = self.image_gen_config.get('koboldcpp_url')
         self.forge_url = self.image_gen_config.get('forge_url', 'http://127.0.0.1:7860')
-        
-        # 実際に使用するURLとプロバイダー名を決定
-        if self.koboldcpp_url:
-            self.api_url = self.koboldcpp_url.rstrip('/')
-            self.provider_name = "KoboldCPP"
-            logger.info(f"Using KoboldCPP for image generation at: {self.api_url}")
-        else:
-            self.api_url = self.forge_url.rstrip('/')
-            self.provider_name = "Stable Diffusion WebUI Forge"
-            logger.info(f"Using Stable Diffusion WebUI Forge for image generation at: {self.api_url}")
+        self.backends: List[SDBackend] = build_backends(self.image_gen_config)
+
+        # モデル一覧の表示などで使う代表プロバイダー（先頭のワーカー）
+        self.api_url = self.backends[0].url
+        self.provider_name = self.backends[0].provider_name
+        for backend in self.backends:
+            logger.info(f"Using {backend.provider_name} for image generation at: {backend.url} "
+                        f"(name: {backend.name}, max_concurrent: {backend.max_concurrent})")
 
         self.default_model = self.image_gen_config.get('model', 'sd_xl_base_1.0.safetensors')
         self.default_size = self.image_gen_config.get('default_size', '1024x1024')
@@ -60,10 +121,29 @@ class ImageGenerator:
         # プログレスバー設定
         self.show_progress = self.image_gen_config.get('show_progress', True)
         self.progress_update_interval = self.image_gen_config.get('progress_update_interval', 2.0)
+        # 進捗の取得間隔（ワーカーごとに1本）と、メッセージを編集する最小のステップ差
+        self.progress_poll_interval = self.image_gen_config.get('progress_poll_interval', 1.0)
+        self.progress_min_step_delta = max(1, int(self.image_gen_config.get('progress_min_step_delta', 2)))
+        # ライブプレビュー（低解像度サムネイル）
+        self.show_live_preview = self.image_gen_config.get('live_preview', False)
+        self.live_preview_interval = self.image_gen_config.get('live_preview_interval', 6.0)
+        self.live_preview_size = self.image_gen_config.get('live_preview_size', 256)
 
         # 画像保存設定
         self.save_images = self.image_gen_config.get('save_images', True)
         self.save_directory = self.image_gen_config.get('save_directory', 'data/image')
+        # 受信した画像の一時ファイル置き場（保存時にリネームだけで済むよう保存先と同じディレクトリ配下に置く）
+        self.temp_directory = os.path.join(self.save_directory, '.tmp')
+
+        # 画像の受け取り・送信設定
+        delivery_config = self.image_gen_config.get('delivery', {}) or {}
+        self.stream_chunk_size = max(4096, int(delivery_config.get('chunk_size', 256 * 1024)))
+        self.upload_limit_bytes = int(float(delivery_config.get('upload_limit_mb', 10)) * 1024 * 1024)
+        self.recompress_mode = str(delivery_config.get('recompress', 'auto')).lower()
+        self.recompress_format = str(delivery_config.get('format', 'webp')).lower()
+        self.recompress_lossless = delivery_config.get('lossless', True)
+        self.recompress_quality = int(delivery_config.get('quality', 90))
+        self._cleanup_temp_images()
 
         # 生成パラメータ
         self.default_params = self.image_gen_config.get('default_params', {})
@@ -86,18 +166,121 @@ class ImageGenerator:
 
         # キュー管理
         self.generation_queue: deque[GenerationTask] = deque()
-        self.is_generating = False
         self.queue_lock = asyncio.Lock()
-        self.current_task: Optional[GenerationTask] = None
+        self.active_tasks: List[GenerationTask] = []
+        self.max_retries = self.image_gen_config.get('max_retries', 1)
+
+        # チェックポイント優先スケジューリング
+        # 先頭から affinity_window 件の中で読み込み済みモデルのタスクを優先し、
+        # affinity_max_skips 回後回しにされたタスクは次に必ず実行する
+        self.checkpoint_affinity = self.image_gen_config.get('checkpoint_affinity', True)
+        self.affinity_window = max(1, int(self.image_gen_config.get('affinity_window', 4)))
+        self.affinity_max_skips = max(0, int(self.image_gen_config.get('affinity_max_skips', 3)))
+
+        # マイクロバッチ設定: モデル・サイズ・サンプラー・ステップ数が同じタスクを1回のリクエストにまとめる
+        batching_config = self.image_gen_config.get('batching', {}) or {}
+        self.batching_enabled = batching_config.get('enabled', True)
+        self.max_batch_size = max(1, int(batching_config.get('max_batch_size', 4)))
+        self.batch_window = max(0.0, float(batching_config.get('window', 0.5)))
+        # プロンプトが異なるタスクをまとめるときに使う WebUI 標準のスクリプト
+        self.batch_script = batching_config.get('script_name', 'prompts from file or textbox')
+
+        self._dispatcher_task: Optional[asyncio.Task] = None
+        self._running_jobs: Set[asyncio.Task] = set()
+        self.queue_stats: Dict[str, float] = {
+            'dispatched': 0, 'requeued': 0, 'failed': 0, 'queue_wait_seconds_total': 0.0,
+            'delivered': 0, 'latency_seconds_total': 0.0, 'batches': 0, 'batched_images': 0
+        }
+
+        # キューの永続化（再起動後も待機中のタスクを引き継ぐ）
+        self.queue_file = self.image_gen_config.get('queue_file', 'data/image_queue.json')
+        self._save_lock = asyncio.Lock()
+        # 直近に完了・キャンセルしたタスク（タイミング表示用）
+        self.recent_jobs: deque[GenerationTask] = deque(maxlen=20)
+        self._restore_queue()
 
         self.http_session = aiohttp.ClientSession()
+        self.backend_pool = BackendPool(
+            self.backends,
+            self.http_session,
+            health_check_interval=self.image_gen_config.get('health_check_interval', 30.0),
+            failure_threshold=self.image_gen_config.get('health_failure_threshold', 2)
+        )
+        self.progress_hub = ProgressHub(self.http_session, poll_interval=self.progress_poll_interval,
+                                        include_preview=self.show_live_preview)
+        self.progress_stats: Dict[str, int] = {'edits': 0, 'edits_skipped': 0}
 
-        logger.info(f"ImageGenerator initialized with {self.provider_name} at: {self.api_url}")
+        logger.info(f"ImageGenerator initialized with {len(self.backends)} backend(s), "
+                    f"total concurrency: {self.backend_pool.capacity}")
         logger.info(f"Default model: {self.default_model}")
         logger.info(f"Available models: {len(self.available_models)} models")
         logger.info(f"Save images: {self.save_images} (directory: {self.save_directory})")
         logger.info(f"Resolution limits: {self.min_width}x{self.min_height} to {self.max_width}x{self.max_height}")
 
+        # 復元したタスクがあれば、イベントループ上で生成されている場合はすぐに処理を再開する
+        if self.generation_queue:
+            try:
+                asyncio.get_running_loop()
+                self._ensure_dispatcher()
+            except RuntimeError:
+                pass
+
+    def _cleanup_temp_images(self) -> None:
+        """前回の実行で残った受信途中の一時ファイルを削除する"""
+        if not os.path.isdir(self.temp_directory):
+            return
+        for name in os.listdir(self.temp_directory):
+            if name.startswith('gen_'):
+                try:
+                    os.remove(os.path.join(self.temp_directory, name))
+                except OSError:
+                    pass
+
+    def _restore_queue(self) -> None:
+        """前回終了時に残っていたタスクを読み込む（実行中だったタスクも待機列に戻す）"""
+        if not os.path.exists(self.queue_file):
+            return
+        try:
+            with open(self.queue_file, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load image generation queue: {e}")
+            return
+
+        for record in records:
+            try:
+                task = GenerationTask.from_record(record, position=len(self.generation_queue) + 1)
+            except (KeyError, TypeError) as e:
+                logger.warning(f"Skipping invalid queued image task: {e}")
+                continue
+            task.model = task.model or self.get_model_for_channel(task.channel_id)
+            task.params = self._build_generation_params(task.arguments, task.model)
+            self.generation_queue.append(task)
+
+        if self.generation_queue:
+            logger.info(f"Restored {len(self.generation_queue)} queued image generation task(s)")
+
+    async def _save_queue(self) -> None:
+        """実行中・待機中のタスクをキューファイルに書き出す"""
+        records = [t.to_record() for t in self.active_tasks if not t.cancelled]
+        records += [t.to_record() for t in self.generation_queue]
+        data = json.dumps(records, indent=2, ensure_ascii=False)
+
+        async with self._save_lock:
+            try:
+                os.makedirs(os.path.dirname(self.queue_file) or '.', exist_ok=True)
+                tmp_path = f"{self.queue_file}.tmp"
+                try:
+                    import aiofiles
+                    async with aiofiles.open(tmp_path, 'w', encoding='utf-8') as f:
+                        await f.write(data)
+                except ImportError:
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        f.write(data)
+                os.replace(tmp_path, self.queue_file)
+            except Exception as e:
+                logger.error(f"Failed to save image generation queue: {e}")
+
     def _load_channel_models(self) -> Dict[str, str]:
         """チャンネルごとのモデル設定を読み込む"""
         import os
@@ -264,18 +447,24 @@ class ImageGenerator:
             prompt: str,
             model: str,
             elapsed_time: float = 0.0,
-            it_per_sec: float = 0.0
+            it_per_sec: float = 0.0,
+            current_position: int = 0,
+            preview: Optional[bytes] = None,
+            keep_preview: bool = False
     ):
-        """プログレスメッセージを更新"""
+        """
+        プログレスメッセージを更新
+
+        Args:
+            preview: 新しいライブプレビューのサムネイル（JPEG）
+            keep_preview: 以前に添付したプレビューを引き続き表示する
+        """
         progress_bar = self._create_progress_bar(current, total, it_per_sec)
 
         # キュー情報を取得
         queue_info = ""
-        current_position = 0
         async with self.queue_lock:
             queue_length = len(self.generation_queue)
-            if self.current_task:
-                current_position = self.current_task.position
             if queue_length > 0:
                 queue_info = f"\n📋 **Queue:** {queue_length} task(s) waiting / {queue_length}件待機中"
 
@@ -306,12 +495,20 @@ class ImageGenerator:
         else:
             embed.set_footer(text="✅ Finalizing... / 最終処理中...")
 
+        if preview or keep_preview:
+            embed.set_thumbnail(url="attachment://preview.jpg")
+
         try:
-            await message.edit(embed=embed)
+            if preview:
+                await message.edit(embed=embed,
+                                   attachments=[discord.File(io.BytesIO(preview), filename="preview.jpg")])
+            else:
+                await message.edit(embed=embed)
         except discord.HTTPException as e:
             logger.warning(f"Failed to update progress message: {e}")
 
-    async def _show_queue_message(self, channel_id: int, position: int, prompt: str) -> Optional[discord.Message]:
+    async def _show_queue_message(self, channel_id: int, position: int, prompt: str,
+                                  job_id: Optional[str] = None) -> Optional[discord.Message]:
         """キュー待機メッセージを表示"""
         channel = self.bot.get_channel(channel_id)
         if not channel:
@@ -333,7 +530,10 @@ class ImageGenerator:
                 value="Waiting... / 待機中...",
                 inline=True
             )
-            embed.set_footer(text="Your generation will start soon / まもなく生成が開始されます")
+            footer = "Your generation will start soon / まもなく生成が開始されます"
+            if job_id:
+                footer += f" | Job ID: {job_id} (/image-cancel で取り消し)"
+            embed.set_footer(text=footer)
 
             return await channel.send(embed=embed)
         except Exception as e:
@@ -463,6 +663,9 @@ class ImageGenerator:
         """
         画像生成を実行し、結果を返す
 
+        空いているワーカーがあればそのまま生成を待って結果を返し、
+        全ワーカーが使用中の場合はキューに追加して待機メッセージを返す。
+
         Args:
             arguments: ツール呼び出しの引数
             channel_id: Discordチャンネルid
@@ -476,6 +679,8 @@ class ImageGenerator:
         if not prompt:
             return "❌ Error: Empty prompt provided. / エラー: プロンプトが空です。"
 
+        self._ensure_dispatcher()
+
         # キューに追加
         async with self.queue_lock:
             position = len(self.generation_queue) + 1
@@ -485,195 +690,558 @@ class ImageGenerator:
                 prompt=prompt,
                 channel_id=channel_id,
                 position=position,
-                queue_message=None
+                queue_message=None,
+                arguments=dict(arguments),
+                future=asyncio.get_running_loop().create_future(),
+                model=self.get_model_for_channel(channel_id)
             )
+            task.params = self._build_generation_params(arguments, task.model)
 
-            # 既に生成中の場合はキュー待機メッセージを表示
-            if self.is_generating:
-                queue_message = await self._show_queue_message(channel_id, position, prompt)
-                task.queue_message = queue_message
-                self.generation_queue.append(task)
-                logger.info(f"📋 [IMAGE_GEN] User {user_name} added to queue at position {position}")
-                return f"⏳ Your request has been added to the queue (Position #{position}). Please wait... / リクエストをキューに追加しました（位置: #{position}）。お待ちください..."
+            # 待機中のタスクがなく空いているワーカーがあれば即座に開始される
+            starts_now = not self.generation_queue and self.backend_pool.has_free_slot()
+            if not starts_now:
+                if self.backend_pool.capacity == 0:
+                    logger.warning("⚠️ [IMAGE_GEN] No healthy backend available, task will wait for recovery")
+                task.queue_message = await self._show_queue_message(channel_id, position, prompt, task.job_id)
 
             self.generation_queue.append(task)
+            self.backend_pool.changed.set()
+
+        await self._save_queue()
+
+        if not starts_now:
+            logger.info(f"📋 [IMAGE_GEN] User {user_name} added to queue at position {position} (job {task.job_id})")
+            return f"⏳ Your request has been added to the queue (Position #{position}, Job ID: {task.job_id}). Please wait... / リクエストをキューに追加しました（位置: #{position}、ジョブID: {task.job_id}）。お待ちください..."
 
-        # 生成を開始
         try:
-            result = await self._process_queue(arguments, channel_id)
-            return result
+            # ワーカー障害で再キューされた場合も、結果はチャンネルに送信されるため待ち時間には上限を設ける
+            return await asyncio.wait_for(asyncio.shield(task.future), timeout=self.timeout * (self.max_retries + 1))
+        except asyncio.TimeoutError:
+            return "⏳ Image generation is taking longer than expected. The image will be posted to the channel when ready. / 画像生成に時間がかかっています。完成次第チャンネルに送信します。"
         except Exception as e:
             logger.error(f"❌ [IMAGE_GEN] Error in run: {e}", exc_info=True)
             return f"❌ Error during image generation: {str(e)[:200]}"
 
-    async def _process_queue(self, arguments: Dict[str, Any], channel_id: int) -> str:
-        """キューを処理して画像を生成"""
-        async with self.queue_lock:
-            if not self.generation_queue:
-                return "❌ Error: No tasks in queue."
-
-            self.is_generating = True
-            self.current_task = self.generation_queue.popleft()
+    def _ensure_dispatcher(self):
+        """ディスパッチャーと死活監視を起動する（イベントループ上で初回のみ）"""
+        if self._dispatcher_task is None or self._dispatcher_task.done():
+            self.backend_pool.start()
+            self._dispatcher_task = asyncio.create_task(self._dispatch_loop())
 
-        # キューメッセージを更新（生成開始）
-        if self.current_task.queue_message:
-            await self._update_queue_message(
-                self.current_task.queue_message,
-                "Generating... / 生成中...",
-                self.current_task.position,
-                self.current_task.prompt
-            )
+    async def _dispatch_loop(self):
+        """キューのタスクを空いているワーカーに割り当て続ける"""
+        while True:
+            self.backend_pool.changed.clear()
+            async with self.queue_lock:
+                while self.generation_queue:
+                    selected = self._select_next_task()
+                    if selected is None:
+                        break
+                    self._start_task(*selected)
+            # ワーカーの解放・復旧、またはタスクの追加を待つ
+            await self.backend_pool.changed.wait()
+
+    def _select_next_task(self) -> Optional[tuple[GenerationTask, SDBackend]]:
+        """
+        次に実行するタスクとワーカーを選ぶ（queue_lock 取得中に呼ぶこと）
 
-        try:
-            # 引数から生成パラメータを取得（指定されていない場合はデフォルト値を使用）
-            prompt = arguments.get('prompt', '').strip()
-            negative_prompt = arguments.get('negative_prompt', '').strip()
-            size_input = arguments.get('size', self.default_size)
-
-            # サイズを検証・調整
-            width, height, adjusted_size = self._validate_and_adjust_size(size_input)
-
-            # 動的パラメータの取得（LLMからの指定があればそれを使用、なければconfig.yamlのデフォルト）
-            steps = arguments.get('steps', self.default_params.get('steps', 20))
-            cfg_scale = arguments.get('cfg_scale', self.default_params.get('cfg_scale', 7.0))
-            sampler_name = arguments.get('sampler_name', self.default_params.get('sampler_name', 'DPM++ 2M Karras'))
-            seed = arguments.get('seed', self.default_params.get('seed', -1))
-            restore_faces = arguments.get('restore_faces', self.default_params.get('restore_faces', False))
-
-            model = self.get_model_for_channel(channel_id)
-
-            logger.info(f"🎨 [IMAGE_GEN] Starting image generation for {self.current_task.user_name}")
-            logger.info(f"🎨 [IMAGE_GEN] Model: {model}, Size: {adjusted_size} (requested: {size_input})")
-            logger.info(f"🎨 [IMAGE_GEN] Steps: {steps}, CFG: {cfg_scale}, Sampler: {sampler_name}")
-            logger.info(f"🎨 [IMAGE_GEN] Seed: {seed}, Restore Faces: {restore_faces}")
-            logger.info(f"🎨 [IMAGE_GEN] Prompt: {prompt[:100]}...")
-
-            # パラメータ辞書を作成
-            gen_params = {
-                'steps': steps,
-                'cfg_scale': cfg_scale,
-                'sampler_name': sampler_name,
-                'seed': seed,
-                'restore_faces': restore_faces
-            }
+        先頭付近のタスクのうち、空いているワーカーが既に読み込んでいるモデルを使うものを優先し、
+        チェックポイントの入れ替えを減らす。後回しにされたタスクは affinity_max_skips 回で打ち切る。
+        """
+        queue = self.generation_queue
+        head = queue[0]
+        if self.checkpoint_affinity and head.skipped < self.affinity_max_skips:
+            window = min(self.affinity_window, len(queue))
+            for index in range(window):
+                task = queue[index]
+                backend = self.backend_pool.find_loaded(task.model)
+                if backend is None:
+                    continue
+                if index > 0:
+                    for skipped_task in list(queue)[:index]:
+                        skipped_task.skipped += 1
+                    self.backend_pool.record_swap_avoided()
+                    logger.info(f"🔀 [IMAGE_GEN] Running task for {task.user_name} ahead of {index} task(s) "
+                                f"to reuse '{task.model}' on '{backend.name}'")
+                del queue[index]
+                return task, self.backend_pool.acquire(task.model)
+
+        backend = self.backend_pool.acquire(head.model)
+        if backend is None:
+            return None
+        return queue.popleft(), backend
+
+    def _start_task(self, task: GenerationTask, backend: SDBackend):
+        self._record_dispatch(task, backend)
+        logger.info(f"📋 [IMAGE_GEN] Dispatching task for {task.user_name} to '{backend.name}' "
+                    f"(waited {time.time() - task.enqueued_at:.1f}s, {len(self.generation_queue)} still queued)")
+
+        job = asyncio.create_task(self._execute_batch([task], backend))
+        self._running_jobs.add(job)
+        job.add_done_callback(self._running_jobs.discard)
+
+    def _record_dispatch(self, task: GenerationTask, backend: SDBackend):
+        task.started_at = time.time()
+        task.backend_name = backend.name
+        wait = task.started_at - task.enqueued_at
+        backend.queue_wait_seconds_total += wait
+        self.queue_stats['dispatched'] += 1
+        self.queue_stats['queue_wait_seconds_total'] += wait
+        self.active_tasks.append(task)
+
+    def _build_generation_params(self, arguments: Dict[str, Any], model: str) -> Dict[str, Any]:
+        """引数から生成パラメータを決定する（指定されていない場合はconfig.yamlのデフォルト値を使用）"""
+        size_input = arguments.get('size', self.default_size)
+        width, height, adjusted_size = self._validate_and_adjust_size(size_input)
+        return {
+            'negative_prompt': arguments.get('negative_prompt', '').strip(),
+            'size_input': size_input,
+            'size': adjusted_size,
+            'steps': arguments.get('steps', self.default_params.get('steps', 20)),
+            'cfg_scale': arguments.get('cfg_scale', self.default_params.get('cfg_scale', 7.0)),
+            'sampler_name': arguments.get('sampler_name', self.default_params.get('sampler_name', 'DPM++ 2M Karras')),
+            'seed': arguments.get('seed', self.default_params.get('seed', -1)),
+            'restore_faces': arguments.get('restore_faces', self.default_params.get('restore_faces', False)),
+            'model': model
+        }
 
-            image_data = await self._generate_image_forge(
-                prompt, negative_prompt, adjusted_size, model, channel_id, gen_params
-            )
+    # バッチ生成が連続してこの回数失敗したワーカーではバッチ生成を行わない
+    MAX_BATCH_FAILURES = 3
 
-            if not image_data:
-                return "❌ Failed to generate image. / 画像の生成に失敗しました。"
+    @staticmethod
+    def _batch_key(task: GenerationTask) -> tuple:
+        """
+        1回のリクエストにまとめて生成できるタスクのキー
 
-            # 画像を保存
-            saved_path = None
-            if self.save_images:
-                saved_path = await self._save_image(image_data, prompt, model, adjusted_size)
+        プロンプト・ネガティブプロンプト・シードはタスクごとに指定できるため、キーには含めない
+        （_item_prompts を参照）。モデル・サイズ・サンプラー・ステップ数・CFGが同じタスクをまとめる。
+        """
+        params = task.params
+        return (params['model'], params['size'], params['sampler_name'], params['steps'], params['cfg_scale'],
+                params['restore_faces'])
+
+    def _item_prompts(self, tasks: List[GenerationTask]) -> List[tuple]:
+        """タスクごとの (プロンプト, ネガティブプロンプト, シード)"""
+        default_negative = self.default_params.get('negative_prompt', '')
+        return [(task.prompt, task.params['negative_prompt'] or default_negative, task.params.get('seed', -1))
+                for task in tasks]
+
+    def _can_batch(self, backend: SDBackend) -> bool:
+        return self.batching_enabled and self.max_batch_size > 1 and backend.supports_batch
+
+    async def _collect_batch(self, lead: GenerationTask, backend: SDBackend) -> List[GenerationTask]:
+        """先頭タスクと同じ条件で生成できる待機中のタスクを短時間だけ集める"""
+        batch = [lead]
+        key = self._batch_key(lead)
+        if not self._can_batch(backend):
+            return batch
+
+        # 同じ条件のタスクが待機していない場合は待たずに開始する
+        async with self.queue_lock:
+            if not any(self._batch_key(task) == key for task in self.generation_queue):
+                return batch
 
-            channel = self.bot.get_channel(channel_id)
-            if not channel:
-                logger.error(f"Channel {channel_id} not found!")
-                return "❌ Error: Could not find channel to send image."
+        if self.batch_window > 0:
+            await asyncio.sleep(self.batch_window)
 
-            image_file = discord.File(fp=io.BytesIO(image_data), filename="generated_image.png")
+        async with self.queue_lock:
+            for task in list(self.generation_queue):
+                if len(batch) >= self.max_batch_size:
+                    break
+                if self._batch_key(task) == key:
+                    self.generation_queue.remove(task)
+                    self._record_dispatch(task, backend)
+                    batch.append(task)
+
+        if len(batch) > 1:
+            logger.info(f"📦 [IMAGE_GEN] Batching {len(batch)} tasks on '{backend.name}' "
+                        f"(model: {lead.params['model']}, size: {lead.params['size']}, "
+                        f"{len(set(self._item_prompts(batch)))} distinct prompt(s))")
+        return batch
+
+    async def _execute_batch(self, tasks: List[GenerationTask], backend: SDBackend):
+        tasks = await self._collect_batch(tasks[0], backend)
+        try:
+            results = await self._process_batch(tasks, backend)
+        except ImageBackendUnavailableError as e:
+            for task in tasks:
+                if task in self.active_tasks:
+                    self.active_tasks.remove(task)
+            # 元の順序を保ったまま先頭に戻す
+            for task in reversed(tasks):
+                await self._requeue_or_fail(task, backend, e)
+            await self._save_queue()
+            return
+        except Exception as e:
+            logger.error(f"❌ [IMAGE_GEN] Error while processing task: {e}", exc_info=True)
+            self.queue_stats['failed'] += len(tasks)
+            results = [f"❌ Error during image generation: {str(e)[:200]}"] * len(tasks)
+
+        for task, result in zip(tasks, results):
+            self._finish_task(task, result)
+        await self._save_queue()
+
+    def _finish_task(self, task: GenerationTask, result: str):
+        """タスクを完了扱いにして結果を返す"""
+        task.finished_at = time.time()
+        if task in self.active_tasks:
+            self.active_tasks.remove(task)
+        self.recent_jobs.append(task)
+        if task.future and not task.future.done():
+            task.future.set_result(result)
+
+    async def _requeue_or_fail(self, task: GenerationTask, backend: SDBackend, error: Exception):
+        """ワーカーが応答しなくなったタスクを先頭に戻し、別のワーカーで再実行する"""
+        task.attempts += 1
+        if task.attempts <= self.max_retries:
+            backend.requeued += 1
+            self.queue_stats['requeued'] += 1
+            logger.warning(f"🔁 [IMAGE_GEN] Backend '{backend.name}' failed ({error}), "
+                           f"requeueing task for {task.user_name} (attempt {task.attempts}/{self.max_retries})")
+            task.started_at = None
+            task.backend_name = None
+            async with self.queue_lock:
+                self.generation_queue.appendleft(task)
+            self.backend_pool.changed.set()
+            if task.queue_message:
+                await self._update_queue_message(task.queue_message, "Requeued / 再キュー中...",
+                                                  task.position, task.prompt)
+            return
+
+        self.queue_stats['failed'] += 1
+        logger.error(f"❌ [IMAGE_GEN] Giving up task for {task.user_name} after {task.attempts} attempt(s): {error}")
+        if task.queue_message:
+            await self._update_queue_message(task.queue_message, "❌ Failed / 失敗しました",
+                                              task.position, task.prompt)
+        self._finish_task(task, "❌ Failed to generate image: all backends are unavailable. / "
+                                "画像生成サーバーに接続できませんでした。")
+
+    async def cancel_jobs(self, user_id: int, job_id: Optional[str] = None) -> List[GenerationTask]:
+        """
+        依頼者のタスクを取り消す
 
-            # Embedに詳細なパラメータ情報を追加
-            embed = discord.Embed(
-                title="🎨 Generated Image / 生成された画像",
-                description=f"**Prompt:** {prompt[:200]}{'...' if len(prompt) > 200 else ''}",
-                color=discord.Color.blue()
-            )
-            if negative_prompt:
-                embed.add_field(
-                    name="Negative Prompt",
-                    value=negative_prompt[:100] + ('...' if len(negative_prompt) > 100 else ''),
-                    inline=False
-                )
-            embed.add_field(name="Size", value=adjusted_size, inline=True)
-            embed.add_field(name="Model", value=model, inline=True)
-            embed.add_field(name="Steps", value=str(steps), inline=True)
-            embed.add_field(name="CFG Scale", value=str(cfg_scale), inline=True)
-            embed.add_field(name="Sampler", value=sampler_name, inline=True)
-            if seed != -1:
-                embed.add_field(name="Seed", value=str(seed), inline=True)
-            if restore_faces:
-                embed.add_field(name="Face Restoration", value="✅ Enabled", inline=True)
-
-            # サイズが調整された場合は注記
-            if size_input != adjusted_size:
-                embed.add_field(
-                    name="ℹ️ Size Adjusted",
-                    value=f"Requested: {size_input} → Used: {adjusted_size}",
-                    inline=False
-                )
+        待機中のタスクはキューから取り除き、生成中のタスクは結果を送信しないようにする。
+        生成中のタスクがワーカー上で単独で動いている場合は生成自体も中断する。
 
-            # フッターメッセージをプロバイダーに応じて動的に変更
-            if self.provider_name == "KoboldCPP":
-                embed.set_footer(text=f"Powered by KoboldCPP and PLANA")
-            else:
-                embed.set_footer(text="Powered by SDWebUI reForge and PLANA")
+        Args:
+            user_id: 依頼者のユーザーID（本人のタスクのみ取り消せる）
+            job_id: 取り消すジョブID。省略時は本人の全タスク
 
-            await channel.send(embed=embed, file=image_file)
+        Returns:
+            取り消したタスクのリスト
+        """
+        def matches(task: GenerationTask) -> bool:
+            return task.user_id == user_id and not task.cancelled and (job_id is None or task.job_id == job_id)
 
-            # キューメッセージを削除
-            if self.current_task.queue_message:
+        async with self.queue_lock:
+            queued = [t for t in self.generation_queue if matches(t)]
+            for task in queued:
+                self.generation_queue.remove(task)
+            running = [t for t in self.active_tasks if matches(t)]
+
+        for task in queued + running:
+            task.cancelled = True
+            self._resolve_queue_message(task)
+            if task.queue_message:
                 try:
-                    await self.current_task.queue_message.delete()
+                    await task.queue_message.delete()
                 except Exception as e:
                     logger.warning(f"Failed to delete queue message: {e}")
+                task.queue_message = None
+            task.queue_message_id = None
+
+        for task in queued:
+            self._finish_task(task, "🚫 Image generation was cancelled by the requester. / 画像生成は取り消されました。")
+
+        for task in running:
+            sharing = [t for t in self.active_tasks if t.backend_name == task.backend_name and not t.cancelled]
+            backend = next((b for b in self.backends if b.name == task.backend_name), None)
+            if backend and not sharing:
+                await self._interrupt_backend(backend)
+
+        if queued or running:
+            logger.info(f"🚫 [IMAGE_GEN] Cancelled {len(queued)} queued and {len(running)} running task(s) "
+                        f"for user {user_id}")
+            await self._save_queue()
+        return queued + running
+
+    def _resolve_queue_message(self, task: GenerationTask):
+        """再起動前に投稿した待機メッセージをIDから引き継ぐ"""
+        if task.queue_message is not None or not task.queue_message_id:
+            return
+        channel = self.bot.get_channel(task.channel_id)
+        if channel:
+            task.queue_message = channel.get_partial_message(task.queue_message_id)
+
+    async def _interrupt_backend(self, backend: SDBackend):
+        """ワーカーで実行中の生成を中断する"""
+        try:
+            async with self.http_session.post(f"{backend.url}/sdapi/v1/interrupt",
+                                              timeout=aiohttp.ClientTimeout(total=5.0)) as response:
+                logger.info(f"🛑 [IMAGE_GEN] Interrupt sent to '{backend.name}' (status {response.status})")
+        except Exception as e:
+            logger.warning(f"Failed to interrupt backend '{backend.name}': {e}")
 
-            logger.info(f"✅ [IMAGE_GEN] Successfully generated and sent image")
-            if saved_path:
-                logger.info(f"💾 [IMAGE_GEN] Image saved to: {saved_path}")
+    def get_user_jobs(self, user_id: int) -> List[GenerationTask]:
+        """依頼者の実行中・待機中のタスク（キューの順）"""
+        return [t for t in self.active_tasks + list(self.generation_queue)
+                if t.user_id == user_id and not t.cancelled]
 
-            # 現在のキュー位置を取得
-            queue_position_info = ""
-            async with self.queue_lock:
-                if self.current_task:
-                    queue_position_info = f" Queue position / キュー位置: #{self.current_task.position}"
-
-            # パラメータ情報を含めたレスポンス
-            param_info = f"\nParameters: size={adjusted_size}, steps={steps}, cfg={cfg_scale}, sampler={sampler_name}"
-            if seed != -1:
-                param_info += f", seed={seed}"
-            if restore_faces:
-                param_info += f", restore_faces=true"
-            if size_input != adjusted_size:
-                param_info += f"\n(Size adjusted from {size_input} to {adjusted_size})"
-
-            return (
-                f"✅ Successfully generated image with prompt: '{prompt[:100]}{'...' if len(prompt) > 100 else ''}'\n"
-                f"The image has been sent to the channel. / 画像をチャンネルに送信しました。"
-                f"{queue_position_info}"
-                f"{param_info}"
-                f"{f' (Saved locally)' if saved_path else ''}"
+    def get_queue_position(self, task: GenerationTask) -> int:
+        """現在のキュー位置（実行中は0）"""
+        try:
+            return list(self.generation_queue).index(task) + 1
+        except ValueError:
+            return 0
+
+    def get_recent_jobs_text(self, limit: int = 5) -> str:
+        """直近のタスクの待ち時間・生成時間・合計時間"""
+        lines = []
+        for task in list(self.recent_jobs)[-limit:][::-1]:
+            wait = (task.started_at - task.enqueued_at) if task.started_at else 0.0
+            run = (task.finished_at - task.started_at) if task.started_at and task.finished_at else 0.0
+            total = (task.finished_at - task.enqueued_at) if task.finished_at else 0.0
+            lines.append(f"{task.job_id} {task.status:<9} wait {wait:5.1f}s | run {run:5.1f}s | "
+                         f"total {total:5.1f}s | {task.user_name}")
+        return "\n".join(lines) or "No jobs yet"
+
+    async def _process_batch(self, tasks: List[GenerationTask], backend: SDBackend) -> List[str]:
+        """割り当てられたワーカーでタスク群の画像を1リクエストで生成し、それぞれのチャンネルに送信"""
+        lead = tasks[0]
+        params = lead.params
+        model = params['model']
+
+        # キューメッセージを更新（生成開始）
+        for task in tasks:
+            self._resolve_queue_message(task)
+            if task.queue_message:
+                await self._update_queue_message(
+                    task.queue_message,
+                    "Generating... / 生成中...",
+                    task.position,
+                    task.prompt
+                )
+
+        logger.info(f"🎨 [IMAGE_GEN] Starting image generation for "
+                    f"{', '.join(t.user_name for t in tasks)} on '{backend.name}'")
+        logger.info(f"🎨 [IMAGE_GEN] Model: {model}, Size: {params['size']} (requested: {params['size_input']})")
+        logger.info(f"🎨 [IMAGE_GEN] Steps: {params['steps']}, CFG: {params['cfg_scale']}, "
+                    f"Sampler: {params['sampler_name']}")
+        logger.info(f"🎨 [IMAGE_GEN] Seed: {params['seed']}, Restore Faces: {params['restore_faces']}")
+        logger.info(f"🎨 [IMAGE_GEN] Prompt: {lead.prompt[:100]}...")
+
+        # パラメータ辞書を作成
+        gen_params = {
+            'steps': params['steps'],
+            'cfg_scale': params['cfg_scale'],
+            'sampler_name': params['sampler_name'],
+            'seed': params['seed'],
+            'restore_faces': params['restore_faces']
+        }
+
+        images: Optional[List[Optional[GeneratedImage]]] = None
+        started_at = time.monotonic()
+        try:
+            images = await self._generate_image_forge(
+                lead.prompt, params['negative_prompt'], params['size'], model, lead.channel_id, gen_params,
+                backend=backend, position=lead.position, batch_size=len(tasks),
+                item_prompts=self._item_prompts(tasks) if len(tasks) > 1 else None
             )
+            if len(tasks) > 1 and images and len(images) >= len(tasks):
+                backend.batch_failures = 0
+            elif len(tasks) > 1:
+                # バッチ生成に失敗した場合は1件ずつ生成し直す（連続して失敗するワーカーではバッチ生成をやめる）
+                self._discard_images(images)
+                backend.batch_failures += 1
+                if backend.batch_failures >= self.MAX_BATCH_FAILURES:
+                    backend.supports_batch = False
+                    logger.warning(f"⚠️ [IMAGE_GEN] Batched request failed {backend.batch_failures} times in a row "
+                                   f"on '{backend.name}', disabling batching for this backend")
+                else:
+                    logger.warning(f"⚠️ [IMAGE_GEN] Batched request failed on '{backend.name}' "
+                                   f"({backend.batch_failures}/{self.MAX_BATCH_FAILURES}), retrying individually")
+                images = []
+                for task in tasks:
+                    single = await self._generate_image_forge(
+                        task.prompt, task.params['negative_prompt'], params['size'], model,
+                        task.channel_id, {**gen_params, 'seed': task.params['seed']},
+                        backend=backend, position=task.position
+                    )
+                    images.append(single[0] if single else None)
+        except ImageBackendUnavailableError as e:
+            self.backend_pool.mark_unhealthy(backend, str(e))
+            self._discard_images(images)
+            raise
+        except BaseException:
+            self._discard_images(images)
+            raise
+        finally:
+            # 画像を受け取った時点でワーカーを解放し、送信・保存中に次のタスクを開始できるようにする
+            generated = [image for image in images or [] if image]
+            self.backend_pool.release(backend, time.monotonic() - started_at if generated else None,
+                                      model if self.checkpoint_affinity else None, images=len(generated))
+            if len(tasks) > 1 and generated:
+                self.queue_stats['batches'] += 1
+                self.queue_stats['batched_images'] += len(generated)
+
+        results = []
+        try:
+            for index, task in enumerate(tasks):
+                if task.cancelled:
+                    results.append("🚫 Image generation was cancelled by the requester. / 画像生成は取り消されました。")
+                    continue
+                image = images[index] if images and index < len(images) else None
+                if not image:
+                    results.append("❌ Failed to generate image. / 画像の生成に失敗しました。")
+                    continue
+                results.append(await self._deliver_image(task, image, backend, batch_size=len(tasks)))
+        finally:
+            # 保存しなかった画像・取り消されたタスクの画像の一時ファイルを削除
+            self._discard_images(images)
+        return results
+
+    @staticmethod
+    def _discard_images(images: Optional[List[Optional[GeneratedImage]]]):
+        for image in images or []:
+            if image:
+                image.discard()
+
+    async def _prepare_upload(self, path: str, limit: int) -> Optional[str]:
+        """
+        送信用のファイルを決める。上限を超える場合（または常に再圧縮する設定の場合）は
+        スレッド上で再圧縮したファイルを返し、収められない場合は None を返す。
+        """
+        size = os.path.getsize(path)
+        if self.recompress_mode == 'never' or (self.recompress_mode != 'always' and size <= limit):
+            return path if size <= limit else None
+
+        started = time.monotonic()
+        compressed = await asyncio.to_thread(
+            recompress_image, path, limit, self.recompress_format, self.recompress_lossless, self.recompress_quality
+        )
+        if compressed:
+            logger.info(f"🗜️ [IMAGE_GEN] Recompressed image {size} -> {os.path.getsize(compressed)} bytes "
+                        f"({self.recompress_format}) in {time.monotonic() - started:.2f}s")
+            return compressed
+        # 常に再圧縮する設定で失敗した場合でも、元の画像が上限内ならそのまま送る
+        return path if size <= limit else None
+
+    async def _deliver_image(self, task: GenerationTask, image: GeneratedImage, backend: SDBackend,
+                             batch_size: int = 1) -> str:
+        """
+        生成された画像を保存し、依頼元のチャンネルに送信してLLM向けの結果を返す
+
+        受信時にデコードした一時ファイルを保存先へ移動し、そのファイルをそのまま送信する
+        （画像データをメモリ上で複製しない）。保存しない設定の場合は一時ファイルから送信する。
+        """
+        params = task.params
+        prompt = task.prompt
+        negative_prompt = params['negative_prompt']
+        size_input, adjusted_size = params['size_input'], params['size']
+        steps, cfg_scale, sampler_name = params['steps'], params['cfg_scale'], params['sampler_name']
+        seed, restore_faces, model = params['seed'], params['restore_faces'], params['model']
+
+        # 画像を保存
+        saved_path = None
+        if self.save_images:
+            saved_path = await self._save_image(image, prompt, model, adjusted_size, task.job_id)
+
+        channel = self.bot.get_channel(task.channel_id)
+        if not channel:
+            logger.error(f"Channel {task.channel_id} not found!")
+            return "❌ Error: Could not find channel to send image."
+
+        guild = getattr(channel, 'guild', None)
+        upload_limit = guild.filesize_limit if guild else self.upload_limit_bytes
+        source_path = saved_path or image.path
+        upload_path = await self._prepare_upload(source_path, upload_limit)
+        if not upload_path:
+            logger.error(f"❌ [IMAGE_GEN] Image ({image.size} bytes) exceeds upload limit ({upload_limit} bytes)")
+            return ("❌ The generated image is too large to upload. / 生成された画像がアップロード上限を超えています。"
+                    f"{' (Saved locally)' if saved_path else ''}")
+
+        # Embedに詳細なパラメータ情報を追加
+        embed = discord.Embed(
+            title="🎨 Generated Image / 生成された画像",
+            description=f"**Prompt:** {prompt[:200]}{'...' if len(prompt) > 200 else ''}",
+            color=discord.Color.blue()
+        )
+        if negative_prompt:
+            embed.add_field(
+                name="Negative Prompt",
+                value=negative_prompt[:100] + ('...' if len(negative_prompt) > 100 else ''),
+                inline=False
+            )
+        embed.add_field(name="Size", value=adjusted_size, inline=True)
+        embed.add_field(name="Model", value=model, inline=True)
+        embed.add_field(name="Steps", value=str(steps), inline=True)
+        embed.add_field(name="CFG Scale", value=str(cfg_scale), inline=True)
+        embed.add_field(name="Sampler", value=sampler_name, inline=True)
+        if seed != -1:
+            embed.add_field(name="Seed", value=str(seed), inline=True)
+        if restore_faces:
+            embed.add_field(name="Face Restoration", value="✅ Enabled", inline=True)
+
+        # サイズが調整された場合は注記
+        if size_input != adjusted_size:
+            embed.add_field(
+                name="ℹ️ Size Adjusted",
+                value=f"Requested: {size_input} → Used: {adjusted_size}",
+                inline=False
+            )
+
+        # フッターメッセージをプロバイダーに応じて動的に変更
+        backend_suffix = f" ({backend.name})" if len(self.backends) > 1 else ""
+        if batch_size > 1:
+            backend_suffix += f" - batch x{batch_size}"
+        if backend.provider_name == "KoboldCPP":
+            embed.set_footer(text=f"Powered by KoboldCPP and PLANA{backend_suffix}")
+        else:
+            embed.set_footer(text=f"Powered by SDWebUI reForge and PLANA{backend_suffix}")
 
+        try:
+            filename = "generated_image" + os.path.splitext(upload_path)[1]
+            await channel.send(embed=embed, file=discord.File(fp=upload_path, filename=filename))
         finally:
-            async with self.queue_lock:
-                self.is_generating = False
-                self.current_task = None
-
-                # 次のタスクがあれば処理
-                if self.generation_queue:
-                    next_task = self.generation_queue[0]
-                    logger.info(f"📋 [IMAGE_GEN] Processing next task for {next_task.user_name}")
-                    # 次のタスクを非同期で処理
-                    asyncio.create_task(self._process_next_task())
-
-    async def _process_next_task(self):
-        """次のキュータスクを処理"""
-        async with self.queue_lock:
-            if not self.generation_queue:
-                return
-            task = self.generation_queue[0]
-
-        # タスク情報から引数を再構築
-        arguments = {
-            'prompt': task.prompt,
-            'size': self.default_size
-        }
+            if upload_path != source_path:
+                try:
+                    os.remove(upload_path)
+                except OSError:
+                    pass
 
-        await self._process_queue(arguments, task.channel_id)
+        # キューメッセージを削除
+        if task.queue_message:
+            try:
+                await task.queue_message.delete()
+            except Exception as e:
+                logger.warning(f"Failed to delete queue message: {e}")
+
+        latency = time.time() - task.enqueued_at
+        self.queue_stats['delivered'] += 1
+        self.queue_stats['latency_seconds_total'] += latency
+        logger.info(f"✅ [IMAGE_GEN] Successfully generated and sent image ({latency:.1f}s since request)")
+        if saved_path:
+            logger.info(f"💾 [IMAGE_GEN] Image saved to: {saved_path}")
+
+        # キュー位置情報
+        queue_position_info = f" Queue position / キュー位置: #{task.position}"
+
+        # パラメータ情報を含めたレスポンス
+        param_info = f"\nParameters: size={adjusted_size}, steps={steps}, cfg={cfg_scale}, sampler={sampler_name}"
+        if seed != -1:
+            param_info += f", seed={seed}"
+        if restore_faces:
+            param_info += f", restore_faces=true"
+        if size_input != adjusted_size:
+            param_info += f"\n(Size adjusted from {size_input} to {adjusted_size})"
+
+        return (
+            f"✅ Successfully generated image with prompt: '{prompt[:100]}{'...' if len(prompt) > 100 else ''}'\n"
+            f"The image has been sent to the channel. / 画像をチャンネルに送信しました。"
+            f"{queue_position_info}"
+            f"{param_info}"
+            f"{f' (Saved locally)' if saved_path else ''}"
+        )
 
     async def _generate_image_forge(
             self,
@@ -682,11 +1250,21 @@ class ImageGenerator:
             size: str,
             model: str,
             channel_id: int,
-            gen_params: Dict[str, Any]
-    ) -> Optional[bytes]:
+            gen_params: Dict[str, Any],
+            backend: SDBackend,
+            position: int = 0,
+            batch_size: int = 1,
+            item_prompts: Optional[List[tuple]] = None
+    ) -> Optional[List[GeneratedImage]]:
         """
         Stable Diffusion WebUI Forge APIで画像を生成
 
+        batch_size を指定すると同じプロンプトの画像をその枚数だけ1回のGPUパスでまとめて生成する。
+        item_prompts にタスクごとのプロンプトを渡した場合、全て同じなら batch_size でまとめ、
+        異なれば WebUI 標準の「Prompts from file or textbox」スクリプトで1回のリクエストとして生成する
+        （モデルの読み込みとリクエストの往復は1回で済み、画像はプロンプトの順に返る）。
+        応答のJSONは逐次解析し、base64の画像はチャンクごとに一時ファイルへデコードする。
+
         Args:
             prompt: 生成する画像の説明
             negative_prompt: 除外する要素
@@ -694,14 +1272,21 @@ class ImageGenerator:
             model: 使用するモデル名
             channel_id: Discordチャンネルid (プログレス表示用)
             gen_params: 生成パラメータ (steps, cfg_scale, sampler_name, seed, restore_faces)
+            backend: 生成を実行するワーカー
+            position: キュー位置 (プログレス表示用)
+            batch_size: 1回のリクエストで生成する枚数
+            item_prompts: 画像ごとの (プロンプト, ネガティブプロンプト, シード)
 
         Returns:
-            生成された画像データ(PNG形式)
+            一時ファイルにデコードされた画像(PNG形式)のリスト
+
+        Raises:
+            ImageBackendUnavailableError: ワーカーへの接続が切れた・応答しない場合（別ワーカーで再実行される）
         """
         width, height = map(int, size.split('x'))
 
         # Forge WebUI API エンドポイント
-        url = f"{self.api_url}/sdapi/v1/txt2img"
+        url = f"{backend.url}/sdapi/v1/txt2img"
 
         # 渡されたパラメータを使用（デフォルトは既に適用済み）
         steps = gen_params.get('steps', 20)
@@ -710,6 +1295,19 @@ class ImageGenerator:
         seed = gen_params.get('seed', -1)
         restore_faces = gen_params.get('restore_faces', False)
 
+        batch_size = max(1, batch_size)
+        display_prompt = f"{prompt} (x{batch_size})" if batch_size > 1 else prompt
+        script_lines = None
+        if item_prompts and len(item_prompts) > 1:
+            batch_size = len(item_prompts)
+            first_prompt, first_negative, _ = item_prompts[0]
+            if all(item == (first_prompt, first_negative, -1) for item in item_prompts):
+                prompt, negative_prompt = first_prompt, first_negative
+            else:
+                # 1行に1枚。行ごとにプロンプト・ネガティブプロンプト・シードを指定し、1枚ずつ生成させる
+                script_lines = [self._prompt_script_line(*item) for item in item_prompts]
+                display_prompt = f"{first_prompt} (+{batch_size - 1} more)"
+
         payload = {
             "prompt": prompt,
             "negative_prompt": negative_prompt or self.default_params.get('negative_prompt', ''),
@@ -718,17 +1316,28 @@ class ImageGenerator:
             "steps": steps,
             "cfg_scale": cfg_scale,
             "sampler_name": sampler_name,
-            "batch_size": 1,
+            "batch_size": batch_size,
             "n_iter": 1,
+            # バッチ生成時のグリッド画像は不要
+            "do_not_save_grid": True,
             "seed": seed,
             "restore_faces": restore_faces,
             "tiling": self.default_params.get('tiling', False),
             "override_settings": {
                 "sd_model_checkpoint": model
             },
-            "override_settings_restore_afterwards": True
+            # チェックポイント優先スケジューリング時は読み込んだモデルをそのまま残し、次のタスクで再利用する
+            "override_settings_restore_afterwards": not self.checkpoint_affinity
         }
 
+        if script_lines:
+            payload["batch_size"] = 1
+            # シードは行ごとに指定する（指定のない行はランダム）
+            payload["seed"] = -1
+            # [各行でシードを変える, 各行でバッチ内のシードを揃える, プロンプトの位置, 行のテキスト]
+            payload["script_name"] = self.batch_script
+            payload["script_args"] = [False, False, "start", "\n".join(script_lines)]
+
         # 追加パラメータがあればマージ（ただしユーザー指定を優先）
         extra_params = self.default_params.get('extra_params')
         if extra_params and isinstance(extra_params, dict):
@@ -737,10 +1346,10 @@ class ImageGenerator:
                 if key not in payload:
                     payload[key] = value
 
-        logger.info(f"🟢 [IMAGE_GEN] Calling {self.provider_name} API")
+        logger.info(f"🟢 [IMAGE_GEN] Calling {backend.provider_name} API ({backend.name})")
         logger.info(f"🟢 [IMAGE_GEN] URL: {url}")
         logger.info(f"🟢 [IMAGE_GEN] Model: {model}")
-        logger.info(f"🟢 [IMAGE_GEN] Size: {width}x{height}")
+        logger.info(f"🟢 [IMAGE_GEN] Size: {width}x{height}, Batch: {batch_size}")
         logger.info(f"🟢 [IMAGE_GEN] Steps: {payload['steps']}, CFG: {payload['cfg_scale']}")
         logger.info(f"🟢 [IMAGE_GEN] Sampler: {payload['sampler_name']}, Seed: {payload['seed']}")
         logger.info(f"🟢 [IMAGE_GEN] Restore Faces: {payload['restore_faces']}")
@@ -753,23 +1362,22 @@ class ImageGenerator:
                 try:
                     # キュー情報を追加
                     queue_info = ""
-                    current_position = 0
                     async with self.queue_lock:
                         queue_length = len(self.generation_queue)
-                        if self.current_task:
-                            current_position = self.current_task.position
                         if queue_length > 0:
                             queue_info = f"\n📋 **Queue:** {queue_length} task(s) waiting / {queue_length}件待機中"
 
-                    position_info = f"\n🔢 **Queue Position / キュー位置:** #{current_position}" if current_position > 0 else ""
+                    position_info = f"\n🔢 **Queue Position / キュー位置:** #{position}" if position > 0 else ""
 
                     embed = discord.Embed(
                         title="🎨 Starting Image Generation... / 画像生成を開始...",
-                        description=f"**Prompt:** {prompt[:150]}{'...' if len(prompt) > 150 else ''}{position_info}{queue_info}",
+                        description=f"**Prompt:** {display_prompt[:150]}{'...' if len(display_prompt) > 150 else ''}{position_info}{queue_info}",
                         color=discord.Color.orange()
                     )
                     embed.add_field(name="Model", value=model, inline=True)
                     embed.add_field(name="Size", value=size, inline=True)
+                    if len(self.backends) > 1:
+                        embed.add_field(name="Backend", value=backend.name, inline=True)
                     embed.set_footer(text="⏳ Initializing... / 初期化中...")
                     progress_message = await channel.send(embed=embed)
                 except Exception as e:
@@ -778,16 +1386,14 @@ class ImageGenerator:
         # プログレス監視タスクを起動
         progress_task = None
         if self.show_progress and progress_message:
-            import time
             start_time = time.time()
             progress_task = asyncio.create_task(
-                self._monitor_progress(progress_message, steps, prompt, model, start_time)
+                self._monitor_progress(progress_message, steps, display_prompt, model, start_time, backend, position)
             )
             logger.info(f"🟢 [IMAGE_GEN] Progress monitoring task started")
 
         try:
             # 画像生成リクエストを送信
-            import time
             start_time = time.time()
 
             async with self.http_session.post(
@@ -799,7 +1405,9 @@ class ImageGenerator:
                 logger.info(f"🟢 [IMAGE_GEN] Response status: {response.status}")
 
                 if response.status == 200:
-                    result = await response.json()
+                    parsed = await read_txt2img_response(
+                        response.content.iter_chunked(self.stream_chunk_size), self.temp_directory
+                    )
 
                     # プログレス監視を停止
                     if progress_task:
@@ -809,25 +1417,29 @@ class ImageGenerator:
                         except asyncio.CancelledError:
                             pass
 
-                    if result.get('images') and len(result['images']) > 0:
-                        # Base64エンコードされた画像をデコード
-                        b64_image = result['images'][0]
-                        image_bytes = base64.b64decode(b64_image)
+                    if parsed.images:
+                        # グリッドが先頭に付いている場合は除く
+                        image_list = parsed.images
+                        if len(image_list) > batch_size:
+                            for grid in image_list[:-batch_size]:
+                                grid.discard()
+                            image_list = image_list[-batch_size:]
 
                         elapsed_time = time.time() - start_time
-                        logger.info(f"✅ [IMAGE_GEN] Successfully received image ({len(image_bytes)} bytes)")
+                        logger.info(f"✅ [IMAGE_GEN] Successfully received {len(image_list)} image(s) "
+                                    f"({sum(image.size for image in image_list)} bytes)")
                         logger.info(f"✅ [IMAGE_GEN] Total generation time: {elapsed_time:.1f}s")
 
                         # 生成情報をログ出力
-                        if 'info' in result:
-                            logger.info(f"🟢 [IMAGE_GEN] Generation info: {result['info'][:200]}...")
+                        if 'info' in parsed.text_values:
+                            logger.info(f"🟢 [IMAGE_GEN] Generation info: {parsed.text_values['info'][:200]}...")
 
                         # 完了メッセージを表示
                         if progress_message:
                             try:
                                 final_embed = discord.Embed(
                                     title="✅ Image Generation Complete! / 画像生成完了!",
-                                    description=f"**Prompt:** {prompt[:150]}{'...' if len(prompt) > 150 else ''}",
+                                    description=f"**Prompt:** {display_prompt[:150]}{'...' if len(display_prompt) > 150 else ''}",
                                     color=discord.Color.green()
                                 )
                                 final_embed.add_field(
@@ -844,7 +1456,7 @@ class ImageGenerator:
                             except Exception as e:
                                 logger.warning(f"Failed to update final progress: {e}")
 
-                        return image_bytes
+                        return image_list
 
                     logger.error(f"❌ [IMAGE_GEN] No image data in response")
                     if progress_message:
@@ -863,8 +1475,8 @@ class ImageGenerator:
                             pass
                     return None
 
-        except asyncio.TimeoutError:
-            logger.error(f"❌ [IMAGE_GEN] Request timed out after {self.timeout}s")
+        except asyncio.TimeoutError as e:
+            logger.error(f"❌ [IMAGE_GEN] Request to '{backend.name}' timed out after {self.timeout}s")
             if progress_task:
                 progress_task.cancel()
             if progress_message:
@@ -872,10 +1484,10 @@ class ImageGenerator:
                     await progress_message.delete()
                 except:
                     pass
-            return None
-        except aiohttp.ClientConnectorError as e:
+            raise ImageBackendUnavailableError(f"timed out after {self.timeout}s", e)
+        except aiohttp.ClientConnectionError as e:
             logger.error(f"❌ [IMAGE_GEN] Connection error: {e}")
-            logger.error(f"❌ [IMAGE_GEN] Make sure {self.provider_name} is running at {self.api_url}")
+            logger.error(f"❌ [IMAGE_GEN] Make sure {backend.provider_name} is running at {backend.url}")
             if progress_task:
                 progress_task.cancel()
             if progress_message:
@@ -883,7 +1495,7 @@ class ImageGenerator:
                     await progress_message.delete()
                 except:
                     pass
-            return None
+            raise ImageBackendUnavailableError(f"connection error: {e}", e)
         except Exception as e:
             logger.error(f"❌ [IMAGE_GEN] Exception during API call: {e}", exc_info=True)
             if progress_task:
@@ -895,113 +1507,119 @@ class ImageGenerator:
                     pass
             return None
 
+    @staticmethod
+    def _prompt_script_line(prompt: str, negative_prompt: str, seed: int) -> str:
+        """「Prompts from file or textbox」スクリプトの1行（改行はスペースにし、値は shlex で引用する）"""
+        parts = ["--prompt", shlex.quote(" ".join(prompt.split())),
+                 "--negative_prompt", shlex.quote(" ".join((negative_prompt or "").split()))]
+        if seed is not None and seed != -1:
+            parts += ["--seed", str(int(seed))]
+        return " ".join(parts)
+
     async def _monitor_progress(
             self,
             message: discord.Message,
             total_steps: int,
             prompt: str,
             model: str,
-            start_time: float
+            start_time: float,
+            backend: SDBackend,
+            position: int = 0
     ):
-        """プログレスを監視してメッセージを更新"""
-        progress_url = f"{self.api_url}/sdapi/v1/progress"
+        """
+        共有の進捗ハブから進捗を受け取ってメッセージを更新
+
+        ステップ数が progress_min_step_delta 以上進んだ場合にだけ編集し、
+        編集間隔も progress_update_interval 秒以上空ける（完了直前の更新は間隔に関係なく反映する）。
+        """
+        subscription = self.progress_hub.subscribe(backend)
 
         last_step = 0
+        last_edit_step = 0
+        last_edit_time = 0.0
+        last_preview_time = 0.0
         last_update_time = start_time
-        consecutive_errors = 0
-        max_consecutive_errors = 5
+        has_preview = False
 
         try:
-            # 少し待ってから監視開始（API起動待ち）
-            await asyncio.sleep(1.0)
-
             while True:
-                try:
-                    async with self.http_session.get(
-                            progress_url,
-                            timeout=aiohttp.ClientTimeout(total=5.0)
-                    ) as response:
-                        if response.status == 200:
-                            import time
-                            data = await response.json()
-
-                            # progressが0.0の場合はまだ開始していない
-                            progress = data.get('progress', 0.0)
-                            state = data.get('state', {})
-                            job_count = state.get('job_count', 0)
-
-                            # 生成が開始されているか確認
-                            if progress > 0.0 or job_count > 0:
-                                consecutive_errors = 0  # エラーカウントをリセット
-
-                                current_step = int(progress * total_steps)
-                                if current_step > total_steps:
-                                    current_step = total_steps
-
-                                current_time = time.time()
-                                elapsed_time = current_time - start_time
-
-                                # it/s を計算
-                                it_per_sec = 0.0
-                                time_diff = current_time - last_update_time
-                                if time_diff > 0 and current_step > last_step:
-                                    steps_diff = current_step - last_step
-                                    it_per_sec = steps_diff / time_diff
-
-                                await self._update_progress_message(
-                                    message,
-                                    current_step,
-                                    total_steps,
-                                    prompt,
-                                    model,
-                                    elapsed_time,
-                                    it_per_sec
-                                )
+                snapshot = await subscription.get()
 
-                                last_step = current_step
-                                last_update_time = current_time
-
-                                logger.debug(
-                                    f"📊 [IMAGE_GEN] Progress: {current_step}/{total_steps} ({progress * 100:.1f}%)")
-                            else:
-                                # まだ開始していない場合は初期化中と表示
-                                logger.debug(f"⏳ [IMAGE_GEN] Waiting for generation to start...")
-                        else:
-                            consecutive_errors += 1
-                            logger.warning(f"⚠️ [IMAGE_GEN] Progress API returned status {response.status}")
-
-                except asyncio.TimeoutError:
-                    consecutive_errors += 1
-                    logger.debug(
-                        f"⚠️ [IMAGE_GEN] Progress check timeout (attempt {consecutive_errors}/{max_consecutive_errors})")
-                except Exception as e:
-                    consecutive_errors += 1
-                    logger.debug(
-                        f"⚠️ [IMAGE_GEN] Progress check error: {e} (attempt {consecutive_errors}/{max_consecutive_errors})")
+                # 生成が開始されているか確認
+                if not snapshot.started:
+                    logger.debug(f"⏳ [IMAGE_GEN] Waiting for generation to start...")
+                    continue
 
-                # 連続エラーが多すぎる場合は監視を停止
-                if consecutive_errors >= max_consecutive_errors:
-                    logger.warning(f"❌ [IMAGE_GEN] Too many consecutive errors, stopping progress monitoring")
-                    break
+                total = snapshot.sampling_steps if snapshot.sampling_steps > 0 else total_steps
+                if snapshot.sampling_steps > 0:
+                    current_step = min(snapshot.sampling_step, total)
+                else:
+                    current_step = min(int(snapshot.progress * total), total)
+
+                current_time = time.time()
+                step_delta = current_step - last_edit_step
+                finishing = current_step >= total and last_edit_step < total
+                if not finishing and (step_delta < self.progress_min_step_delta or
+                                      current_time - last_edit_time < self.progress_update_interval):
+                    self.progress_stats['edits_skipped'] += 1
+                    continue
+
+                # it/s を計算
+                it_per_sec = 0.0
+                time_diff = current_time - last_update_time
+                if time_diff > 0 and current_step > last_step:
+                    it_per_sec = (current_step - last_step) / time_diff
+
+                preview = None
+                if (self.show_live_preview and snapshot.current_image and
+                        current_time - last_preview_time >= self.live_preview_interval):
+                    preview = await asyncio.to_thread(make_preview_thumbnail, snapshot.current_image,
+                                                      self.live_preview_size)
+                    if preview:
+                        last_preview_time = current_time
+                        has_preview = True
+
+                await self._update_progress_message(
+                    message,
+                    current_step,
+                    total,
+                    prompt,
+                    model,
+                    current_time - start_time,
+                    it_per_sec,
+                    position,
+                    preview=preview,
+                    keep_preview=has_preview
+                )
+                self.progress_stats['edits'] += 1
+
+                last_step = current_step
+                last_edit_step = current_step
+                last_edit_time = current_time
+                last_update_time = current_time
 
-                await asyncio.sleep(self.progress_update_interval)
+                logger.debug(
+                    f"📊 [IMAGE_GEN] Progress: {current_step}/{total} ({snapshot.progress * 100:.1f}%)")
 
         except asyncio.CancelledError:
             # タスクがキャンセルされた場合は正常終了
             logger.info(f"🛑 [IMAGE_GEN] Progress monitoring cancelled")
-            pass
         except Exception as e:
             logger.error(f"❌ [IMAGE_GEN] Unexpected error in progress monitoring: {e}", exc_info=True)
+        finally:
+            self.progress_hub.unsubscribe(subscription)
 
-    async def _save_image(self, image_data: bytes, prompt: str, model: str, size: str) -> Optional[str]:
+    async def _save_image(self, image: GeneratedImage, prompt: str, model: str, size: str,
+                          job_id: str = "") -> Optional[str]:
         """
-        生成された画像をファイルに保存
+        生成された画像をファイルに保存（受信時の一時ファイルを保存先へ移動する）
 
         Args:
-            image_data: 画像データ（バイト列）
+            image: 一時ファイルにデコードされた画像
             prompt: 生成プロンプト
             model: 使用したモデル名
             size: 画像サイズ
+            job_id: タスクのジョブID（同じ秒に保存した画像同士でファイル名が重ならないようにする）
 
         Returns:
             保存されたファイルパス（相対パス）、失敗時はNone
@@ -1025,19 +1643,20 @@ class ImageGenerator:
             model_short = model.split('.')[0][:20] if '.' in model else model[:20]
             model_short = re.sub(r'[^\w-]', '', model_short)
 
-            # ファイル名を構築
-            filename = f"{timestamp}_{model_short}_{size}_{safe_prompt}.png"
-            filepath = os.path.join(self.save_directory, filename)
+            # ファイル名を構築（既存のファイルは上書きせず、番号を付けて別名にする）
+            stem = f"{timestamp}_{job_id}_{model_short}_{size}_{safe_prompt}" if job_id else \
+                f"{timestamp}_{model_short}_{size}_{safe_prompt}"
+            filepath = os.path.join(self.save_directory, f"{stem}.png")
+            counter = 1
+            while os.path.exists(filepath):
+                filepath = os.path.join(self.save_directory, f"{stem}_{counter}.png")
+                counter += 1
 
-            # 画像を保存
+            # 画像を保存（同じファイルシステム上ならリネームのみでデータはコピーしない）
             try:
-                import aiofiles
-                async with aiofiles.open(filepath, 'wb') as f:
-                    await f.write(image_data)
-            except ImportError:
-                # aiofilesがない場合は通常の書き込み
-                with open(filepath, 'wb') as f:
-                    f.write(image_data)
+                os.replace(image.path, filepath)
+            except OSError:
+                await asyncio.to_thread(shutil.move, image.path, filepath)
 
             logger.info(f"💾 [IMAGE_GEN] Image saved to: {filepath}")
             return filepath
@@ -1047,8 +1666,9 @@ class ImageGenerator:
             return None
 
     async def get_available_models_from_api(self) -> Optional[List[str]]:
-        """Forge WebUI / KoboldCPPから利用可能なモデルリストを取得"""
-        url = f"{self.api_url}/sdapi/v1/sd-models"
+        """Forge WebUI / KoboldCPPから利用可能なモデルリストを取得（稼働中の先頭ワーカーに問い合わせ）"""
+        backend = next((b for b in self.backends if b.healthy), self.backend_pool.primary)
+        url = f"{backend.url}/sdapi/v1/sd-models"
 
         try:
             async with self.http_session.get(
@@ -1058,7 +1678,7 @@ class ImageGenerator:
                 if response.status == 200:
                     models = await response.json()
                     model_names = [model['title'] for model in models]
-                    logger.info(f"📋 [IMAGE_GEN] Found {len(model_names)} models in {self.provider_name}")
+                    logger.info(f"📋 [IMAGE_GEN] Found {len(model_names)} models in {backend.provider_name} ({backend.name})")
                     return model_names
                 else:
                     logger.error(f"❌ [IMAGE_GEN] Failed to fetch models: {response.status}")
@@ -1067,7 +1687,37 @@ class ImageGenerator:
             logger.error(f"❌ [IMAGE_GEN] Error fetching models: {e}")
             return None
 
+    def get_queue_stats_text(self) -> str:
+        """キューとワーカーごとの統計を表示用テキストで返す"""
+        stats = self.queue_stats
+        dispatched = stats['dispatched']
+        avg_wait = stats['queue_wait_seconds_total'] / dispatched if dispatched else 0.0
+        avg_latency = stats['latency_seconds_total'] / stats['delivered'] if stats['delivered'] else 0.0
+        avg_batch = stats['batched_images'] / stats['batches'] if stats['batches'] else 0.0
+        return (
+            f"Queue: {len(self.generation_queue)} waiting / {len(self.active_tasks)} running "
+            f"(capacity {self.backend_pool.capacity}) | avg wait {avg_wait:.1f}s | "
+            f"avg latency {avg_latency:.1f}s/img | requeued {stats['requeued']} | failed {stats['failed']}\n"
+            f"Batches: {stats['batches']} (avg {avg_batch:.1f} images)\n"
+            f"Progress: {self.progress_hub.get_stats_text()} | edits {self.progress_stats['edits']} "
+            f"(skipped {self.progress_stats['edits_skipped']})\n"
+            f"{self.backend_pool.get_stats_text()}"
+        )
+
     async def close(self):
-        """HTTPセッションをクローズ"""
+        """ディスパッチャーを停止し、HTTPセッションをクローズ"""
+        if self._dispatcher_task:
+            self._dispatcher_task.cancel()
+            self._dispatcher_task = None
+        for job in list(self._running_jobs):
+            job.cancel()
+        await self.backend_pool.close()
+        await self.progress_hub.close()
+
+        for task in list(self.generation_queue) + self.active_tasks:
+            if task.future and not task.future.done():
+                task.future.set_result("❌ Image generation was stopped. / 画像生成が停止されました。")
+        self.generation_queue.clear()
+
         await self.http_session.close()
-        logger.info(f"ImageGenerator HTTP session closed for {self.provider_name}")
\ No newline at end of file
+        logger.info(f"ImageGenerator HTTP session closed ({len(self.backends)} backend(s))")
\ No newline at end of file
@@ -0,0 +1,193 @@
+# PLANA/llm/plugins/image_ingest.py
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+
+EXTENSION_MIME_TYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'gif': 'image/gif',
+                        'webp': 'image/webp'}
+
+
+class ImageTooLargeError(Exception):
+    """ダウンロード中に上限サイズを超えた"""
+
+    def __init__(self, size: int, limit: int):
+        super().__init__(f"image exceeds {limit} bytes (got {size}+ bytes)")
+        self.size = size
+        self.limit = limit
+
+
+def guess_mime_type(url: str, content_type: Optional[str]) -> str:
+    if content_type and content_type.startswith('image/'):
+        return content_type
+    ext = url.split('?')[0].rsplit('.', 1)[-1].lower()
+    return EXTENSION_MIME_TYPES.get(ext, 'image/jpeg')
+
+
+async def fetch_image(session: aiohttp.ClientSession, url: str, max_bytes: int = MAX_IMAGE_BYTES,
+                      timeout: float = 10.0) -> Optional[Tuple[bytes, str]]:
+    """
+    画像をストリーミングでダウンロードする
+
+    Content-Length が上限を超えている場合は本文を読まずに中断し、ヘッダーが無い場合も
+    受信済みのバイト数が上限を超えた時点で中断する（ImageTooLargeError）。
+
+    Returns:
+        (画像データ, MIMEタイプ)。ステータスが200以外の場合は None。
+    """
+    async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+        if response.status != 200:
+            logger.warning(f"Failed to download image from {url} (Status: {response.status})")
+            return None
+        if response.content_length is not None and response.content_length > max_bytes:
+            raise ImageTooLargeError(response.content_length, max_bytes)
+
+        buffer = bytearray()
+        async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+            buffer.extend(chunk)
+            if len(buffer) > max_bytes:
+                raise ImageTooLargeError(len(buffer), max_bytes)
+        return bytes(buffer), guess_mime_type(url, response.content_type)
+
+
+def transcode_image(data: bytes, mime_type: str, max_dimension: int = 0,
+                    jpeg_quality: int = 90) -> Optional[Tuple[bytes, str]]:
+    """
+    LLMに送る画像を整える（CPU処理のためワーカープロセス上で呼ぶこと）
+
+    - アニメーションGIFは先頭フレームのPNGに変換する
+    - 長辺が max_dimension を超える場合は縮小し、透過があればPNG、なければJPEGで再エンコードする
+    - どちらにも該当しない場合は元のデータをそのまま返す
+
+    Returns:
+        (画像データ, MIMEタイプ)。変換できない画像の場合は None。
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        if mime_type == 'image/gif':
+            # アニメーションGIFかどうか判定できないため送信しない
+            logger.warning("⚠️ Pillow (PIL) library not found. Cannot process animated GIFs. Skipping image.")
+            return None
+        return data, mime_type
+
+    with Image.open(io.BytesIO(data)) as img:
+        animated = getattr(img, 'is_animated', False)
+        oversized = max_dimension > 0 and max(img.size) > max_dimension
+        if not animated and not oversized:
+            return data, mime_type
+
+        img.seek(0)
+        frame = img.copy()
+
+    if oversized:
+        frame.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+    has_alpha = frame.mode in ('RGBA', 'LA', 'P') and (frame.mode != 'P' or 'transparency' in frame.info)
+    output = io.BytesIO()
+    if animated or has_alpha:
+        if frame.mode not in ('RGBA', 'RGB', 'L', 'LA'):
+            frame = frame.convert('RGBA')
+        frame.save(output, format='PNG', optimize=True)
+        return output.getvalue(), 'image/png'
+    if frame.mode != 'RGB':
+        frame = frame.convert('RGB')
+    frame.save(output, format='JPEG', quality=jpeg_quality, optimize=True)
+    return output.getvalue(), 'image/jpeg'
+
+
+def needs_transcode(data: bytes, mime_type: str, max_dimension: int = 0) -> bool:
+    """
+    transcode_image で変換が必要かどうかをヘッダーだけ読んで判定する（イベントループ上で呼べる軽さ）
+
+    GIF はアニメーションの判定にフレームを読む必要があるため常に変換対象とする。
+    ヘッダーが読めない画像も、ワーカー側で判定させるため変換対象とする。
+    """
+    if mime_type == 'image/gif':
+        return True
+    try:
+        from PIL import Image
+    except ImportError:
+        return False  # transcode_image もGIF以外はそのまま返す
+
+    try:
+        # Image.open はヘッダーだけを読み、画素データはデコードしない
+        with Image.open(io.BytesIO(data)) as img:
+            if img.format == 'GIF':
+                return True
+            oversized = max_dimension > 0 and max(img.size) > max_dimension
+            return oversized or getattr(img, 'is_animated', False)
+    except Exception:
+        return True
+
+
+class ImageTranscoder:
+    """
+    画像の変換をワーカープロセスで行う（イベントループと他のCogを止めない）
+
+    プロセスプールが使えない環境や、プールが壊れた場合はスレッドで実行する。
+    """
+
+    def __init__(self, workers: int = 2, use_processes: bool = True):
+        self.workers = max(1, int(workers))
+        self.use_processes = use_processes
+        self._executor: Optional[concurrent.futures.Executor] = None
+
+    def _get_executor(self) -> concurrent.futures.Executor:
+        if self._executor is None:
+            if self.use_processes:
+                try:
+                    # マルチスレッドのプロセスを fork するとロックを持ったままの子プロセスが固まることがあるため spawn で起動する
+                    self._executor = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+                except (OSError, NotImplementedError) as e:
+                    logger.warning(f"Process pool unavailable for image transcoding, using threads: {e}")
+                    self.use_processes = False
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers,
+                                                                       thread_name_prefix="image-transcode")
+        return self._executor
+
+    async def start(self) -> int:
+        """
+        ワーカーを起動しておく（プロセスの起動を最初の画像付きメッセージに待たせない）
+
+        Returns:
+            起動したワーカー数
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        pids = await asyncio.gather(*(loop.run_in_executor(executor, os.getpid) for _ in range(self.workers)),
+                                    return_exceptions=True)
+        return len({pid for pid in pids if not isinstance(pid, BaseException)})
+
+    async def transcode(self, data: bytes, mime_type: str, max_dimension: int = 0) -> Optional[Tuple[bytes, str]]:
+        # 変換が不要な画像はワーカーとの間で画像データを受け渡さずにそのまま返す
+        if not needs_transcode(data, mime_type, max_dimension):
+            return data, mime_type
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_executor(), transcode_image, data, mime_type, max_dimension)
+        except BrokenProcessPool:
+            logger.warning("Image transcoding process pool broke, falling back to threads")
+            self._executor = None
+            self.use_processes = False
+            return await loop.run_in_executor(self._get_executor(), transcode_image, data, mime_type, max_dimension)
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
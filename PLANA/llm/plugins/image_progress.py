@@ -0,0 +1,156 @@
+# PLANA/llm/plugins/image_progress.py
+from __future__ import annotations
+
+import asyncio
+import base64
+import io
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set
+
+import aiohttp
+
+from PLANA.llm.plugins.image_backends import SDBackend
+
+try:
+    from PIL import Image
+
+    PIL_AVAILABLE = True
+except ImportError:
+    Image = None
+    PIL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ProgressSnapshot:
+    """`/sdapi/v1/progress` の1回分の応答"""
+    progress: float = 0.0
+    sampling_step: int = 0
+    sampling_steps: int = 0
+    eta: float = 0.0
+    job_count: int = 0
+    current_image: Optional[str] = None
+    received_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def started(self) -> bool:
+        return self.progress > 0.0 or self.job_count > 0
+
+
+class ProgressSubscription:
+    """ワーカー1台分の進捗を受け取る購読者。古い進捗は捨てて最新のものだけを保持する。"""
+
+    def __init__(self, backend: SDBackend):
+        self.backend = backend
+        self._queue: asyncio.Queue[ProgressSnapshot] = asyncio.Queue(maxsize=1)
+
+    def push(self, snapshot: ProgressSnapshot):
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(snapshot)
+
+    async def get(self) -> ProgressSnapshot:
+        return await self._queue.get()
+
+
+class ProgressHub:
+    """
+    ワーカーごとに1本だけ進捗をポーリングし、生成中の全タスクに配信する。
+
+    同じワーカーで複数のタスクが待っていてもリクエストは1本に集約され、
+    購読者がいなくなったワーカーのポーリングは自動的に停止する。
+    Forge / KoboldCPP の API には進捗のプッシュ通知が無いため、ポーリングを共有する形で実装している。
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, poll_interval: float = 1.0, include_preview: bool = False):
+        self.session = session
+        self.poll_interval = max(0.25, float(poll_interval))
+        self.include_preview = include_preview
+        self._subscribers: Dict[str, Set[ProgressSubscription]] = {}
+        self._pollers: Dict[str, asyncio.Task] = {}
+        self.stats: Dict[str, int] = {'polls': 0, 'poll_errors': 0, 'deliveries': 0}
+
+    def subscribe(self, backend: SDBackend) -> ProgressSubscription:
+        subscription = ProgressSubscription(backend)
+        self._subscribers.setdefault(backend.name, set()).add(subscription)
+        poller = self._pollers.get(backend.name)
+        if poller is None or poller.done():
+            self._pollers[backend.name] = asyncio.create_task(self._poll_loop(backend))
+        return subscription
+
+    def unsubscribe(self, subscription: ProgressSubscription):
+        subscribers = self._subscribers.get(subscription.backend.name)
+        if subscribers:
+            subscribers.discard(subscription)
+
+    async def _poll_loop(self, backend: SDBackend):
+        url = f"{backend.url}/sdapi/v1/progress?skip_current_image={'false' if self.include_preview else 'true'}"
+        consecutive_errors = 0
+        try:
+            while self._subscribers.get(backend.name):
+                try:
+                    async with self.session.get(url, timeout=aiohttp.ClientTimeout(total=5.0)) as response:
+                        self.stats['polls'] += 1
+                        if response.status == 200:
+                            snapshot = self._parse(await response.json())
+                            consecutive_errors = 0
+                            for subscription in list(self._subscribers.get(backend.name, ())):
+                                subscription.push(snapshot)
+                                self.stats['deliveries'] += 1
+                        else:
+                            consecutive_errors += 1
+                            logger.warning(f"⚠️ [IMAGE_GEN] Progress API of '{backend.name}' returned status {response.status}")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    consecutive_errors += 1
+                    self.stats['poll_errors'] += 1
+                    logger.debug(f"⚠️ [IMAGE_GEN] Progress check error on '{backend.name}': {e}")
+
+                # 応答しない間は間隔を広げる
+                await asyncio.sleep(self.poll_interval * min(1 + consecutive_errors, 5))
+        finally:
+            self._pollers.pop(backend.name, None)
+
+    @staticmethod
+    def _parse(data: dict) -> ProgressSnapshot:
+        state = data.get('state') or {}
+        return ProgressSnapshot(
+            progress=float(data.get('progress') or 0.0),
+            sampling_step=int(state.get('sampling_step') or 0),
+            sampling_steps=int(state.get('sampling_steps') or 0),
+            eta=float(data.get('eta_relative') or 0.0),
+            job_count=int(state.get('job_count') or 0),
+            current_image=data.get('current_image') or None
+        )
+
+    async def close(self):
+        self._subscribers.clear()
+        for poller in list(self._pollers.values()):
+            poller.cancel()
+        self._pollers.clear()
+
+    def get_stats_text(self) -> str:
+        return (f"polls {self.stats['polls']} (errors {self.stats['poll_errors']}) | "
+                f"deliveries {self.stats['deliveries']} | pollers {len(self._pollers)}")
+
+
+def make_preview_thumbnail(b64_image: str, max_size: int = 256) -> Optional[bytes]:
+    """ライブプレビュー画像を低解像度のJPEGに縮小する（CPU処理のためスレッド上で呼ぶこと）"""
+    if not PIL_AVAILABLE or not b64_image:
+        return None
+    if b64_image.startswith('data:'):
+        b64_image = b64_image.split(',', 1)[-1]
+    try:
+        with Image.open(io.BytesIO(base64.b64decode(b64_image))) as img:
+            img = img.convert('RGB')
+            img.thumbnail((max_size, max_size))
+            buffer = io.BytesIO()
+            img.save(buffer, format='JPEG', quality=60)
+            return buffer.getvalue()
+    except Exception as e:
+        logger.debug(f"[IMAGE_GEN] Failed to create preview thumbnail: {e}")
+        return None
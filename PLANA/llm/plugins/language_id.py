@@ -0,0 +1,359 @@
+# PLANA/llm/plugins/language_id.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from langdetect import DetectorFactory, LangDetectException, detect_langs
+    from langdetect.detector_factory import init_factory
+except ImportError:
+    DetectorFactory = None
+    LangDetectException = Exception
+    detect_langs = None
+    init_factory = None
+
+logger = logging.getLogger(__name__)
+
+LANGUAGE_NAMES = {
+    'en': 'English', 'ja': 'Japanese', 'ko': 'Korean', 'zh-cn': 'Simplified Chinese',
+    'zh-tw': 'Traditional Chinese', 'vi': 'Vietnamese', 'th': 'Thai', 'id': 'Indonesian',
+    'de': 'German', 'fr': 'French', 'es': 'Spanish', 'pt': 'Portuguese', 'it': 'Italian',
+    'ru': 'Russian', 'ar': 'Arabic', 'hi': 'Hindi', 'tr': 'Turkish', 'nl': 'Dutch', 'pl': 'Polish',
+    'el': 'Greek', 'he': 'Hebrew',
+}
+
+# 文字の種類（Unicodeのブロック）ごとの範囲
+_SCRIPT_RANGES: List[Tuple[str, int, int]] = [
+    ('kana', 0x3041, 0x30FF), ('kana', 0x31F0, 0x31FF), ('kana', 0xFF66, 0xFF9F),
+    ('han', 0x3400, 0x4DBF), ('han', 0x4E00, 0x9FFF), ('han', 0xF900, 0xFAFF),
+    ('hangul', 0x1100, 0x11FF), ('hangul', 0x3130, 0x318F), ('hangul', 0xAC00, 0xD7AF),
+    ('thai', 0x0E00, 0x0E7F), ('arabic', 0x0600, 0x06FF), ('cyrillic', 0x0400, 0x04FF),
+    ('devanagari', 0x0900, 0x097F), ('greek', 0x0370, 0x03FF), ('hebrew', 0x0590, 0x05FF),
+]
+# 文字の種類だけで言語が決まるもの
+_SCRIPT_LANGUAGES = {'hangul': 'ko', 'thai': 'th', 'arabic': 'ar', 'cyrillic': 'ru', 'devanagari': 'hi',
+                     'greek': 'el', 'hebrew': 'he'}
+# 文字の種類で判定する言語（ラテン文字だけの文にこれらの言語の判定結果を使い回さない）
+SCRIPT_LANGUAGE_CODES = frozenset({'ja', 'zh-cn', 'zh-tw', *_SCRIPT_LANGUAGES.values()})
+# 簡体字・繁体字で字形が異なる頻出字
+_SIMPLIFIED_CHARS = frozenset("们这个说来时会对发还没过经么为于与说话问间让给应该开关长见车东门书学习电视听买")
+_TRADITIONAL_CHARS = frozenset("們這個說來時會對發還沒過經麼為於與說話問間讓給應該開關長見車東門書學習電視聽買")
+
+# langdetect がない環境で使う、ラテン文字の言語の機能語
+_LATIN_STOPWORDS: Dict[str, frozenset] = {
+    'en': frozenset("the and is are you to of it that this what for with have was not can do my your how".split()),
+    'de': frozenset("der die das und ist ich nicht du sie es ein eine zu mit auf für wie was den dem".split()),
+    'fr': frozenset("le la les et est je tu vous il elle un une des pas que qui pour avec dans ce".split()),
+    'es': frozenset("el la los las y es que de en un una por para con no yo tú qué como está muy pero más hay del".split()),
+    'pt': frozenset("o a os as e é que de em um uma por para com não eu você está isso muito".split()),
+    'it': frozenset("il lo la gli le e è che di un una per con non io sono questo come ciao".split()),
+    'nl': frozenset("de het een en is ik je niet dat van op met voor zijn wat hoe".split()),
+    'pl': frozenset("i w nie jest to się na że z do jak co ja ty czy tak".split()),
+    'tr': frozenset("bir ve bu için ne ben sen değil mi çok var ama gibi da de".split()),
+    'vi': frozenset("của và là có không tôi bạn này một những được cho với người".split()),
+    'id': frozenset("yang dan di ini itu saya kamu tidak ada dengan untuk apa bisa aku".split()),
+}
+_WORD_PATTERN = re.compile(r"[^\W\d_]+")
+
+
+def script_counts(text: str) -> Counter:
+    """文字の種類ごとの文字数（ラテン文字は 'latin'、その他の記号・数字は数えない）"""
+    counts: Counter = Counter()
+    for char in text:
+        code = ord(char)
+        if code < 0x0250:
+            if char.isalpha():
+                counts['latin'] += 1
+            continue
+        for script, start, end in _SCRIPT_RANGES:
+            if start <= code <= end:
+                counts[script] += 1
+                break
+        else:
+            if 0x1E00 <= code <= 0x1EFF:  # ベトナム語などの拡張ラテン文字
+                counts['latin'] += 1
+    return counts
+
+
+def classify_script(text: str, min_ratio: float = 0.3, counts: Optional[Counter] = None) -> Optional[str]:
+    """
+    文字の種類から明らかに判定できる言語を返す（ラテン文字の文章など判定できない場合は None）
+
+    かなを含めば日本語、ハングルなら韓国語のように判定する。かなを含まない漢字だけの文は中国語とし、
+    簡体字・繁体字の頻出字の数で zh-cn / zh-tw を区別する（2文字以下の漢字だけの文は判定しない）。
+    """
+    counts = script_counts(text) if counts is None else counts
+    letters = sum(counts.values())
+    if not letters:
+        return None
+    if counts['kana'] and (counts['kana'] + counts['han']) / letters >= min_ratio:
+        return 'ja'
+    script, count = max(((s, c) for s, c in counts.items() if s != 'latin'), key=lambda item: item[1],
+                        default=(None, 0))
+    if script is None or count / letters < min_ratio:
+        return None
+    if script == 'han':
+        if count <= 2:
+            return None
+        simplified = sum(1 for char in text if char in _SIMPLIFIED_CHARS)
+        traditional = sum(1 for char in text if char in _TRADITIONAL_CHARS)
+        return 'zh-tw' if traditional > simplified else 'zh-cn'
+    return _SCRIPT_LANGUAGES.get(script)
+
+
+def classify_latin_stopwords(text: str) -> Tuple[Optional[str], float]:
+    """機能語の出現数でラテン文字の言語を判定する（langdetect がない環境用）"""
+    words = [unicodedata.normalize('NFC', word) for word in _WORD_PATTERN.findall(text.lower())]
+    if not words:
+        return None, 0.0
+    scores = {lang: sum(1 for word in words if word in stopwords) for lang, stopwords in _LATIN_STOPWORDS.items()}
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    (best, best_score), (_, second_score) = ranked[0], ranked[1]
+    # 機能語が見つからない場合と、複数の言語で同点の場合は判定しない
+    if not best_score or best_score == second_score:
+        return None, 0.0
+    return best, best_score / sum(scores.values())
+
+
+@dataclass
+class LanguageGuess:
+    code: str
+    confidence: float
+    method: str  # 'script' / 'ngram' / 'stopwords' / 'memo'
+
+
+@dataclass
+class _UserLanguage:
+    code: str
+    streak: int
+    updated_at: float
+    reused: int = 0
+
+
+# 判定精度の確認用のサンプル（言語コード, 文）
+SAMPLE_SET: List[Tuple[str, str]] = [
+    ('ja', "今日はいい天気ですね。散歩に行きませんか？"),
+    ('ja', "このコマンドの使い方を教えてください"),
+    ('ja', "ありがとう！"),
+    ('ja', "Discordのボットを作っています"),
+    ('ko', "오늘 날씨가 정말 좋네요. 같이 산책할래요?"),
+    ('ko', "이 명령어는 어떻게 사용하나요?"),
+    ('zh-cn', "今天天气很好，我们一起去散步吧。"),
+    ('zh-cn', "这个命令应该怎么用？"),
+    ('zh-tw', "今天天氣很好，我們一起去散步吧。"),
+    ('zh-tw', "這個指令應該怎麼用？"),
+    ('th', "วันนี้อากาศดีมาก ไปเดินเล่นกันไหม"),
+    ('ru', "Сегодня хорошая погода, пойдём гулять?"),
+    ('ar', "الطقس جميل اليوم، هل تريد أن نتمشى؟"),
+    ('hi', "आज मौसम बहुत अच्छा है, क्या हम टहलने चलें?"),
+    ('en', "The weather is really nice today, do you want to go for a walk?"),
+    ('en', "How do I use this command to play music?"),
+    ('de', "Das Wetter ist heute wirklich schön, wollen wir spazieren gehen?"),
+    ('fr', "Il fait vraiment beau aujourd'hui, tu veux aller te promener avec moi ?"),
+    ('es', "Hace muy buen tiempo hoy, ¿quieres ir a dar un paseo conmigo?"),
+    ('pt', "O tempo está muito bom hoje, você quer dar uma volta comigo?"),
+    ('it', "Oggi il tempo è davvero bello, vuoi fare una passeggiata con me?"),
+    ('nl', "Het weer is vandaag echt mooi, wil je een wandeling maken?"),
+    ('pl', "Pogoda jest dziś naprawdę ładna, czy chcesz iść na spacer?"),
+    ('tr', "Bugün hava gerçekten çok güzel, yürüyüşe çıkmak ister misin?"),
+    ('vi', "Hôm nay thời tiết thật đẹp, bạn có muốn đi dạo không?"),
+    ('id', "Cuaca hari ini sangat bagus, apakah kamu mau jalan-jalan dengan saya?"),
+]
+
+
+class LanguageIdentifier:
+    """
+    ユーザーのメッセージの言語を判定する
+
+    1. 文字の種類による判定（日本語・韓国語・中国語・タイ語など。イベントループ上で実行しても十分速い）
+    2. ラテン文字などの文章は n-gram モデル（langdetect、乱数シードを固定して結果を決定的にする）を
+       スレッドで実行する。langdetect がない環境では機能語による判定を使う
+    3. ユーザーごとに直近の判定結果を覚え、同じ言語が stable_after 回続いたら、以降 recheck_every 回は
+       n-gram モデルでの判定を省略する（文字の種類で判定できる場合は常にそちらを優先し、
+       文字の種類で判定した言語をラテン文字だけの文に使い回すことはしない。
+       漢字だけの文は、日本語を使っているユーザーなら日本語とする）
+
+    config (llm.language_detection):
+        enabled: 有効にするか
+        min_ngram_chars: n-gram モデルで判定する最小の文字数（短い文は前回の結果を使う）
+        min_confidence: n-gram モデルの結果を採用する確率の下限
+        stable_after / recheck_every: 判定結果を使い回す条件
+        memo_size: 判定結果を覚えるユーザー数の上限
+        memo_ttl_seconds: 判定結果を覚えておく秒数
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        self.enabled = config.get('enabled', True)
+        self.min_ngram_chars = int(config.get('min_ngram_chars', 15))
+        self.min_confidence = float(config.get('min_confidence', 0.5))
+        self.stable_after = int(config.get('stable_after', 2))
+        self.recheck_every = int(config.get('recheck_every', 5))
+        self.memo_size = int(config.get('memo_size', 1000))
+        self.memo_ttl_seconds = float(config.get('memo_ttl_seconds', 1800))
+        self._memo: OrderedDict[int, _UserLanguage] = OrderedDict()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self.stats: Dict[str, List[float]] = {}
+
+    @property
+    def backend(self) -> str:
+        return 'langdetect' if detect_langs else 'stopwords'
+
+    def _ensure_loaded(self):
+        # langdetect のプロファイルの読み込みはスレッドセーフではないため、一度だけロックして行う
+        if self._loaded or not detect_langs:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                DetectorFactory.seed = 0
+                init_factory()
+                self._loaded = True
+
+    def classify(self, text: str) -> Optional[LanguageGuess]:
+        """メッセージ1件の言語を判定する（n-gram モデルを使う場合はブロッキング）"""
+        code = classify_script(text)
+        if code:
+            return LanguageGuess(code, 1.0, 'script')
+        if len(text.strip()) < self.min_ngram_chars:
+            return None
+        if detect_langs:
+            self._ensure_loaded()
+            try:
+                best = detect_langs(text)[0]
+            except LangDetectException:
+                return None
+            if best.prob < self.min_confidence:
+                return None
+            return LanguageGuess(best.lang, best.prob, 'ngram')
+        code, confidence = classify_latin_stopwords(text)
+        if code is None:
+            return None
+        return LanguageGuess(code, confidence, 'stopwords')
+
+    def _remember(self, user_id: int, code: str) -> _UserLanguage:
+        entry = self._memo.get(user_id)
+        if entry and entry.code == code:
+            entry.streak += 1
+        else:
+            entry = _UserLanguage(code, 1, 0.0)
+        entry.updated_at = time.monotonic()
+        entry.reused = 0
+        self._memo[user_id] = entry
+        self._memo.move_to_end(user_id)
+        while len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+        return entry
+
+    def _memo_for(self, user_id: Optional[int]) -> Optional[_UserLanguage]:
+        entry = self._memo.get(user_id) if user_id is not None else None
+        if entry and time.monotonic() - entry.updated_at > self.memo_ttl_seconds:
+            del self._memo[user_id]
+            return None
+        return entry
+
+    def _record(self, method: str, started: float):
+        self.stats.setdefault(method, []).append((time.perf_counter() - started) * 1000)
+        if len(self.stats[method]) > 1000:
+            del self.stats[method][:500]
+
+    async def detect(self, text: str, user_id: Optional[int] = None) -> Optional[LanguageGuess]:
+        """メッセージの言語を判定する（必要な場合だけ n-gram モデルをスレッドで実行する）"""
+        if not self.enabled or not text.strip():
+            return None
+        started = time.perf_counter()
+        memo = self._memo_for(user_id)
+
+        counts = script_counts(text)
+        code = classify_script(text, counts=counts)
+        if code in ('zh-cn', 'zh-tw') and not counts['kana'] and memo and memo.code == 'ja':
+            # 漢字だけの文（地名など）は日本語を使っているユーザーなら日本語とみなす
+            self._remember(user_id, 'ja')
+            self._record('memo', started)
+            return LanguageGuess('ja', 1.0, 'memo')
+        if code:
+            if user_id is not None:
+                self._remember(user_id, code)
+            self._record('script', started)
+            return LanguageGuess(code, 1.0, 'script')
+
+        if memo and memo.code in SCRIPT_LANGUAGE_CODES and set(counts) == {'latin'}:
+            # 文字の種類が変わった（日本語 → 英語など）場合は前回の結果を使わない
+            memo = None
+        short = len(text.strip()) < self.min_ngram_chars
+        if memo and (short or (memo.streak >= self.stable_after and memo.reused < self.recheck_every)):
+            memo.reused += 1
+            self._record('memo', started)
+            return LanguageGuess(memo.code, 1.0, 'memo')
+        if short:
+            return None
+
+        guess = await asyncio.get_running_loop().run_in_executor(None, self.classify, text)
+        if guess is None:
+            # 判定できなかった場合は前回の結果を使う
+            return LanguageGuess(memo.code, 1.0, 'memo') if memo else None
+        if user_id is not None:
+            self._remember(user_id, guess.code)
+        self._record(guess.method, started)
+        return guess
+
+    def evaluate(self, samples: Optional[List[Tuple[str, str]]] = None) -> Dict[str, Any]:
+        """サンプルの文で判定の精度と時間を計測する（n-gram モデルの読み込みも兼ねる）"""
+        samples = samples or SAMPLE_SET
+        load_started = time.perf_counter()
+        self._ensure_loaded()
+        load_ms = (time.perf_counter() - load_started) * 1000
+        results = []
+        for expected, text in samples:
+            started = time.perf_counter()
+            guess = self.classify(text)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            results.append((expected, guess, elapsed_ms))
+
+        by_method: Dict[str, List[Tuple[bool, float]]] = {}
+        misses = []
+        for expected, guess, elapsed_ms in results:
+            method = guess.method if guess else 'none'
+            correct = guess is not None and guess.code == expected
+            by_method.setdefault(method, []).append((correct, elapsed_ms))
+            if not correct:
+                misses.append(f"{expected}->{guess.code if guess else '?'}")
+        return {
+            'backend': self.backend,
+            'samples': len(results),
+            'accuracy': sum(1 for e, g, _ in results if g and g.code == e) / max(len(results), 1),
+            'load_ms': load_ms,
+            'by_method': {
+                method: {'count': len(items), 'accuracy': sum(c for c, _ in items) / len(items),
+                         'mean_ms': sum(t for _, t in items) / len(items)}
+                for method, items in by_method.items()
+            },
+            'misses': misses,
+        }
+
+    @staticmethod
+    def format_evaluation(report: Dict[str, Any]) -> str:
+        methods = " | ".join(f"{method}: {stats['count']} samples, {stats['accuracy']:.0%}, "
+                             f"{stats['mean_ms']:.3f}ms avg"
+                             for method, stats in report['by_method'].items())
+        text = (f"{report['samples']} samples, accuracy {report['accuracy']:.0%} (backend {report['backend']}, "
+                f"load {report['load_ms']:.0f}ms) | {methods}")
+        if report['misses']:
+            text += f" | misses: {', '.join(report['misses'])}"
+        return text
+
+    def get_stats_text(self) -> str:
+        parts = []
+        for method, samples in self.stats.items():
+            ordered = sorted(samples)
+            parts.append(f"{method}: {len(samples)} detections, p50 {ordered[len(ordered) // 2]:.3f}ms "
+                         f"p95 {ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]:.3f}ms")
+        return " | ".join(parts) or "no detections yet"
@@ -0,0 +1,153 @@
+# PLANA/llm/plugins/media_cache.py
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Discord CDN の添付ファイルURL（署名パラメータは期限切れで変わるため、添付ファイルIDで識別する）
+_DISCORD_ATTACHMENT_PATTERN = re.compile(
+    r'^https?://(?:cdn|media)\.discordapp\.(?:com|net)/(?:ephemeral-)?attachments/\d+/(\d+)/([^?#]+)',
+    re.IGNORECASE
+)
+
+
+@dataclass
+class CachedImage:
+    """LLMに送る形式に変換済みの画像（data: URL）"""
+    content_hash: str
+    mime_type: str
+    data_url: str
+    source_bytes: int
+
+    @property
+    def size(self) -> int:
+        return len(self.data_url)
+
+    def to_content_part(self) -> Dict[str, object]:
+        return {"type": "image_url", "image_url": {"url": self.data_url, "detail": "auto"}}
+
+
+def cache_key_for_url(url: str) -> str:
+    """画像URLのキャッシュキー。Discordの添付ファイルはIDとファイル名、その他はURLそのもの"""
+    match = _DISCORD_ATTACHMENT_PATTERN.match(url)
+    if match:
+        return f"attachment:{match.group(1)}/{match.group(2)}"
+    return f"url:{url}"
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class MultimodalPayloadCache:
+    """
+    変換済み画像のLRUキャッシュ（上限はdata: URLの合計バイト数）
+
+    画像本体は内容のハッシュで1つだけ保持し、URL・添付ファイルIDはそのハッシュへの別名として記録する。
+    同じ画像が別のURLで貼られてもメモリは増えず、会話履歴の組み立て時にはダウンロードせずに再利用できる。
+    同じキーの読み込みが同時に走った場合は1回にまとめる。
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max(0, int(max_bytes))
+        self._entries: OrderedDict[str, CachedImage] = OrderedDict()
+        self._aliases: Dict[str, str] = {}
+        self._keys_by_hash: Dict[str, Set[str]] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.total_bytes = 0
+        self.stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0}
+
+    def get(self, key: str) -> Optional[CachedImage]:
+        content_id = self._aliases.get(key)
+        if content_id is None:
+            return None
+        entry = self._entries.get(content_id)
+        if entry is None:
+            self._aliases.pop(key, None)
+            return None
+        self._entries.move_to_end(content_id)
+        return entry
+
+    def put(self, key: str, entry: CachedImage):
+        if entry.size > self.max_bytes:
+            return
+        existing = self._entries.get(entry.content_hash)
+        if existing is None:
+            self._entries[entry.content_hash] = entry
+            self.total_bytes += entry.size
+        else:
+            self._entries.move_to_end(entry.content_hash)
+        self._aliases[key] = entry.content_hash
+        self._keys_by_hash.setdefault(entry.content_hash, set()).add(key)
+        self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._entries:
+            content_id, entry = self._entries.popitem(last=False)
+            self.total_bytes -= entry.size
+            for key in self._keys_by_hash.pop(content_id, ()):
+                self._aliases.pop(key, None)
+            self.stats['evictions'] += 1
+
+    async def get_or_load(self, url: str, loader: Callable[[], Awaitable[Optional[CachedImage]]],
+                          variant: str = "") -> Optional[CachedImage]:
+        """
+        キャッシュにあればそれを返し、なければ loader で読み込んで保存する
+
+        読み込みに失敗した場合（None）は保存しない。
+        variant には変換条件（縮小サイズなど）を渡す。条件が違えば別のキーになるが、
+        変換結果が同じ内容ならハッシュで1つにまとめられる。
+        """
+        key = cache_key_for_url(url)
+        if variant:
+            key = f"{key}@{variant}"
+        cached = self.get(key)
+        if cached is not None:
+            self.stats['hits'] += 1
+            return cached
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(inflight)
+
+        self.stats['misses'] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            entry = await loader()
+            if entry is not None:
+                self.put(key, entry)
+            future.set_result(entry)
+            return entry
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 待っている呼び出しがいない場合に「例外が取得されなかった」警告を出さない
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._aliases.clear()
+        self._keys_by_hash.clear()
+        self.total_bytes = 0
+
+    def get_stats_text(self) -> str:
+        lookups = self.stats['hits'] + self.stats['misses']
+        hit_rate = (self.stats['hits'] / lookups * 100) if lookups else 0.0
+        return (f"{len(self._entries)} images / {self.total_bytes / 1024 / 1024:.1f}MB of "
+                f"{self.max_bytes / 1024 / 1024:.0f}MB | hit rate {hit_rate:.0f}% "
+                f"({self.stats['hits']}/{lookups}) | coalesced {self.stats['coalesced']} | "
+                f"evictions {self.stats['evictions']}")
@@ -1,33 +1,61 @@
 # PLANA/llm/plugins/memory_manager.py
 from __future__ import annotations
 
-import json
+import asyncio
 import logging
 import os
-from typing import Dict, Any, TYPE_CHECKING
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from PLANA.llm.plugins.memory_store import (MemoryRecord, MemoryStore, SCOPES, SCOPE_CHANNEL, SCOPE_GLOBAL,
+                                            SCOPE_GUILD, ScopeRef)
 
 if TYPE_CHECKING:
     from discord.ext import commands
 
-try:
-    import aiofiles
-except ImportError:
-    aiofiles = None
-
 logger = logging.getLogger(__name__)
 
+SCOPE_HEADERS = {
+    SCOPE_GLOBAL: "# グローバル共有メモリ（全サーバー共通）",
+    SCOPE_GUILD: "# サーバーのメモリ（このサーバー専用）",
+    SCOPE_CHANNEL: "# チャンネルのメモリ（このチャンネル専用）",
+}
+
 
 class MemoryManager:
     """
-    サーバーをまたいで共有されるグローバルメモリを管理するプラグイン。
-    キーと値のペアで情報を保存し、Botが参加している全ての場所から参照できる。
+    LLMが参照する共有メモリを管理するプラグイン。
+    キーと値のペアで情報を保存し、スコープ（global: 全サーバー共通 / guild: サーバー / channel: チャンネル）
+    ごとに参照できる場所が決まる。
+
+    メモリは SQLite（FTS5 の全文検索インデックス付き）に保存し、システムプロンプトには
+    メッセージに関連するものだけを上限トークン数まで含める（件数が少ないうちは全件）。
+
+    config (llm.memory):
+        db_path: SQLiteファイルのパス
+        legacy_json_path: 旧形式のJSONファイル（初回起動時に global スコープへ取り込む）
+        top_k: システムプロンプトに含める最大件数
+        max_tokens: システムプロンプトに含めるメモリのトークン数の上限
+        inline_all_below: 参照できるメモリがこの件数以下なら、関連度に関係なく全件含める
     """
 
-    def __init__(self, bot: commands.Bot):
+    def __init__(self, bot: commands.Bot, config: Optional[Dict[str, Any]] = None):
         self.bot = bot
-        self.memories_path = "data/global_memories.json"
-        self.memories: Dict[str, str] = self._load_json_data(self.memories_path)
-        logger.info(f"MemoryManager initialized: Loaded {len(self.memories)} global memories.")
+        config = config or {}
+        self.db_path = config.get('db_path', "data/memories.db")
+        self.memories_path = config.get('legacy_json_path', "data/global_memories.json")
+        self.top_k = int(config.get('top_k', 8))
+        self.max_tokens = int(config.get('max_tokens', 600))
+        self.inline_all_below = int(config.get('inline_all_below', 12))
+
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        self.store = MemoryStore(self.db_path)
+        if os.path.exists(self.memories_path):
+            imported = self.store.import_json(self.memories_path, SCOPE_GLOBAL, 0)
+            if imported is not None:
+                logger.info(f"MemoryManager: Imported {imported} global memories from '{self.memories_path}'.")
+        logger.info(f"MemoryManager initialized: {self.store.count()} memories in '{self.db_path}' "
+                    f"(full-text search: {'fts5' if self.store.fts_enabled else 'like'}).")
 
     @property
     def name(self) -> str:
@@ -41,7 +69,7 @@ class MemoryManager:
             "type": "function",
             "function": {
                 "name": self.name,
-                "description": "グローバル共有メモリに情報をキーと値のペアで保存・更新します。Bot全体で共有すべき普遍的な情報（例: 開発者からのお知らせ）を記憶するために使用します。",
+                "description": "共有メモリに情報をキーと値のペアで保存・更新します。Bot全体やサーバー・チャンネルで共有すべき情報（例: 開発者からのお知らせ、サーバーのルール）を記憶するために使用します。",
                 "parameters": {
                     "type": "object",
                     "properties": {
@@ -52,6 +80,11 @@ class MemoryManager:
                         "value": {
                             "type": "string",
                             "description": "記憶する情報の内容。例: '次回のメンテナンスは来週月曜日です。'"
+                        },
+                        "scope": {
+                            "type": "string",
+                            "enum": list(SCOPES),
+                            "description": "共有する範囲。global: 全サーバー共通（既定）、guild: このサーバーのみ、channel: このチャンネルのみ"
                         }
                     },
                     "required": ["key", "value"]
@@ -59,70 +92,119 @@ class MemoryManager:
             }
         }
 
+    @staticmethod
+    def visible_scopes(guild_id: int = 0, channel_id: int = 0) -> List[ScopeRef]:
+        """チャンネルから参照できるスコープ（global → guild → channel の順）"""
+        scopes: List[ScopeRef] = [(SCOPE_GLOBAL, 0)]
+        if guild_id:
+            scopes.append((SCOPE_GUILD, guild_id))
+        if channel_id:
+            scopes.append((SCOPE_CHANNEL, channel_id))
+        return scopes
+
+    @staticmethod
+    def scope_id_for(scope: str, guild_id: int = 0, channel_id: int = 0) -> int:
+        """
+        スコープに対応するID（global は 0）
+
+        Raises:
+            ValueError: 不明なスコープ、またはDMでサーバーのスコープを指定した場合
+        """
+        if scope == SCOPE_GLOBAL:
+            return 0
+        scope_id = {SCOPE_GUILD: guild_id, SCOPE_CHANNEL: channel_id}.get(scope)
+        if scope_id is None:
+            raise ValueError(f"unknown memory scope '{scope}'")
+        if not scope_id:
+            raise ValueError(f"memory scope '{scope}' is not available here")
+        return scope_id
+
     # --- データ操作メソッド (コマンドから使用) ---
-    async def save_memory(self, key: str, value: str) -> None:
-        self.memories[key] = value
-        await self._save_memories()
-        logger.info(f"[save_memory] Saved global memory: key='{key}'")
-
-    def list_memories(self) -> Dict[str, str]:
-        return self.memories
-
-    async def delete_memory(self, key: str) -> bool:
-        if key in self.memories:
-            del self.memories[key]
-            await self._save_memories()
-            logger.info(f"[delete_memory] Deleted global memory: key='{key}'")
-            return True
-        return False
+    async def save_memory(self, key: str, value: str, scope: str = SCOPE_GLOBAL, scope_id: int = 0) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self.store.upsert, scope, scope_id, key, value)
+        logger.info(f"[save_memory] Saved {scope} memory: key='{key}' (scope_id={scope_id})")
+
+    async def list_memories(self, scope: str = SCOPE_GLOBAL, scope_id: int = 0) -> Dict[str, str]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.store.list, scope, scope_id)
+
+    async def delete_memory(self, key: str, scope: str = SCOPE_GLOBAL, scope_id: int = 0) -> bool:
+        deleted = await asyncio.get_running_loop().run_in_executor(None, self.store.delete, scope, scope_id, key)
+        if deleted:
+            logger.info(f"[delete_memory] Deleted {scope} memory: key='{key}' (scope_id={scope_id})")
+        return deleted
 
     # --- ツール実行メソッド (LLMCogから使用) ---
-    async def run_tool(self, arguments: Dict[str, Any]) -> str:
+    async def run_tool(self, arguments: Dict[str, Any], guild_id: int = 0, channel_id: int = 0) -> str:
         key = arguments.get('key')
         value = arguments.get('value')
+        scope = arguments.get('scope') or SCOPE_GLOBAL
         if not key or not value:
             logger.warning(f"[run_tool] memory tool called with missing key/value")
             return "Error: keyとvalueの両方が必要です。"
 
         try:
-            await self.save_memory(key, value)
-            return f"グローバル共有メモリにキー'{key}'で情報を記憶しました。"
+            scope_id = self.scope_id_for(scope, guild_id, channel_id)
+        except ValueError as e:
+            return f"Error: {e}"
+        try:
+            await self.save_memory(key, value, scope, scope_id)
+            return f"{SCOPE_HEADERS[scope].lstrip('# ')}にキー'{key}'で情報を記憶しました。"
         except Exception as e:
-            logger.error(f"[run_tool] Failed to save global memory: {e}", exc_info=True)
-            return f"Error: グローバル共有メモリへの保存に失敗しました - {e}"
+            logger.error(f"[run_tool] Failed to save memory: {e}", exc_info=True)
+            return f"Error: 共有メモリへの保存に失敗しました - {e}"
 
     # --- プロンプト生成メソッド (LLMCogから使用) ---
-    def get_formatted_memories(self) -> str | None:
-        """システムプロンプトに注入するための整形済みメモリ文字列を返す"""
-        if not self.memories:
+    async def get_formatted_memories(self, query: str = "", guild_id: int = 0, channel_id: int = 0,
+                                     count_tokens: Optional[Callable[[str], int]] = None) -> str | None:
+        """
+        システムプロンプトに注入するための整形済みメモリ文字列を返す
+
+        参照できるメモリが inline_all_below 件以下なら全件、それより多ければ query に関連する
+        上位 top_k 件を max_tokens 以内で返す。SQLite の読み込みはスレッドで行う
+        （保存中の書き込みとロックを待つ間もイベントループを止めない）。
+        """
+        count_tokens = count_tokens or (lambda text: len(text) // 3)
+        scopes = self.visible_scopes(guild_id, channel_id)
+        started = time.perf_counter()
+        total, records = await asyncio.get_running_loop().run_in_executor(None, self._load_records, query, scopes)
+        if not total:
+            return None
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if not records:
+            logger.info(f"[get_formatted_memories] No relevant memories out of {total} ({elapsed_ms:.2f}ms).")
             return None
 
-        header = "# グローバル共有メモリ（全サーバー共通）"
-        items = [f"- {key}: {value}" for key, value in self.memories.items()]
-
-        logger.info(f"[get_formatted_memories] Loaded {len(items)} global memories.")
-
-        return "\n".join([header] + items)
-
-    # --- ファイルI/O (プライベートメソッド) ---
-    def _load_json_data(self, path: str) -> Dict[str, Any]:
-        try:
-            if os.path.exists(path):
-                with open(path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-        except (IOError, json.JSONDecodeError) as e:
-            logger.error(f"Failed to load JSON file '{path}': {e}")
-        return {}
-
-    async def _save_memories(self) -> None:
-        try:
-            os.makedirs(os.path.dirname(self.memories_path), exist_ok=True)
-            if aiofiles:
-                async with aiofiles.open(self.memories_path, 'w', encoding='utf-8') as f:
-                    await f.write(json.dumps(self.memories, indent=4, ensure_ascii=False))
-            else:
-                with open(self.memories_path, 'w', encoding='utf-8') as f:
-                    json.dump(self.memories, f, indent=4, ensure_ascii=False)
-        except IOError as e:
-            logger.error(f"Failed to save memories file '{self.memories_path}': {e}")
-            raise
\ No newline at end of file
+        text = self._format(records, count_tokens)
+        if not text:
+            return None
+        included = text.count("\n- ")
+        logger.info(f"[get_formatted_memories] Loaded {included}/{total} memories "
+                    f"(~{count_tokens(text)} tokens) in {elapsed_ms:.2f}ms.")
+        return text
+
+    def _load_records(self, query: str, scopes: List[ScopeRef]) -> Tuple[int, List[MemoryRecord]]:
+        """(参照できるメモリの件数, プロンプトに含める候補)"""
+        total = self.store.count(scopes)
+        if not total:
+            return 0, []
+        if total <= self.inline_all_below:
+            return total, self.store.fetch(scopes)
+        return total, self.store.search(query, scopes, limit=self.top_k)
+
+    def _format(self, records: List[MemoryRecord], count_tokens: Callable[[str], int]) -> str:
+        """
+        records の順（関連度の高い順）に max_tokens まで選び、スコープごとにまとめて整形する
+        """
+        selected: Dict[str, List[str]] = {}
+        used = 0
+        for record in records:
+            item = f"- {record.key}: {record.value}"
+            cost = count_tokens(item) + (0 if record.scope in selected else count_tokens(SCOPE_HEADERS[record.scope]))
+            if used + cost > self.max_tokens:
+                continue
+            selected.setdefault(record.scope, []).append(item)
+            used += cost
+        return "\n\n".join("\n".join([SCOPE_HEADERS[scope]] + selected[scope]) for scope in SCOPES if scope in selected)
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,250 @@
+# PLANA/llm/plugins/memory_store.py
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCOPE_GLOBAL = "global"
+SCOPE_GUILD = "guild"
+SCOPE_CHANNEL = "channel"
+SCOPES = (SCOPE_GLOBAL, SCOPE_GUILD, SCOPE_CHANNEL)
+
+# (スコープ, スコープのID)。global の ID は常に 0
+ScopeRef = Tuple[str, int]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS memories (
+    id INTEGER PRIMARY KEY,
+    scope TEXT NOT NULL,
+    scope_id INTEGER NOT NULL DEFAULT 0,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_ts REAL NOT NULL,
+    UNIQUE (scope, scope_id, key)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# trigram トークナイザは分かち書きなしで日本語の部分一致検索ができる（SQLite 3.34 以降）
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts USING fts5(
+    key, value, content='memories', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS memories_ai AFTER INSERT ON memories BEGIN
+    INSERT INTO memories_fts (rowid, key, value) VALUES (new.id, new.key, new.value);
+END;
+CREATE TRIGGER IF NOT EXISTS memories_ad AFTER DELETE ON memories BEGIN
+    INSERT INTO memories_fts (memories_fts, rowid, key, value) VALUES ('delete', old.id, old.key, old.value);
+END;
+CREATE TRIGGER IF NOT EXISTS memories_au AFTER UPDATE ON memories BEGIN
+    INSERT INTO memories_fts (memories_fts, rowid, key, value) VALUES ('delete', old.id, old.key, old.value);
+    INSERT INTO memories_fts (rowid, key, value) VALUES (new.id, new.key, new.value);
+END;
+"""
+
+_WORD_PATTERN = re.compile(r'[a-z0-9]{3,}')
+_CJK_RUN_PATTERN = re.compile(r'[\u3041-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff66-\uff9f]+')
+# 1回の検索に使う語の上限（長いメッセージで MATCH 式が大きくなりすぎないようにする）
+MAX_QUERY_TERMS = 48
+
+
+@dataclass
+class MemoryRecord:
+    scope: str
+    scope_id: int
+    key: str
+    value: str
+    updated_ts: float
+    score: float = 0.0
+
+
+def build_match_query(text: str) -> Optional[str]:
+    """
+    メッセージから FTS5 の MATCH 式（語の OR）を作る
+
+    trigram トークナイザは3文字未満の語を検索できないため、英数字は3文字以上の単語、
+    日本語・韓国語は3文字ずつずらした部分文字列にする。検索に使える語がなければ None。
+    """
+    text = text.lower()
+    terms = list(dict.fromkeys(_WORD_PATTERN.findall(text)))
+    for run in _CJK_RUN_PATTERN.findall(text):
+        terms.extend(run[i:i + 3] for i in range(len(run) - 2))
+    terms = list(dict.fromkeys(terms))[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def build_bigram_terms(text: str) -> List[str]:
+    """
+    日本語・韓国語の2文字ずつずらした部分文字列を返す（trigram で拾えない2文字の語の補完用）
+    """
+    terms = []
+    for run in _CJK_RUN_PATTERN.findall(text.lower()):
+        terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return list(dict.fromkeys(terms))[:MAX_QUERY_TERMS]
+
+
+class MemoryStore:
+    """
+    LLMの共有メモリ（キーと値）を保存するSQLiteストア
+
+    スコープ（global / guild / channel）ごとにキーが一意になる。保存・削除は1行ずつ書き込み、
+    検索は FTS5 の全文検索インデックスを使う（FTS5 が使えない SQLite では LIKE で検索する）。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        try:
+            self._conn.executescript(FTS_SCHEMA)
+            self.fts_enabled = True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"FTS5 (trigram) is not available in this SQLite build, falling back to LIKE search: {e}")
+            self.fts_enabled = False
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def upsert(self, scope: str, scope_id: int, key: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO memories (scope, scope_id, key, value, updated_ts) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (scope, scope_id, key) DO UPDATE SET value = excluded.value, "
+                "updated_ts = excluded.updated_ts",
+                (scope, scope_id, key, value, time.time()))
+            self._conn.commit()
+
+    def delete(self, scope: str, scope_id: int, key: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM memories WHERE scope = ? AND scope_id = ? AND key = ?",
+                                        (scope, scope_id, key))
+            self._conn.commit()
+            return cursor.rowcount > 0
+
+    def list(self, scope: str, scope_id: int) -> Dict[str, str]:
+        """スコープ内のメモリを保存順に返す"""
+        with self._lock:
+            rows = self._conn.execute("SELECT key, value FROM memories WHERE scope = ? AND scope_id = ? ORDER BY id",
+                                      (scope, scope_id)).fetchall()
+        return dict(rows)
+
+    def count(self, scopes: Optional[Sequence[ScopeRef]] = None) -> int:
+        where, params = self._scope_clause(scopes)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM memories m WHERE {where}", params).fetchone()[0]
+
+    def fetch(self, scopes: Sequence[ScopeRef], limit: int = 1000) -> List[MemoryRecord]:
+        """指定したスコープのメモリを保存順に返す"""
+        where, params = self._scope_clause(scopes)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT scope, scope_id, key, value, updated_ts FROM memories m WHERE {where} ORDER BY id LIMIT ?",
+                (*params, limit)).fetchall()
+        return [MemoryRecord(*row) for row in rows]
+
+    def search(self, text: str, scopes: Sequence[ScopeRef], limit: int = 8) -> List[MemoryRecord]:
+        """
+        指定したスコープのメモリから、text に関連するものを関連度の高い順に返す
+
+        全文検索（3文字以上の語）で limit 件に満たない場合は、日本語・韓国語の2文字の部分文字列で
+        部分一致検索した結果を後ろに補う（「地震」「天気」などの2文字の語は trigram では検索できない）。
+        """
+        where, params = self._scope_clause(scopes)
+        rows = []
+        match = build_match_query(text)
+        if match is not None:
+            if self.fts_enabled:
+                # bm25() は関連度が高いほど小さい（負の）値になる
+                sql = (f"SELECT m.id, m.scope, m.scope_id, m.key, m.value, m.updated_ts, "
+                       f"-bm25(memories_fts, 2.0, 1.0) "
+                       f"FROM memories_fts JOIN memories m ON m.id = memories_fts.rowid "
+                       f"WHERE memories_fts MATCH ? AND {where} ORDER BY bm25(memories_fts, 2.0, 1.0) LIMIT ?")
+                with self._lock:
+                    rows = self._conn.execute(sql, (match, *params, limit)).fetchall()
+            else:
+                terms = [term.strip('"').replace('""', '"') for term in match.split(" OR ")]
+                rows = self._search_substrings(terms, where, params, limit)
+
+        if len(rows) < limit:
+            bigrams = build_bigram_terms(text)
+            if bigrams:
+                rows += self._search_substrings(bigrams, where, params, limit - len(rows),
+                                                exclude_ids=[row[0] for row in rows])
+        return [MemoryRecord(*row[1:]) for row in rows]
+
+    def _search_substrings(self, terms: Sequence[str], where: str, params: tuple, limit: int,
+                           exclude_ids: Sequence[int] = ()) -> list:
+        """含まれる語の数が多い順に部分一致で検索する（instr を使うため語の長さに制限がない）"""
+        hits = " + ".join("(instr(lower(m.key || ' ' || m.value), ?) > 0)" for _ in terms)
+        exclude = f" AND m.id NOT IN ({', '.join('?' for _ in exclude_ids)})" if exclude_ids else ""
+        sql = (f"SELECT m.id, m.scope, m.scope_id, m.key, m.value, m.updated_ts, ({hits}) AS hits "
+               f"FROM memories m WHERE {where}{exclude} AND hits > 0 ORDER BY hits DESC, m.id DESC LIMIT ?")
+        with self._lock:
+            return self._conn.execute(sql, (*terms, *params, *exclude_ids, limit)).fetchall()
+
+    def import_entries(self, entries: Iterable[Tuple[str, int, str, str]], overwrite: bool = False) -> int:
+        """(スコープ, スコープのID, キー, 値) をまとめて保存する。overwrite=False なら既存のキーは残す"""
+        now = time.time()
+        rows = [(scope, scope_id, key, str(value), now) for scope, scope_id, key, value in entries]
+        if overwrite:
+            # INSERT OR REPLACE は削除トリガーを起動しないため、FTS に古い行が残る。upsert と同じく UPDATE にする
+            sql = ("INSERT INTO memories (scope, scope_id, key, value, updated_ts) VALUES (?, ?, ?, ?, ?) "
+                   "ON CONFLICT (scope, scope_id, key) DO UPDATE SET value = excluded.value, "
+                   "updated_ts = excluded.updated_ts")
+        else:
+            sql = "INSERT OR IGNORE INTO memories (scope, scope_id, key, value, updated_ts) VALUES (?, ?, ?, ?, ?)"
+        with self._lock:
+            # total_changes は FTS のトリガーが書いた行も数えるため、文ごとの rowcount を合計する
+            written = sum(self._conn.execute(sql, row).rowcount for row in rows)
+            self._conn.commit()
+            return written
+
+    def import_json(self, path: str, scope: str = SCOPE_GLOBAL, scope_id: int = 0) -> Optional[int]:
+        """
+        旧形式の JSON ファイル（{キー: 値}）を一度だけ取り込む
+
+        Returns:
+            取り込んだ件数（取り込み済み、またはファイルが読めない場合は None）
+        """
+        marker = f"imported:{path}"
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM meta WHERE name = ?", (marker,)).fetchone():
+                return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (IOError, json.JSONDecodeError) as e:
+            logger.error(f"Failed to read memories to import from '{path}': {e}")
+            return None
+        if not isinstance(data, dict):
+            logger.error(f"Memories file '{path}' is not a JSON object, skipping import.")
+            return None
+        imported = self.import_entries((scope, scope_id, str(key), value) for key, value in data.items())
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (marker, str(time.time())))
+            self._conn.commit()
+        return imported
+
+    @staticmethod
+    def _scope_clause(scopes: Optional[Sequence[ScopeRef]]) -> Tuple[str, tuple]:
+        if not scopes:
+            return "1 = 1", ()
+        clause = " OR ".join("(m.scope = ? AND m.scope_id = ?)" for _ in scopes)
+        params = tuple(value for scope in scopes for value in scope)
+        return f"({clause})", params
@@ -0,0 +1,289 @@
+# PLANA/llm/plugins/request_scheduler.py
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from PLANA.llm.error.errors import LLMQueueFullError, LLMQueueTimeoutError
+
+logger = logging.getLogger(__name__)
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+@dataclass(eq=False)
+class SchedulerTicket:
+    """LLMリクエスト1件分の順番待ちの状態"""
+    provider: str
+    guild_id: int
+    user_id: int
+    start_tag: float = 0.0
+    seq: int = 0
+    enqueued_at: float = field(default_factory=time.monotonic)
+    granted_at: Optional[float] = None
+    released: bool = False
+    cancelled: bool = False
+    future: Optional[asyncio.Future] = None
+
+    @property
+    def flow(self) -> Tuple[int, int]:
+        return self.guild_id, self.user_id
+
+    @property
+    def queue_wait(self) -> float:
+        return (self.granted_at or time.monotonic()) - self.enqueued_at
+
+
+def _percentile(samples: Deque[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class _ProviderQueue:
+    """プロバイダー1つ分の同時実行枠と待ち行列"""
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self.running = 0
+        self.waiting: List[Tuple[float, int, SchedulerTicket]] = []
+        self.waiting_count = 0
+        self.virtual_time = 0.0
+        self.flow_finish: Dict[Tuple[int, int], float] = {}
+        self.active_users: Dict[int, Counter] = {}
+        self.wait_samples: Deque[float] = deque(maxlen=200)
+        self.service_samples: Deque[float] = deque(maxlen=200)
+        self.stats: Dict[str, int] = {'admitted': 0, 'queued': 0, 'rejected': 0, 'shed': 0, 'completed': 0}
+
+    def pending_tickets(self) -> List[SchedulerTicket]:
+        return [ticket for _, _, ticket in sorted(self.waiting) if not ticket.cancelled]
+
+
+class LLMRequestScheduler:
+    """
+    プロバイダーごとの同時実行数の制限と、ギルド・ユーザー間で公平な順番待ち
+
+    待ち行列は Start-time Fair Queuing で並べる。ギルドごとの重み（既定は1）を、そのギルドで
+    リクエスト中のユーザー数で割った値をユーザーごとの重みとするため、1人が連投しても
+    他のユーザーや他のギルドのリクエストが先に処理される。
+    待ち行列が満杯の場合と、予想待ち時間が期限を超える場合は受け付けず、期限までに
+    順番が回ってこなかったリクエストは取り消す。
+
+    config (llm.request_scheduler):
+        enabled: 有効にするか
+        default_capacity: プロバイダーごとの同時実行数
+        capacities: プロバイダーごとの同時実行数 (例: koboldcpp: 1)
+        max_queue: プロバイダーごとの待ち行列の上限
+        max_wait_seconds: 順番待ちの期限
+        guild_weights: ギルドIDごとの重み
+        position_update_seconds: 待ち順位の表示を更新する間隔
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        self.enabled = config.get('enabled', True)
+        self.default_capacity = int(config.get('default_capacity', 4))
+        self.capacities: Dict[str, int] = {k: int(v) for k, v in (config.get('capacities') or {}).items()}
+        self.max_queue = int(config.get('max_queue', 50))
+        self.max_wait_seconds = float(config.get('max_wait_seconds', 90))
+        self.guild_weights: Dict[int, float] = {int(k): float(v) for k, v in
+                                                (config.get('guild_weights') or {}).items()}
+        self.position_update_seconds = float(config.get('position_update_seconds', 3.0))
+        self._queues: Dict[str, _ProviderQueue] = {}
+        self._seq = itertools.count()
+
+    def _queue(self, provider: str) -> _ProviderQueue:
+        queue = self._queues.get(provider)
+        if queue is None:
+            queue = _ProviderQueue(self.capacities.get(provider, self.default_capacity))
+            self._queues[provider] = queue
+        return queue
+
+    def position(self, ticket: SchedulerTicket) -> int:
+        """待ち行列での順位（1始まり）。実行中・終了済みなら0"""
+        if ticket.granted_at is not None or ticket.cancelled:
+            return 0
+        pending = self._queue(ticket.provider).pending_tickets()
+        return pending.index(ticket) + 1 if ticket in pending else 0
+
+    def has_capacity(self, provider: str) -> bool:
+        """順番待ちなしで実行枠を確保できるか"""
+        if not self.enabled:
+            return True
+        queue = self._queue(provider)
+        return queue.running < queue.capacity and queue.waiting_count == 0
+
+    def _expected_wait(self, queue: _ProviderQueue) -> float:
+        if len(queue.service_samples) < 5:
+            return 0.0
+        mean_service = sum(queue.service_samples) / len(queue.service_samples)
+        return (queue.waiting_count + 1) / queue.capacity * mean_service
+
+    def _activate(self, queue: _ProviderQueue, ticket: SchedulerTicket):
+        queue.active_users.setdefault(ticket.guild_id, Counter())[ticket.user_id] += 1
+
+    def _deactivate(self, queue: _ProviderQueue, ticket: SchedulerTicket):
+        users = queue.active_users.get(ticket.guild_id)
+        if users is None:
+            return
+        users[ticket.user_id] -= 1
+        if users[ticket.user_id] <= 0:
+            del users[ticket.user_id]
+        if not users:
+            del queue.active_users[ticket.guild_id]
+
+    def _grant(self, queue: _ProviderQueue, ticket: SchedulerTicket):
+        queue.running += 1
+        queue.virtual_time = max(queue.virtual_time, ticket.start_tag)
+        ticket.granted_at = time.monotonic()
+        queue.wait_samples.append(ticket.queue_wait)
+        queue.stats['admitted'] += 1
+        if ticket.future and not ticket.future.done():
+            ticket.future.set_result(True)
+
+    def _dispatch(self, queue: _ProviderQueue):
+        while queue.running < queue.capacity and queue.waiting:
+            _, _, ticket = heapq.heappop(queue.waiting)
+            if ticket.cancelled:
+                continue
+            queue.waiting_count -= 1
+            self._grant(queue, ticket)
+
+    async def acquire(self, provider: str, guild_id: int, user_id: int,
+                      on_position: Optional[PositionCallback] = None) -> SchedulerTicket:
+        """
+        実行枠を確保する（空きがなければ順番を待つ）
+
+        Raises:
+            LLMQueueFullError: 待ち行列が満杯、または予想待ち時間が期限を超える
+            LLMQueueTimeoutError: 期限までに順番が回ってこなかった
+        """
+        ticket = SchedulerTicket(provider=provider, guild_id=guild_id, user_id=user_id, seq=next(self._seq))
+        if not self.enabled:
+            ticket.granted_at = ticket.enqueued_at
+            return ticket
+
+        queue = self._queue(provider)
+        immediate = queue.running < queue.capacity and queue.waiting_count == 0
+        if not immediate:
+            if queue.waiting_count >= self.max_queue:
+                queue.stats['rejected'] += 1
+                raise LLMQueueFullError(f"queue for '{provider}' is full ({queue.waiting_count} waiting)", provider)
+            expected_wait = self._expected_wait(queue)
+            if expected_wait > self.max_wait_seconds:
+                queue.stats['rejected'] += 1
+                raise LLMQueueFullError(f"expected wait for '{provider}' is {expected_wait:.0f}s "
+                                        f"(limit {self.max_wait_seconds:.0f}s)", provider)
+
+        # ユーザーごとの重み = ギルドの重み / そのギルドでリクエスト中のユーザー数
+        self._activate(queue, ticket)
+        active_in_guild = len(queue.active_users[guild_id])
+        weight = self.guild_weights.get(guild_id, 1.0) / active_in_guild
+        ticket.start_tag = max(queue.virtual_time, queue.flow_finish.get(ticket.flow, 0.0))
+        queue.flow_finish[ticket.flow] = ticket.start_tag + 1.0 / weight
+        if immediate:
+            self._grant(queue, ticket)
+            return ticket
+
+        ticket.future = asyncio.get_running_loop().create_future()
+        heapq.heappush(queue.waiting, (ticket.start_tag, ticket.seq, ticket))
+        queue.waiting_count += 1
+        queue.stats['queued'] += 1
+
+        deadline = ticket.enqueued_at + self.max_wait_seconds
+        last_position = 0
+        try:
+            while True:
+                position = self.position(ticket)
+                if on_position and position and position != last_position:
+                    last_position = position
+                    try:
+                        await on_position(position)
+                    except Exception as e:
+                        logger.debug(f"Failed to report queue position: {e}")
+                if ticket.granted_at is not None:
+                    return ticket
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queue.stats['shed'] += 1
+                    raise LLMQueueTimeoutError(f"waited {ticket.queue_wait:.0f}s for '{provider}'", provider)
+                try:
+                    await asyncio.wait_for(asyncio.shield(ticket.future),
+                                           timeout=min(self.position_update_seconds, remaining))
+                    return ticket
+                except asyncio.TimeoutError:
+                    continue
+        except BaseException:
+            if ticket.granted_at is not None:
+                # 枠を確保した直後にキャンセルされた場合は枠を返す
+                self.release(ticket)
+            else:
+                ticket.cancelled = True
+                queue.waiting_count -= 1
+                self._deactivate(queue, ticket)
+                self._dispatch(queue)
+            raise
+
+    def release(self, ticket: SchedulerTicket):
+        if ticket.released or ticket.granted_at is None:
+            return
+        ticket.released = True
+        if not self.enabled:
+            return
+        queue = self._queue(ticket.provider)
+        service = time.monotonic() - ticket.granted_at
+        queue.running = max(0, queue.running - 1)
+        queue.service_samples.append(service)
+        queue.stats['completed'] += 1
+        self._deactivate(queue, ticket)
+        if not queue.active_users and not queue.waiting_count:
+            # アイドルになったら仮想時刻とフローの記録をリセットする
+            queue.flow_finish.clear()
+            queue.virtual_time = 0.0
+        logger.info(f"⏱️ [SCHED] provider='{ticket.provider}' | queue_wait={ticket.queue_wait:.2f}s | "
+                    f"service={service:.2f}s | running={queue.running}/{queue.capacity} | "
+                    f"waiting={queue.waiting_count}")
+        self._dispatch(queue)
+
+    @asynccontextmanager
+    async def reserve(self, provider: str, guild_id: int, user_id: int,
+                      on_position: Optional[PositionCallback] = None) -> AsyncIterator[SchedulerTicket]:
+        ticket = await self.acquire(provider, guild_id, user_id, on_position)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """プロバイダーごとの統計（待ち時間と処理時間は別々に集計する）"""
+        return {
+            provider: {
+                'running': queue.running,
+                'capacity': queue.capacity,
+                'waiting': queue.waiting_count,
+                'queue_wait_p50': _percentile(queue.wait_samples, 0.5),
+                'queue_wait_p95': _percentile(queue.wait_samples, 0.95),
+                'service_p50': _percentile(queue.service_samples, 0.5),
+                'service_p95': _percentile(queue.service_samples, 0.95),
+                **queue.stats,
+            }
+            for provider, queue in self._queues.items()
+        }
+
+    def get_stats_text(self) -> str:
+        lines = []
+        for provider, stats in self.get_stats().items():
+            lines.append(
+                f"{provider}: {stats['running']}/{stats['capacity']} running, {stats['waiting']} waiting | "
+                f"wait p50 {stats['queue_wait_p50']:.1f}s p95 {stats['queue_wait_p95']:.1f}s | "
+                f"service p50 {stats['service_p50']:.1f}s p95 {stats['service_p95']:.1f}s | "
+                f"rejected {stats['rejected']} shed {stats['shed']}")
+        return "\n".join(lines) or "no requests yet"
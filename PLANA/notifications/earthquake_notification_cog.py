@@ -7,7 +7,7 @@ import logging
 import os
 from datetime import datetime, timedelta, timezone
 from enum import Enum
-from typing import Literal, Optional, Dict, Set, Any
+from typing import Literal, Optional, Dict, Any
 
 import aiohttp
 import discord
@@ -17,77 +17,45 @@ from discord.ext import commands, tasks
 # 最初にロガーを定義
 logger = logging.getLogger('EarthquakeTsunamiCog')
 
-# Matplotlibのインポート
-MATPLOTLIB_AVAILABLE = False
-CARTOPY_AVAILABLE = False
-plt = None
-
-try:
-    import matplotlib
-
-    matplotlib.use('Agg')
-    import matplotlib.pyplot as plt
-
-    MATPLOTLIB_AVAILABLE = True
-    logger.info("✅ Matplotlibが正常にインポートされました。")
-
-    # 日本語フォント設定（改善版）
-    try:
-        import japanize_matplotlib
-
-        logger.info("✅ japanize_matplotlibが正常にインポートされました。")
-    except ImportError:
-        logger.info("ℹ️ japanize_matplotlibなし。代替フォントを設定します。")
-        try:
-            import matplotlib.font_manager as fm
-
-            japanese_fonts = ['MS Gothic', 'Yu Gothic', 'Meiryo', 'MS UI Gothic', 'DejaVu Sans']
-            available_fonts = [f.name for f in fm.fontManager.ttflist]
-
-            for font in japanese_fonts:
-                if font in available_fonts:
-                    plt.rcParams['font.family'] = font
-                    logger.info(f"✅ 日本語フォント設定: {font}")
-                    break
-            else:
-                plt.rcParams['font.sans-serif'] = ['DejaVu Sans']
-                logger.warning("⚠️ 日本語フォントが見つかりません。")
-        except Exception as e:
-            logger.debug(f"フォント設定エラー（続行）: {e}")
-
-    # Cartopyのインポート
-    try:
-        import cartopy.crs as ccrs
-        import cartopy.feature as cfeature
-
-        CARTOPY_AVAILABLE = True
-        logger.info("✅ Cartopyが正常にインポートされました。地図機能が有効です。")
-    except ImportError as e:
-        CARTOPY_AVAILABLE = False
-        logger.warning(f"⚠️ Cartopyが見つかりません。地図機能は無効になります。")
-        logger.error(f"   詳細エラー: {e}", exc_info=True)
-
-except ImportError as e:
-    MATPLOTLIB_AVAILABLE = False
-    CARTOPY_AVAILABLE = False
-    plt = None
-    logger.error(f"❌ Matplotlibのインポートに失敗しました: {e}")
-except Exception as e:
-    MATPLOTLIB_AVAILABLE = False
-    CARTOPY_AVAILABLE = False
-    plt = None
-    logger.error(f"❌ 予期しないエラーが発生しました: {e}", exc_info=True)
-
 from PLANA.notifications.error.earthquake_errors import (
     EarthquakeTsunamiExceptionHandler,
     APIError,
     DataParsingError,
     ConfigError,
-    NotificationError
+    NotificationError,
+    RenderError
 )
+# matplotlib / cartopy は描画時にレンダリングワーカー側で読み込む（起動時間の短縮）
+from PLANA.notifications.plugins import map_tasks
+from PLANA.notifications.plugins.map_tasks import CARTOPY_AVAILABLE, HISTORY_MAP_EXTENT
+from PLANA.notifications.plugins.quake_store import QuakeHistoryStore
+from PLANA.notifications.plugins.recent_ids import RecentIdWindow
+from PLANA.notifications.plugins.render_pool import MapRenderPool, PRIORITY_BACKGROUND, PRIORITY_LIVE, PRIORITY_USER
 
 DATA_DIR = 'data'
 CONFIG_FILE = os.path.join(DATA_DIR, 'earthquake_tsunami_notification_config.json')
+BASEMAP_CACHE_DIR = os.path.join(DATA_DIR, 'basemap_cache')
+HISTORY_DB_FILE = os.path.join(DATA_DIR, 'earthquake_history.db')
+
+SCALE_CODES = {
+    "震度1": 10, "震度2": 20, "震度3": 30, "震度4": 40,
+    "震度5弱": 45, "震度5強": 50, "震度6弱": 55, "震度6強": 60, "震度7": 70
+}
+
+# 地域ごとの検索範囲 (lat_min, lat_max, lon_min, lon_max)
+REGION_BBOXES = {
+    "北海道": (41.3, 46.0, 139.0, 149.0),
+    "東北": (36.8, 41.6, 138.8, 143.5),
+    "関東": (34.0, 37.2, 138.3, 142.0),
+    "中部": (34.5, 38.6, 135.4, 139.3),
+    "近畿": (33.4, 36.0, 134.0, 136.9),
+    "中国・四国": (32.6, 35.7, 130.8, 134.8),
+    "九州": (30.9, 34.3, 128.5, 132.2),
+    "沖縄・南西諸島": (24.0, 31.0, 122.5, 131.5),
+}
+
+# 背景地図の事前生成を何件ずつワーカーに渡すか（間に速報・コマンドの描画を挟めるようにする）
+PREWARM_CHUNK_SIZE = 8
 
 
 class InfoType(Enum):
@@ -105,20 +73,62 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
 
         self.ensure_data_dir()
         self.config = self.load_config()
+        self.settings = (getattr(bot, 'config', None) or {}).get('earthquake', {}) or {}
+
+        basemap_settings = self.settings.get('basemap_cache', {}) or {}
+        self.basemap_enabled = CARTOPY_AVAILABLE and basemap_settings.get('enabled', True)
+        self.basemap_prewarm = basemap_settings.get('prewarm', True)
+
+        # 地図レンダリング専用のワーカープール（cartopy読み込み済みのプロセスを常駐させる）
+        pool_settings = self.settings.get('render_pool', {}) or {}
+        self.render_pool: Optional[MapRenderPool] = None
+        if CARTOPY_AVAILABLE:
+            self.render_pool = MapRenderPool(
+                workers=pool_settings.get('workers', 2),
+                max_renders_per_worker=pool_settings.get('max_renders_per_worker', 50),
+                render_timeout=pool_settings.get('render_timeout', 60.0),
+                max_queue_size=pool_settings.get('max_queue_size', 32),
+                use_processes=pool_settings.get('use_processes', True),
+                initializer=map_tasks.init_worker,
+                initargs=(basemap_settings, BASEMAP_CACHE_DIR)
+            )
+
+        # 受信した地震情報のローカル履歴（/earthquake_history, /earthquake_map で使用）
+        self.history_retention_days = self.settings.get('history_retention_days', 365)
+        self.quake_store: Optional[QuakeHistoryStore] = None
+        try:
+            self.quake_store = QuakeHistoryStore(self.settings.get('history_db_file', HISTORY_DB_FILE))
+        except Exception as e:
+            logger.error(f"❌ 地震履歴データベースを開けませんでした（APIから直接取得します）: {e}")
+
+        # 地図画像を一度だけアップロードしてURLを使い回すためのキャッシュチャンネル
+        self.image_cache_channel_id = self.settings.get('image_cache_channel_id')
 
         self.last_ids: Dict[str, Optional[str]] = {
             InfoType.EEW.value: None, InfoType.QUAKE.value: None, InfoType.TSUNAMI.value: None
         }
-        self.processed_ids: Dict[str, Set[str]] = {
-            InfoType.EEW.value: set(), InfoType.QUAKE.value: set(), InfoType.TSUNAMI.value: set()
-        }
         self.max_processed_ids = 1000
+        self.processed_ids: Dict[str, RecentIdWindow] = {
+            InfoType.EEW.value: RecentIdWindow(self.max_processed_ids),
+            InfoType.QUAKE.value: RecentIdWindow(self.max_processed_ids),
+            InfoType.TSUNAMI.value: RecentIdWindow(self.max_processed_ids)
+        }
 
         self.ws_session = None
         self.ws_connection = None
         self.ws_reconnect_delay = 5
         self.ws_max_reconnect_delay = 300
         self.ws_running = False
+        self.ws_task: Optional[asyncio.Task] = None
+
+        # 受信ループと通知処理を分離するためのキュー（Discordへの送信が遅くても受信を止めない）
+        self.event_queue: asyncio.Queue = asyncio.Queue(maxsize=self.settings.get('event_queue_size', 500))
+        self.event_worker_task: Optional[asyncio.Task] = None
+        # 最後に受信した情報の時刻（再接続時にこの時刻以降をAPIから補完する）
+        self.last_seen_time: Optional[datetime] = None
+        self.backfill_margin = timedelta(seconds=60)
+        # 補完で取得した緊急地震速報は、これより古ければ通知しない（秒）
+        self.eew_backfill_max_age = self.settings.get('eew_backfill_max_age', 180)
 
         self.http_session = None
         self.jst = timezone(timedelta(hours=+9), 'JST')
@@ -129,6 +139,7 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
         self.error_stats = {'api_errors': 0, 'parsing_errors': 0, 'network_errors': 0, 'ws_disconnects': 0,
                             'last_error_time': None}
         self.processing_stats = {'eew_processed': 0, 'quake_processed': 0, 'tsunami_processed': 0, 'unknown_skipped': 0,
+                                 'image_bytes_saved': 0, 'backfilled': 0, 'stale_eew_skipped': 0, 'queue_dropped': 0,
                                  'last_stats_output': datetime.now(self.jst)}
         self.stats_interval = 3600
 
@@ -139,11 +150,22 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
         logger.info("🔄 EarthquakeTsunamiCog セットアップ開始...")
         try:
             await self.recreate_http_session()
+            if self.quake_store and self.history_retention_days:
+                cutoff = datetime.now(self.jst) - timedelta(days=self.history_retention_days)
+                removed = await asyncio.get_event_loop().run_in_executor(None, self.quake_store.prune, cutoff)
+                if removed:
+                    logger.info(f"🗑️ {self.history_retention_days}日より古い地震履歴を{removed}件削除しました")
             logger.info("🔄 最新情報のIDを初期化中...")
             await self.initialize_processed_ids()
 
+            self.last_seen_time = datetime.now(self.jst)
+            self.event_worker_task = asyncio.create_task(self.event_worker())
             self.ws_running = True
-            asyncio.create_task(self.websocket_listener())
+            self.ws_task = asyncio.create_task(self.websocket_listener())
+
+            if self.render_pool:
+                self.render_pool.start()
+                asyncio.create_task(self.warm_up_renderer())
 
             self.output_stats_task.start()
 
@@ -160,6 +182,9 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
             await self.ws_connection.close()
         if self.ws_session and not self.ws_session.closed:
             await self.ws_session.close()
+        for task in (self.ws_task, self.event_worker_task):
+            if task and not task.done():
+                task.cancel()
 
         if self.http_session and not self.http_session.closed:
             await self.http_session.close()
@@ -167,6 +192,12 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
         if hasattr(self, 'output_stats_task'):
             self.output_stats_task.cancel()
 
+        if self.render_pool:
+            await self.render_pool.close()
+
+        if self.quake_store:
+            self.quake_store.close()
+
         logger.info("✅ EarthquakeTsunamiCog アンロード完了")
 
     async def websocket_listener(self):
@@ -185,13 +216,20 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
                     logger.info("✅ WebSocket接続成功")
                     reconnect_delay = self.ws_reconnect_delay
 
+                    # 切断中（または起動処理中）に発表された情報をAPIから補完
+                    if self.last_seen_time:
+                        asyncio.create_task(self.backfill_missed_events(self.last_seen_time))
+
                     async for msg in ws:
                         if msg.type == aiohttp.WSMsgType.TEXT:
                             try:
                                 data = json.loads(msg.data)
                                 logger.debug(
                                     f"WebSocket受信: code={data.get('code')}, id={data.get('_id') or data.get('id')}")
-                                await self.process_websocket_message(data)
+                                if isinstance(data, dict) and data.get('code') in (551, 552):
+                                    self.last_seen_time = max(self.last_seen_time or datetime.min.replace(tzinfo=self.jst),
+                                                              self.parse_p2p_time(data.get('time')))
+                                self.enqueue_event(data)
                             except json.JSONDecodeError as e:
                                 logger.error(f"WebSocketメッセージのJSON解析エラー: {e}")
                                 self.error_stats['parsing_errors'] += 1
@@ -214,7 +252,64 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
                 await asyncio.sleep(reconnect_delay)
                 reconnect_delay = min(reconnect_delay * 2, self.ws_max_reconnect_delay)
 
-    async def process_websocket_message(self, data: Dict[str, Any]):
+    def parse_p2p_time(self, time_str) -> datetime:
+        """P2P地震情報の受信時刻（例: 2024/01/01 12:00:00.123）を解析"""
+        if isinstance(time_str, str):
+            for fmt in ("%Y/%m/%d %H:%M:%S.%f", "%Y/%m/%d %H:%M:%S"):
+                try:
+                    return datetime.strptime(time_str, fmt).replace(tzinfo=self.jst)
+                except ValueError:
+                    continue
+        return datetime.now(self.jst)
+
+    def enqueue_event(self, data: Dict[str, Any], backfilled: bool = False):
+        """受信した情報を処理キューに追加（受信ループをブロックしない）"""
+        try:
+            self.event_queue.put_nowait((data, backfilled))
+        except asyncio.QueueFull:
+            self.processing_stats['queue_dropped'] += 1
+            logger.error(f"❌ 処理キューが満杯のため情報を破棄しました: id={self.extract_id_safe(data) if isinstance(data, dict) else None}")
+
+    async def event_worker(self):
+        """処理キューから情報を受け取り、受信順に通知処理を行う"""
+        while True:
+            data, backfilled = await self.event_queue.get()
+            try:
+                await self.process_websocket_message(data, backfilled=backfilled)
+            except Exception as e:
+                self.exception_handler.log_generic_error(e, "キューの情報処理")
+            finally:
+                self.event_queue.task_done()
+
+    async def backfill_missed_events(self, since: datetime):
+        """指定時刻以降に発表された情報をAPIから取得し、処理キューに追加"""
+        try:
+            url = f"{self.api_base_url}/history?codes=551&codes=552&limit=100"
+            data = await self.safe_api_request(url)
+            if not data or not isinstance(data, list):
+                return
+
+            threshold = since - self.backfill_margin
+            missed = [
+                item for item in data
+                if isinstance(item, dict) and self.parse_p2p_time(item.get('time')) >= threshold
+                and self.extract_id_safe(item) not in self.processed_ids.get(self.classify_info_type(item).value, ())
+            ]
+            if not missed:
+                logger.info("🔁 再接続時の補完: 取りこぼした情報はありません")
+                return
+
+            # APIは新しい順で返すため、古い順に処理する
+            for item in reversed(missed):
+                self.enqueue_event(item, backfilled=True)
+            self.processing_stats['backfilled'] += len(missed)
+            logger.info(f"🔁 再接続時の補完: {since.strftime('%H:%M:%S')} 以降の情報を{len(missed)}件処理します")
+        except (APIError, DataParsingError) as e:
+            logger.warning(f"再接続時の補完に失敗: {e}")
+        except Exception as e:
+            self.exception_handler.log_generic_error(e, "再接続時の補完")
+
+    async def process_websocket_message(self, data: Dict[str, Any], backfilled: bool = False):
         """WebSocketから受信したメッセージを処理"""
         try:
             if not isinstance(data, dict):
@@ -243,7 +338,16 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
                 logger.debug(f"既に処理済みのID: {info_id} ({info_type.value})")
                 return
 
-            logger.info(f"🆕 WebSocketで新しい{info_type.value}情報を受信: ID {info_id}, code={code}")
+            logger.info(f"🆕 {'APIの補完' if backfilled else 'WebSocket'}で新しい{info_type.value}情報を受信: ID {info_id}, code={code}")
+
+            if info_type == InfoType.EEW and backfilled:
+                age = (datetime.now(self.jst) - self.parse_p2p_time(data.get('time'))).total_seconds()
+                if age > self.eew_backfill_max_age:
+                    logger.info(f"⏭️ {int(age)}秒前の緊急地震速報のため通知をスキップ: ID {info_id}")
+                    self.processing_stats['stale_eew_skipped'] += 1
+                    self.processed_ids[info_type.value].add(info_id)
+                    await self.store_events([data])
+                    return
 
             if info_type == InfoType.EEW:
                 await self.send_eew_notification(data)
@@ -262,7 +366,8 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
 
             self.processed_ids[info_type.value].add(info_id)
             self.last_ids[info_type.value] = info_id
-            self.manage_processed_ids(info_type.value)
+
+            await self.store_events([data])
 
         except NotificationError as e:
             logger.error(f"通知エラー: {e}", exc_info=True)
@@ -299,11 +404,6 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
             self.error_stats['last_error_time'] = datetime.now(self.jst)
             raise self.exception_handler.handle_api_error(e, url)
 
-    def manage_processed_ids(self, info_type: str):
-        if len(self.processed_ids[info_type]) > self.max_processed_ids:
-            self.processed_ids[info_type] = set(list(self.processed_ids[info_type])[-self.max_processed_ids:])
-            logger.info(f"{info_type}: 処理済みID数を{self.max_processed_ids}に制限")
-
     async def initialize_processed_ids(self):
         logger.info("🔍 最新情報のIDを初期化中...")
 
@@ -315,6 +415,7 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
 
             if data and isinstance(data, list):
                 logger.info(f"✅ 地震情報を{len(data)}件取得")
+                await self.store_events(data)
                 latest_eew_id = None
                 latest_quake_id = None
 
@@ -345,6 +446,7 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
 
         except (APIError, DataParsingError) as e:
             logger.error(f"❌ 地震情報(code 551)のID初期化に失敗: {e}")
+            await self.load_processed_ids_from_store([InfoType.EEW, InfoType.QUAKE])
         except Exception as e:
             self.exception_handler.log_generic_error(e, "地震情報(code 551)のID初期化")
 
@@ -356,6 +458,7 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
 
             if data and isinstance(data, list):
                 logger.info(f"✅ 津波情報を{len(data)}件取得")
+                await self.store_events(data)
 
                 latest_tsunami_id = None
 
@@ -381,14 +484,129 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
 
         except (APIError, DataParsingError) as e:
             logger.error(f"❌ 津波情報(code 552)のID初期化に失敗: {e}")
+            await self.load_processed_ids_from_store([InfoType.TSUNAMI])
         except Exception as e:
             self.exception_handler.log_generic_error(e, "津波情報(code 552)のID初期化")
 
         logger.info("🔍 ID初期化結果:")
         for it, lid in self.last_ids.items():
-            count = len(self.processed_ids.get(it, set()))
+            count = len(self.processed_ids.get(it, ()))
             logger.info(f"  {it.upper()}: {lid[:8] if lid else '未取得'} (処理済み: {count}件)")
 
+    def get_event_time(self, item: Dict[str, Any]) -> datetime:
+        """情報の発生時刻（不明な場合は発表時刻）を取得"""
+        earthquake = item.get('earthquake') or {}
+        issue = item.get('issue') or {}
+        return self.parse_earthquake_time(earthquake.get('time', ''), issue.get('time', '') or item.get('time'))
+
+    async def store_events(self, items: list):
+        """受信した情報をローカル履歴に保存"""
+        if not self.quake_store:
+            return
+        events = []
+        for item in items:
+            if not isinstance(item, dict) or item.get('code') not in (551, 552):
+                continue
+            info_type = self.classify_info_type(item)
+            if info_type == InfoType.UNKNOWN:
+                continue
+            events.append((item, info_type.value, self.get_event_time(item)))
+        if not events:
+            return
+        try:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self.quake_store.upsert_events, events)
+        except Exception as e:
+            self.exception_handler.log_generic_error(e, "地震履歴の保存")
+
+    async def load_processed_ids_from_store(self, info_types: list):
+        """API取得に失敗した場合に、ローカル履歴から処理済みIDを復元"""
+        if not self.quake_store:
+            return
+        try:
+            loop = asyncio.get_event_loop()
+            for info_type in info_types:
+                ids = await loop.run_in_executor(None, self.quake_store.latest_ids, info_type.value,
+                                                 self.max_processed_ids)
+                self.processed_ids[info_type.value].update(reversed(ids))
+                if ids and not self.last_ids[info_type.value]:
+                    self.last_ids[info_type.value] = ids[0]
+                logger.info(f"  {info_type.value.upper()}: ローカル履歴から{len(ids)}件のIDを復元")
+        except Exception as e:
+            self.exception_handler.log_generic_error(e, "ローカル履歴からのID復元")
+
+    async def query_quake_history(self, limit: int, min_scale: int = 0, since: Optional[datetime] = None,
+                                  bbox: Optional[tuple] = None, require_location: bool = False) -> list:
+        """地震情報をローカル履歴から検索（履歴が空の場合はAPIから取得して保存）"""
+        loop = asyncio.get_event_loop()
+        if self.quake_store:
+            count = await loop.run_in_executor(None, self.quake_store.count, InfoType.QUAKE.value)
+            if count == 0:
+                await self.backfill_quake_history()
+            return await loop.run_in_executor(
+                None,
+                lambda: self.quake_store.query(InfoType.QUAKE.value, since=since, min_scale=min_scale, bbox=bbox,
+                                               require_location=require_location, limit=limit)
+            )
+
+        # ローカル履歴が使えない場合は従来どおりAPIの直近100件から絞り込む
+        data = await self.safe_api_request(f"{self.api_base_url}/history?codes=551&limit=100")
+        if not data or not isinstance(data, list):
+            raise DataParsingError("地震情報の取得結果が空です。")
+        results = []
+        for item in data:
+            if self.classify_info_type(item) != InfoType.QUAKE:
+                continue
+            earthquake = item.get('earthquake', {})
+            hypocenter = earthquake.get('hypocenter', {})
+            lat, lon = hypocenter.get('latitude'), hypocenter.get('longitude')
+            if earthquake.get('maxScale', -1) < min_scale:
+                continue
+            if since is not None and self.get_event_time(item) < since:
+                continue
+            if (require_location or bbox) and (lat is None or lon is None):
+                continue
+            if bbox and not (bbox[0] <= lat <= bbox[1] and bbox[2] <= lon <= bbox[3]):
+                continue
+            results.append(item)
+            if len(results) >= limit:
+                break
+        return results
+
+    async def backfill_quake_history(self):
+        """APIの履歴をローカル履歴に取り込む"""
+        try:
+            data = await self.safe_api_request(f"{self.api_base_url}/history?codes=551&limit=100")
+            if data and isinstance(data, list):
+                await self.store_events(data)
+                logger.info(f"📥 地震履歴を{len(data)}件取り込みました")
+        except (APIError, DataParsingError) as e:
+            logger.warning(f"地震履歴の取り込みに失敗: {e}")
+
+    async def warm_up_renderer(self):
+        """レンダリングワーカーを起動し、履歴マップと地震マップの全グリッドの背景地図を事前生成"""
+        try:
+            loop = asyncio.get_event_loop()
+            start = loop.time()
+            ready = await self.render_pool.warm_up(map_tasks.ping)
+            logger.info(f"🖌️ レンダリングワーカー{ready}個の準備が完了しました ({(loop.time() - start):.1f}秒)")
+
+            if self.basemap_enabled and self.basemap_prewarm:
+                grid_extents = await loop.run_in_executor(None, map_tasks.basemap_grid_extents)
+                extents = [HISTORY_MAP_EXTENT] + grid_extents
+                start = loop.time()
+                warmed = 0
+                for i in range(0, len(extents), PREWARM_CHUNK_SIZE):
+                    chunk = extents[i:i + PREWARM_CHUNK_SIZE]
+                    done = await self.render_pool.submit(map_tasks.prewarm_basemaps, chunk,
+                                                         priority=PRIORITY_BACKGROUND, timeout=600)
+                    warmed += done
+                    if done < len(chunk):
+                        break  # 容量上限に達したか描画に失敗している
+                logger.info(f"🗺️ 背景地図を{warmed}/{len(extents)}件事前生成しました ({(loop.time() - start):.1f}秒)")
+        except Exception as e:
+            self.exception_handler.log_generic_error(e, "レンダリングワーカーの準備")
+
     def extract_id_safe(self, item: Dict[str, Any]) -> Optional[str]:
         """IDを安全に抽出"""
         try:
@@ -409,7 +627,9 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
             f"QUAKE:{self.processing_stats['quake_processed']} "
             f"TSUNAMI:{self.processing_stats['tsunami_processed']} "
             f"UNKNOWN:{self.processing_stats['unknown_skipped']} "
-            f"エラー:{error_total} WS切断:{self.error_stats['ws_disconnects']}"
+            f"補完:{self.processing_stats['backfilled']} キュー破棄:{self.processing_stats['queue_dropped']} "
+            f"エラー:{error_total} WS切断:{self.error_stats['ws_disconnects']} "
+            f"画像削減:{self.processing_stats['image_bytes_saved'] / 1024 / 1024:.1f}MB"
         )
         logger.info(stats_msg)
 
@@ -474,13 +694,7 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
             raise ConfigError(f"設定ファイルの保存に失敗: {e}")
 
     def scale_to_japanese(self, scale_code):
-        if scale_code is None or scale_code == -1:
-            return "震度情報なし"
-        scale_map = {
-            10: "震度1", 20: "震度2", 30: "震度3", 40: "震度4",
-            45: "震度5弱", 50: "震度5強", 55: "震度6弱", 60: "震度6強", 70: "震度7"
-        }
-        return scale_map.get(scale_code, f"不明({scale_code})")
+        return map_tasks.scale_to_japanese(scale_code)
 
     def get_embed_color(self, scale_code, info_type="quake"):
         if info_type == "tsunami":
@@ -676,7 +890,8 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
                             'time': quake_time
                         }
 
-                        map_buffer = await self.generate_single_earthquake_map(quake_data, info_type)
+                        map_buffer = await self.generate_single_earthquake_map(quake_data, info_type,
+                                                                               priority=PRIORITY_LIVE)
                         map_file = discord.File(fp=map_buffer, filename="earthquake_location.png")
                         embed.set_image(url="attachment://earthquake_location.png")
                     except Exception as e:
@@ -730,331 +945,38 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
         except Exception as e:
             raise NotificationError(f"津波通知処理エラー: {e}")
 
-    async def generate_single_earthquake_map(self, quake: dict, info_type: str) -> io.BytesIO:
+    async def render_map(self, func, *args, priority: int = PRIORITY_USER) -> io.BytesIO:
+        """地図をレンダリングプールで描画する"""
+        if not self.render_pool:
+            raise RenderError("地図機能は現在利用できません。")
+        return io.BytesIO(await self.render_pool.submit(func, *args, priority=priority))
+
+    async def generate_single_earthquake_map(self, quake: dict, info_type: str,
+                                             priority: int = PRIORITY_USER) -> io.BytesIO:
         """単一の地震の位置を地図に表示"""
         loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._generate_single_map_sync, quake, info_type)
-
-    def _calculate_smart_map_extent(self, lat: float, lon: float, max_scale: int) -> tuple:
-        """
-        震源地の位置と震度に基づいて、最適な地図表示範囲を計算
-        フィリピンなど遠方の地震にも対応
-        """
-        # 拡大した日本周辺の境界（フィリピンを含む）
-        REGION_LON_MIN, REGION_LON_MAX = 118, 150
-        REGION_LAT_MIN, REGION_LAT_MAX = 10, 46
-
-        # 震源地が範囲外（フィリピンなど）の場合の判定
-        is_far_south = lat < 24
-        is_far_west = lon < 122
-
-        # 震度に応じた基本ズーム範囲
-        if max_scale >= 50:
-            base_zoom = 5.0
-        elif max_scale >= 40:
-            base_zoom = 4.0
-        else:
-            base_zoom = 3.0
-
-        # フィリピン付近の場合はズームを調整
-        if is_far_south or is_far_west:
-            base_zoom = max(base_zoom, 8.0)
-
-        lon_span = base_zoom * 2
-        lat_span = base_zoom * 1.6
-
-        # 震源地からの距離を計算
-        dist_to_west = lon - REGION_LON_MIN
-        dist_to_east = REGION_LON_MAX - lon
-        dist_to_south = lat - REGION_LAT_MIN
-        dist_to_north = REGION_LAT_MAX - lat
-
-        edge_threshold = base_zoom
-
-        center_lon = lon
-        center_lat = lat
-
-        # 西端・東端の調整
-        if dist_to_west < edge_threshold:
-            center_lon = lon + (edge_threshold - dist_to_west) * 0.5
-        elif dist_to_east < edge_threshold:
-            center_lon = lon - (edge_threshold - dist_to_east) * 0.5
-
-        # 南端・北端の調整（フィリピンなど南方向を特に考慮）
-        if dist_to_south < edge_threshold:
-            center_lat = lat + (edge_threshold - dist_to_south) * 0.5
-        elif dist_to_north < edge_threshold:
-            center_lat = lat - (edge_threshold - dist_to_north) * 0.5
-
-        # 表示範囲を計算
-        lon_min = center_lon - lon_span / 2
-        lon_max = center_lon + lon_span / 2
-        lat_min = center_lat - lat_span / 2
-        lat_max = center_lat + lat_span / 2
-
-        # 境界調整
-        if lon_min < REGION_LON_MIN:
-            shift = REGION_LON_MIN - lon_min
-            lon_min = REGION_LON_MIN
-            lon_max = min(lon_max + shift, REGION_LON_MAX)
-
-        if lon_max > REGION_LON_MAX:
-            shift = lon_max - REGION_LON_MAX
-            lon_max = REGION_LON_MAX
-            lon_min = max(lon_min - shift, REGION_LON_MIN)
-
-        if lat_min < REGION_LAT_MIN:
-            shift = REGION_LAT_MIN - lat_min
-            lat_min = REGION_LAT_MIN
-            lat_max = min(lat_max + shift, REGION_LAT_MAX)
-
-        if lat_max > REGION_LAT_MAX:
-            shift = lat_max - REGION_LAT_MAX
-            lat_max = REGION_LAT_MAX
-            lat_min = max(lat_min - shift, REGION_LAT_MIN)
-
-        return (lon_min, lon_max, lat_min, lat_max)
-
-    def _generate_single_map_sync(self, quake: dict, info_type: str) -> io.BytesIO:
-        """単一の地震マップ画像を生成（台風風デザイン）"""
-        lat, lon = quake['lat'], quake['lon']
-        max_scale = quake['max_scale']
-
-        fig = plt.figure(figsize=(16, 16), dpi=150, facecolor='#2c3e50')
-        ax = fig.add_axes([0, 0, 1, 1], projection=ccrs.PlateCarree(), facecolor='#2c3e50')
-
-        # スマートな地図範囲計算
-        lon_min, lon_max, lat_min, lat_max = self._calculate_smart_map_extent(lat, lon, max_scale)
-        ax.set_extent([lon_min, lon_max, lat_min, lat_max], crs=ccrs.PlateCarree())
-
-        # 台風風のデザイン：海と陸の色分け
-        ax.add_feature(cfeature.OCEAN, facecolor='#2c3e50', zorder=0)
-        ax.add_feature(cfeature.LAND, facecolor='#95a5a6', edgecolor='none', zorder=1)
-        ax.add_feature(cfeature.COASTLINE, edgecolor='white', linewidth=1.5, zorder=3)
-
-        # 都道府県境界
-        try:
-            states = cfeature.NaturalEarthFeature(
-                category='cultural',
-                name='admin_1_states_provinces_lines',
-                scale='10m',
-                facecolor='none'
-            )
-            ax.add_feature(states, edgecolor='white', linewidth=0.6, alpha=0.5, zorder=2)
-        except:
-            logger.debug("都道府県境界の追加をスキップ")
-
-        # グリッド線（白色）
-        ax.gridlines(crs=ccrs.PlateCarree(), draw_labels=False,
-                     linewidth=0.5, color='white', alpha=0.3, linestyle='--')
-
-        # タイトル
-        title_prefix = "緊急地震速報" if info_type == "eew" else "地震情報"
-        title = f'{title_prefix} - 震源位置\n{quake["name"]}'
-        ax.text(0.5, 0.98, title, transform=ax.transAxes,
-                fontsize=18, fontweight='bold', ha='center', va='top', color='white',
-                bbox=dict(boxstyle='round,pad=0.8', facecolor='black',
-                          edgecolor='white', alpha=0.8, linewidth=2))
-
-        # 主要都市のマーカー
-        cities = {
-            '札幌': (141.35, 43.06), '仙台': (140.87, 38.27), '東京': (139.69, 35.69),
-            '名古屋': (136.91, 35.18), '大阪': (135.50, 34.69), '福岡': (130.42, 33.59),
-            '那覇': (127.68, 26.21), 'マニラ': (120.98, 14.60)
-        }
-
-        displayed_cities = 0
-        for city, (city_lon, city_lat) in cities.items():
-            if lon_min <= city_lon <= lon_max and lat_min <= city_lat <= lat_max:
-                ax.plot(city_lon, city_lat, marker='^', color='yellow',
-                        markersize=8, zorder=8, transform=ccrs.Geodetic(),
-                        markeredgecolor='black', markeredgewidth=1.5)
-                ax.text(city_lon, city_lat + 0.15, city, fontsize=9, ha='center', color='white',
-                        bbox=dict(boxstyle='round,pad=0.3', facecolor='black',
-                                  edgecolor='yellow', alpha=0.85, linewidth=1),
-                        transform=ccrs.Geodetic(), zorder=9, fontweight='bold')
-                displayed_cities += 1
-
-        # 震源地の色とサイズ
-        def get_color_and_size(scale):
-            if scale >= 70:
-                return '#8B0000', 550
-            elif scale >= 60:
-                return '#DC143C', 500
-            elif scale >= 55:
-                return '#FF0000', 450
-            elif scale >= 50:
-                return '#FF4500', 400
-            elif scale >= 45:
-                return '#FF8C00', 350
-            elif scale >= 40:
-                return '#FFA500', 300
-            elif scale >= 30:
-                return '#FFD700', 250
-            else:
-                return '#87CEEB', 200
-
-        color, size = get_color_and_size(max_scale)
-
-        # 震源地をマーク
-        ax.scatter(lon, lat, marker='x', c='red', s=size * 2,
-                   linewidths=6, zorder=11, transform=ccrs.Geodetic())
-        ax.scatter(lon, lat, c='red', s=size, alpha=0.8,
-                   edgecolors='white', linewidths=3, zorder=10,
-                   transform=ccrs.Geodetic(), label='震源')
-
-        # 震源地情報
-        info_text = f'震度: {self.scale_to_japanese(max_scale)}\n'
-        if quake['magnitude'] != -1:
-            info_text += f'M{quake["magnitude"]:.1f}\n'
-        if quake['depth'] != -1:
-            info_text += f'深さ: {quake["depth"]}km'
-
-        zoom_range = (lon_max - lon_min) / 2
-        text_offset = zoom_range * 0.6
-        text_y = lat - text_offset
-
-        if text_y < lat_min + 0.5:
-            text_y = lat + text_offset
-
-        text_x = lon
-        if lon < lon_min + 1:
-            text_x = lon_min + 1.5
-        elif lon > lon_max - 1:
-            text_x = lon_max - 1.5
-
-        ax.text(text_x, text_y, info_text,
-                fontsize=13, ha='center', va='top', color='white',
-                bbox=dict(boxstyle='round,pad=0.7', facecolor='black',
-                          edgecolor='red', linewidth=2.5, alpha=0.9),
-                transform=ccrs.Geodetic(), zorder=12, fontweight='bold')
-
-        # 凡例
-        ax.legend(loc='upper left', frameon=True, fontsize=12,
-                  fancybox=True, shadow=True, framealpha=0.9,
-                  bbox_to_anchor=(0.02, 0.92), facecolor='black',
-                  edgecolor='white', labelcolor='white')
-
-        # 画像として保存
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png', dpi=150, bbox_inches='tight',
-                    pad_inches=0, facecolor='#2c3e50', edgecolor='none')
-        buffer.seek(0)
-        plt.close(fig)
-
+        start = loop.time()
+        buffer = await self.render_map(map_tasks.render_single_map, quake, info_type, priority=priority)
+        logger.info(f"🗺️ 震源地図を生成しました ({(loop.time() - start) * 1000:.0f}ms)")
         return buffer
 
-    def _generate_map_sync(self, quakes: list, min_scale: Optional[str], hours: Optional[int]) -> io.BytesIO:
-        """複数の地震マップ画像を生成（台風風デザイン）"""
-        fig = plt.figure(figsize=(16, 16), dpi=150, facecolor='#2c3e50')
-        ax = fig.add_axes([0, 0, 1, 1], projection=ccrs.PlateCarree(), facecolor='#2c3e50')
-
-        # 日本周辺に範囲を限定
-        ax.set_extent([128, 146, 30, 46], crs=ccrs.PlateCarree())
-
-        ax.add_feature(cfeature.OCEAN, facecolor='#2c3e50', zorder=0)
-        ax.add_feature(cfeature.LAND, facecolor='#95a5a6', edgecolor='none', zorder=1)
-        ax.add_feature(cfeature.COASTLINE, edgecolor='white', linewidth=1.5, zorder=3)
-
-        # 都道府県境界
+    async def upload_map_to_cache_channel(self, image_bytes: bytes, filename: str) -> Optional[str]:
+        """地図画像をキャッシュチャンネルに一度だけアップロードし、添付ファイルのURLを返す"""
+        if not self.image_cache_channel_id:
+            return None
         try:
-            states = cfeature.NaturalEarthFeature(
-                category='cultural',
-                name='admin_1_states_provinces_lines',
-                scale='10m',
-                facecolor='none'
-            )
-            ax.add_feature(states, edgecolor='white', linewidth=0.6, alpha=0.5, zorder=2)
-        except:
-            logger.debug("都道府県境界の追加をスキップ")
-
-        # グリッド線
-        ax.gridlines(crs=ccrs.PlateCarree(), draw_labels=False,
-                     linewidth=0.5, color='white', alpha=0.3, linestyle='--')
-
-        # タイトル
-        if hours is not None:
-            title = f'地震発生地点マップ（過去{hours}時間、{len(quakes)}件）'
-        else:
-            title = f'地震発生地点マップ（{len(quakes)}件）'
-        if min_scale:
-            title += f'\n最小震度: {min_scale}'
-        ax.text(0.5, 0.98, title, transform=ax.transAxes,
-                fontsize=18, fontweight='bold', ha='center', va='top', color='white',
-                bbox=dict(boxstyle='round,pad=0.8', facecolor='black',
-                          edgecolor='white', alpha=0.9, linewidth=2))
-
-        # 震度に応じた色とサイズ
-        def get_color_and_size(max_scale):
-            if max_scale >= 70:
-                return '#8B0000', 350, '震度7'
-            elif max_scale >= 60:
-                return '#DC143C', 300, '震度6強'
-            elif max_scale >= 55:
-                return '#FF0000', 250, '震度6弱'
-            elif max_scale >= 50:
-                return '#FF4500', 200, '震度5強'
-            elif max_scale >= 45:
-                return '#FF8C00', 150, '震度5弱'
-            elif max_scale >= 40:
-                return '#FFA500', 120, '震度4'
-            elif max_scale >= 30:
-                return '#FFD700', 100, '震度3'
-            elif max_scale >= 20:
-                return '#90EE90', 80, '震度2'
-            else:
-                return '#87CEEB', 60, '震度1'
-
-        legend_elements = {}
-
-        # 各地震をプロット
-        for quake in quakes:
-            color, size, label = get_color_and_size(quake['max_scale'])
-            ax.scatter(quake['lon'], quake['lat'], c=color, s=size, alpha=0.7,
-                       edgecolors='white', linewidths=1.5, zorder=5,
-                       transform=ccrs.Geodetic())
-            if label not in legend_elements:
-                legend_elements[label] = plt.scatter([], [], c=color, s=120,
-                                                     edgecolors='white', linewidths=1.5, alpha=0.7)
-
-        # 凡例
-        scale_order = ['震度7', '震度6強', '震度6弱', '震度5強', '震度5弱', '震度4', '震度3', '震度2', '震度1']
-        legend_items = [legend_elements[s] for s in scale_order if s in legend_elements]
-        legend_labels = [s for s in scale_order if s in legend_elements]
-
-        if legend_items:
-            legend = ax.legend(legend_items, legend_labels, loc='upper right', frameon=True,
-                               fontsize=11, title='震度', title_fontsize=12,
-                               fancybox=True, shadow=True, framealpha=0.9,
-                               bbox_to_anchor=(0.98, 0.92), facecolor='black',
-                               edgecolor='white')
-            plt.setp(legend.get_texts(), color='white')
-            plt.setp(legend.get_title(), color='white')
-
-        # 主要都市
-        cities = {
-            '札幌': (141.35, 43.06), '東京': (139.69, 35.69),
-            '名古屋': (136.91, 35.18), '大阪': (135.50, 34.69),
-            '福岡': (130.42, 33.59),
-        }
-
-        for city, (lon, lat) in cities.items():
-            ax.plot(lon, lat, marker='^', color='yellow', markersize=7,
-                    zorder=4, transform=ccrs.Geodetic(),
-                    markeredgecolor='black', markeredgewidth=1.2)
-            ax.text(lon, lat + 0.35, city, fontsize=9, ha='center', color='white',
-                    bbox=dict(boxstyle='round,pad=0.3', facecolor='black',
-                              edgecolor='yellow', alpha=0.85, linewidth=0.8),
-                    transform=ccrs.Geodetic(), zorder=4, fontweight='bold')
-
-        # 画像として保存
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png', dpi=150, bbox_inches='tight',
-                    pad_inches=0, facecolor='#2c3e50', edgecolor='none')
-        buffer.seek(0)
-        plt.close(fig)
-
-        return buffer
+            channel = self.bot.get_channel(int(self.image_cache_channel_id))
+            if channel is None:
+                channel = await self.bot.fetch_channel(int(self.image_cache_channel_id))
+            message = await channel.send(file=discord.File(fp=io.BytesIO(image_bytes), filename=filename))
+            if message.attachments:
+                return message.attachments[0].url
+            logger.warning("キャッシュチャンネルへのアップロード結果に添付ファイルがありません")
+        except (discord.HTTPException, ValueError) as e:
+            logger.warning(f"キャッシュチャンネルへの地図アップロードに失敗（チャンネルごとの添付に切り替え）: {e}")
+        except Exception as e:
+            self.exception_handler.log_generic_error(e, "キャッシュチャンネルへの地図アップロード")
+        return None
 
     async def send_embed_to_channels(self, embed, info_type, map_file=None):
         if not self.config:
@@ -1065,6 +987,17 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
         sent_count, failed_count, skipped_count = 0, 0, 0
         config_modified = False
 
+        # 地図画像は一度だけ読み出し、可能ならキャッシュチャンネルのURLを全チャンネルで共有する
+        image_bytes, image_url, url_sent_count = None, None, 0
+        url_embed = None
+        if map_file:
+            map_file.fp.seek(0)
+            image_bytes = map_file.fp.read()
+            image_url = await self.upload_map_to_cache_channel(image_bytes, map_file.filename)
+            if image_url:
+                url_embed = embed.copy()
+                url_embed.set_image(url=image_url)
+
         for guild_id, guild_config in self.config.copy().items():
             try:
                 if not isinstance(guild_config, dict):
@@ -1107,9 +1040,11 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
                     failed_count += 1
                     continue
 
-                if map_file:
-                    map_file.fp.seek(0)
-                    file_copy = discord.File(fp=io.BytesIO(map_file.fp.read()), filename=map_file.filename)
+                if url_embed:
+                    await channel.send(embed=url_embed)
+                    url_sent_count += 1
+                elif image_bytes is not None:
+                    file_copy = discord.File(fp=io.BytesIO(image_bytes), filename=map_file.filename)
                     await channel.send(embed=embed, file=file_copy)
                 else:
                     await channel.send(embed=embed)
@@ -1138,6 +1073,14 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
         logger.info(
             f"📊 {info_type}通知送信完了: 成功 {sent_count}件, 失敗 {failed_count}件, スキップ {skipped_count}件")
 
+        if image_url:
+            # チャンネルごとに添付した場合との差分（キャッシュチャンネルへの1回分を差し引く）
+            bytes_saved = max(0, len(image_bytes) * (url_sent_count - 1))
+            self.processing_stats['image_bytes_saved'] += bytes_saved
+            logger.info(
+                f"🖼️ 地図画像をURL共有で送信: {url_sent_count}件, "
+                f"削減量 {bytes_saved / 1024 / 1024:.2f}MB (画像 {len(image_bytes) / 1024:.0f}KB)")
+
         if sent_count == 0 and (failed_count > 0 or skipped_count > 0):
             logger.warning(f"⚠️ {info_type}の通知が1件も送信されませんでした")
 
@@ -1179,6 +1122,9 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
             )
 
             ws_status = "✅ 接続中" if self.ws_connection and not self.ws_connection.closed else "❌ 切断中"
+            if self.last_seen_time:
+                ws_status += f"\n最終受信: {self.last_seen_time.strftime('%m/%d %H:%M:%S')}"
+            ws_status += f"\n処理待ち: {self.event_queue.qsize()}件 / 補完: {self.processing_stats['backfilled']}件"
             embed.add_field(name="🔌 WebSocket状態", value=ws_status, inline=True)
 
             embed.add_field(
@@ -1189,7 +1135,7 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
 
             id_status = ""
             for it, lid in self.last_ids.items():
-                count = len(self.processed_ids.get(it, set()))
+                count = len(self.processed_ids.get(it, ()))
                 id_status += f"**{it.upper()}**: `{lid[:8] if lid else '未取得'}` ({count}件)\n"
             embed.add_field(name="🆔 最後のID", value=id_status, inline=False)
 
@@ -1227,6 +1173,13 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
             )
             embed.add_field(name="📊 エラー統計", value=error_summary, inline=False)
 
+            if self.quake_store:
+                history_count = await asyncio.get_event_loop().run_in_executor(None, self.quake_store.count)
+                embed.add_field(name="🗄️ ローカル地震履歴", value=f"{history_count}件", inline=True)
+
+            if self.render_pool:
+                embed.add_field(name="🖌️ 地図レンダリング", value=self.render_pool.get_stats_text(), inline=False)
+
             embed.set_footer(text="システム診断完了 | P2P地震情報 WebSocket API | PLANA by coffin299")
             await interaction.followup.send(embed=embed)
         except Exception as e:
@@ -1456,7 +1409,8 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
     @app_commands.describe(
         limit="表示する地震の数（1-50）",
         min_scale="表示する最小震度",
-        hours="過去何時間以内の地震を表示（1-168時間=7日）"
+        hours="過去何時間以内の地震を表示（1-8760時間=1年）",
+        region="表示する地域"
     )
     async def show_earthquake_map(
             self,
@@ -1464,7 +1418,9 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
             limit: Optional[int] = 20,
             min_scale: Optional[Literal[
                 "震度1", "震度2", "震度3", "震度4", "震度5弱", "震度5強", "震度6弱", "震度6強", "震度7"]] = None,
-            hours: Optional[int] = 24
+            hours: Optional[int] = 24,
+            region: Optional[Literal[
+                "北海道", "東北", "関東", "中部", "近畿", "中国・四国", "九州", "沖縄・南西諸島"]] = None
     ):
         try:
             await interaction.response.defer(ephemeral=False)
@@ -1474,60 +1430,31 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
                 return
 
             limit = max(1, min(limit, 50))
-            hours = max(1, min(hours, 168))
-
-            scale_map = {
-                "震度1": 10, "震度2": 20, "震度3": 30, "震度4": 40,
-                "震度5弱": 45, "震度5強": 50, "震度6弱": 55, "震度6強": 60, "震度7": 70
-            }
-            min_scale_code = scale_map.get(min_scale, 0) if min_scale else 0
-
+            hours = max(1, min(hours, 8760))
+            min_scale_code = SCALE_CODES.get(min_scale, 0) if min_scale else 0
             cutoff_time = datetime.now(self.jst) - timedelta(hours=hours)
 
-            url = f"{self.api_base_url}/history?codes=551&limit=100"
-            data = await self.safe_api_request(url)
-
-            if not data or not isinstance(data, list):
-                await interaction.followup.send("❌ 地震情報の取得に失敗しました。")
-                return
+            items = await self.query_quake_history(limit, min_scale=min_scale_code, since=cutoff_time,
+                                                   bbox=REGION_BBOXES.get(region), require_location=True)
 
             filtered_quakes = []
-            for item in data:
-                info_type = self.classify_info_type(item)
-                if info_type != InfoType.QUAKE:
-                    continue
-
+            for item in items:
                 earthquake = item.get('earthquake', {})
-                max_scale = earthquake.get('maxScale', -1)
-
-                if max_scale < min_scale_code:
-                    continue
-
-                issue = item.get('issue', {})
-                quake_time = self.parse_earthquake_time(earthquake.get('time', ''), issue.get('time', ''))
-                if quake_time < cutoff_time:
-                    continue
-
                 hypocenter = earthquake.get('hypocenter', {})
-                lat = hypocenter.get('latitude')
-                lon = hypocenter.get('longitude')
-
-                if lat is not None and lon is not None:
-                    filtered_quakes.append({
-                        'lat': lat,
-                        'lon': lon,
-                        'magnitude': hypocenter.get('magnitude', -1),
-                        'depth': hypocenter.get('depth', -1),
-                        'max_scale': max_scale,
-                        'name': hypocenter.get('name', '不明'),
-                        'time': quake_time
-                    })
-
-                    if len(filtered_quakes) >= limit:
-                        break
+                filtered_quakes.append({
+                    'lat': hypocenter.get('latitude'),
+                    'lon': hypocenter.get('longitude'),
+                    'magnitude': hypocenter.get('magnitude', -1),
+                    'depth': hypocenter.get('depth', -1),
+                    'max_scale': earthquake.get('maxScale', -1),
+                    'name': hypocenter.get('name', '不明'),
+                    'time': self.get_event_time(item)
+                })
 
             if not filtered_quakes:
                 filter_text = f"（{min_scale}以上、過去{hours}時間以内）" if min_scale else f"（過去{hours}時間以内）"
+                if region:
+                    filter_text += f"（{region}）"
                 await interaction.followup.send(f"ℹ️ 該当する地震情報{filter_text}が見つかりませんでした。")
                 return
 
@@ -1537,7 +1464,7 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
 
             embed = discord.Embed(
                 title=f"📍 地震発生地点マップ ({len(filtered_quakes)}件)",
-                description=f"過去{hours}時間以内、最小震度: {min_scale or '指定なし'}",
+                description=f"過去{hours}時間以内、最小震度: {min_scale or '指定なし'}、地域: {region or '全国'}",
                 color=discord.Color.red(),
                 timestamp=datetime.now(self.jst)
             )
@@ -1556,50 +1483,42 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
     async def generate_earthquake_map(self, quakes: list, min_scale: Optional[str], hours: int) -> io.BytesIO:
         """地震マップ画像を生成"""
         loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._generate_map_sync, quakes, min_scale, hours)
+        start = loop.time()
+        buffer = await self.render_map(map_tasks.render_history_map, quakes, min_scale, hours)
+        logger.info(f"🗺️ 地震マップを生成しました ({len(quakes)}件, {(loop.time() - start) * 1000:.0f}ms)")
+        return buffer
 
     @app_commands.command(name="earthquake_history", description="最近の地震情報を表示します")
     @app_commands.describe(
         limit="表示する地震の数（1-20）",
-        min_scale="表示する最小震度"
+        min_scale="表示する最小震度",
+        hours="過去何時間以内の地震を表示（指定なしで全期間）",
+        region="表示する地域"
     )
     async def show_history(
             self,
             interaction: discord.Interaction,
             limit: Optional[int] = 10,
             min_scale: Optional[
-                Literal["震度1", "震度2", "震度3", "震度4", "震度5弱", "震度5強", "震度6弱", "震度6強", "震度7"]] = None
+                Literal["震度1", "震度2", "震度3", "震度4", "震度5弱", "震度5強", "震度6弱", "震度6強", "震度7"]] = None,
+            hours: Optional[int] = None,
+            region: Optional[Literal[
+                "北海道", "東北", "関東", "中部", "近畿", "中国・四国", "九州", "沖縄・南西諸島"]] = None
     ):
         try:
             await interaction.response.defer(ephemeral=False)
 
             limit = max(1, min(limit, 20))
+            min_scale_code = SCALE_CODES.get(min_scale, 0) if min_scale else 0
+            since = datetime.now(self.jst) - timedelta(hours=max(1, hours)) if hours else None
 
-            scale_map = {
-                "震度1": 10, "震度2": 20, "震度3": 30, "震度4": 40,
-                "震度5弱": 45, "震度5強": 50, "震度6弱": 55, "震度6強": 60, "震度7": 70
-            }
-            min_scale_code = scale_map.get(min_scale, 0) if min_scale else 0
-
-            url = f"{self.api_base_url}/history?codes=551&limit=100"
-            data = await self.safe_api_request(url)
-
-            if not data or not isinstance(data, list):
-                await interaction.followup.send("❌ 地震情報の取得に失敗しました。")
-                return
-
-            filtered_quakes = []
-            for item in data:
-                info_type = self.classify_info_type(item)
-                if info_type == InfoType.QUAKE:
-                    max_scale = item.get('earthquake', {}).get('maxScale', -1)
-                    if max_scale >= min_scale_code:
-                        filtered_quakes.append(item)
-                        if len(filtered_quakes) >= limit:
-                            break
+            filtered_quakes = await self.query_quake_history(limit, min_scale=min_scale_code, since=since,
+                                                             bbox=REGION_BBOXES.get(region))
 
             if not filtered_quakes:
                 filter_text = f"（{min_scale}以上）" if min_scale else ""
+                if region:
+                    filter_text += f"（{region}）"
                 await interaction.followup.send(f"ℹ️ 該当する地震情報{filter_text}が見つかりませんでした。")
                 return
 
@@ -1630,7 +1549,7 @@ class EarthquakeTsunamiCog(commands.Cog, name="EarthquakeNotifications"):
 
             embed = discord.Embed(
                 title=f"📊 最近の地震情報 ({len(filtered_quakes)}件)",
-                description=f"最小震度: {min_scale or '指定なし'}",
+                description=f"最小震度: {min_scale or '指定なし'}、地域: {region or '全国'}",
                 color=discord.Color.blue(),
                 timestamp=datetime.now(self.jst)
             )
@@ -36,6 +36,10 @@ class NotificationError(EarthquakeTsunamiError):
     """通知送信時のエラー"""
     pass
 
+class RenderError(EarthquakeTsunamiError):
+    """地図のレンダリング時のエラー（タイムアウト、ワーカー異常終了、キュー溢れなど）"""
+    pass
+
 
 # --- エラーハンドラクラス ---
 
@@ -0,0 +1,337 @@
+# PLANA/notifications/plugins/basemap_cache.py
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+    import matplotlib
+
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import cartopy.crs as ccrs
+    import cartopy.feature as cfeature
+
+    BASEMAP_AVAILABLE = True
+except ImportError:
+    np = None
+    plt = None
+    ccrs = None
+    cfeature = None
+    BASEMAP_AVAILABLE = False
+
+try:
+    from PIL import Image
+
+    PIL_AVAILABLE = True
+except ImportError:
+    Image = None
+    PIL_AVAILABLE = False
+
+# 地震マップ共通の描画パラメータ（背景と前景で一致している必要がある）
+MAP_FIGSIZE = (16, 16)
+MAP_DPI = 150
+MAP_FACECOLOR = '#2c3e50'
+
+Extent = Tuple[float, float, float, float]
+
+
+def draw_static_features(ax):
+    """海・陸・海岸線・都道府県境界・グリッド線などの静的な背景を描画"""
+    ax.add_feature(cfeature.OCEAN, facecolor=MAP_FACECOLOR, zorder=0)
+    ax.add_feature(cfeature.LAND, facecolor='#95a5a6', edgecolor='none', zorder=1)
+    ax.add_feature(cfeature.COASTLINE, edgecolor='white', linewidth=1.5, zorder=3)
+
+    # 都道府県境界
+    try:
+        states = cfeature.NaturalEarthFeature(
+            category='cultural',
+            name='admin_1_states_provinces_lines',
+            scale='10m',
+            facecolor='none'
+        )
+        ax.add_feature(states, edgecolor='white', linewidth=0.6, alpha=0.5, zorder=2)
+    except Exception:
+        logger.debug("都道府県境界の追加をスキップ")
+
+    # グリッド線（白色）
+    ax.gridlines(crs=ccrs.PlateCarree(), draw_labels=False,
+                 linewidth=0.5, color='white', alpha=0.3, linestyle='--')
+
+
+def new_map_axes(extent: Extent):
+    """地震マップ用のFigureとGeoAxesを作成"""
+    fig = plt.figure(figsize=MAP_FIGSIZE, dpi=MAP_DPI, facecolor=MAP_FACECOLOR)
+    ax = fig.add_axes([0, 0, 1, 1], projection=ccrs.PlateCarree(), facecolor=MAP_FACECOLOR)
+    ax.set_extent(list(extent), crs=ccrs.PlateCarree())
+    return fig, ax
+
+
+class BasemapCache:
+    """
+    地震マップの静的な背景（海・陸・海岸線・都道府県境界）を事前にラスタライズしてキャッシュする。
+
+    表示範囲は map_tasks.snap_map_extent で固定グリッドに揃えたものを渡すこと（範囲そのものがキーになる）。
+    背景はメモリ上のLRUとディスク上のPNGの2段で保持し、ディスクは max_disk_mb を超えると
+    最終利用（更新日時）の古いものから削除する。
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_entries: int = 6, max_disk_mb: float = 512):
+        self.cache_dir = cache_dir
+        self.max_entries = max(1, int(max_entries))
+        self.max_disk_bytes = max(0, int(float(max_disk_mb) * 1024 * 1024))
+        self._entries: "OrderedDict[Extent, Tuple[Any, Extent]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats: Dict[str, float] = {
+            'memory_hits': 0, 'disk_hits': 0, 'misses': 0,
+            'disk_evictions': 0, 'render_ms_total': 0.0, 'disk_load_ms_total': 0.0
+        }
+
+        if self.cache_dir:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+            except OSError as e:
+                logger.warning(f"背景地図キャッシュディレクトリの作成に失敗しました（メモリのみで動作）: {e}")
+                self.cache_dir = None
+
+    @property
+    def available(self) -> bool:
+        return BASEMAP_AVAILABLE
+
+    @staticmethod
+    def _key(extent: Extent) -> Extent:
+        return tuple(round(float(v), 4) for v in extent)
+
+    def get(self, extent: Extent):
+        """
+        背景画像を取得する。キャッシュに無ければその場でレンダリングする。
+
+        Returns:
+            (RGB配列, 実際の表示範囲) のタプル。描画できない場合は None。
+        """
+        if not BASEMAP_AVAILABLE:
+            return None
+
+        key = self._key(extent)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return entry
+
+        entry = self._load_from_disk(key)
+        if entry is not None:
+            self.stats['disk_hits'] += 1
+        else:
+            self.stats['misses'] += 1
+            start = time.perf_counter()
+            entry = self.render_background(key)
+            self.stats['render_ms_total'] += (time.perf_counter() - start) * 1000
+            self._save_to_disk(key, entry)
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def prewarm(self, extents) -> int:
+        """
+        指定された表示範囲の背景をまとめて事前生成する（executor上で実行すること）
+
+        ディスクに保存済みの範囲は読み込まずに済ませる（使われたときに読み込む）。
+        ディスクの容量上限に達した場合は、生成済みの背景を押し出さないようそこで打ち切る。
+        """
+        warmed = 0
+        evictions = self.stats['disk_evictions']
+        for extent in extents:
+            if self.stats['disk_evictions'] > evictions:
+                logger.info("背景地図キャッシュが容量上限に達したため事前生成を打ち切りました")
+                break
+            path = self._disk_path(self._key(extent))
+            try:
+                if path and os.path.exists(path):
+                    warmed += 1
+                elif self.get(extent) is not None:
+                    warmed += 1
+            except Exception as e:
+                logger.warning(f"背景地図の事前生成に失敗: {extent} - {e}")
+        return warmed
+
+    def draw(self, ax, extent: Extent) -> bool:
+        """キャッシュ済みの背景をaxesに貼り付ける。失敗した場合は False を返す。"""
+        entry = self.get(extent)
+        if entry is None:
+            return False
+        background, actual_extent = entry
+        ax.imshow(background, origin='upper', extent=list(actual_extent),
+                  transform=ccrs.PlateCarree(), interpolation='nearest', zorder=0)
+        ax.set_extent(list(actual_extent), crs=ccrs.PlateCarree())
+        return True
+
+    @staticmethod
+    def render_background(extent: Extent):
+        """静的背景を最終出力と同じFigure設定でレンダリングし、axes領域のピクセルを切り出す"""
+        fig, ax = new_map_axes(extent)
+        try:
+            draw_static_features(ax)
+            fig.canvas.draw()
+            actual_extent = tuple(ax.get_extent(crs=ccrs.PlateCarree()))
+            bbox = ax.get_window_extent()
+            buffer = np.asarray(fig.canvas.buffer_rgba())
+            height = buffer.shape[0]
+            x0, x1 = int(round(bbox.x0)), int(round(bbox.x1))
+            y0, y1 = int(round(bbox.y0)), int(round(bbox.y1))
+            background = buffer[height - y1:height - y0, x0:x1, :3].copy()
+            return background, actual_extent
+        finally:
+            plt.close(fig)
+
+    def _disk_path(self, key: Extent) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        digest = hashlib.sha1(repr((key, MAP_FIGSIZE, MAP_DPI)).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"basemap_{digest}.png")
+
+    def _load_from_disk(self, key: Extent):
+        path = self._disk_path(key)
+        if not path or not PIL_AVAILABLE or not os.path.exists(path):
+            return None
+        try:
+            start = time.perf_counter()
+            with Image.open(path) as img:
+                extent_text = img.info.get('extent')
+                background = np.asarray(img.convert('RGB'))
+            if not extent_text:
+                return None
+            actual_extent = tuple(float(v) for v in extent_text.split(','))
+            self.stats['disk_load_ms_total'] += (time.perf_counter() - start) * 1000
+            # 更新日時を最終利用日時として使う（容量超過時に古いものから削除する）
+            os.utime(path)
+            return background, actual_extent
+        except Exception as e:
+            logger.debug(f"背景地図キャッシュの読み込みに失敗: {path} - {e}")
+            return None
+
+    def _save_to_disk(self, key: Extent, entry):
+        path = self._disk_path(key)
+        if not path or not PIL_AVAILABLE:
+            return
+        try:
+            from PIL import PngImagePlugin
+
+            background, actual_extent = entry
+            meta = PngImagePlugin.PngInfo()
+            meta.add_text('extent', ','.join(repr(float(v)) for v in actual_extent))
+            # 書き込み途中のファイルを他のワーカーが読まないよう、一時ファイルに書いてから置き換える
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                Image.fromarray(background).save(tmp_path, format='PNG', pnginfo=meta, compress_level=1)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        except Exception as e:
+            logger.debug(f"背景地図キャッシュの保存に失敗: {path} - {e}")
+            return
+        self._prune_disk()
+
+    def _prune_disk(self):
+        """ディスク上の背景の合計サイズが上限を超えたら、最終利用の古いものから削除する"""
+        if not self.cache_dir or not self.max_disk_bytes:
+            return
+        files = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.name.startswith('basemap_') and entry.name.endswith('.png'):
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError as e:
+            logger.debug(f"背景地図キャッシュの容量確認に失敗: {e}")
+            return
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.stats['disk_evictions'] += 1
+            except OSError as e:
+                logger.debug(f"背景地図キャッシュの削除に失敗: {path} - {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats_text(self) -> str:
+        misses = self.stats['misses']
+        avg_render = self.stats['render_ms_total'] / misses if misses else 0.0
+        return (
+            f"メモリ: {self.stats['memory_hits']} / ディスク: {self.stats['disk_hits']} / "
+            f"生成: {misses} (平均 {avg_render:.0f}ms) / 保持: {len(self._entries)}件"
+        )
+
+
+def benchmark(extents=None, runs: int = 3) -> Dict[str, float]:
+    """
+    背景を毎回描画する従来経路と、キャッシュ済み背景を合成する経路のレンダリング時間を比較する。
+
+    Returns:
+        各経路の平均時間（ミリ秒）
+    """
+    if not BASEMAP_AVAILABLE:
+        raise RuntimeError("matplotlib / cartopy が利用できないためベンチマークを実行できません。")
+
+    import io
+
+    extents = extents or [(128, 146, 30, 46), (134.5, 146.5, 30.0, 41.6)]
+    cache = BasemapCache(cache_dir=None)
+
+    def _finish(fig, ax, extent):
+        ax.scatter((extent[0] + extent[1]) / 2, (extent[2] + extent[3]) / 2, c='red', s=300,
+                   edgecolors='white', linewidths=3, zorder=10, transform=ccrs.Geodetic())
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', dpi=MAP_DPI, bbox_inches='tight',
+                    pad_inches=0, facecolor=MAP_FACECOLOR, edgecolor='none')
+        plt.close(fig)
+
+    def _uncached(extent):
+        fig, ax = new_map_axes(extent)
+        draw_static_features(ax)
+        _finish(fig, ax, extent)
+
+    def _cached(extent):
+        fig, ax = new_map_axes(extent)
+        cache.draw(ax, extent)
+        _finish(fig, ax, extent)
+
+    # 初回生成はキャッシュ経路の計測から除外する
+    cache.prewarm(extents)
+
+    results = {}
+    for name, func in (('uncached_ms', _uncached), ('cached_ms', _cached)):
+        start = time.perf_counter()
+        for _ in range(runs):
+            for extent in extents:
+                func(extent)
+        results[name] = (time.perf_counter() - start) * 1000 / (runs * len(extents))
+    results['speedup'] = results['uncached_ms'] / results['cached_ms'] if results['cached_ms'] else 0.0
+    return results
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    result = benchmark()
+    print(f"背景を毎回描画: {result['uncached_ms']:.1f}ms / キャッシュ合成: {result['cached_ms']:.1f}ms "
+          f"(x{result['speedup']:.1f})")
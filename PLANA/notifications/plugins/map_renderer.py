@@ -0,0 +1,330 @@
+# PLANA/notifications/plugins/map_renderer.py
+"""
+地震マップの描画処理。
+
+描画はレンダリング用ワーカープロセス（render_pool）からも呼び出されるため、
+Cogに依存しないモジュールレベルの関数として定義し、結果はPNGのバイト列で返す。
+"""
+import io
+import logging
+import os
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Matplotlibのインポート
+MATPLOTLIB_AVAILABLE = False
+CARTOPY_AVAILABLE = False
+plt = None
+
+try:
+    import matplotlib
+
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    MATPLOTLIB_AVAILABLE = True
+    logger.info("✅ Matplotlibが正常にインポートされました。")
+
+    # 日本語フォント設定（改善版）
+    try:
+        import japanize_matplotlib
+
+        logger.info("✅ japanize_matplotlibが正常にインポートされました。")
+    except ImportError:
+        logger.info("ℹ️ japanize_matplotlibなし。代替フォントを設定します。")
+        try:
+            import matplotlib.font_manager as fm
+
+            japanese_fonts = ['MS Gothic', 'Yu Gothic', 'Meiryo', 'MS UI Gothic', 'DejaVu Sans']
+            available_fonts = [f.name for f in fm.fontManager.ttflist]
+
+            for font in japanese_fonts:
+                if font in available_fonts:
+                    plt.rcParams['font.family'] = font
+                    logger.info(f"✅ 日本語フォント設定: {font}")
+                    break
+            else:
+                plt.rcParams['font.sans-serif'] = ['DejaVu Sans']
+                logger.warning("⚠️ 日本語フォントが見つかりません。")
+        except Exception as e:
+            logger.debug(f"フォント設定エラー（続行）: {e}")
+
+    # Cartopyのインポート
+    try:
+        import cartopy.crs as ccrs
+
+        CARTOPY_AVAILABLE = True
+        logger.info("✅ Cartopyが正常にインポートされました。地図機能が有効です。")
+    except ImportError as e:
+        CARTOPY_AVAILABLE = False
+        logger.warning(f"⚠️ Cartopyが見つかりません。地図機能は無効になります。")
+        logger.error(f"   詳細エラー: {e}", exc_info=True)
+
+except ImportError as e:
+    MATPLOTLIB_AVAILABLE = False
+    CARTOPY_AVAILABLE = False
+    plt = None
+    logger.error(f"❌ Matplotlibのインポートに失敗しました: {e}")
+except Exception as e:
+    MATPLOTLIB_AVAILABLE = False
+    CARTOPY_AVAILABLE = False
+    plt = None
+    logger.error(f"❌ 予期しないエラーが発生しました: {e}", exc_info=True)
+
+
+from PLANA.notifications.plugins.basemap_cache import BasemapCache, draw_static_features, new_map_axes
+from PLANA.notifications.plugins.map_tasks import (
+    HISTORY_MAP_EXTENT, calculate_smart_map_extent, scale_to_japanese, snap_map_extent
+)
+
+# このプロセスで使用する背景地図キャッシュ（configure_basemap_cache で設定）
+_basemap_cache: Optional[BasemapCache] = None
+
+
+def configure_basemap_cache(settings: Optional[dict], default_cache_dir: Optional[str] = None) -> Optional[BasemapCache]:
+    """背景地図キャッシュを設定から生成し、このプロセスの描画で使用する"""
+    global _basemap_cache
+    settings = settings or {}
+    if not CARTOPY_AVAILABLE or not settings.get('enabled', True):
+        _basemap_cache = None
+        return None
+    _basemap_cache = BasemapCache(
+        cache_dir=settings.get('cache_dir', default_cache_dir),
+        max_entries=settings.get('max_entries', 6),
+        max_disk_mb=settings.get('max_disk_mb', 512)
+    )
+    return _basemap_cache
+
+
+def get_basemap_cache() -> Optional[BasemapCache]:
+    return _basemap_cache
+
+
+def prewarm_basemaps(extents) -> int:
+    """背景地図を事前生成する"""
+    if not _basemap_cache:
+        return 0
+    return _basemap_cache.prewarm(extents)
+
+
+def init_worker(basemap_settings: Optional[dict], default_cache_dir: Optional[str] = None):
+    """レンダリングワーカーの初期化。cartopy等の読み込みはこのモジュールのimport時に一度だけ行われる"""
+    configure_basemap_cache(basemap_settings, default_cache_dir)
+
+
+def ping() -> int:
+    """ワーカーの起動確認用"""
+    return os.getpid()
+
+
+def create_map_axes(extent: tuple):
+    """背景描画済みのFigureとGeoAxesを作成（キャッシュがあれば再利用）"""
+    fig, ax = new_map_axes(extent)
+    try:
+        if _basemap_cache and _basemap_cache.draw(ax, extent):
+            return fig, ax
+    except Exception as e:
+        logger.warning(f"背景地図キャッシュの利用に失敗（通常描画で続行）: {e}")
+    draw_static_features(ax)
+    return fig, ax
+
+
+def render_single_map(quake: dict, info_type: str) -> bytes:
+    """単一の地震マップ画像を生成（台風風デザイン）"""
+    lat, lon = quake['lat'], quake['lon']
+    max_scale = quake['max_scale']
+
+    # スマートな地図範囲計算（キャッシュ利用時は固定グリッドに揃えて背景を共有）
+    if _basemap_cache:
+        extent = snap_map_extent(lat, lon, max_scale)
+    else:
+        extent = calculate_smart_map_extent(lat, lon, max_scale)
+    lon_min, lon_max, lat_min, lat_max = extent
+
+    # 台風風のデザイン：海と陸の色分け・都道府県境界・グリッド線
+    fig, ax = create_map_axes(extent)
+
+    # タイトル
+    title_prefix = "緊急地震速報" if info_type == "eew" else "地震情報"
+    title = f'{title_prefix} - 震源位置\n{quake["name"]}'
+    ax.text(0.5, 0.98, title, transform=ax.transAxes,
+            fontsize=18, fontweight='bold', ha='center', va='top', color='white',
+            bbox=dict(boxstyle='round,pad=0.8', facecolor='black',
+                      edgecolor='white', alpha=0.8, linewidth=2))
+
+    # 主要都市のマーカー
+    cities = {
+        '札幌': (141.35, 43.06), '仙台': (140.87, 38.27), '東京': (139.69, 35.69),
+        '名古屋': (136.91, 35.18), '大阪': (135.50, 34.69), '福岡': (130.42, 33.59),
+        '那覇': (127.68, 26.21), 'マニラ': (120.98, 14.60)
+    }
+
+    displayed_cities = 0
+    for city, (city_lon, city_lat) in cities.items():
+        if lon_min <= city_lon <= lon_max and lat_min <= city_lat <= lat_max:
+            ax.plot(city_lon, city_lat, marker='^', color='yellow',
+                    markersize=8, zorder=8, transform=ccrs.Geodetic(),
+                    markeredgecolor='black', markeredgewidth=1.5)
+            ax.text(city_lon, city_lat + 0.15, city, fontsize=9, ha='center', color='white',
+                    bbox=dict(boxstyle='round,pad=0.3', facecolor='black',
+                              edgecolor='yellow', alpha=0.85, linewidth=1),
+                    transform=ccrs.Geodetic(), zorder=9, fontweight='bold')
+            displayed_cities += 1
+
+    # 震源地の色とサイズ
+    def get_color_and_size(scale):
+        if scale >= 70:
+            return '#8B0000', 550
+        elif scale >= 60:
+            return '#DC143C', 500
+        elif scale >= 55:
+            return '#FF0000', 450
+        elif scale >= 50:
+            return '#FF4500', 400
+        elif scale >= 45:
+            return '#FF8C00', 350
+        elif scale >= 40:
+            return '#FFA500', 300
+        elif scale >= 30:
+            return '#FFD700', 250
+        else:
+            return '#87CEEB', 200
+
+    color, size = get_color_and_size(max_scale)
+
+    # 震源地をマーク
+    ax.scatter(lon, lat, marker='x', c='red', s=size * 2,
+               linewidths=6, zorder=11, transform=ccrs.Geodetic())
+    ax.scatter(lon, lat, c='red', s=size, alpha=0.8,
+               edgecolors='white', linewidths=3, zorder=10,
+               transform=ccrs.Geodetic(), label='震源')
+
+    # 震源地情報
+    info_text = f'震度: {scale_to_japanese(max_scale)}\n'
+    if quake['magnitude'] != -1:
+        info_text += f'M{quake["magnitude"]:.1f}\n'
+    if quake['depth'] != -1:
+        info_text += f'深さ: {quake["depth"]}km'
+
+    zoom_range = (lon_max - lon_min) / 2
+    text_offset = zoom_range * 0.6
+    text_y = lat - text_offset
+
+    if text_y < lat_min + 0.5:
+        text_y = lat + text_offset
+
+    text_x = lon
+    if lon < lon_min + 1:
+        text_x = lon_min + 1.5
+    elif lon > lon_max - 1:
+        text_x = lon_max - 1.5
+
+    ax.text(text_x, text_y, info_text,
+            fontsize=13, ha='center', va='top', color='white',
+            bbox=dict(boxstyle='round,pad=0.7', facecolor='black',
+                      edgecolor='red', linewidth=2.5, alpha=0.9),
+            transform=ccrs.Geodetic(), zorder=12, fontweight='bold')
+
+    # 凡例
+    ax.legend(loc='upper left', frameon=True, fontsize=12,
+              fancybox=True, shadow=True, framealpha=0.9,
+              bbox_to_anchor=(0.02, 0.92), facecolor='black',
+              edgecolor='white', labelcolor='white')
+
+    # 画像として保存
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=150, bbox_inches='tight',
+                pad_inches=0, facecolor='#2c3e50', edgecolor='none')
+    plt.close(fig)
+
+    return buffer.getvalue()
+
+
+def render_history_map(quakes: list, min_scale: Optional[str], hours: Optional[int]) -> bytes:
+    """複数の地震マップ画像を生成（台風風デザイン）"""
+    # 日本周辺に範囲を限定（背景はキャッシュを再利用）
+    fig, ax = create_map_axes(HISTORY_MAP_EXTENT)
+
+    # タイトル
+    if hours is not None:
+        title = f'地震発生地点マップ（過去{hours}時間、{len(quakes)}件）'
+    else:
+        title = f'地震発生地点マップ（{len(quakes)}件）'
+    if min_scale:
+        title += f'\n最小震度: {min_scale}'
+    ax.text(0.5, 0.98, title, transform=ax.transAxes,
+            fontsize=18, fontweight='bold', ha='center', va='top', color='white',
+            bbox=dict(boxstyle='round,pad=0.8', facecolor='black',
+                      edgecolor='white', alpha=0.9, linewidth=2))
+
+    # 震度に応じた色とサイズ
+    def get_color_and_size(max_scale):
+        if max_scale >= 70:
+            return '#8B0000', 350, '震度7'
+        elif max_scale >= 60:
+            return '#DC143C', 300, '震度6強'
+        elif max_scale >= 55:
+            return '#FF0000', 250, '震度6弱'
+        elif max_scale >= 50:
+            return '#FF4500', 200, '震度5強'
+        elif max_scale >= 45:
+            return '#FF8C00', 150, '震度5弱'
+        elif max_scale >= 40:
+            return '#FFA500', 120, '震度4'
+        elif max_scale >= 30:
+            return '#FFD700', 100, '震度3'
+        elif max_scale >= 20:
+            return '#90EE90', 80, '震度2'
+        else:
+            return '#87CEEB', 60, '震度1'
+
+    legend_elements = {}
+
+    # 各地震をプロット
+    for quake in quakes:
+        color, size, label = get_color_and_size(quake['max_scale'])
+        ax.scatter(quake['lon'], quake['lat'], c=color, s=size, alpha=0.7,
+                   edgecolors='white', linewidths=1.5, zorder=5,
+                   transform=ccrs.Geodetic())
+        if label not in legend_elements:
+            legend_elements[label] = plt.scatter([], [], c=color, s=120,
+                                                 edgecolors='white', linewidths=1.5, alpha=0.7)
+
+    # 凡例
+    scale_order = ['震度7', '震度6強', '震度6弱', '震度5強', '震度5弱', '震度4', '震度3', '震度2', '震度1']
+    legend_items = [legend_elements[s] for s in scale_order if s in legend_elements]
+    legend_labels = [s for s in scale_order if s in legend_elements]
+
+    if legend_items:
+        legend = ax.legend(legend_items, legend_labels, loc='upper right', frameon=True,
+                           fontsize=11, title='震度', title_fontsize=12,
+                           fancybox=True, shadow=True, framealpha=0.9,
+                           bbox_to_anchor=(0.98, 0.92), facecolor='black',
+                           edgecolor='white')
+        plt.setp(legend.get_texts(), color='white')
+        plt.setp(legend.get_title(), color='white')
+
+    # 主要都市
+    cities = {
+        '札幌': (141.35, 43.06), '東京': (139.69, 35.69),
+        '名古屋': (136.91, 35.18), '大阪': (135.50, 34.69),
+        '福岡': (130.42, 33.59),
+    }
+
+    for city, (lon, lat) in cities.items():
+        ax.plot(lon, lat, marker='^', color='yellow', markersize=7,
+                zorder=4, transform=ccrs.Geodetic(),
+                markeredgecolor='black', markeredgewidth=1.2)
+        ax.text(lon, lat + 0.35, city, fontsize=9, ha='center', color='white',
+                bbox=dict(boxstyle='round,pad=0.3', facecolor='black',
+                          edgecolor='yellow', alpha=0.85, linewidth=0.8),
+                transform=ccrs.Geodetic(), zorder=4, fontweight='bold')
+
+    # 画像として保存
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=150, bbox_inches='tight',
+                pad_inches=0, facecolor='#2c3e50', edgecolor='none')
+    plt.close(fig)
+
+    return buffer.getvalue()
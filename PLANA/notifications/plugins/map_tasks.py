@@ -0,0 +1,201 @@
+# PLANA/notifications/plugins/map_tasks.py
+"""
+地図描画の軽量なエントリポイント。
+
+matplotlib / cartopy の読み込みには数秒かかるため、Cog（メインプロセス）はこのモジュールだけを
+importし、描画関数はレンダリングワーカー上で初めて呼ばれたときに map_renderer を読み込む。
+関数はモジュール名で参照されるため、プロセスプールにそのまま渡せる。
+"""
+import importlib.util
+import os
+from typing import Optional
+
+# 実際にimportせずにインストール済みかだけを確認する
+CARTOPY_AVAILABLE = (importlib.util.find_spec('matplotlib') is not None and
+                     importlib.util.find_spec('cartopy') is not None)
+
+# 履歴マップ（日本周辺）の表示範囲
+HISTORY_MAP_EXTENT = (128, 146, 30, 46)
+
+SCALE_NAMES = {
+    10: "震度1", 20: "震度2", 30: "震度3", 40: "震度4",
+    45: "震度5弱", 50: "震度5強", 55: "震度6弱", 60: "震度6強", 70: "震度7"
+}
+
+
+# 震源地を想定する範囲（経度・緯度の最小/最大）
+MAP_REGION = (118, 150, 10, 46)
+# ズーム段階ごとの代表の震度（calculate_smart_map_extent の分岐に対応）
+ZOOM_SCALES = (30, 40, 50)
+# 背景地図グリッドの一覧を作るときに震源地をずらす間隔（度）
+GRID_SAMPLE_STEP = 0.25
+# 震源を表示範囲の端からこの割合以上内側に置く
+SNAP_EDGE_MARGIN = 0.1
+
+
+def scale_to_japanese(scale_code) -> str:
+    if scale_code is None or scale_code == -1:
+        return "震度情報なし"
+    return SCALE_NAMES.get(scale_code, f"不明({scale_code})")
+
+
+def _base_zoom(max_scale: int, is_far: bool) -> float:
+    """震度に応じた基本ズーム範囲（フィリピン付近などの遠方は広めにする）"""
+    if max_scale >= 50:
+        base_zoom = 5.0
+    elif max_scale >= 40:
+        base_zoom = 4.0
+    else:
+        base_zoom = 3.0
+    if is_far:
+        base_zoom = max(base_zoom, 8.0)
+    return base_zoom
+
+
+def calculate_smart_map_extent(lat: float, lon: float, max_scale: int) -> tuple:
+    """
+    震源地の位置と震度に基づいて、最適な地図表示範囲を計算
+    フィリピンなど遠方の地震にも対応
+    """
+    # 拡大した日本周辺の境界（フィリピンを含む）
+    REGION_LON_MIN, REGION_LON_MAX = 118, 150
+    REGION_LAT_MIN, REGION_LAT_MAX = 10, 46
+
+    # 震源地が範囲外（フィリピンなど）の場合の判定
+    is_far_south = lat < 24
+    is_far_west = lon < 122
+
+    base_zoom = _base_zoom(max_scale, is_far_south or is_far_west)
+    lon_span = base_zoom * 2
+    lat_span = base_zoom * 1.6
+
+    # 震源地からの距離を計算
+    dist_to_west = lon - REGION_LON_MIN
+    dist_to_east = REGION_LON_MAX - lon
+    dist_to_south = lat - REGION_LAT_MIN
+    dist_to_north = REGION_LAT_MAX - lat
+
+    edge_threshold = base_zoom
+
+    center_lon = lon
+    center_lat = lat
+
+    # 西端・東端の調整
+    if dist_to_west < edge_threshold:
+        center_lon = lon + (edge_threshold - dist_to_west) * 0.5
+    elif dist_to_east < edge_threshold:
+        center_lon = lon - (edge_threshold - dist_to_east) * 0.5
+
+    # 南端・北端の調整（フィリピンなど南方向を特に考慮）
+    if dist_to_south < edge_threshold:
+        center_lat = lat + (edge_threshold - dist_to_south) * 0.5
+    elif dist_to_north < edge_threshold:
+        center_lat = lat - (edge_threshold - dist_to_north) * 0.5
+
+    # 表示範囲を計算
+    lon_min = center_lon - lon_span / 2
+    lon_max = center_lon + lon_span / 2
+    lat_min = center_lat - lat_span / 2
+    lat_max = center_lat + lat_span / 2
+
+    # 境界調整
+    if lon_min < REGION_LON_MIN:
+        shift = REGION_LON_MIN - lon_min
+        lon_min = REGION_LON_MIN
+        lon_max = min(lon_max + shift, REGION_LON_MAX)
+
+    if lon_max > REGION_LON_MAX:
+        shift = lon_max - REGION_LON_MAX
+        lon_max = REGION_LON_MAX
+        lon_min = max(lon_min - shift, REGION_LON_MIN)
+
+    if lat_min < REGION_LAT_MIN:
+        shift = REGION_LAT_MIN - lat_min
+        lat_min = REGION_LAT_MIN
+        lat_max = min(lat_max + shift, REGION_LAT_MAX)
+
+    if lat_max > REGION_LAT_MAX:
+        shift = lat_max - REGION_LAT_MAX
+        lat_max = REGION_LAT_MAX
+        lat_min = max(lat_min - shift, REGION_LAT_MIN)
+
+    return (lon_min, lon_max, lat_min, lat_max)
+
+
+def _snap_center(center: float, epicenter: float, step: float) -> float:
+    snapped = round(center / step) * step
+    # 丸めで震源が端に寄りすぎる場合は1マス震源側にずらす（端から1割以上は内側に収める）
+    if abs(epicenter - snapped) > step * (1 - SNAP_EDGE_MARGIN * 2):
+        snapped += step if epicenter > snapped else -step
+    return snapped
+
+
+def snap_map_extent(lat: float, lon: float, max_scale: int) -> tuple:
+    """
+    calculate_smart_map_extent の表示範囲を、ズーム段階ごとの固定グリッドに揃える
+
+    幅・高さはズーム段階ごとに固定し、中心を幅・高さの半分刻みのグリッドに丸める。
+    取り得る表示範囲が有限個になるため、背景地図キャッシュを事前に全て生成できる。
+    """
+    base_zoom = _base_zoom(max_scale, lat < 24 or lon < 122)
+    lon_span = base_zoom * 2
+    lat_span = base_zoom * 1.6
+    lon_min, lon_max, lat_min, lat_max = calculate_smart_map_extent(lat, lon, max_scale)
+    center_lon = _snap_center((lon_min + lon_max) / 2, lon, lon_span / 2)
+    center_lat = _snap_center((lat_min + lat_max) / 2, lat, lat_span / 2)
+    return (
+        round(center_lon - lon_span / 2, 4),
+        round(center_lon + lon_span / 2, 4),
+        round(center_lat - lat_span / 2, 4),
+        round(center_lat + lat_span / 2, 4),
+    )
+
+
+def basemap_grid_extents() -> list:
+    """
+    snap_map_extent が返し得る表示範囲の一覧（背景地図の事前生成用）
+
+    狭い範囲（よく使われる震度3以下）から順に、各段階の中では日本の中心に近い順に並べる。
+    """
+    extents = set()
+    for lat_index in range(int((MAP_REGION[3] - MAP_REGION[2]) / GRID_SAMPLE_STEP) + 1):
+        lat = MAP_REGION[2] + lat_index * GRID_SAMPLE_STEP
+        for lon_index in range(int((MAP_REGION[1] - MAP_REGION[0]) / GRID_SAMPLE_STEP) + 1):
+            lon = MAP_REGION[0] + lon_index * GRID_SAMPLE_STEP
+            for max_scale in ZOOM_SCALES:
+                extents.add(snap_map_extent(lat, lon, max_scale))
+
+    def _order(extent):
+        center_lon = (extent[0] + extent[1]) / 2
+        center_lat = (extent[2] + extent[3]) / 2
+        return extent[1] - extent[0], (center_lon - 137.0) ** 2 + (center_lat - 37.0) ** 2
+
+    return sorted(extents, key=_order)
+
+
+def _renderer():
+    from PLANA.notifications.plugins import map_renderer
+    return map_renderer
+
+
+def init_worker(basemap_settings: Optional[dict], default_cache_dir: Optional[str] = None):
+    """レンダリングワーカーの初期化（ここで matplotlib / cartopy を読み込む）"""
+    _renderer().init_worker(basemap_settings, default_cache_dir)
+
+
+def ping() -> int:
+    """ワーカーの起動確認用"""
+    _renderer()
+    return os.getpid()
+
+
+def prewarm_basemaps(extents) -> int:
+    return _renderer().prewarm_basemaps(extents)
+
+
+def render_single_map(quake: dict, info_type: str) -> bytes:
+    return _renderer().render_single_map(quake, info_type)
+
+
+def render_history_map(quakes: list, min_scale: Optional[str], hours: Optional[int]) -> bytes:
+    return _renderer().render_history_map(quakes, min_scale, hours)
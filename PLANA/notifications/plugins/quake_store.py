@@ -0,0 +1,145 @@
+# PLANA/notifications/plugins/quake_store.py
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (lat_min, lat_max, lon_min, lon_max)
+BoundingBox = Tuple[float, float, float, float]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS quakes (
+    id TEXT PRIMARY KEY,
+    code INTEGER NOT NULL,
+    info_type TEXT NOT NULL,
+    time_ts REAL NOT NULL,
+    max_scale INTEGER NOT NULL DEFAULT -1,
+    lat REAL,
+    lon REAL,
+    magnitude REAL,
+    name TEXT,
+    received_ts REAL NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_quakes_type_time ON quakes (info_type, time_ts DESC);
+CREATE INDEX IF NOT EXISTS idx_quakes_scale ON quakes (max_scale);
+CREATE INDEX IF NOT EXISTS idx_quakes_latlon ON quakes (lat, lon);
+"""
+
+
+class QuakeHistoryStore:
+    """
+    P2P地震情報の受信履歴をSQLiteに保存するローカルストア。
+
+    WebSocketで受信した情報と起動時のバックフィルを蓄積し、
+    /earthquake_history や /earthquake_map の検索をAPIに問い合わせずに処理する。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def upsert_events(self, events: Iterable[Tuple[Dict[str, Any], str, datetime]]) -> int:
+        """
+        情報をまとめて保存する。同じIDの情報は上書きされる。
+
+        Args:
+            events: (APIのJSONデータ, 情報タイプ, 発生時刻) のイテラブル
+        """
+        rows = []
+        now = time.time()
+        for item, info_type, event_time in events:
+            item_id = item.get('_id') or item.get('id')
+            if not item_id:
+                continue
+            earthquake = item.get('earthquake') or {}
+            hypocenter = earthquake.get('hypocenter') or {}
+            lat, lon = hypocenter.get('latitude'), hypocenter.get('longitude')
+            # 震源不明の場合は -200 等が入ることがあるため、範囲外は位置なしとして扱う
+            if lat is not None and lon is not None and not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                lat, lon = None, None
+            magnitude = hypocenter.get('magnitude')
+            rows.append((
+                str(item_id), item.get('code', 0), info_type, event_time.timestamp(),
+                earthquake.get('maxScale', -1) if isinstance(earthquake.get('maxScale'), int) else -1,
+                lat, lon,
+                magnitude if isinstance(magnitude, (int, float)) else None,
+                hypocenter.get('name'), now,
+                json.dumps(item, ensure_ascii=False)
+            ))
+
+        if not rows:
+            return 0
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO quakes "
+                "(id, code, info_type, time_ts, max_scale, lat, lon, magnitude, name, received_ts, payload) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+        return len(rows)
+
+    def query(self, info_type: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+              min_scale: int = 0, bbox: Optional[BoundingBox] = None, require_location: bool = False,
+              limit: int = 20) -> List[Dict[str, Any]]:
+        """条件に一致する情報を新しい順に返す（APIのJSONデータ形式）"""
+        clauses, params = ["info_type = ?"], [info_type]
+        if since is not None:
+            clauses.append("time_ts >= ?")
+            params.append(since.timestamp())
+        if until is not None:
+            clauses.append("time_ts <= ?")
+            params.append(until.timestamp())
+        if min_scale > 0:
+            clauses.append("max_scale >= ?")
+            params.append(min_scale)
+        if bbox is not None:
+            lat_min, lat_max, lon_min, lon_max = bbox
+            clauses.append("lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?")
+            params.extend([lat_min, lat_max, lon_min, lon_max])
+        elif require_location:
+            clauses.append("lat IS NOT NULL AND lon IS NOT NULL")
+        params.append(max(1, int(limit)))
+
+        sql = f"SELECT payload FROM quakes WHERE {' AND '.join(clauses)} ORDER BY time_ts DESC LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [json.loads(payload) for (payload,) in rows]
+
+    def latest_ids(self, info_type: str, limit: int = 1000) -> List[str]:
+        """指定タイプの新しいIDを新しい順に返す"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM quakes WHERE info_type = ? ORDER BY time_ts DESC LIMIT ?",
+                (info_type, limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self, info_type: Optional[str] = None) -> int:
+        with self._lock:
+            if info_type:
+                return self._conn.execute("SELECT COUNT(*) FROM quakes WHERE info_type = ?",
+                                          (info_type,)).fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM quakes").fetchone()[0]
+
+    def prune(self, older_than: datetime) -> int:
+        """古い情報を削除する"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM quakes WHERE time_ts < ?", (older_than.timestamp(),))
+            self._conn.commit()
+            return cursor.rowcount
@@ -0,0 +1,37 @@
+# PLANA/notifications/plugins/recent_ids.py
+from collections import OrderedDict
+from typing import Iterable, Iterator
+
+
+class RecentIdWindow:
+    """
+    挿入順を保持する上限付きのID集合。
+
+    上限を超えると最も古いIDから1件ずつ捨てるため、追加・判定・削除はいずれも O(1)。
+    """
+
+    def __init__(self, max_size: int = 1000):
+        self.max_size = max(1, int(max_size))
+        self._ids: "OrderedDict[str, None]" = OrderedDict()
+
+    def add(self, item_id: str):
+        if item_id in self._ids:
+            self._ids.move_to_end(item_id)
+            return
+        self._ids[item_id] = None
+        if len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+
+    def update(self, item_ids: Iterable[str]):
+        """古い順に渡されたIDをまとめて追加する"""
+        for item_id in item_ids:
+            self.add(item_id)
+
+    def __contains__(self, item_id) -> bool:
+        return item_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._ids)
@@ -0,0 +1,219 @@
+# PLANA/notifications/plugins/render_pool.py
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional
+
+from PLANA.notifications.error.earthquake_errors import RenderError
+
+logger = logging.getLogger(__name__)
+
+# 数値が小さいほど優先される
+PRIORITY_LIVE = 0  # 緊急地震速報・地震情報の自動通知
+PRIORITY_USER = 10  # /earthquake_map などユーザーからのリクエスト
+PRIORITY_BACKGROUND = 20  # 背景地図の事前生成
+
+# スレッドモードのレンダリングを直列化するロック（pyplot の状態はプロセス内で共有されるため、
+# プールを作り直しても、タイムアウトしたスレッドが描画を続けている間は次の描画を始めない）
+_THREAD_RENDER_LOCK = threading.Lock()
+
+
+def _run_serialized(func: Callable, *args) -> Any:
+    with _THREAD_RENDER_LOCK:
+        return func(*args)
+
+
+class MapRenderPool:
+    """
+    地図レンダリング専用のワーカープール。
+
+    matplotlib/cartopy をimport済みのワーカープロセスを常駐させ、優先度付きキューから
+    空いているワーカーに1件ずつ割り当てる。レンダリングごとにタイムアウトを設け、
+    各ワーカーは max_renders_per_worker 件処理するたびに再起動してメモリ使用量を抑える。
+    """
+
+    def __init__(self, workers: int = 2, max_renders_per_worker: int = 50, render_timeout: float = 60.0,
+                 max_queue_size: int = 32, use_processes: bool = True,
+                 initializer: Optional[Callable] = None, initargs: tuple = ()):
+        self.workers = max(1, int(workers))
+        self.max_renders_per_worker = max(1, int(max_renders_per_worker))
+        self.render_timeout = float(render_timeout)
+        self.max_queue_size = max(1, int(max_queue_size))
+        self.use_processes = use_processes
+        self.initializer = initializer
+        self.initargs = initargs
+
+        self._executor: Optional[concurrent.futures.Executor] = None
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._dispatchers: List[asyncio.Task] = []
+        self._counter = itertools.count()
+
+        self.stats: Dict[str, float] = {
+            'submitted': 0, 'completed': 0, 'failed': 0, 'timeouts': 0, 'restarts': 0,
+            'live_renders': 0, 'user_renders': 0, 'background_renders': 0,
+            'queue_wait_ms_total': 0.0, 'render_ms_total': 0.0
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._executor is not None
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def start(self):
+        """ワーカーとディスパッチャーを起動する（イベントループ上で呼び出すこと）"""
+        if self.running:
+            return
+        self._executor = self._create_executor()
+        self._queue = asyncio.PriorityQueue(maxsize=self.max_queue_size)
+        self._dispatchers = [asyncio.create_task(self._dispatch_loop()) for _ in range(self.workers)]
+        mode = "プロセス" if self.use_processes else "スレッド"
+        logger.info(f"🖌️ 地図レンダリングプールを起動しました ({mode} x{self.workers})")
+
+    async def warm_up(self, ping: Callable) -> int:
+        """全ワーカーを起動させ、重いimportを事前に済ませる"""
+        results = await asyncio.gather(
+            *(self.submit(ping, priority=PRIORITY_USER) for _ in range(self.workers)),
+            return_exceptions=True
+        )
+        return sum(1 for r in results if not isinstance(r, BaseException))
+
+    async def submit(self, func: Callable, *args, priority: int = PRIORITY_USER,
+                     timeout: Optional[float] = None) -> Any:
+        """レンダリングをキューに追加し、結果を待つ"""
+        if not self.running:
+            raise RenderError("地図レンダリングプールが起動していません。")
+
+        future = asyncio.get_running_loop().create_future()
+        job = {
+            'func': func, 'args': args, 'priority': priority,
+            'timeout': timeout or self.render_timeout,
+            'future': future, 'enqueued_at': time.perf_counter()
+        }
+        try:
+            self._queue.put_nowait((priority, next(self._counter), job))
+        except asyncio.QueueFull:
+            raise RenderError(f"地図レンダリングの待ち行列が上限({self.max_queue_size}件)に達しています。")
+        self.stats['submitted'] += 1
+        return await future
+
+    async def _dispatch_loop(self):
+        while True:
+            _, _, job = await self._queue.get()
+            future = job['future']
+            try:
+                if future.done():
+                    continue
+
+                started_at = time.perf_counter()
+                self.stats['queue_wait_ms_total'] += (started_at - job['enqueued_at']) * 1000
+                try:
+                    result = await self._run(job)
+                except Exception as e:
+                    self.stats['failed'] += 1
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+
+                self.stats['completed'] += 1
+                self.stats['render_ms_total'] += (time.perf_counter() - started_at) * 1000
+                if job['priority'] <= PRIORITY_LIVE:
+                    self.stats['live_renders'] += 1
+                elif job['priority'] < PRIORITY_BACKGROUND:
+                    self.stats['user_renders'] += 1
+                else:
+                    self.stats['background_renders'] += 1
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: dict) -> Any:
+        loop = asyncio.get_running_loop()
+        func, args = job['func'], job['args']
+        if not self.use_processes:
+            func, args = _run_serialized, (func, *args)
+        for attempt in range(2):
+            executor = self._executor
+            try:
+                return await asyncio.wait_for(loop.run_in_executor(executor, func, *args), timeout=job['timeout'])
+            except asyncio.TimeoutError:
+                self.stats['timeouts'] += 1
+                if self.use_processes:
+                    logger.warning(f"⏱️ 地図レンダリングが{job['timeout']:.0f}秒でタイムアウトしました")
+                    self._restart_executor(executor)
+                else:
+                    # スレッドは強制終了できないため作り直さない（後続の描画は終わるまで待つ）
+                    logger.warning(f"⏱️ 地図レンダリングが{job['timeout']:.0f}秒でタイムアウトしました "
+                                   f"(スレッドモードのため、描画が終わるまで次のレンダリングは待機します)")
+                raise RenderError(f"地図のレンダリングがタイムアウトしました ({job['timeout']:.0f}秒)。")
+            except BrokenProcessPool:
+                logger.warning("レンダリングワーカーが異常終了しました。プールを再起動します。")
+                self._restart_executor(executor)
+                if attempt:
+                    raise RenderError("レンダリングワーカーが異常終了しました。")
+
+    def _create_executor(self) -> concurrent.futures.Executor:
+        if not self.use_processes:
+            # pyplotの状態はスレッド間で共有されるため、スレッドモードでは1本に限定する
+            self.workers = 1
+            # initializer（cartopy等の読み込み）はイベントループではなくワーカースレッド上で実行する
+            return concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='map-render',
+                                                         initializer=self.initializer, initargs=self.initargs)
+
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=self.initializer,
+            initargs=self.initargs,
+            max_tasks_per_child=self.max_renders_per_worker
+        )
+
+    def _restart_executor(self, broken: Optional[concurrent.futures.Executor]):
+        """タイムアウトや異常終了したワーカーを破棄して作り直す"""
+        if broken is None or broken is not self._executor:
+            return  # 他のディスパッチャーが既に再起動済み
+        for process in list(getattr(broken, '_processes', {}).values()):
+            try:
+                process.terminate()
+            except Exception:
+                pass
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._create_executor()
+        self.stats['restarts'] += 1
+
+    async def close(self):
+        for task in self._dispatchers:
+            task.cancel()
+        self._dispatchers = []
+
+        if self._queue:
+            while not self._queue.empty():
+                _, _, job = self._queue.get_nowait()
+                if not job['future'].done():
+                    job['future'].set_exception(RenderError("地図レンダリングプールが停止しました。"))
+
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        logger.info("🖌️ 地図レンダリングプールを停止しました")
+
+    def get_stats_text(self) -> str:
+        completed = self.stats['completed']
+        started = completed + self.stats['failed']
+        avg_wait = self.stats['queue_wait_ms_total'] / started if started else 0.0
+        avg_render = self.stats['render_ms_total'] / completed if completed else 0.0
+        return (
+            f"完了: {completed} (速報 {self.stats['live_renders']} / コマンド {self.stats['user_renders']} / "
+            f"事前生成 {self.stats['background_renders']}) | "
+            f"待機中: {self.queue_size}\n"
+            f"平均待ち: {avg_wait:.0f}ms | 平均描画: {avg_render:.0f}ms | "
+            f"タイムアウト: {self.stats['timeouts']} | 再起動: {self.stats['restarts']}"
+        )
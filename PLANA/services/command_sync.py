@@ -0,0 +1,140 @@
+# PLANA/services/command_sync.py
+import hashlib
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import discord
+from discord import app_commands
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_FILE = "data/command_sync_cache.json"
+
+
+@dataclass
+class CommandDiff:
+    """前回同期したコマンドとの差分"""
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+
+    @property
+    def empty(self) -> bool:
+        return not (self.added or self.changed or self.removed)
+
+    def summary(self) -> str:
+        parts = []
+        if self.added:
+            parts.append(f"added: {', '.join(self.added)}")
+        if self.changed:
+            parts.append(f"changed: {', '.join(self.changed)}")
+        if self.removed:
+            parts.append(f"removed: {', '.join(self.removed)}")
+        return " / ".join(parts) or "no changes"
+
+
+@dataclass
+class SyncResult:
+    scope: str
+    synced: bool
+    command_count: int
+    diff: CommandDiff
+    reason: str
+
+
+def _hash(data: Any) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class CommandSyncCache:
+    """
+    スラッシュコマンドの同期結果をスコープ（グローバル / テストギルド）ごとに記録し、
+    コマンド定義が変わっていない場合は tree.sync() を省略する。
+
+    コマンド定義は Discord に送信するペイロード（to_dict）をそのままハッシュ化して比較する。
+    """
+
+    def __init__(self, cache_file: str = DEFAULT_CACHE_FILE):
+        self.cache_file = cache_file
+        self.entries: Dict[str, Dict[str, Any]] = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (json.JSONDecodeError, IOError) as e:
+            logger.warning(f"Failed to load command sync cache ({self.cache_file}): {e}")
+            return {}
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.cache_file) or '.', exist_ok=True)
+            tmp_path = self.cache_file + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_file)
+        except IOError as e:
+            logger.warning(f"Failed to save command sync cache ({self.cache_file}): {e}")
+
+    @staticmethod
+    def scope_key(guild: Optional[discord.abc.Snowflake]) -> str:
+        return f"guild:{guild.id}" if guild else "global"
+
+    @staticmethod
+    def command_payloads(tree: app_commands.CommandTree,
+                         guild: Optional[discord.abc.Snowflake] = None) -> Dict[str, Any]:
+        """同期対象のコマンドのペイロード（コマンド種別:名前 → to_dict の結果）"""
+        payloads = {}
+        for command in tree.get_commands(guild=guild):
+            try:
+                payload = command.to_dict(tree)
+            except TypeError:
+                # discord.py 2.3 以前は引数なし
+                payload = command.to_dict()
+            payloads[f"{payload.get('type', 1)}:{payload['name']}"] = payload
+        return payloads
+
+    def diff(self, scope: str, command_hashes: Dict[str, str]) -> CommandDiff:
+        previous: Dict[str, str] = (self.entries.get(scope) or {}).get('commands', {})
+        return CommandDiff(
+            added=sorted(name for name in command_hashes if name not in previous),
+            changed=sorted(name for name, h in command_hashes.items() if name in previous and previous[name] != h),
+            removed=sorted(name for name in previous if name not in command_hashes)
+        )
+
+    async def sync(self, tree: app_commands.CommandTree, guild: Optional[discord.abc.Snowflake] = None,
+                   force: bool = False, dry_run: bool = False) -> SyncResult:
+        """
+        コマンド定義が前回の同期から変わっている場合だけ tree.sync() を呼ぶ
+
+        Args:
+            force: 変更がなくても同期する
+            dry_run: 差分を返すだけで同期しない
+        """
+        scope = self.scope_key(guild)
+        payloads = self.command_payloads(tree, guild)
+        command_hashes = {name: _hash(payload) for name, payload in payloads.items()}
+        fingerprint = _hash(command_hashes)
+        diff = self.diff(scope, command_hashes)
+        unchanged = (self.entries.get(scope) or {}).get('fingerprint') == fingerprint
+
+        if dry_run:
+            return SyncResult(scope, False, len(payloads), diff, "dry run")
+        if unchanged and not force:
+            return SyncResult(scope, False, len(payloads), diff, "unchanged")
+
+        synced = await tree.sync(guild=guild)
+        self.entries[scope] = {
+            'fingerprint': fingerprint,
+            'commands': command_hashes,
+            'synced_at': time.time(),
+        }
+        self._save()
+        return SyncResult(scope, True, len(synced), diff, "forced" if unchanged else "changed")
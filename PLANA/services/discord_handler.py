@@ -1,15 +1,221 @@
 # PLANA/services/discord_handler.py
 
 import asyncio
+import copy
 import json
 import logging
 import os
 import re
-from asyncio import Queue
-from typing import List
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Dict, List, Optional, Pattern, Tuple, Union
 
+import discord
 from discord import Client, TextChannel
 
+# 先頭の引用符、括弧、空白
+_LEADING_PUNCTUATION = re.compile(r'^[「『"\'『»«‹›〈〉《》【】〔〕［］｛｝（）()［］\s]+')
+
+# 絵文字パターン（Unicode絵文字の範囲）
+_EMOJI_PATTERN = re.compile(
+    "["
+    "\U0001F1E0-\U0001F1FF"  # flags (iOS)
+    "\U0001F300-\U0001F5FF"  # symbols & pictographs
+    "\U0001F600-\U0001F64F"  # emoticons
+    "\U0001F680-\U0001F6FF"  # transport & map symbols
+    "\U0001F700-\U0001F77F"  # alchemical symbols
+    "\U0001F780-\U0001F7FF"  # Geometric Shapes Extended
+    "\U0001F800-\U0001F8FF"  # Supplemental Arrows-C
+    "\U0001F900-\U0001F9FF"  # Supplemental Symbols and Pictographs
+    "\U0001FA00-\U0001FA6F"  # Chess Symbols
+    "\U0001FA70-\U0001FAFF"  # Symbols and Pictographs Extended-A
+    "\U00002702-\U000027B0"  # Dingbats
+    "\U000024C2-\U0001F251"
+    "]+", flags=re.UNICODE
+)
+
+
+def _display_chars(text: str, count: int = 1) -> str:
+    """
+    テキストから先頭の記号・絵文字・空白を除去し、指定文字数を返す。
+    絵文字も1文字としてカウントする。
+    """
+    cleaned = _LEADING_PUNCTUATION.sub('', text)
+
+    # 絵文字を除去してから文字数を取得
+    chars_without_emoji = _EMOJI_PATTERN.sub('', cleaned)
+
+    if len(chars_without_emoji) >= count:
+        return chars_without_emoji[:count]
+    elif len(cleaned) >= count:
+        return cleaned[:count]
+    else:
+        return text[:count] if text else ''
+
+
+# 匿名化ルール（パターン, 置換）。上から順に適用する。パターンは読み込み時に一度だけコンパイルする。
+_SANITIZE_RULES: List[Tuple[Pattern, Union[str, Callable[[re.Match], str]]]] = [
+    # Windowsユーザーパス
+    (re.compile(r'[A-Za-z]:\\Users\\[^\\]+\\[^\\]+', re.IGNORECASE), '********'),
+    # Session ID
+    (re.compile(r'((?:Session ID:?|session)\s+)[a-f09]{32}', re.IGNORECASE), r'\1****'),
+    # Session ID (上で取り切れなかった場合)
+    (re.compile(r'((?:Session ID:?|session)\s+)([a-f0-9])([a-f0-9]{31})', re.IGNORECASE), r'\1\2****'),
+    # LLMCog形式: guild='サーバー名(ID or 匿名化済み)' -> guild='サー****(****)'
+    (re.compile(r"guild='([^']+)\([^)]+\)'"),
+     lambda m: f"guild='{_display_chars(m.group(1), 2)}****(****)'"),
+    # LLMCog形式: author='ユーザー名(ID or 匿名化済み)' -> author='ユー****(****)'
+    (re.compile(r"author='([^']+)\([^)]+\)'"),
+     lambda m: f"author='{_display_chars(m.group(1), 2)}****(****)'"),
+    # LLMCog形式: channel='チャンネル名(ID or 匿名化済み)' -> channel='チャ****(****)'
+    (re.compile(r"channel='([^']+)\([^)]+\)'"),
+     lambda m: f"channel='{_display_chars(m.group(1), 2)}****(****)'"),
+    # MusicCog形式: Guild ID (サーバー名): -> Guild ****(サー****):
+    (re.compile(r"Guild (\d+) \(([^)]+)\):"),
+     lambda m: f"Guild ****({m.group(2)[:1]}****):"),
+    # IDのみなので完全匿名化を維持
+    (re.compile(r"Channel ID \d+ \(Guild ID \d+\)"), "Channel ID **** (Guild ID ****)"),
+    # MusicCog形式: Connected to チャンネル名 -> Connected to チャ****
+    (re.compile(r"Connected to (.+)"),
+     lambda m: f"Connected to {m.group(1)[:1]}****"),
+    # BioManager形式: for user [ID] (ユーザー名) -> for user X**** (ユ****)
+    (re.compile(r"for user (\d+) \(([^)]+)\)"),
+     lambda m: f"for user {m.group(1)[:1]}**** ({m.group(2)[:1]}****)"),
+    # BioManager形式: for user [ID] -> for user X**** (括弧がない場合)
+    (re.compile(r"for user (\d+)(?!\s*\()"),
+     lambda m: f"for user {m.group(1)[:1]}****"),
+    # BioManager形式: Content: 'ユーザーbio' -> Content: 'ユ****'
+    (re.compile(r"Content: '([^']+)'"),
+     lambda m: f"Content: '{m.group(1)[:1]}****'"),
+    # Twitch通知形式: ギルド [ID] のチャンネル [ID] -> ギルド X**** のチャンネル Y****
+    (re.compile(r"ギルド (\d+) のチャンネル (\d+)"),
+     lambda m: f"ギルド {m.group(1)[:1]}**** のチャンネル {m.group(2)[:1]}****"),
+    # メッセージID形式: message ID: 1425082992111386664 -> message ID: 1****
+    (re.compile(r"message ID:? (\d+)", re.IGNORECASE),
+     lambda m: f"message ID: {m.group(1)[:1]}****"),
+    # 一般的なDiscord ID (18-19桁の数字) -> X****
+    (re.compile(r"(?<!\d)(\d{17,19})(?!\d)"),
+     lambda m: f"{m.group(1)[:1]}****"),
+    # switch_model_slash等のログ形式: by ユーザー名 -> by ユ****
+    (re.compile(r"\bby ([^\s.]+)"),
+     lambda m: f"by {m.group(1)[:1]}****"),
+    # send_embed_to_channels形式: 'hoge' の '📗-fuga' -> 'h****' の '📗****'
+    # または: 'ギルド名' の 'チャンネル名' -> 'ギ****' の 'チ****'
+    (re.compile(r"'([^']+)' の '([^']+)'"),
+     lambda m: f"'{_display_chars(m.group(1), 1)}****' の '{_display_chars(m.group(2), 1)}****'"),
+    # [on_message]形式: [on_message] ギルド名(ID****),ユーザー名(ID****)💬
+    # -> [on_message] ギ****(ID****),ユ****(ID****)💬
+    (re.compile(r"\[on_message\] ([^(]+)\(([^)]+)\),([^(]+)\(([^)]+)\)"),
+     lambda m: f"[on_message] {_display_chars(m.group(1), 1)}****({m.group(2)}),"
+               f"{_display_chars(m.group(3), 1)}****({m.group(4)})"),
+    # [/chat]形式も同様に処理
+    (re.compile(r"\[/chat\] ([^(]+)\(([^)]+)\),([^(]+)\(([^)]+)\)"),
+     lambda m: f"[/chat] {_display_chars(m.group(1), 1)}****({m.group(2)}),"
+               f"{_display_chars(m.group(3), 1)}****({m.group(4)})"),
+    # on_guild_join/on_guild_remove形式: 'サーバー名' (ID: X****) -> 'サ****' (ID: X****)
+    (re.compile(r"'([^']+)' \(ID: (\d+\*+)\)"),
+     lambda m: f"'{_display_chars(m.group(1), 1)}****' (ID: {m.group(2)})"),
+    # cleanup_task_loop形式: guild: 1**** (サーバー名) -> guild: 1**** (サ****)
+    (re.compile(r"guild: (\d+\*+) \(([^)]+)\)"),
+     lambda m: f"guild: {m.group(1)} ({_display_chars(m.group(2), 1)}****)"),
+]
+
+
+def sanitize_log_message(message: str) -> str:
+    """ログメッセージからユーザー名・サーバー名・IDなどを匿名化する"""
+    for pattern, replacement in _SANITIZE_RULES:
+        message = pattern.sub(replacement, message)
+    return message
+
+
+class LogRingBuffer:
+    """
+    任意のスレッドから書き込める固定長のリングバッファ。
+
+    WARNING 以上のレコードは容量の一部（important_ratio）を使う別のリングに入れるため、
+    DEBUG/INFO が大量に出てもエラーが押し出されない。どちらのリングも満杯の場合は最も古いレコードを
+    上書きし、捨てた件数をレベルごとに数える。取り出す時は2つのリングを出力順に並べ直す。
+    書き込み側はロックを取って末尾に追加するだけなので、ログを出すスレッドを待たせない。
+    """
+
+    def __init__(self, capacity: int = 5000, important_ratio: float = 0.2):
+        capacity = max(2, capacity)
+        important = min(capacity - 1, max(1, int(capacity * important_ratio)))
+        # (追加順の番号, レベル, レコード)
+        self._items: deque = deque(maxlen=capacity - important)
+        self._important: deque = deque(maxlen=important)
+        self._lock = threading.Lock()
+        self._seq = 0
+        self.dropped_by_level: Counter = Counter()
+        self.total = 0
+
+    def append(self, item: Any, level: int = logging.NOTSET):
+        ring = self._important if level >= logging.WARNING else self._items
+        with self._lock:
+            if len(ring) == ring.maxlen:
+                self.dropped_by_level[logging.getLevelName(ring[0][1])] += 1
+            ring.append((self._seq, level, item))
+            self._seq += 1
+            self.total += 1
+
+    def drain(self, limit: Optional[int] = None) -> List[Any]:
+        """古いものから最大 limit 件を取り出す（省略時は全件）"""
+        items = []
+        with self._lock:
+            normal, important = self._items, self._important
+            while (normal or important) and (limit is None or len(items) < limit):
+                if not important or (normal and normal[0][0] < important[0][0]):
+                    items.append(normal.popleft()[2])
+                else:
+                    items.append(important.popleft()[2])
+        return items
+
+    @property
+    def dropped(self) -> int:
+        return sum(self.dropped_by_level.values())
+
+    @property
+    def capacity(self) -> int:
+        return self._items.maxlen + self._important.maxlen
+
+    def __len__(self) -> int:
+        return len(self._items) + len(self._important)
+
+
+def benchmark_emit_overhead(handler: logging.Handler, iterations: int = 2000) -> Dict[str, float]:
+    """
+    ハンドラを付けた場合と付けない場合で、1回の logger.info() にかかる時間を計測する（マイクロ秒）
+
+    計測中のレコードが実際に送信されないよう、DiscordLogHandler の場合は一時的に別のバッファに差し替える。
+    """
+    bench_logger = logging.getLogger("PLANA.log_benchmark")
+    bench_logger.propagate = False
+    bench_logger.setLevel(logging.INFO)
+
+    def measure() -> float:
+        started = time.perf_counter()
+        for i in range(iterations):
+            bench_logger.info("benchmark message %d for user 123456789012345678 in guild='test(1)'", i)
+        return (time.perf_counter() - started) / iterations * 1_000_000
+
+    original_buffer = getattr(handler, 'buffer', None)
+    if isinstance(original_buffer, LogRingBuffer):
+        handler.buffer = LogRingBuffer(original_buffer.capacity)
+    try:
+        baseline = measure()
+        bench_logger.addHandler(handler)
+        try:
+            with_handler = measure()
+        finally:
+            bench_logger.removeHandler(handler)
+    finally:
+        if isinstance(original_buffer, LogRingBuffer):
+            handler.buffer = original_buffer
+
+    return {'baseline_us': baseline, 'with_handler_us': with_handler,
+            'overhead_us': max(0.0, with_handler - baseline)}
+
 
 class DiscordLogFormatter(logging.Formatter):
     """
@@ -43,17 +249,45 @@ class DiscordLogHandler(logging.Handler):
     """
     Pythonのログを複数のDiscordチャンネルにバッチ送信するためのカスタムロギングハンドラ。
     レートリミットを回避するため、ログをキューに溜め、定期的にまとめて送信します。
+
+    emit() はレコードをリングバッファに積むだけで、フォーマットと匿名化は送信タスクが
+    スレッド上でまとめて行います（ログを出したスレッドやイベントループを待たせない）。
+
+    送信前に同じ内容のログを「×N」にまとめ、溜まりすぎている場合は WARNING 以上を残して
+    DEBUG/INFO を間引きます。1回に送る件数と送信間隔はレートリミットの状況に合わせて調整します。
     """
 
+    # 1回のフラッシュで送るレコード数の範囲
+    MIN_FLUSH_RECORDS = 50
+    # この秒数以上かかった送信はレートリミットで待たされたとみなす
+    RATE_LIMITED_SEND_SECONDS = 1.0
+    # チャンネルごとのチャンク送信間隔(秒)の範囲
+    MIN_SEND_DELAY = 0.2
+    MAX_SEND_DELAY = 5.0
+
     def __init__(self, bot: Client, channel_ids: List[int], interval: float = 5.0,
-                 config_path: str = "data/log_channels.json"):
+                 config_path: str = "data/log_channels.json", max_buffer: int = 5000,
+                 pressure_threshold: int = 300, info_sample_every: int = 10):
         super().__init__()
         self.bot = bot
         self.channel_ids = channel_ids
         self.interval = interval
         self.config_path = config_path
 
-        self.queue: Queue[str] = Queue()
+        self.buffer = LogRingBuffer(max_buffer)
+        self._reported_drops: Counter = Counter()
+
+        # 溜まっている件数がこれを超えたら DEBUG/INFO を info_sample_every 件に1件だけ残す
+        self.pressure_threshold = pressure_threshold
+        self.info_sample_every = max(1, info_sample_every)
+        self.flush_limit = max(self.MIN_FLUSH_RECORDS, pressure_threshold)
+        self.send_delays: Dict[int, float] = {}
+
+        # 送信の遅れ（最も古い未送信レコードが出力されてからの秒数）
+        self.lag_seconds = 0.0
+        self.max_lag_seconds = 0.0
+        self.stats: Dict[str, int] = {'flushes': 0, 'sent_messages': 0, 'deduplicated': 0, 'sampled_out': 0,
+                                      'rate_limited_sends': 0}
         self.channels: List[TextChannel] = []
         self._closed = False
 
@@ -130,198 +364,86 @@ class DiscordLogHandler(logging.Handler):
     def emit(self, record: logging.LogRecord):
         if self._closed:
             return
-        msg = self.format(record)
-        msg = self._sanitize_log_message(msg)
-        try:
-            self.queue.put_nowait(msg)
-        except asyncio.QueueFull:
-            print("DiscordLogHandler: Log queue is full, dropping message.")
+        # 引数付きのログは後から引数が変更されても内容が変わらないよう、ここで文字列化だけしておく
+        self.buffer.append((record, record.getMessage() if record.args else None), record.levelno)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'buffered': len(self.buffer),
+            'capacity': self.buffer.capacity,
+            'total': self.buffer.total,
+            'dropped': self.buffer.dropped,
+            'dropped_by_level': dict(self.buffer.dropped_by_level),
+            'flush_limit': self.flush_limit,
+            'lag_seconds': round(self.lag_seconds, 1),
+            'max_lag_seconds': round(self.max_lag_seconds, 1),
+            **self.stats,
+        }
 
     def _get_display_chars(self, text: str, count: int = 1) -> str:
+        return _display_chars(text, count)
+
+    def _sanitize_log_message(self, message: str) -> str:
+        return sanitize_log_message(message)
+
+    def _aggregate(self, items: List[Tuple[logging.LogRecord, Optional[str]]], under_pressure: bool
+                   ) -> Tuple[List[Tuple[logging.LogRecord, Optional[str], int]], int]:
         """
-        テキストから先頭の記号・絵文字・空白を除去し、指定文字数を返す。
-        絵文字も1文字としてカウントする。
+        同じレベル・ロガー・内容のレコードを最初の1件にまとめて件数を数える。
+        under_pressure の場合は WARNING 未満のレコードを info_sample_every 件に1件だけ残す。
+
+        Returns:
+            (レコード, 文字列化済みメッセージ, 件数) のリストと、間引いた件数
         """
-        # 先頭の引用符、括弧、空白を除去
-        cleaned = re.sub(r'^[「『"\'『»«‹›〈〉《》【】〔〕［］｛｝（）()［］\s]+', '', text)
-
-        # 絵文字パターン（Unicode絵文字の範囲）
-        emoji_pattern = re.compile(
-            "["
-            "\U0001F1E0-\U0001F1FF"  # flags (iOS)
-            "\U0001F300-\U0001F5FF"  # symbols & pictographs
-            "\U0001F600-\U0001F64F"  # emoticons
-            "\U0001F680-\U0001F6FF"  # transport & map symbols
-            "\U0001F700-\U0001F77F"  # alchemical symbols
-            "\U0001F780-\U0001F7FF"  # Geometric Shapes Extended
-            "\U0001F800-\U0001F8FF"  # Supplemental Arrows-C
-            "\U0001F900-\U0001F9FF"  # Supplemental Symbols and Pictographs
-            "\U0001FA00-\U0001FA6F"  # Chess Symbols
-            "\U0001FA70-\U0001FAFF"  # Symbols and Pictographs Extended-A
-            "\U00002702-\U000027B0"  # Dingbats
-            "\U000024C2-\U0001F251"
-            "]+", flags=re.UNICODE
-        )
-
-        # 絵文字を除去してから文字数を取得
-        chars_without_emoji = emoji_pattern.sub('', cleaned)
-
-        if len(chars_without_emoji) >= count:
-            return chars_without_emoji[:count]
-        elif len(cleaned) >= count:
-            return cleaned[:count]
-        else:
-            return text[:count] if text else ''
+        groups: Dict[Tuple[int, str, str, Any], List[Any]] = {}
+        sampled_out = 0
+        low_severity_seen = 0
+        for record, frozen_message in items:
+            if under_pressure and record.levelno < logging.WARNING:
+                low_severity_seen += 1
+                if low_severity_seen % self.info_sample_every:
+                    sampled_out += 1
+                    continue
+            message = frozen_message if frozen_message is not None else str(record.msg)
+            key = (record.levelno, record.name, message, record.exc_info[0] if record.exc_info else None)
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [record, frozen_message, 1]
+            else:
+                group[2] += 1
+        return [tuple(group) for group in groups.values()], sampled_out
 
-    def _sanitize_log_message(self, message: str) -> str:
-        # Windowsユーザーパス
-        message = re.sub(
-            r'[A-Za-z]:\\Users\\[^\\]+\\[^\\]+',
-            '********',
-            message,
-            flags=re.IGNORECASE
-        )
-        # Session ID
-        message = re.sub(
-            r'((?:Session ID:?|session)\s+)[a-f09]{32}',
-            r'\1****',
-            message,
-            flags=re.IGNORECASE
-        )
-        # Session ID (上で取り切れなかった場合)
-        message = re.sub(
-            r'((?:Session ID:?|session)\s+)([a-f0-9])([a-f0-9]{31})',
-            r'\1\2****',
-            message,
-            flags=re.IGNORECASE
-        )
-        # LLMCog形式: guild='サーバー名(ID or 匿名化済み)' -> guild='サー****(****)'
-        message = re.sub(
-            r"guild='([^']+)\([^)]+\)'",
-            lambda m: f"guild='{self._get_display_chars(m.group(1), 2)}****(****)'",
-            message
-        )
-        # LLMCog形式: author='ユーザー名(ID or 匿名化済み)' -> author='ユー****(****)'
-        message = re.sub(
-            r"author='([^']+)\([^)]+\)'",
-            lambda m: f"author='{self._get_display_chars(m.group(1), 2)}****(****)'",
-            message
-        )
-        # LLMCog形式: channel='チャンネル名(ID or 匿名化済み)' -> channel='チャ****(****)'
-        message = re.sub(
-            r"channel='([^']+)\([^)]+\)'",
-            lambda m: f"channel='{self._get_display_chars(m.group(1), 2)}****(****)'",
-            message
-        )
-        # MusicCog形式: Guild ID (サーバー名): -> Guild ****(サー****):
-        message = re.sub(
-            r"Guild (\d+) \(([^)]+)\):",
-            lambda m: f"Guild ****({m.group(2)[:1]}****):",
-            message
-        )
-        # IDのみなので完全匿名化を維持
-        message = re.sub(
-            r"Channel ID \d+ \(Guild ID \d+\)",
-            "Channel ID **** (Guild ID ****)",
-            message
-        )
-        # MusicCog形式: Connected to チャンネル名 -> Connected to チャ****
-        message = re.sub(
-            r"Connected to (.+)",
-            lambda m: f"Connected to {m.group(1)[:1]}****",
-            message
-        )
-        # BioManager形式: for user [ID] (ユーザー名) -> for user X**** (ユ****)
-        message = re.sub(
-            r"for user (\d+) \(([^)]+)\)",
-            lambda m: f"for user {m.group(1)[:1]}**** ({m.group(2)[:1]}****)",
-            message
-        )
-        # BioManager形式: for user [ID] -> for user X**** (括弧がない場合)
-        message = re.sub(
-            r"for user (\d+)(?!\s*\()",
-            lambda m: f"for user {m.group(1)[:1]}****",
-            message
-        )
-        # BioManager形式: Content: 'ユーザーbio' -> Content: 'ユ****'
-        message = re.sub(
-            r"Content: '([^']+)'",
-            lambda m: f"Content: '{m.group(1)[:1]}****'",
-            message
-        )
-        # Twitch通知形式: ギルド [ID] のチャンネル [ID] -> ギルド X**** のチャンネル Y****
-        message = re.sub(
-            r"ギルド (\d+) のチャンネル (\d+)",
-            lambda m: f"ギルド {m.group(1)[:1]}**** のチャンネル {m.group(2)[:1]}****",
-            message
-        )
-        # メッセージID形式: message ID: 1425082992111386664 -> message ID: 1****
-        message = re.sub(
-            r"message ID:? (\d+)",
-            lambda m: f"message ID: {m.group(1)[:1]}****",
-            message,
-            flags=re.IGNORECASE
-        )
-        # 一般的なDiscord ID (18-19桁の数字) -> X****
-        message = re.sub(
-            r"(?<!\d)(\d{17,19})(?!\d)",
-            lambda m: f"{m.group(1)[:1]}****",
-            message
-        )
-
-        # switch_model_slash等のログ形式: by ユーザー名 -> by ユ****
-        message = re.sub(
-            r"\bby ([^\s.]+)",
-            lambda m: f"by {m.group(1)[:1]}****",
-            message
-        )
-
-        # send_embed_to_channels形式: 'hoge' の '📗-fuga' -> 'h****' の '📗****'
-        # または: 'ギルド名' の 'チャンネル名' -> 'ギ****' の 'チ****'
-        message = re.sub(
-            r"'([^']+)' の '([^']+)'",
-            lambda
-                m: f"'{self._get_display_chars(m.group(1), 1)}****' の '{self._get_display_chars(m.group(2), 1)}****'",
-            message
-        )
-
-        # [on_message]形式: [on_message] ギルド名(ID****),ユーザー名(ID****)💬
-        # -> [on_message] ギ****(ID****),ユ****(ID****)💬
-        message = re.sub(
-            r"\[on_message\] ([^(]+)\(([^)]+)\),([^(]+)\(([^)]+)\)",
-            lambda
-                m: f"[on_message] {self._get_display_chars(m.group(1), 1)}****({m.group(2)}),{self._get_display_chars(m.group(3), 1)}****({m.group(4)})",
-            message
-        )
-
-        # [/chat]形式も同様に処理
-        message = re.sub(
-            r"\[/chat\] ([^(]+)\(([^)]+)\),([^(]+)\(([^)]+)\)",
-            lambda
-                m: f"[/chat] {self._get_display_chars(m.group(1), 1)}****({m.group(2)}),{self._get_display_chars(m.group(3), 1)}****({m.group(4)})",
-            message
-        )
-
-        # on_guild_join/on_guild_remove形式: 'サーバー名' (ID: X****) -> 'サ****' (ID: X****)
-        message = re.sub(
-            r"'([^']+)' \(ID: (\d+\*+)\)",
-            lambda m: f"'{self._get_display_chars(m.group(1), 1)}****' (ID: {m.group(2)})",
-            message
-        )
-
-        # cleanup_task_loop形式: guild: 1**** (サーバー名) -> guild: 1**** (サ****)
-        message = re.sub(
-            r"guild: (\d+\*+) \(([^)]+)\)",
-            lambda m: f"guild: {m.group(1)} ({self._get_display_chars(m.group(2), 1)}****)",
-            message
-        )
-        return message
+    def _render_records(self, items: List[Tuple[logging.LogRecord, Optional[str]]],
+                        under_pressure: bool = False) -> Tuple[List[str], int, int]:
+        """
+        溜まったレコードを集約し、フォーマット・匿名化する（送信タスクからスレッド上で呼ばれる）
+
+        Returns:
+            送信する行、まとめた件数、間引いた件数
+        """
+        groups, sampled_out = self._aggregate(items, under_pressure)
+        rendered = []
+        deduplicated = 0
+        for record, frozen_message, count in groups:
+            if frozen_message is not None:
+                # 引数はログ出力時点で文字列化済み。他のハンドラに影響しないようコピーに設定する
+                record = copy.copy(record)
+                record.msg, record.args = frozen_message, None
+            try:
+                line = sanitize_log_message(self.format(record))
+            except Exception as e:
+                line = f"<failed to format log record: {e}>"
+            if count > 1:
+                line += f" (×{count})"
+                deduplicated += count - 1
+            rendered.append(line)
+        return rendered, deduplicated, sampled_out
 
     async def _process_queue(self):
         """
         キューに溜まったログを全て取り出し、個々のログが途切れないようにチャンク分けして送信する。
         """
-        if self.queue.empty():
+        if not len(self.buffer):
             return
 
         # チャンネルの存在確認と更新
@@ -356,16 +478,35 @@ class DiscordLogHandler(logging.Handler):
         if not self.channels:
             if self.channel_ids:
                 print(f"DiscordLogHandler: No valid channels found for IDs {self.channel_ids}. Clearing log queue.")
-            while not self.queue.empty():
-                self.queue.get_nowait()
+            self.buffer.drain()
             return
 
-        # キューから全てのログを取得
-        records = []
-        while not self.queue.empty():
-            records.append(self.queue.get_nowait())
-        if not records:
+        # バッファから最大 flush_limit 件を取り出し、集約・フォーマット・匿名化をスレッド上で行う
+        backlog = len(self.buffer)
+        items = self.buffer.drain(self.flush_limit)
+        if not items:
             return
+        self.lag_seconds = max(0.0, time.time() - items[0][0].created)
+        self.max_lag_seconds = max(self.max_lag_seconds, self.lag_seconds)
+        dropped_by_level = self.buffer.dropped_by_level - self._reported_drops
+        dropped = sum(dropped_by_level.values())
+        under_pressure = backlog > self.pressure_threshold or dropped > 0
+
+        records, deduplicated, sampled_out = await asyncio.to_thread(self._render_records, items, under_pressure)
+        self.stats['deduplicated'] += deduplicated
+        self.stats['sampled_out'] += sampled_out
+
+        notices = []
+        if dropped > 0:
+            self._reported_drops = self.buffer.dropped_by_level.copy()
+            levels = ", ".join(f"{level} {count}" for level, count in dropped_by_level.most_common())
+            notices.append(f"⚠️ {dropped} log record(s) dropped ({levels}; buffer full, capacity {self.buffer.capacity})")
+        if sampled_out:
+            notices.append(f"ℹ️ {sampled_out} DEBUG/INFO record(s) sampled out under load "
+                           f"({backlog} buffered, kept 1 in {self.info_sample_every})")
+        if self.lag_seconds > self.interval * 2:
+            notices.append(f"⏱️ Log sender is {self.lag_seconds:.1f}s behind")
+        records = notices + records
 
         # ログを1つのコードブロック内にまとめてチャンク分けする
         chunks = []
@@ -415,45 +556,74 @@ class DiscordLogHandler(logging.Handler):
         if current_logs:
             chunks.append("```ansi\n" + "\n".join(current_logs) + "\n```")
 
-        # 全てのチャンネルに、作成したチャンクを送信
-        channels_to_remove = []
-        for channel in self.channels:
-            send_success = False
-            for chunk in chunks:
-                if not chunk.strip():
-                    continue
-                try:
-                    await channel.send(chunk, silent=True)
-                    send_success = True
-                    # チャンク間の送信にわずかな遅延を入れ、レートリミットを回避
-                    await asyncio.sleep(0.2)
-                except discord.errors.Forbidden:
-                    # 権限エラー: チャンネルが削除されたか、アクセス権がない
-                    print(f"DiscordLogHandler: ⚠️ No permission to send to channel {channel.id}. Marking for removal.")
-                    channels_to_remove.append((channel.id, "Forbidden: No permission to send messages"))
-                    break
-                except discord.errors.NotFound:
-                    # チャンネルが見つからない（削除された）
-                    print(f"DiscordLogHandler: ⚠️ Channel {channel.id} not found (deleted?). Marking for removal.")
-                    channels_to_remove.append((channel.id, "NotFound: Channel has been deleted"))
-                    break
-                except Exception as e:
-                    print(f"Failed to send log to Discord channel {channel.id}: {e}")
-                    if not send_success:
-                        # 1つも送信できなかった場合のみ失敗カウントを増やす
-                        self.invalid_channel_attempts[channel.id] = self.invalid_channel_attempts.get(channel.id, 0) + 1
-                        if self.invalid_channel_attempts[channel.id] >= self.max_attempts:
-                            channels_to_remove.append(
-                                (channel.id, f"Failed to send after {self.max_attempts} attempts: {str(e)}"))
-                    break
-
-            # 成功したらカウントリセット
-            if send_success:
-                self.invalid_channel_attempts.pop(channel.id, None)
+        # 全てのチャンネルに、作成したチャンクを並行して送信
+        results = await asyncio.gather(*(self._send_chunks(channel, chunks) for channel in list(self.channels)))
+        self.stats['flushes'] += 1
+
+        # レートリミットに当たった場合は1回に送る件数を減らし、余裕があって溜まっている場合は増やす
+        rate_limited = any(limited for limited, _ in results)
+        if rate_limited:
+            self.flush_limit = max(self.MIN_FLUSH_RECORDS, self.flush_limit // 2)
+        elif len(self.buffer) > 0:
+            self.flush_limit = min(self.buffer.capacity, int(self.flush_limit * 1.5))
 
         # 無効なチャンネルを削除
-        for channel_id, reason in channels_to_remove:
-            await self._remove_invalid_channel(channel_id, reason)
+        for _, removal in results:
+            if removal:
+                await self._remove_invalid_channel(*removal)
+
+    async def _send_chunks(self, channel: TextChannel, chunks: List[str]) -> Tuple[bool, Optional[Tuple[int, str]]]:
+        """
+        1つのチャンネルにチャンクを順番に送信する。送信間隔はチャンネルごとに調整する。
+
+        Returns:
+            (レートリミットで待たされたか, 削除すべき場合は (チャンネルID, 理由))
+        """
+        delay = self.send_delays.get(channel.id, self.MIN_SEND_DELAY)
+        send_success = False
+        rate_limited = False
+        removal = None
+        for chunk in chunks:
+            if not chunk.strip():
+                continue
+            try:
+                started = time.monotonic()
+                await channel.send(chunk, silent=True)
+                self.stats['sent_messages'] += 1
+                send_success = True
+                # discord.py がレートリミットで待機した場合は送信に時間がかかるので、間隔を広げる
+                if time.monotonic() - started >= self.RATE_LIMITED_SEND_SECONDS:
+                    rate_limited = True
+                    self.stats['rate_limited_sends'] += 1
+                    delay = min(self.MAX_SEND_DELAY, delay * 2)
+                else:
+                    delay = max(self.MIN_SEND_DELAY, delay * 0.8)
+                # チャンク間の送信にわずかな遅延を入れ、レートリミットを回避
+                await asyncio.sleep(delay)
+            except discord.errors.Forbidden:
+                # 権限エラー: チャンネルが削除されたか、アクセス権がない
+                print(f"DiscordLogHandler: ⚠️ No permission to send to channel {channel.id}. Marking for removal.")
+                removal = (channel.id, "Forbidden: No permission to send messages")
+                break
+            except discord.errors.NotFound:
+                # チャンネルが見つからない（削除された）
+                print(f"DiscordLogHandler: ⚠️ Channel {channel.id} not found (deleted?). Marking for removal.")
+                removal = (channel.id, "NotFound: Channel has been deleted")
+                break
+            except Exception as e:
+                print(f"Failed to send log to Discord channel {channel.id}: {e}")
+                if not send_success:
+                    # 1つも送信できなかった場合のみ失敗カウントを増やす
+                    self.invalid_channel_attempts[channel.id] = self.invalid_channel_attempts.get(channel.id, 0) + 1
+                    if self.invalid_channel_attempts[channel.id] >= self.max_attempts:
+                        removal = (channel.id, f"Failed to send after {self.max_attempts} attempts: {str(e)}")
+                break
+
+        self.send_delays[channel.id] = delay
+        # 成功したらカウントリセット
+        if send_success:
+            self.invalid_channel_attempts.pop(channel.id, None)
+        return rate_limited, removal
 
     async def _log_sender_loop(self):
         """バックグラウンドで定期的にキュー処理を呼び出すループ。"""
@@ -461,7 +631,8 @@ class DiscordLogHandler(logging.Handler):
             await self.bot.wait_until_ready()
             while not self._closed:
                 await self._process_queue()
-                await asyncio.sleep(self.interval)
+                # 送り切れなかったログが残っている場合は間隔を空けずに続けて送信する
+                await asyncio.sleep(self.MIN_SEND_DELAY if len(self.buffer) else self.interval)
         except asyncio.CancelledError:
             pass
         except Exception as e:
@@ -0,0 +1,171 @@
+# PLANA/services/startup.py
+import ast
+import asyncio
+import importlib
+import importlib.util
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from discord.ext import commands
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CogLoadResult:
+    """Cog1つ分のロード結果と所要時間"""
+    module: str
+    import_seconds: float = 0.0
+    setup_seconds: float = 0.0
+    status: str = "pending"
+    error: Optional[str] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.status == "loaded"
+
+
+def collect_imports(module_path: str) -> List[str]:
+    """
+    Cogのソースを解析し、モジュールレベルでimportしているモジュール名を返す（実行はしない）
+
+    try / if の中のimportも含める（オプション依存のimportは失敗しても無視される）。
+    """
+    spec = importlib.util.find_spec(module_path)
+    if spec is None or not spec.origin or not spec.origin.endswith('.py'):
+        return []
+    with open(spec.origin, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=spec.origin)
+
+    names: List[str] = []
+
+    def visit(nodes):
+        for node in nodes:
+            if isinstance(node, ast.Import):
+                names.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names.append(node.module)
+                # from パッケージ import サブモジュール の形式はサブモジュールも読み込む
+                names.extend(f"{node.module}.{alias.name}" for alias in node.names if alias.name != '*')
+            elif isinstance(node, ast.Try):
+                visit(node.body)
+                for handler in node.handlers:
+                    visit(handler.body)
+                visit(node.orelse)
+                visit(node.finalbody)
+            elif isinstance(node, ast.If):
+                visit(node.body)
+                visit(node.orelse)
+
+    visit(tree.body)
+    return list(dict.fromkeys(names))
+
+
+def _prewarm_imports(module_path: str) -> float:
+    """Cogが依存するモジュールを読み込んでおく（スレッド上で実行される）。所要時間を返す。"""
+    started = time.perf_counter()
+    try:
+        names = collect_imports(module_path)
+    except Exception as e:
+        logger.debug(f"Failed to parse imports of {module_path}: {e}")
+        return time.perf_counter() - started
+
+    for name in names:
+        parent, _, attr = name.rpartition('.')
+        # from X import 関数 の形式は X が読み込み済みで属性として存在すればよい
+        if parent and attr:
+            parent_module = sys.modules.get(parent)
+            if parent_module is not None and hasattr(parent_module, attr):
+                continue
+        try:
+            importlib.import_module(name)
+        except Exception:
+            # 関数・クラス名だった場合や、オプション依存が無い場合。実際のロード時に改めて判定される
+            pass
+    return time.perf_counter() - started
+
+
+class CogLoader:
+    """
+    Cogを並行してロードする。
+
+    各Cogが依存するモジュール（openai, yt_dlp など重いもの）をスレッドプールで並行してimportしておき、
+    Cog本体の load_extension はイベントループ上で指定順に行う。先頭のCogは他のCogのimportを
+    待たずにロードを始められる。スレッドでのimportに失敗した場合は通常のロード時にimportされる。
+    """
+
+    def __init__(self, bot: commands.Bot, modules: List[str], parallel_imports: bool = True,
+                 import_workers: int = 4):
+        self.bot = bot
+        self.modules = list(modules)
+        self.parallel_imports = parallel_imports
+        self.import_workers = max(1, int(import_workers))
+        self.results: List[CogLoadResult] = []
+        self.total_seconds = 0.0
+
+    async def load_all(self) -> List[CogLoadResult]:
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        executor: Optional[ThreadPoolExecutor] = None
+        prewarms: Dict[str, asyncio.Future] = {}
+
+        if self.parallel_imports:
+            executor = ThreadPoolExecutor(max_workers=self.import_workers, thread_name_prefix="cog-import")
+            prewarms = {module: loop.run_in_executor(executor, _prewarm_imports, module)
+                        for module in self.modules}
+
+        try:
+            for module_path in self.modules:
+                result = CogLoadResult(module_path)
+                if module_path in prewarms:
+                    try:
+                        result.import_seconds = await prewarms[module_path]
+                    except Exception as e:
+                        logger.debug(f"Import prewarm of {module_path} failed: {e}")
+                await self._load(result)
+                self.results.append(result)
+        finally:
+            if executor:
+                executor.shutdown(wait=False)
+
+        self.total_seconds = time.perf_counter() - started
+        return self.results
+
+    async def _load(self, result: CogLoadResult):
+        module_path = result.module
+        started = time.perf_counter()
+        try:
+            await self.bot.load_extension(module_path)
+            result.status = "loaded"
+            logging.info(f"  > Cog '{module_path}' のロードに成功しました。")
+        except commands.ExtensionAlreadyLoaded:
+            result.status = "already loaded"
+            logging.debug(f"Cog '{module_path}' は既にロードされています。")
+        except commands.ExtensionNotFound:
+            result.status, result.error = "not found", "ExtensionNotFound"
+            logging.error(f"  > Cog '{module_path}' が見つかりません。ファイルパスを確認してください。")
+        except commands.NoEntryPointError:
+            result.status, result.error = "no setup", "NoEntryPointError"
+            logging.error(f"  > Cog '{module_path}' に setup 関数が見つかりません。Cogとして正しく実装されていますか？")
+        except Exception as e:
+            result.status, result.error = "failed", str(e)
+            logging.error(f"  > Cog '{module_path}' のロード中に予期しないエラーが発生しました: {e}", exc_info=True)
+        finally:
+            result.setup_seconds = time.perf_counter() - started
+
+    def format_report(self) -> str:
+        """Cogごとの import / setup 時間の表"""
+        width = max([len(r.module) for r in self.results] + [3])
+        lines = [f"{'Cog':<{width}}  {'import':>8}  {'setup':>8}  status",
+                 f"{'-' * width}  {'-' * 8}  {'-' * 8}  ------"]
+        for r in self.results:
+            lines.append(f"{r.module:<{width}}  {r.import_seconds:>7.2f}s  {r.setup_seconds:>7.2f}s  {r.status}")
+        import_total = sum(r.import_seconds for r in self.results)
+        setup_total = sum(r.setup_seconds for r in self.results)
+        lines.append(f"total {self.total_seconds:.2f}s wall "
+                     f"(import {import_total:.2f}s across threads, setup {setup_total:.2f}s)")
+        return "\n".join(lines)
@@ -6,6 +6,10 @@ import os
 import shutil
 import sys
 import json
+import time
+
+# 起動からの経過時間の基準（time-to-ready の計測用）
+PROCESS_STARTED_AT = time.perf_counter()
 
 # --- ロギング設定の初期化 ---
 logging.getLogger('discord').setLevel(logging.WARNING)
@@ -14,7 +18,9 @@ logging.getLogger('google.generativeai').setLevel(logging.WARNING)
 logging.getLogger('google.ai').setLevel(logging.WARNING)
 logging.getLogger('httpx').setLevel(logging.WARNING)
 
-from PLANA.services.discord_handler import DiscordLogHandler, DiscordLogFormatter
+from PLANA.services.discord_handler import DiscordLogHandler, DiscordLogFormatter, benchmark_emit_overhead
+from PLANA.services.command_sync import CommandSyncCache
+from PLANA.services.startup import CogLoader
 from PLANA.utilities.error.errors import InvalidDiceNotationError, DiceValueError
 
 CONFIG_FILE = 'config.yaml'
@@ -57,6 +63,8 @@ class Shittim(commands.Bot):
         self.config = None
         self.status_templates = []
         self.status_index = 0
+        # 起動時間の内訳（秒）。time_to_ready は初回の on_ready で記録する
+        self.startup_metrics: dict[str, float] = {}
         #ロードする順序を指定
         self.cogs_to_load = [
             'PLANA.images.image_commands_cog',
@@ -72,6 +80,17 @@ class Shittim(commands.Bot):
             'PLANA.utilities.slash_command_cog',
         ]
 
+    async def add_cog(self, cog: commands.Cog, /, **kwargs):
+        await super().add_cog(cog, **kwargs)
+        # コマンド一覧のキャッシュなどを作り直せるように通知する（リロード時は remove → add の順に呼ばれる）
+        self.dispatch("cogs_changed", cog.qualified_name)
+
+    async def remove_cog(self, name: str, /, **kwargs):
+        cog = await super().remove_cog(name, **kwargs)
+        if cog is not None:
+            self.dispatch("cogs_changed", name)
+        return cog
+
     def is_admin(self, user_id: int) -> bool:
         """ユーザーが管理者かどうかをチェック"""
         admin_ids = self.config.get('admin_user_ids', [])
@@ -155,6 +174,11 @@ class Shittim(commands.Bot):
 
                 root_logger.addHandler(discord_handler)
                 logging.info(f"DiscordへのロギングをチャンネルID {all_log_channel_ids} で有効化しました。")
+
+                # ログ1回あたりのハンドラのオーバーヘッドを計測
+                bench = benchmark_emit_overhead(discord_handler)
+                logging.info(f"DiscordLogHandler emit overhead: {bench['overhead_us']:.2f}µs/call "
+                             f"(without handler {bench['baseline_us']:.2f}µs, with handler {bench['with_handler_us']:.2f}µs)")
             except Exception as e:
                 logging.error(f"DiscordLogHandler の初期化中にエラーが発生しました: {e}")
         else:
@@ -163,38 +187,51 @@ class Shittim(commands.Bot):
         # ===== ロギング設定ここまで =====================================
         # ================================================================
 
+        self.startup_metrics['setup_hook_started'] = time.perf_counter() - PROCESS_STARTED_AT
+
         logging.info("Cogのロードを開始します...")
-        loaded_cogs_count = 0
-        for module_path in self.cogs_to_load:
-            try:
-                await self.load_extension(module_path)
-                logging.info(f"  > Cog '{module_path}' のロードに成功しました。")
-                loaded_cogs_count += 1
-            except commands.ExtensionAlreadyLoaded:
-                logging.debug(f"Cog '{module_path}' は既にロードされています。")
-            except commands.ExtensionNotFound:
-                logging.error(f"  > Cog '{module_path}' が見つかりません。ファイルパスを確認してください。")
-            except commands.NoEntryPointError:
-                logging.error(f"  > Cog '{module_path}' に setup 関数が見つかりません。Cogとして正しく実装されていますか？")
-            except Exception as e:
-                logging.error(f"  > Cog '{module_path}' のロード中に予期しないエラーが発生しました: {e}", exc_info=True)
-        logging.info(f"Cogのロードが完了しました。合計 {loaded_cogs_count} 個のCogをロードしました。")
+        startup_config = self.config.get('startup', {}) or {}
+        cog_loader = CogLoader(
+            self,
+            self.cogs_to_load,
+            parallel_imports=startup_config.get('parallel_imports', True),
+            import_workers=startup_config.get('import_workers', 4)
+        )
+        results = await cog_loader.load_all()
+        loaded_cogs_count = sum(1 for r in results if r.loaded)
+        self.startup_metrics['cogs'] = cog_loader.total_seconds
+        logging.info(f"Cogのロードが完了しました。合計 {loaded_cogs_count} 個のCogをロードしました。"
+                     f"({cog_loader.total_seconds:.2f}秒)")
+        logging.info("Cogのロード時間:\n" + cog_loader.format_report())
+
+        sync_started = time.perf_counter()
 
         if self.config.get('sync_slash_commands', True):
             try:
                 test_guild_id = self.config.get('test_guild_id')
-                if test_guild_id:
-                    guild_obj = discord.Object(id=int(test_guild_id))
-                    synced_commands = await self.tree.sync(guild=guild_obj)
-                    logging.info(
-                        f"{len(synced_commands)}個のスラッシュコマンドをテストギルド {test_guild_id} に同期しました。")
+                guild_obj = discord.Object(id=int(test_guild_id)) if test_guild_id else None
+                scope_label = f"テストギルド {test_guild_id}" if test_guild_id else "グローバル"
+                # コマンド定義が前回の同期から変わっていない場合は同期を省略する
+                result = await CommandSyncCache().sync(
+                    self.tree,
+                    guild=guild_obj,
+                    force=self.config.get('force_sync_slash_commands', False),
+                    dry_run=self.config.get('sync_slash_commands_dry_run', False)
+                )
+                if result.synced:
+                    logging.info(f"{result.command_count}個のスラッシュコマンドを{scope_label}に同期しました。"
+                                 f"({result.reason}: {result.diff.summary()})")
+                elif result.reason == "dry run":
+                    logging.info(f"[dry run] {scope_label}のスラッシュコマンドの差分: {result.diff.summary()}")
                 else:
-                    synced_commands = await self.tree.sync()
-                    logging.info(f"{len(synced_commands)}個のグローバルスラッシュコマンドを同期しました。")
+                    logging.info(f"{scope_label}のスラッシュコマンド({result.command_count}個)は前回の同期から"
+                                 f"変更がないため、同期を省略しました。")
             except Exception as e:
                 logging.error(f"スラッシュコマンドの同期中にエラーが発生しました: {e}", exc_info=True)
         else:
             logging.info("スラッシュコマンドの同期は設定で無効化されています。")
+        self.startup_metrics['sync'] = time.perf_counter() - sync_started
+        self.dispatch("app_commands_synced")
         self.tree.on_error = self.on_app_command_error
 
     async def on_app_command_error(self, interaction: discord.Interaction, error: discord.app_commands.AppCommandError):
@@ -271,6 +308,11 @@ class Shittim(commands.Bot):
             logging.error("on_ready: self.user が None です。処理をスキップします。")
             return
         logging.info(f'{self.user.name} ({self.user.id}) としてDiscordにログインし、準備が完了しました！')
+        if 'time_to_ready' not in self.startup_metrics:
+            self.startup_metrics['time_to_ready'] = time.perf_counter() - PROCESS_STARTED_AT
+            logging.info(f"⏱️ 起動から準備完了まで {self.startup_metrics['time_to_ready']:.2f}秒 "
+                         f"(Cogロード {self.startup_metrics.get('cogs', 0.0):.2f}秒, "
+                         f"コマンド同期 {self.startup_metrics.get('sync', 0.0):.2f}秒)")
         logging.info(f"現在 {len(self.guilds)} サーバーに参加しています。")
         logging.info("📱 モバイルステータスで表示されています")
         self.status_templates = self.config.get('status_rotation', [